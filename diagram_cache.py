@@ -0,0 +1,143 @@
+"""
+Rendered Diagram Cache
+
+Process-wide, content-addressed cache for pathway diagram artifacts (DOT,
+Mermaid, Graphviz source, SVG, ...). Phase 4 used to keep a single
+signature per session in p4_state['viz_cache'] and skipped it whenever
+heuristics had been applied, so toggling between two applied variants
+rebuilt DOT, SVG and Mermaid on every switch.
+
+Entries are keyed by the md5 of the node list plus orientation, so any
+session showing the same pathway version reuses the same artifacts. The
+cache is LRU-evicted by total bytes and holds many recent versions.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Set CPQ_DIAGRAM_CACHE_MB=128 to change the budget
+CACHE_SIZE_ENV = "CPQ_DIAGRAM_CACHE_MB"
+
+
+def diagram_key(nodes, orientation: str = "TD") -> str:
+    """Content address of one pathway version as drawn in one orientation."""
+    payload = json.dumps(nodes or [], sort_keys=True, default=str) + "|" + str(orientation)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def _size(value) -> int:
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(repr(value))
+
+
+# ==========================================
+# CACHE
+# ==========================================
+
+class DiagramCache:
+    """
+    Byte-bounded LRU of artifacts keyed by (diagram key, kind).
+
+    Args:
+        max_bytes: Total artifact bytes kept before least-recently-used
+            artifacts are evicted
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # (key, kind) -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str, kind: str):
+        """Cached artifact or None."""
+        with self._lock:
+            entry = self._entries.get((key, kind))
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end((key, kind))
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: str, kind: str, value) -> bool:
+        """Store an artifact; falsy values and values larger than the budget are skipped."""
+        if not value:
+            return False
+        size = _size(value)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop((key, kind), None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[(key, kind)] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._stats["evictions"] += 1
+        return True
+
+    def get_or_build(self, key: str, kind: str, build):
+        """Return the cached artifact, calling build() and caching its result on a miss."""
+        value = self.get(key, kind)
+        if value is None:
+            value = build()
+            self.put(key, kind, value)
+        return value
+
+    def artifacts(self, key: str) -> dict:
+        """Every cached artifact for one diagram key, as {kind: value}."""
+        with self._lock:
+            found = {kind: entry[0] for (k, kind), entry in self._entries.items() if k == key}
+            for kind in found:
+                self._entries.move_to_end((key, kind))
+            return found
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["entries"] = len(self._entries)
+            out["bytes"] = self._bytes
+            out["diagrams"] = len({k for k, _ in self._entries})
+        return out
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_diagram_cache() -> DiagramCache:
+    """Return the process-wide diagram cache, shared by every session."""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                try:
+                    max_bytes = int(float(os.environ.get(CACHE_SIZE_ENV, "")) * 1024 * 1024)
+                except ValueError:
+                    max_bytes = DEFAULT_MAX_BYTES
+                _shared_cache = DiagramCache(max_bytes=max_bytes)
+    return _shared_cache
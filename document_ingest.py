@@ -0,0 +1,338 @@
+"""
+Document Ingestion
+
+Content-addressed ingestion of the guidelines users upload in Phases 1, 3 and
+4. Every upload used to be read whole into memory, converted, written to a
+temp file, sent to the Gemini Files API and reviewed by the LLM, even when the
+same guideline had already been uploaded in an earlier phase.
+
+How it works:
+1. content_hash() streams the upload through SHA-256 in 1 MiB chunks; the
+   hash keys everything else
+2. iter_markdown() extracts text block by block (DOCX paragraphs, PDF pages,
+   text files in decoded chunks) so callers can write the upload file as it
+   is produced instead of holding several copies of the document
+3. IngestCache remembers, per hash, the extracted text, the Files API URI
+   (until shortly before Gemini expires it) and the review per context, so a
+   repeat upload costs neither bandwidth nor an LLM call. Uploaded files are
+   only visible to the API key that uploaded them, so URIs are also keyed by
+   the key's scope (model_cascade.client_scope); text and reviews are shared
+4. split_sections() cuts large documents at their markdown headings (long
+   sections at paragraph breaks), and select_sections() keeps the sections
+   most relevant to a prompt (BM25, see faq_index) within a character budget,
+   so later prompts need not attach the whole guideline
+"""
+
+import codecs
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from faq_index import FaqIndex
+from sqlite_connections import SQLiteConnections
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+DEFAULT_INGEST_PATH = os.path.join("data", "documents", "ingest.sqlite")
+# SQLite location; set to "0" to disable the cache (every upload goes to Gemini)
+INGEST_PATH_ENV = "CPQ_DOCUMENT_CACHE"
+READ_CHUNK_BYTES = 1 << 20
+# Gemini deletes uploaded files after 48 hours; stop reusing a URI an hour early
+DEFAULT_URI_TTL = 47 * 3600
+URI_SAFETY_MARGIN = 3600
+SECTION_MAX_CHARS = 4000
+# Documents longer than this are sent to prompts as selected sections
+LARGE_DOCUMENT_CHARS = 12000
+SELECTION_BUDGET_CHARS = 8000
+
+_HEADING_STYLES = (("heading 1", "#"), ("title", "#"), ("heading 2", "##"), ("heading 3", "###"))
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+Section = Tuple[str, str]       # (heading path, body)
+
+
+# ==========================================
+# HASHING AND EXTRACTION
+# ==========================================
+
+def content_hash(stream: BinaryIO, chunk_size: int = READ_CHUNK_BYTES) -> str:
+    """SHA-256 of a binary stream read in chunks; the stream is rewound afterwards."""
+    digest = hashlib.sha256()
+    start = stream.tell() if hasattr(stream, "tell") else 0
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(start)
+    return digest.hexdigest()
+
+
+def is_docx(filename: str) -> bool:
+    return filename.lower().endswith(".docx")
+
+
+def is_pdf(filename: str) -> bool:
+    return filename.lower().endswith(".pdf")
+
+
+def _iter_docx(stream: BinaryIO) -> Iterator[str]:
+    from docx import Document
+
+    for para in Document(stream).paragraphs:
+        text = para.text.strip()
+        if not text:
+            continue
+        style_name = para.style.name.lower() if para.style else ""
+        prefix = next((mark for style, mark in _HEADING_STYLES if style in style_name), "")
+        yield f"{prefix} {text}" if prefix else text
+
+
+def _iter_pdf(stream: BinaryIO) -> Iterator[str]:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return
+    for number, page in enumerate(PdfReader(stream).pages, 1):
+        text = (page.extract_text() or "").strip()
+        if text:
+            yield f"## Page {number}\n\n{text}"
+
+
+def _iter_text(stream: BinaryIO, chunk_size: int) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_markdown(filename: str, stream: BinaryIO, chunk_size: int = READ_CHUNK_BYTES) -> Iterator[str]:
+    """
+    Yield the document's text as markdown blocks.
+
+    DOCX yields one block per paragraph (headings as #/##/###), PDF one block
+    per page (needs pypdf; nothing is yielded without it), anything else
+    decoded UTF-8 chunks. Join DOCX and PDF blocks with blank lines and text
+    chunks with "".
+    """
+    if is_docx(filename):
+        return _iter_docx(stream)
+    if is_pdf(filename):
+        return _iter_pdf(stream)
+    return _iter_text(stream, chunk_size)
+
+
+def block_separator(filename: str) -> str:
+    return "\n\n" if is_docx(filename) or is_pdf(filename) else ""
+
+
+# ==========================================
+# SECTIONS
+# ==========================================
+
+def _split_long(title: str, body: str, max_chars: int) -> List[Section]:
+    if len(body) <= max_chars:
+        return [(title, body)]
+    parts, current = [], ""
+    for para in re.split(r"\n\s*\n", body):
+        if current and len(current) + len(para) + 2 > max_chars:
+            parts.append(current)
+            current = ""
+        while len(para) > max_chars:
+            parts.append(para[:max_chars])
+            para = para[max_chars:]
+        current = f"{current}\n\n{para}" if current else para
+    if current:
+        parts.append(current)
+    if len(parts) == 1:
+        return [(title, parts[0])]
+    return [(f"{title} ({i}/{len(parts)})", part) for i, part in enumerate(parts, 1)]
+
+
+def split_sections(markdown: str, max_chars: int = SECTION_MAX_CHARS) -> List[Section]:
+    """Split markdown at headings into (heading path, body) sections of at most max_chars."""
+    sections: List[Section] = []
+    path: List[Tuple[int, str]] = []
+    lines: List[str] = []
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body:
+            title = " › ".join(t for _, t in path) or "Introduction"
+            sections.extend(_split_long(title, body, max_chars))
+        lines.clear()
+
+    in_code = False
+    for line in markdown.splitlines():
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        match = None if in_code else _HEADING_RE.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            path = [(lv, t) for lv, t in path if lv < level] + [(level, match.group(2))]
+        else:
+            lines.append(line)
+    flush()
+    return sections
+
+
+def select_sections(sections: List[Section], query: str,
+                    budget_chars: int = SELECTION_BUDGET_CHARS) -> List[Section]:
+    """
+    The sections most relevant to query that fit in budget_chars, in document order.
+
+    Falls back to the leading sections when nothing in the query matches.
+    """
+    if not sections:
+        return []
+    index = FaqIndex([(title, f"{title} {title} {body}", body, "") for title, body in sections])
+    ranked = [hit.index for hit in index.search(query, limit=len(sections))]
+    if not ranked:
+        ranked = list(range(len(sections)))
+    chosen, used = [], 0
+    for position in ranked:
+        size = len(sections[position][0]) + len(sections[position][1])
+        if used + size > budget_chars and chosen:
+            continue
+        chosen.append(position)
+        used += size
+    return [sections[p] for p in sorted(chosen)]
+
+
+def format_sections(filename: str, sections: List[Section]) -> str:
+    """Selected sections as prompt text."""
+    body = "\n\n".join(f"### {title}\n{text}" for title, text in sections)
+    return f"[Relevant sections of {filename}]\n\n{body}"
+
+
+# ==========================================
+# CACHE
+# ==========================================
+
+class IngestCache:
+    """
+    Per-hash document text, Files API URIs (per API key scope) and reviews.
+
+    Args:
+        path: SQLite file (":memory:" works for tests)
+    """
+
+    def __init__(self, path: str = DEFAULT_INGEST_PATH):
+        self.path = path
+        self._db = SQLiteConnections(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            conn = self._db.connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " hash TEXT PRIMARY KEY,"
+                " filename TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " text TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(uploads)")]
+            if columns and "scope" not in columns:
+                # URIs cached before they were scoped by API key can't be trusted
+                conn.execute("DROP TABLE uploads")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " scope TEXT NOT NULL,"
+                " hash TEXT NOT NULL,"
+                " file_uri TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (scope, hash))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reviews ("
+                " hash TEXT NOT NULL,"
+                " context TEXT NOT NULL,"
+                " review TEXT NOT NULL,"
+                " PRIMARY KEY (hash, context))"
+            )
+            conn.commit()
+
+    def _fetch(self, query: str, params: tuple):
+        with self._lock:
+            return self._db.connection().execute(query, params).fetchone()
+
+    def _write(self, query: str, params: tuple):
+        with self._lock:
+            conn = self._db.connection()
+            with conn:
+                conn.execute(query, params)
+
+    # ---------- text ----------
+
+    def text(self, digest: str) -> Optional[str]:
+        row = self._fetch("SELECT text FROM documents WHERE hash = ?", (digest,))
+        return row[0] if row else None
+
+    def put_text(self, digest: str, filename: str, size: int, text: str):
+        self._write("INSERT OR REPLACE INTO documents (hash, filename, size, text, created_at)"
+                    " VALUES (?, ?, ?, ?, ?)", (digest, filename, size, text, time.time()))
+
+    def sections(self, digest: str, max_chars: int = SECTION_MAX_CHARS) -> List[Section]:
+        text = self.text(digest)
+        return split_sections(text, max_chars) if text else []
+
+    # ---------- uploads ----------
+
+    def file_uri(self, digest: str, scope: str, now: Optional[float] = None) -> Optional[str]:
+        """
+        The Files API URI this API key scope uploaded for digest, unless
+        Gemini is about to expire it.
+        """
+        now = time.time() if now is None else now
+        row = self._fetch("SELECT file_uri, expires_at FROM uploads WHERE scope = ? AND hash = ?",
+                          (scope or "", digest))
+        if row and row[1] - URI_SAFETY_MARGIN > now:
+            return row[0]
+        return None
+
+    def put_file_uri(self, digest: str, scope: str, file_uri: str, expires_at: Optional[float] = None):
+        expires_at = time.time() + DEFAULT_URI_TTL if expires_at is None else expires_at
+        self._write("INSERT OR REPLACE INTO uploads (scope, hash, file_uri, expires_at) VALUES (?, ?, ?, ?)",
+                    (scope or "", digest, file_uri, expires_at))
+
+    # ---------- reviews ----------
+
+    def review(self, digest: str, context: str = "") -> Optional[str]:
+        row = self._fetch("SELECT review FROM reviews WHERE hash = ? AND context = ?", (digest, context or ""))
+        return row[0] if row else None
+
+    def put_review(self, digest: str, context: str, review: str):
+        self._write("INSERT OR REPLACE INTO reviews (hash, context, review) VALUES (?, ?, ?)",
+                    (digest, context or "", review))
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_ingest_cache() -> Optional[IngestCache]:
+    """Return the process-wide cache, or None if it is disabled or can't open."""
+    global _shared_cache
+    path = os.environ.get(INGEST_PATH_ENV) or DEFAULT_INGEST_PATH
+    if path == "0":
+        return None
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                try:
+                    _shared_cache = IngestCache(path)
+                except (sqlite3.Error, OSError):
+                    return None
+    return _shared_cache
@@ -0,0 +1,215 @@
+"""
+Batch GRADE Auto-Grading
+
+Grades large evidence sets by splitting them into size-bounded chunks and
+grading the chunks concurrently. Sending 50+ articles in one prompt gave a
+large, slow response that was often truncated, and then every article fell
+back to "Un-graded".
+
+Pipeline:
+1. Skip PMIDs whose grade is already cached for the same title/abstract
+   hash (stored in the shared response cache)
+2. Split the rest into chunks bounded by article count and prompt size
+3. Grade chunks on a bounded thread pool; merge the results by PMID
+4. Re-chunk and retry only the PMIDs a chunk failed to return
+
+The model call is injected as grade_chunk(prompt) -> raw result, so this
+module has no Streamlit or SDK dependency and can be tested offline.
+"""
+
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from response_cache import get_response_cache, request_fingerprint, is_cache_enabled
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+GRADE_LABELS = ("High (A)", "Moderate (B)", "Low (C)", "Very Low (D)")
+DEFAULT_CHUNK_SIZE = 15          # Articles per prompt
+DEFAULT_CHUNK_CHARS = 6000       # Serialized article budget per prompt
+DEFAULT_WORKERS = 6              # Concurrent grading calls
+DEFAULT_ATTEMPTS = 2             # First pass + one retry of failed PMIDs
+GRADE_CACHE_TTL = 30 * 24 * 3600   # A grade only changes if the article text does
+
+
+# ==========================================
+# PROMPTS AND PARSING
+# ==========================================
+
+def build_grading_prompt(items: list) -> str:
+    """GRADE prompt for one chunk (id + title per article, as the single-call prompt used)."""
+    return (
+        "Assign GRADE quality of evidence (use EXACTLY one of: 'High (A)', 'Moderate (B)', 'Low (C)', or 'Very Low (D)') "
+        "and provide a brief Rationale (1-2 sentences) for each article. "
+        f"{json.dumps([{k: v for k, v in e.items() if k in ['id', 'title']} for e in items])}. "
+        "Return ONLY valid JSON object where keys are PMID strings and values are objects with 'grade' and 'rationale' fields. "
+        "Example: {\"12345678\": {\"grade\": \"High (A)\", \"rationale\": \"text here\"}}"
+    )
+
+
+def extract_grades(result) -> dict:
+    """
+    Normalize a model result to {pmid: {"grade", "rationale"}}.
+
+    Accepts a function-call result ({"arguments": {"grades": ...}}), a
+    {"grades": ...} wrapper, or the bare PMID map.
+    """
+    if not isinstance(result, dict):
+        return {}
+    if isinstance(result.get("arguments"), dict):
+        result = result["arguments"].get("grades", {})
+    elif isinstance(result.get("grades"), dict):
+        result = result["grades"]
+    grades = {}
+    for pmid, data in result.items():
+        if isinstance(data, dict) and data.get("grade"):
+            grades[str(pmid).strip()] = {
+                "grade": data.get("grade"),
+                "rationale": data.get("rationale") or "Not provided.",
+            }
+    return grades
+
+
+def evidence_hash(item: dict) -> str:
+    """Hash of the text a grade depends on (title + abstract)."""
+    text = f"{item.get('title') or ''}\n{item.get('abstract') or ''}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _grade_cache_key(item: dict) -> str:
+    return request_fingerprint(call="grade_evidence", pmid=str(item.get("id", "")), content=evidence_hash(item))
+
+
+# ==========================================
+# CHUNKING
+# ==========================================
+
+def chunk_evidence(items: list, max_items: int = DEFAULT_CHUNK_SIZE,
+                   max_chars: int = DEFAULT_CHUNK_CHARS) -> list:
+    """Split evidence into chunks bounded by article count and serialized size."""
+    chunks = []
+    current = []
+    size = 0
+    for item in items:
+        item_size = len(json.dumps({"id": item.get("id"), "title": item.get("title")}))
+        if current and (len(current) >= max_items or size + item_size > max_chars):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += item_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# ==========================================
+# BATCH GRADING
+# ==========================================
+
+class GradingReport:
+    """Outcome of one batch run."""
+
+    __slots__ = ("grades", "cached", "failed", "calls")
+
+    def __init__(self):
+        self.grades = {}     # pmid -> {"grade", "rationale"}
+        self.cached = 0      # PMIDs served from the grade cache
+        self.failed = []     # PMIDs still ungraded after every attempt
+        self.calls = 0       # Model calls made
+
+
+def grade_evidence(
+    evidence_list: list,
+    grade_chunk,
+    max_workers: int = DEFAULT_WORKERS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_chars: int = DEFAULT_CHUNK_CHARS,
+    attempts: int = DEFAULT_ATTEMPTS,
+    use_cache: bool = True,
+    initializer=None,
+    on_progress=None,
+) -> GradingReport:
+    """
+    Grade evidence in concurrent, size-bounded chunks.
+
+    Args:
+        evidence_list: Evidence dicts with at least 'id' and 'title'
+        grade_chunk: Callable(prompt) -> raw model result for one chunk
+        max_workers: Maximum concurrent grading calls
+        chunk_size / chunk_chars: Per-chunk article and size limits
+        attempts: Passes over the chunks; later passes only resend failed PMIDs
+        use_cache: Reuse grades cached for the same PMID and title/abstract
+        initializer: Optional worker-thread initializer (e.g. to attach a
+            Streamlit script context)
+        on_progress: Optional callback(graded_count, total), called on the
+            calling thread after each chunk finishes
+
+    Returns:
+        GradingReport with grades merged by PMID
+    """
+    report = GradingReport()
+    by_pmid = {}
+    for item in evidence_list or []:
+        pmid = str(item.get("id", "")).strip()
+        if pmid and pmid not in by_pmid:
+            by_pmid[pmid] = item
+    if not by_pmid:
+        return report
+
+    cache = get_response_cache() if (use_cache and is_cache_enabled()) else None
+    pending = []
+    for pmid, item in by_pmid.items():
+        if cache is not None:
+            hit, cached = cache.get(_grade_cache_key(item))
+            if hit and isinstance(cached, dict) and cached.get("grade"):
+                report.grades[pmid] = cached
+                report.cached += 1
+                continue
+        pending.append(item)
+
+    total = len(by_pmid)
+
+    def _run(chunk):
+        try:
+            return extract_grades(grade_chunk(build_grading_prompt(chunk)))
+        except Exception:
+            return {}
+
+    for attempt in range(max(1, attempts)):
+        if not pending:
+            break
+        # Retries use smaller chunks: a chunk that failed whole was likely too big
+        size = chunk_size if attempt == 0 else max(1, chunk_size // 2)
+        chunks = chunk_evidence(pending, max_items=size, max_chars=chunk_chars)
+        workers = max(1, min(max_workers, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpq-grade",
+                                initializer=initializer) as pool:
+            for future in as_completed([pool.submit(_run, chunk) for chunk in chunks]):
+                grades = future.result()
+                report.calls += 1
+                for pmid, grade in grades.items():
+                    if pmid in by_pmid and pmid not in report.grades:
+                        report.grades[pmid] = grade
+                        if cache is not None:
+                            cache.set(_grade_cache_key(by_pmid[pmid]), grade, ttl=GRADE_CACHE_TTL)
+                if on_progress is not None:
+                    on_progress(len(report.grades), total)
+        pending = [item for pmid, item in by_pmid.items() if pmid not in report.grades]
+
+    report.failed = [str(item.get("id")) for item in pending]
+    return report
+
+
+def apply_grades(evidence_list: list, grades: dict, missing_rationale: str = "Not yet evaluated."):
+    """Write grades onto evidence dicts in place; ungraded items keep or get defaults."""
+    for e in evidence_list:
+        grade = grades.get(str(e.get("id", "")).strip())
+        if grade:
+            e["grade"] = grade.get("grade", "Un-graded")
+            e["rationale"] = grade.get("rationale", "Not provided.")
+        else:
+            e.setdefault("grade", "Un-graded")
+            e.setdefault("rationale", missing_rationale)
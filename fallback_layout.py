@@ -0,0 +1,389 @@
+"""
+Pure-Python Fallback Layout
+
+Layered (Sugiyama-style) layout and SVG writer for compiled pathway IRs,
+used when the Graphviz package or the dot executable is missing, or when a
+dot render fails or times out. Until now SVG exports and the diagram in the
+expert feedback form silently disappeared in those deployments.
+
+Pipeline (all in-process, no fork/exec):
+1. Break cycles with one iterative DFS (back edges are reversed)
+2. Longest-path layer assignment in topological order (linear time);
+   End nodes share the bottom layer like dot's rank=sink
+3. Long edges are split with dummy nodes, one per skipped layer
+4. Barycenter crossing minimization, bounded by a sweep and work budget;
+   the best ordering seen is kept
+5. Coordinates from two median-alignment passes, then SVG output
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from pathway_ir import LEGEND_FILL, PathwayIR, wrap_label
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+FONT_SIZE = 11
+CHAR_WIDTH = 6.6            # Average Helvetica glyph width at FONT_SIZE
+LINE_HEIGHT = 14
+PAD_X, PAD_Y = 16, 10
+NODE_GAP = 36               # Between neighbours in a layer
+LAYER_GAP = 56              # Between layers
+MARGIN = 20
+MAX_SWEEPS = 8              # Crossing-minimization sweeps
+CROSSING_BUDGET = 200000    # Edge visits across all sweeps
+EDGE_COLOR = '#333333'
+
+# Shape scale factors around the text box
+_SHAPE_SCALE = {'diamond': (1.6, 1.7), 'oval': (1.2, 1.35)}
+
+
+# ==========================================
+# LAYOUT RECORDS
+# ==========================================
+
+class LayoutNode:
+    __slots__ = ('key', 'lines', 'shape', 'fill', 'w', 'h', 'layer', 'order', 'x', 'y')
+
+    def __init__(self, key, lines, shape, fill, w, h):
+        self.key = key              # IR node index, or None for a dummy
+        self.lines = lines
+        self.shape = shape
+        self.fill = fill
+        self.w = w
+        self.h = h
+        self.layer = 0
+        self.order = 0
+        self.x = 0.0
+        self.y = 0.0
+
+
+class Layout:
+    __slots__ = ('nodes', 'edges', 'legend', 'width', 'height', 'crossings', 'sweeps')
+
+    def __init__(self, nodes, edges, legend, width, height, crossings, sweeps):
+        self.nodes: List[LayoutNode] = nodes        # Real nodes first, then dummies
+        self.edges: List[Tuple[list, str]] = edges  # ([(x, y), ...], label)
+        self.legend = legend                        # (x, y, w, h, lines) or None
+        self.width = width
+        self.height = height
+        self.crossings = crossings
+        self.sweeps = sweeps
+
+
+def _text_box(lines: List[str]) -> Tuple[float, float]:
+    width = max((len(line) for line in lines), default=1) * CHAR_WIDTH + 2 * PAD_X
+    return width, len(lines) * LINE_HEIGHT + 2 * PAD_Y
+
+
+# ==========================================
+# LAYERING
+# ==========================================
+
+def _acyclic_edges(n: int, edges: List[Tuple[int, int]]) -> List[Tuple[int, int, bool]]:
+    """Edges as (u, v, reversed) with every DFS back edge reversed."""
+    succ = [[] for _ in range(n)]
+    for k, (s, d) in enumerate(edges):
+        succ[s].append((d, k))
+    state = [0] * n             # 0 new, 1 on stack, 2 done
+    back = set()
+    for root in range(n):
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(succ[root]))]
+        while stack:
+            v, it = stack[-1]
+            for w, k in it:
+                if state[w] == 1:
+                    back.add(k)
+                elif state[w] == 0:
+                    state[w] = 1
+                    stack.append((w, iter(succ[w])))
+                    break
+            else:
+                state[v] = 2
+                stack.pop()
+    return [(d, s, True) if k in back else (s, d, False) for k, (s, d) in enumerate(edges)]
+
+
+def _longest_path_layers(n: int, dag: List[Tuple[int, int, bool]]) -> List[int]:
+    indeg = [0] * n
+    succ = [[] for _ in range(n)]
+    for u, v, _ in dag:
+        succ[u].append(v)
+        indeg[v] += 1
+    layer = [0] * n
+    queue = [v for v in range(n) if indeg[v] == 0]
+    for u in queue:             # Kahn's algorithm; the list grows while iterating
+        for v in succ[u]:
+            layer[v] = max(layer[v], layer[u] + 1)
+            indeg[v] -= 1
+            if indeg[v] == 0:
+                queue.append(v)
+    return layer
+
+
+# ==========================================
+# CROSSING MINIMIZATION
+# ==========================================
+
+def _count_crossings(upper: List[LayoutNode], down: Dict[int, List[int]]) -> int:
+    """Crossings between two adjacent layers (inversion count with a Fenwick tree)."""
+    targets = []
+    for node in upper:
+        targets.extend(sorted(down.get(id(node), ())))
+    size = max(targets, default=0) + 2
+    tree = [0] * (size + 1)
+    crossings = 0
+    for seen, t in enumerate(targets):
+        i, le = t + 1, 0
+        while i > 0:
+            le += tree[i]
+            i -= i & -i
+        crossings += seen - le
+        i = t + 1
+        while i <= size:
+            tree[i] += 1
+            i += i & -i
+    return crossings
+
+
+def _minimize_crossings(layers: List[List[LayoutNode]], preds, succs, n_edges: int) -> Tuple[int, int]:
+    """Barycenter sweeps within budget; layers are reordered in place. Returns (crossings, sweeps)."""
+    def total():
+        count = 0
+        for upper, lower in zip(layers, layers[1:]):
+            pos = {id(node): node.order for node in lower}
+            down = {id(u): [pos[id(v)] for v in succs[id(u)]] for u in upper}
+            count += _count_crossings(upper, down)
+        return count
+
+    def sweep(rng, neighbours):
+        for li in rng:
+            layer = layers[li]
+            for idx, node in enumerate(layer):
+                adj = neighbours[id(node)]
+                node.x = sum(a.order for a in adj) / len(adj) if adj else idx
+            layer.sort(key=lambda nd: nd.x)
+            for idx, node in enumerate(layer):
+                node.order = idx
+
+    best = total()
+    best_orders = [list(layer) for layer in layers]
+    sweeps = min(MAX_SWEEPS, max(1, CROSSING_BUDGET // max(1, 2 * n_edges)))
+    done = 0
+    for done in range(1, sweeps + 1):
+        if best == 0:
+            done -= 1
+            break
+        if done % 2:
+            sweep(range(1, len(layers)), preds)
+        else:
+            sweep(range(len(layers) - 2, -1, -1), succs)
+        count = total()
+        if count < best:
+            best, best_orders = count, [list(layer) for layer in layers]
+        elif done > 2:
+            break
+    for li, layer in enumerate(best_orders):
+        layers[li] = layer
+        for idx, node in enumerate(layer):
+            node.order = idx
+    return best, done
+
+
+# ==========================================
+# COORDINATES
+# ==========================================
+
+def _place(layers: List[List[LayoutNode]], preds, succs, breadth):
+    """Left-to-right packing pulled toward the median of each node's neighbours."""
+    for layer in layers:
+        pos = 0.0
+        for node in layer:
+            node.x = pos + breadth(node) / 2
+            pos += breadth(node) + NODE_GAP
+
+    def align(rng, neighbours):
+        for li in rng:
+            layer = layers[li]
+            prev_right = -math.inf
+            for node in layer:
+                adj = sorted(a.x for a in neighbours[id(node)])
+                want = (adj[(len(adj) - 1) // 2] + adj[len(adj) // 2]) / 2 if adj else node.x
+                node.x = max(want, prev_right + breadth(node) / 2)
+                prev_right = node.x + breadth(node) / 2 + NODE_GAP
+
+    align(range(1, len(layers)), preds)
+    align(range(len(layers) - 2, -1, -1), succs)
+    left = min((node.x - breadth(node) / 2 for layer in layers for node in layer), default=0.0)
+    for layer in layers:
+        for node in layer:
+            node.x -= left
+
+
+def _clip(node: LayoutNode, tx: float, ty: float) -> Tuple[float, float]:
+    """Point where the segment from node's center toward (tx, ty) leaves its shape."""
+    dx, dy = tx - node.x, ty - node.y
+    if node.key is None or (dx == 0 and dy == 0):
+        return node.x, node.y
+    hw, hh = node.w / 2, node.h / 2
+    if node.shape == 'diamond':
+        t = 1 / (abs(dx) / hw + abs(dy) / hh)
+    elif node.shape == 'oval':
+        t = 1 / math.sqrt((dx / hw) ** 2 + (dy / hh) ** 2)
+    else:
+        t = min(hw / abs(dx) if dx else math.inf, hh / abs(dy) if dy else math.inf)
+    return node.x + dx * t, node.y + dy * t
+
+
+# ==========================================
+# LAYOUT
+# ==========================================
+
+def layout_ir(ir: PathwayIR) -> Layout:
+    """Lay out a compiled pathway (TD: layers top to bottom, LR: left to right)."""
+    horizontal = ir.rankdir == 'LR'
+    nodes = []
+    for node in ir.nodes:
+        lines = wrap_label(node.label, width=25).split("\n")
+        if node.note is not None:
+            lines.append(f"(Note {node.note})")
+        w, h = _text_box(lines)
+        sx, sy = _SHAPE_SCALE.get(node.shape, (1.0, 1.0))
+        nodes.append(LayoutNode(node.index, lines, node.shape, node.fill, w * sx, h * sy))
+    n = len(nodes)
+
+    pairs = [(e.src, e.dst) for e in ir.edges if e.src != e.dst]
+    dag = _acyclic_edges(n, pairs)
+    layer = _longest_path_layers(n, dag)
+    bottom = max(layer, default=0)
+    for node in ir.nodes:
+        if node.type == 'End':
+            layer[node.index] = bottom
+    for node, li in zip(nodes, layer):
+        node.layer = li
+
+    # Split long edges into chains through dummy nodes
+    preds = {id(node): [] for node in nodes}
+    succs = {id(node): [] for node in nodes}
+    chains = []
+    for u, v, flipped in dag:
+        chain = [nodes[u]]
+        for li in range(layer[u] + 1, layer[v]):
+            dummy = LayoutNode(None, [], 'point', None, 1.0, 1.0)
+            dummy.layer = li
+            nodes.append(dummy)
+            preds[id(dummy)], succs[id(dummy)] = [], []
+            chain.append(dummy)
+        chain.append(nodes[v])
+        for a, b in zip(chain, chain[1:]):
+            if a.layer < b.layer:
+                succs[id(a)].append(b)
+                preds[id(b)].append(a)
+        chains.append(chain[::-1] if flipped else chain)
+
+    layers = [[] for _ in range(bottom + 1)] if n else []
+    for node in nodes:          # Real nodes in pathway order, then dummies
+        layers[node.layer].append(node)
+    for layer_nodes in layers:
+        for idx, node in enumerate(layer_nodes):
+            node.order = idx
+    crossings, sweeps = _minimize_crossings(layers, preds, succs, len(pairs))
+
+    breadth = (lambda nd: nd.h) if horizontal else (lambda nd: nd.w)
+    depth = (lambda nd: nd.w) if horizontal else (lambda nd: nd.h)
+    _place(layers, preds, succs, breadth)
+
+    # Layer depth offsets, then map (within-layer, across-layer) to (x, y)
+    offset, centers = MARGIN, []
+    for layer_nodes in layers:
+        extent = max((depth(nd) for nd in layer_nodes), default=0)
+        centers.append(offset + extent / 2)
+        offset += extent + LAYER_GAP
+    for node in nodes:
+        along, across = node.x + MARGIN, centers[node.layer]
+        node.x, node.y = (across, along) if horizontal else (along, across)
+
+    edges = []
+    labels = [e.label for e in ir.edges if e.src != e.dst]
+    for chain, label in zip(chains, labels):
+        points = [(nd.x, nd.y) for nd in chain]
+        points[0] = _clip(chain[0], *points[1])
+        points[-1] = _clip(chain[-1], *points[-2])
+        edges.append((points, label))
+    for e in ir.edges:          # Self loops: small arc to the side of the node
+        if e.src == e.dst:
+            nd = nodes[e.src]
+            x, y = nd.x + nd.w / 2, nd.y
+            edges.append(([(x, y - 6), (x + 24, y - 12), (x + 24, y + 12), (x, y + 6)], e.label))
+
+    width = max((nd.x + nd.w / 2 for nd in nodes), default=0) + MARGIN
+    height = max((nd.y + nd.h / 2 for nd in nodes), default=0) + MARGIN
+    legend = None
+    if ir.notes:
+        lines = ["NOTES:"]
+        for num, text in ir.notes:
+            lines.extend(f"[{num}] {line}" if i == 0 else f"    {line}"
+                         for i, line in enumerate(wrap_label(text, max_width=60).split("\n")))
+        w, h = _text_box(lines)
+        legend = (MARGIN, height, w, h, lines)
+        width = max(width, w + 2 * MARGIN)
+        height += h + MARGIN
+    return Layout(nodes, edges, legend, width, height, crossings, sweeps)
+
+
+# ==========================================
+# SVG
+# ==========================================
+
+def _svg_text(x: float, y: float, lines: List[str], size: int = FONT_SIZE, anchor: str = "middle") -> str:
+    top = y - (len(lines) - 1) * LINE_HEIGHT / 2
+    spans = "".join(
+        f'<tspan x="{x:.1f}" y="{top + i * LINE_HEIGHT:.1f}">{escape(line)}</tspan>'
+        for i, line in enumerate(lines))
+    return f'<text text-anchor="{anchor}" dominant-baseline="central" font-size="{size}">{spans}</text>'
+
+
+def render_svg(ir: PathwayIR, layout: Optional[Layout] = None) -> bytes:
+    """Standalone SVG document for a compiled pathway."""
+    layout = layout or layout_ir(ir)
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{layout.width:.0f}pt" height="{layout.height:.0f}pt" '
+        f'viewBox="0 0 {layout.width:.1f} {layout.height:.1f}">',
+        '<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="8" markerHeight="8" '
+        f'orient="auto-start-reverse"><path d="M0,0 L10,5 L0,10 z" fill="{EDGE_COLOR}"/></marker></defs>',
+        '<g font-family="Helvetica, Arial, sans-serif">',
+        '<rect width="100%" height="100%" fill="white"/>',
+    ]
+    for points, label in layout.edges:
+        coords = " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+        out.append(f'<polyline points="{coords}" fill="none" stroke="{EDGE_COLOR}" marker-end="url(#arrow)"/>')
+        if label:
+            (x1, y1), (x2, y2) = points[0], points[1]
+            out.append(_svg_text((x1 + x2) / 2 + 4, (y1 + y2) / 2, [label], size=FONT_SIZE - 1, anchor="start"))
+    for node in layout.nodes:
+        if node.key is None:
+            continue
+        x, y, hw, hh = node.x, node.y, node.w / 2, node.h / 2
+        style = f'fill="{node.fill}" stroke="#333333"'
+        if node.shape == 'diamond':
+            out.append(f'<polygon points="{x:.1f},{y - hh:.1f} {x + hw:.1f},{y:.1f} {x:.1f},{y + hh:.1f} '
+                       f'{x - hw:.1f},{y:.1f}" {style}/>')
+        elif node.shape == 'oval':
+            out.append(f'<ellipse cx="{x:.1f}" cy="{y:.1f}" rx="{hw:.1f}" ry="{hh:.1f}" {style}/>')
+        else:
+            out.append(f'<rect x="{x - hw:.1f}" y="{y - hh:.1f}" width="{node.w:.1f}" height="{node.h:.1f}" {style}/>')
+        out.append(_svg_text(x, y, node.lines))
+    if layout.legend:
+        x, y, w, h, lines = layout.legend
+        out.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{w:.1f}" height="{h:.1f}" fill="{LEGEND_FILL}" stroke="#333333"/>')
+        out.append(_svg_text(x + PAD_X, y + h / 2, lines, size=FONT_SIZE - 1, anchor="start"))
+    out.append('</g>')
+    out.append('</svg>')
+    return "\n".join(out).encode("utf-8")
@@ -0,0 +1,350 @@
+"""
+Local FAQ Index
+
+BM25 retrieval over the built-in FAQ answers and the user guides, used by the
+in-app assistant before it considers an LLM call. Help questions used to go
+through a chain of substring checks; anything the checks missed needed a
+full Gemini round trip with a ~3 KB system prompt.
+
+How it works:
+1. Documents are the FAQ entries plus one per guide section (split at
+   markdown headings); titles and FAQ search terms count twice
+2. At build time every (term, document) BM25 weight is precomputed into
+   compact per-term arrays (document ids + float32 weights), so a query is a
+   handful of array walks
+3. answer() returns the best hit when it matches at least two of the
+   question's terms and its confidence (BM25 score relative to the highest
+   score the question could reach, every term saturated) clears the
+   threshold; otherwise the caller decides whether an LLM call is worth it.
+   One-word questions ("what is a pathway?") therefore always go to the LLM
+"""
+
+import math
+import os
+import re
+import threading
+from array import array
+from typing import List, Optional, Sequence, Tuple
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+# Minimum confidence (0-1) for answering locally; override with CPQ_FAQ_CONFIDENCE
+FAQ_CONFIDENCE_ENV = "CPQ_FAQ_CONFIDENCE"
+DEFAULT_CONFIDENCE = 0.6
+# Questions matching fewer query terms than this are never answered locally
+MIN_MATCHED_TERMS = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_SECTION_CHARS = 700         # Guide sections are trimmed to this in answers
+
+# User-facing guides indexed next to the FAQ (paths relative to the app directory).
+# Change logs and implementation notes (e.g. QUICK_REFERENCE.md) are left out on purpose.
+GUIDE_DOCUMENTS = (
+    "PHASE5_GUIDE.md",
+    "HEURISTICS_QUICK_REFERENCE.md",
+    "DECISION_SCIENCE_QUICK_REFERENCE.md",
+    "README.md",
+)
+
+# (topic, extra search terms, answer)
+FAQ_ENTRIES = (
+    (
+        "The 5 phases",
+        "five phases workflow overview steps stages",
+        "CarePathIQ has 5 phases: 1) **Define Scope** — clarify condition, context, and goals. "
+        "2) **Appraise Evidence** — gather and grade studies with structured PICO/MESH support. "
+        "3) **Build Decision Tree** — design pathway logic and branches. "
+        "4) **Design Interface** — preview and optimize using Nielsen's usability heuristics. "
+        "5) **Operationalize** — export expert forms, beta testing, education modules, and executive summary."
+    ),
+    (
+        "Phase 1: Define Scope & Charter",
+        "phase 1 scope charter condition setting inclusion exclusion criteria problem statement objectives population",
+        "Phase 1 defines the project scope. Enter the clinical condition and care setting; the AI drafts "
+        "inclusion/exclusion criteria, the problem statement, objectives and target population, which you can edit. "
+        "These fields give context to every later phase."
+    ),
+    (
+        "Phase 3: Build Decision Tree",
+        "decision tree phase 3 nodes pathway branches build create add refine regenerate",
+        "In Phase 3, add nodes (decisions, actions, outcomes), connect them to form branches, "
+        "and iterate using evidence and heuristics. Use the refinement box to request changes, "
+        "then regenerate to update the pathway structure. The AI uses Phase 1 & 2 context to build logical flows."
+    ),
+    (
+        "Phase 2: Appraise Evidence",
+        "evidence phase 2 pubmed mesh search query pico grade studies articles add",
+        "Phase 2 enables intelligent PubMed searches with AI-powered query optimization. "
+        "The system auto-generates optimized queries using MeSH terms and field tags ([tiab], [mesh]) for precise results. "
+        "Include study PMID, title, abstract, GRADE quality assessment, and relevance notes. "
+        "Features: proximity search guidance ([tiab:~N] syntax), AI query optimization, PICO framework, and CSV export. "
+        "See PubMed Search Tips in the Refine search expander for advanced techniques."
+    ),
+    (
+        "Phase 5: Operationalize",
+        "phase 5 operationalize deploy export expert panel beta testing education module executive summary deliverables",
+        "Phase 5 generates 4 deliverables: Expert Panel Feedback Form (HTML), Beta Testing Form (HTML), "
+        "Interactive Education Module (HTML with quizzes & certificates), and Executive Summary (Word doc). "
+        "All are standalone files with no backend—users download, share, and collect responses via CSV."
+    ),
+    (
+        "Phase 4: Design Interface",
+        "heuristics phase 4 usability nielsen design interface recommendations apply undo",
+        "Phase 4 applies Nielsen's 10 Usability Heuristics to your pathway. The AI analyzes each heuristic "
+        "(visibility, error prevention, consistency, etc.) and suggests improvements. You can apply or reject "
+        "each recommendation to optimize the user experience."
+    ),
+    (
+        "API key and models",
+        "api key gemini model models google aistudio quota setup configure",
+        "CarePathIQ uses Google Gemini API (get free key at https://aistudio.google.com/app/apikey). "
+        "Uses gemini-2.5-flash and gemini-2.5-pro models with automatic cascade fallback. "
+        "Enter your API key in the sidebar."
+    ),
+    (
+        "Exporting the pathway diagram",
+        "export download diagram pathway svg png pdf image print flowchart",
+        "In Phase 4, the pathway diagram can be downloaded as SVG (vector, for slides and email), PNG (for "
+        "documents) or PDF (print-ready). Very large pathways are shown as a cluster overview with one "
+        "sub-pathway at a time."
+    ),
+    (
+        "Undo and redo pathway changes",
+        "undo redo revert restore previous version history change edit",
+        "Every pathway change (generation, edits, refinements and applied heuristics) is saved as a version. "
+        "In Phase 4 use **Undo** and **Redo** to step back and forth through versions; the Undo button's tooltip "
+        "shows what the last change touched."
+    ),
+    (
+        "Saving and resuming a project",
+        "save resume continue project progress bookmark url restart lost reload",
+        "Progress is saved automatically while you work. The project id is part of the page URL (?project=...), "
+        "so bookmark the URL and open it again later, or after a reload, to resume the same project."
+    ),
+    (
+        "Files and code structure",
+        "files structure code source architecture modules",
+        "Main files: streamlit_app.py (5-phase workflow), phase5_helpers.py (HTML generators), "
+        "education_template.py (quiz system). Documentation: PHASE5_GUIDE.md, API_ALIGNMENT.md, README.md. "
+        "Uses Streamlit, google-genai, Graphviz, python-docx."
+    ),
+)
+
+HELP_TOPICS = (
+    "I can help with: the 5 phases workflow, building decision trees, evidence appraisal, "
+    "usability heuristics, Phase 5 exports, API setup, or technical structure. What would you like to know?"
+)
+
+
+# ==========================================
+# TEXT PROCESSING
+# ==========================================
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its me my of on or our should "
+    "so that the their then there these this to use used using was what when where which who why "
+    "will with you your".split())
+_NUMBER_WORDS = {"one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "ten": "10"}
+
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 5 and token.endswith("ing"):
+        return token[:-3]
+    if len(token) > 4 and token.endswith("ed") and not token.endswith("eed"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, stop-word-free, lightly stemmed terms."""
+    terms = []
+    for token in _TOKEN.findall((text or "").lower()):
+        if token in _STOPWORDS:
+            continue
+        terms.append(_NUMBER_WORDS.get(token) or _stem(token))
+    return terms
+
+
+def load_guide_sections(paths: Sequence[str], root: str = "") -> List[Tuple[str, str, str]]:
+    """Split markdown guides at headings into (title, body, source) sections."""
+    sections = []
+    for rel in paths:
+        try:
+            with open(os.path.join(root, rel), "r", encoding="utf-8") as fh:
+                text = fh.read()
+        except OSError:
+            continue
+        trail = []              # Heading path, e.g. ["Troubleshooting", "CSV Download Not Working"]
+        body = []
+        in_code = False
+
+        def flush():
+            content = "\n".join(body).strip()
+            if trail and len(content) >= 40:
+                sections.append((" › ".join(trail), content, rel))
+
+        for line in text.splitlines():
+            if line.lstrip().startswith("```"):
+                in_code = not in_code
+            heading = None if in_code else re.match(r"^(#{1,4})\s+(.*)$", line)
+            if heading:
+                flush()
+                body = []
+                level = len(heading.group(1))
+                title = re.sub(r"[*`]", "", heading.group(2)).strip()
+                del trail[level - 1:]
+                trail.extend([""] * (level - 1 - len(trail)))
+                trail.append(title)
+                trail[:] = [t for t in trail if t]
+            else:
+                body.append(line)
+        flush()
+    return sections
+
+
+# ==========================================
+# INDEX
+# ==========================================
+
+class FaqHit:
+    __slots__ = ("index", "title", "answer", "source", "score", "confidence", "matched")
+
+    def __init__(self, index, title, answer, source, score, confidence, matched):
+        self.index = index              # Position of the document in the FaqIndex documents
+        self.title = title
+        self.answer = answer
+        self.source = source
+        self.score = score
+        self.confidence = confidence
+        self.matched = matched          # Distinct query terms found in the document
+
+
+class FaqIndex:
+    """
+    BM25 index with precomputed term weights.
+
+    Args:
+        documents: (title, indexed text, answer, source) tuples
+        min_confidence: Default threshold for answer()
+        min_terms: Default matched-term minimum for answer()
+    """
+
+    def __init__(self, documents: Sequence[Tuple[str, str, str, str]], min_confidence: float = DEFAULT_CONFIDENCE,
+                 min_terms: int = MIN_MATCHED_TERMS):
+        self.min_confidence = min_confidence
+        self.min_terms = min_terms
+        self._titles = [d[0] for d in documents]
+        self._answers = [d[2] for d in documents]
+        self._sources = [d[3] for d in documents]
+        self._terms = {}        # term -> id
+        self._idf = array("f")
+        self._postings_docs = []     # term id -> array('I') of document ids
+        self._postings_weights = []  # term id -> array('f') of BM25 weights
+        self._build([tokenize(d[1]) for d in documents])
+
+    def __len__(self):
+        return len(self._answers)
+
+    def _build(self, docs_terms: List[List[str]]):
+        n = len(docs_terms)
+        avgdl = (sum(len(t) for t in docs_terms) / n) if n else 0.0
+        frequencies = {}        # term -> {doc: tf}
+        for doc, terms in enumerate(docs_terms):
+            for term in terms:
+                frequencies.setdefault(term, {}).setdefault(doc, 0)
+                frequencies[term][doc] += 1
+        for term, tfs in frequencies.items():
+            self._terms[term] = len(self._idf)
+            idf = math.log(1 + (n - len(tfs) + 0.5) / (len(tfs) + 0.5))
+            self._idf.append(idf)
+            docs = array("I")
+            weights = array("f")
+            for doc, tf in sorted(tfs.items()):
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * len(docs_terms[doc]) / (avgdl or 1))
+                docs.append(doc)
+                weights.append(idf * tf * (BM25_K1 + 1) / norm)
+            self._postings_docs.append(docs)
+            self._postings_weights.append(weights)
+        self._unknown_idf = math.log(1 + (n + 0.5) / 0.5)
+
+    def search(self, question: str, limit: int = 3) -> List[FaqHit]:
+        """Best documents for the question, highest score first."""
+        query = list(dict.fromkeys(tokenize(question)))
+        if not query or not self._answers:
+            return []
+        scores = {}
+        matched = {}
+        best_possible = 0.0     # Every term saturated (tf -> infinity); unknown terms count too
+        for term in query:
+            term_id = self._terms.get(term)
+            if term_id is None:
+                best_possible += self._unknown_idf * (BM25_K1 + 1)
+                continue
+            best_possible += self._idf[term_id] * (BM25_K1 + 1)
+            for doc, weight in zip(self._postings_docs[term_id], self._postings_weights[term_id]):
+                scores[doc] = scores.get(doc, 0.0) + weight
+                matched[doc] = matched.get(doc, 0) + 1
+        ranked = sorted(scores, key=lambda d: (-scores[d], d))[:limit]
+        return [FaqHit(d, self._titles[d], self._answers[d], self._sources[d], scores[d],
+                       scores[d] / best_possible if best_possible else 0.0, matched[d]) for d in ranked]
+
+    def answer(self, question: str, min_confidence: Optional[float] = None,
+               min_terms: Optional[int] = None) -> Optional[FaqHit]:
+        """Best hit if it matches enough terms and clears the confidence threshold, else None."""
+        threshold = self.min_confidence if min_confidence is None else min_confidence
+        min_terms = self.min_terms if min_terms is None else min_terms
+        hits = self.search(question, limit=1)
+        if hits and hits[0].matched >= min_terms and hits[0].confidence >= threshold and hits[0].score > 0:
+            return hits[0]
+        return None
+
+
+def _trim(text: str, limit: int = MAX_SECTION_CHARS) -> str:
+    text = re.sub(r"\n{3,}", "\n\n", text.strip())
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n", 0, limit)
+    return text[:cut if cut > limit // 2 else limit].rstrip() + " …"
+
+
+def build_default_index(root: Optional[str] = None, min_confidence: float = DEFAULT_CONFIDENCE) -> FaqIndex:
+    """Index FAQ_ENTRIES plus the sections of GUIDE_DOCUMENTS found under root."""
+    root = os.path.dirname(os.path.abspath(__file__)) if root is None else root
+    documents = [(topic, f"{topic} {topic} {terms} {terms} {answer}", answer, "faq")
+                 for topic, terms, answer in FAQ_ENTRIES]
+    for title, body, source in load_guide_sections(GUIDE_DOCUMENTS, root):
+        answer = f"{_trim(body)}\n\n*Source: {source} › {title}*"
+        documents.append((title, f"{title} {title} {body}", answer, source))
+    return FaqIndex(documents, min_confidence=min_confidence)
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def faq_confidence_threshold() -> float:
+    try:
+        return min(1.0, max(0.0, float(os.environ.get(FAQ_CONFIDENCE_ENV, DEFAULT_CONFIDENCE))))
+    except ValueError:
+        return DEFAULT_CONFIDENCE
+
+
+def get_faq_index() -> FaqIndex:
+    """Return the process-wide FAQ index, built on first use."""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_lock:
+            if _shared_index is None:
+                _shared_index = build_default_index(min_confidence=faq_confidence_threshold())
+    return _shared_index
@@ -0,0 +1,239 @@
+"""
+Feedback Store
+
+Append-only SQLite log of satisfaction-survey responses with incrementally
+maintained aggregates. Each response used to be its own
+data/feedback/feedback_<ms>.json file, and the admin dashboard listed the
+directory and opened and parsed every file on every render (three times:
+the average, the selectbox and the CSV export).
+
+How it works:
+1. append() inserts the response and updates the running aggregates
+   (count and rating sum overall, per phase and per condition) in the same
+   transaction; responses are never updated or deleted
+2. summary() reads the aggregate rows only, so the dashboard costs the same
+   for ten responses or ten thousand
+3. page() reads one page of responses by id (keyset pagination)
+4. iter_csv() streams the export in chunks instead of building the rows up
+   front
+5. Legacy feedback_*.json files are imported once (tracked by file name)
+"""
+
+import csv
+import io
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from sqlite_connections import SQLiteConnections
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+DEFAULT_FEEDBACK_DIR = os.path.join("data", "feedback")
+DEFAULT_FEEDBACK_PATH = os.path.join(DEFAULT_FEEDBACK_DIR, "feedback.sqlite")
+# Override the SQLite location (e.g. a shared volume for several workers)
+FEEDBACK_PATH_ENV = "CPQ_FEEDBACK_DB"
+DEFAULT_PAGE_SIZE = 25
+CSV_CHUNK_ROWS = 500
+
+CSV_HEADER = ("timestamp", "rating", "feedback", "phase", "pathway_condition")
+_DIMENSIONS = ("all", "phase", "condition")
+
+
+# ==========================================
+# STORE
+# ==========================================
+
+class FeedbackStore:
+    """
+    Append-only feedback log.
+
+    Args:
+        path: SQLite file (":memory:" works for tests)
+    """
+
+    def __init__(self, path: str = DEFAULT_FEEDBACK_PATH):
+        self.path = path
+        self._db = SQLiteConnections(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            conn = self._db.connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS feedback ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " timestamp TEXT NOT NULL,"
+                " rating INTEGER,"
+                " feedback_text TEXT NOT NULL DEFAULT '',"
+                " phase TEXT NOT NULL DEFAULT '',"
+                " pathway_condition TEXT NOT NULL DEFAULT '')"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS feedback_aggregates ("
+                " dimension TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " responses INTEGER NOT NULL,"
+                " rated INTEGER NOT NULL,"
+                " rating_sum INTEGER NOT NULL,"
+                " PRIMARY KEY (dimension, key))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS feedback_imports (source TEXT PRIMARY KEY)")
+            conn.commit()
+
+    # ---------- writes ----------
+
+    @staticmethod
+    def _insert(conn, timestamp: str, rating, feedback_text: str, phase: str, condition: str) -> int:
+        cur = conn.execute(
+            "INSERT INTO feedback (timestamp, rating, feedback_text, phase, pathway_condition)"
+            " VALUES (?, ?, ?, ?, ?)", (timestamp, rating, feedback_text, phase, condition))
+        rated = 0 if rating is None else 1
+        for dimension, key in zip(_DIMENSIONS, ("", phase, condition)):
+            conn.execute(
+                "INSERT INTO feedback_aggregates (dimension, key, responses, rated, rating_sum)"
+                " VALUES (?, ?, 1, ?, ?)"
+                " ON CONFLICT (dimension, key) DO UPDATE SET"
+                " responses = responses + 1, rated = rated + excluded.rated,"
+                " rating_sum = rating_sum + excluded.rating_sum",
+                (dimension, key, rated, rating or 0))
+        return cur.lastrowid
+
+    def append(self, rating, feedback_text: str = "", phase: str = "", pathway_condition: str = "",
+               timestamp: Optional[str] = None) -> int:
+        """Record one response; returns its id."""
+        timestamp = timestamp or datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        rating = None if rating is None else int(rating)
+        with self._lock:
+            conn = self._db.connection()
+            with conn:
+                return self._insert(conn, timestamp, rating, feedback_text or "", phase or "",
+                                    pathway_condition or "")
+
+    def import_legacy_dir(self, directory: str = DEFAULT_FEEDBACK_DIR) -> int:
+        """Import feedback_*.json files not imported before; returns how many were added."""
+        try:
+            names = sorted(n for n in os.listdir(directory) if n.startswith("feedback_") and n.endswith(".json"))
+        except OSError:
+            return 0
+        if not names:
+            return 0
+        with self._lock:
+            done = {row[0] for row in self._db.connection().execute("SELECT source FROM feedback_imports")}
+        added = 0
+        for name in names:
+            if name in done:
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(data, dict):
+                continue
+            rating = data.get("rating")
+            with self._lock:
+                conn = self._db.connection()
+                with conn:
+                    if conn.execute("INSERT OR IGNORE INTO feedback_imports (source) VALUES (?)",
+                                    (name,)).rowcount == 0:
+                        continue
+                    self._insert(conn, str(data.get("timestamp", "")),
+                                 rating if isinstance(rating, int) else None,
+                                 str(data.get("feedback_text", "") or ""), str(data.get("phase", "") or ""),
+                                 str(data.get("pathway_condition", "") or ""))
+            added += 1
+        return added
+
+    # ---------- reads ----------
+
+    def summary(self) -> dict:
+        """
+        Totals from the aggregate rows (no scan of the responses).
+
+        Returns:
+            {"count", "mean", "by_phase": {phase: {"count", "mean"}}, "by_condition": {...}}
+        """
+        with self._lock:
+            rows = self._db.connection().execute(
+                "SELECT dimension, key, responses, rated, rating_sum FROM feedback_aggregates").fetchall()
+        result = {"count": 0, "mean": None, "by_phase": {}, "by_condition": {}}
+        for dimension, key, responses, rated, rating_sum in rows:
+            entry = {"count": responses, "mean": rating_sum / rated if rated else None}
+            if dimension == "all":
+                result["count"], result["mean"] = entry["count"], entry["mean"]
+            else:
+                result["by_" + dimension][key] = entry
+        return result
+
+    def __len__(self):
+        return self.summary()["count"]
+
+    def page(self, before_id: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE) -> List[Dict]:
+        """Up to limit responses, newest first, with ids below before_id."""
+        query = ("SELECT id, timestamp, rating, feedback_text, phase, pathway_condition FROM feedback"
+                 + (" WHERE id < ?" if before_id is not None else "") + " ORDER BY id DESC LIMIT ?")
+        params = (before_id, limit) if before_id is not None else (limit,)
+        with self._lock:
+            rows = self._db.connection().execute(query, params).fetchall()
+        return [self._row(r) for r in rows]
+
+    def get(self, response_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.connection().execute(
+                "SELECT id, timestamp, rating, feedback_text, phase, pathway_condition FROM feedback"
+                " WHERE id = ?", (response_id,)).fetchone()
+        return self._row(row) if row else None
+
+    @staticmethod
+    def _row(row) -> Dict:
+        return dict(zip(("id", "timestamp", "rating", "feedback_text", "phase", "pathway_condition"), row))
+
+    def iter_csv(self, chunk_rows: int = CSV_CHUNK_ROWS) -> Iterator[str]:
+        """CSV export (oldest first) in chunks of chunk_rows rows."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_HEADER)
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.connection().execute(
+                    "SELECT id, timestamp, rating, feedback_text, phase, pathway_condition FROM feedback"
+                    " WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk_rows)).fetchall()
+            for row in rows:
+                writer.writerow(["" if v is None else v for v in row[1:]])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if len(rows) < chunk_rows:
+                return
+            last_id = rows[-1][0]
+
+    def export_csv(self) -> str:
+        return "".join(self.iter_csv())
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_feedback_store() -> Optional[FeedbackStore]:
+    """Return the process-wide store (legacy JSON files imported on first use), or None if it can't open."""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_lock:
+            if _shared_store is None:
+                try:
+                    store = FeedbackStore(os.environ.get(FEEDBACK_PATH_ENV) or DEFAULT_FEEDBACK_PATH)
+                    store.import_legacy_dir(DEFAULT_FEEDBACK_DIR)
+                except (sqlite3.Error, OSError):
+                    return None
+                _shared_store = store
+    return _shared_store
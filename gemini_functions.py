@@ -353,6 +353,76 @@ APPLY_HEURISTICS = types.FunctionDeclaration(
     }
 )
 
+# -----------------------------------------------------------------------------
+# Pathway Patch (edits instead of a whole new pathway; see pathway_patch.py)
+# -----------------------------------------------------------------------------
+_PATCH_BRANCHES = {
+    "type": "array",
+    "description": "Complete branch list. Targets are current node indices; the k-th inserted node is N + k",
+    "items": {
+        "type": "object",
+        "properties": {
+            "label": {"type": "string"},
+            "target": {"type": "integer"}
+        },
+        "required": ["label", "target"]
+    }
+}
+
+PATCH_PATHWAY_NODES = types.FunctionDeclaration(
+    name="patch_pathway_nodes",
+    description="Edit an existing clinical pathway by returning only the operations needed (insert, update, delete, retarget) instead of the whole node list.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "operations": {
+                "type": "array",
+                "description": "Edits to apply, in order. Indices refer to the pathway as shown (before any edit)",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "op": {
+                            "type": "string",
+                            "enum": ["insert", "update", "delete", "retarget"],
+                            "description": "insert a new node, update fields of a node, delete a node, or retarget a Decision node's branches"
+                        },
+                        "index": {
+                            "type": "integer",
+                            "description": "Node to update/delete/retarget; for insert, the node the new one goes before (omit to append)"
+                        },
+                        "node": {
+                            "type": "object",
+                            "description": "insert: the full new node. update: only the fields that change",
+                            "properties": {
+                                "type": {
+                                    "type": "string",
+                                    "enum": ["Start", "Decision", "Process", "End"]
+                                },
+                                "label": {"type": "string"},
+                                "evidence": {"type": "string"},
+                                "notes": {"type": "string"},
+                                "branches": _PATCH_BRANCHES
+                            }
+                        },
+                        "branches": _PATCH_BRANCHES
+                    },
+                    "required": ["op"]
+                }
+            },
+            "applied_heuristics": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "When applying usability heuristics: IDs of the heuristics applied (e.g., ['H2', 'H5'])"
+            },
+            "summary": {
+                "type": "string",
+                "description": "Brief summary of the changes"
+            }
+        },
+        "required": ["operations"]
+    }
+)
+
 # -----------------------------------------------------------------------------
 # Beta Test Scenario Generation
 # -----------------------------------------------------------------------------
@@ -450,6 +520,7 @@ PATHWAY_TOOLS = [
     GENERATE_PATHWAY_NODES,
     DEFINE_PATHWAY_SCOPE,
     APPLY_HEURISTICS,
+    PATCH_PATHWAY_NODES,
 ]
 
 # Quality improvement tools
@@ -483,6 +554,16 @@ def get_tools(function_declarations):
     return types.Tool(function_declarations=function_declarations)
 
 
+def argument_schema(function_declaration, name):
+    """
+    Schema of one function argument, for use as a JSON response_schema.
+
+    Lets a call stream plain JSON (function-call arguments arrive in one piece)
+    while the output stays constrained exactly as the declaration would.
+    """
+    return function_declaration.parameters.properties[name]
+
+
 def get_generation_config(
     enable_thinking=True,
     thinking_budget=1024,
@@ -20,6 +20,8 @@ Usage:
 
 from typing import Optional, List, Dict, Any
 
+from prompt_budget import evidence_lines, fill_greedy
+
 
 # ============================================================================
 # PROMPT TEMPLATE 1: Comprehensive Pathway Generation
@@ -534,13 +536,22 @@ def format_refinement_prompt(
     )
 
 
-def build_evidence_context(evidence_list: List[Dict[str, Any]], max_items: int = 20) -> str:
+def build_evidence_context(
+    evidence_list: List[Dict[str, Any]],
+    max_items: Optional[int] = 20,
+    query: str = "",
+    context: str = "",
+    budget_tokens: Optional[int] = None
+) -> str:
     """
     Build evidence context string from Phase 2 evidence list.
     
     Args:
         evidence_list: st.session_state.data['phase2']['evidence']
-        max_items: Maximum number of evidence items to include
+        max_items: Maximum number of evidence items to include (None for no cap)
+        query: Rank evidence by relevance to this text (e.g. a refinement request)
+        context: Secondary ranking text (e.g. the pathway's node labels)
+        budget_tokens: Keep as many ranked items as fit in this many tokens
     
     Returns:
         Formatted string for prompt context
@@ -548,14 +559,13 @@ def build_evidence_context(evidence_list: List[Dict[str, Any]], max_items: int =
     if not evidence_list:
         return "No specific evidence provided."
     
-    context_lines = []
-    for e in evidence_list[:max_items]:
-        pmid = e.get('id', 'N/A')
-        title = e.get('title', 'Unknown')
-        abstract = e.get('abstract', '')[:200]
-        context_lines.append(f"- PMID {pmid}: {title} | Abstract: {abstract}")
+    lines = evidence_lines(evidence_list, query, context)
+    if max_items is not None:
+        lines = lines[:max_items]
+    if budget_tokens is not None:
+        lines, _ = fill_greedy(lines, budget_tokens)
     
-    return "\n".join(context_lines)
+    return "\n".join(lines) or "No specific evidence provided."
 
 
 def build_pathway_summary(nodes: List[Dict[str, Any]]) -> str:
@@ -0,0 +1,296 @@
+"""
+Streaming Helpers for Gemini Calls
+
+Long generations (Phase 3 pathway nodes, education modules, executive
+summaries) take 20-60 s to arrive in full. generate_content_stream delivers
+the response in chunks, so the UI can show progress and, for JSON output,
+start rendering finished items while the rest is still being written.
+
+Two pieces:
+1. Incremental JSON parsers that take text chunks and emit each array
+   element (or top-level object member) as soon as it is syntactically
+   complete
+2. collect_stream(), which drains a generate_content_stream iterator,
+   reports text as it grows, and keeps every chunk so the caller can parse
+   the final result exactly as it would a non-streamed response
+
+Nothing here imports Streamlit; callbacks decide how progress is shown.
+"""
+
+import os
+import json
+
+# Set CPQ_STREAMING=0 to make every call wait for the full response again
+STREAMING_ENABLED_ENV = "CPQ_STREAMING"
+
+
+def is_streaming_enabled() -> bool:
+    return os.environ.get(STREAMING_ENABLED_ENV, "1").lower() not in ("0", "false", "no", "n")
+
+
+# ==========================================
+# INCREMENTAL JSON PARSING
+# ==========================================
+
+class _Frame:
+    """One open JSON container while scanning."""
+
+    __slots__ = ("kind", "is_target", "expect_key", "key", "child_start", "child_key")
+
+    def __init__(self, kind: str, is_target: bool):
+        self.kind = kind                # "[" or "{"
+        self.is_target = is_target
+        self.expect_key = kind == "{"
+        self.key = None                 # Most recent member name (objects only)
+        self.child_start = None         # Buffer offset where the current member value began
+        self.child_key = None
+
+
+class _IncrementalJSONScanner:
+    """
+    Character-level scanner shared by the streaming parsers.
+
+    Text before the first '[' or '{' (markdown fences, "Here is the JSON:")
+    is skipped. One container is chosen as the target by _is_target(); each
+    of its direct children is decoded with json.loads the moment its closing
+    character arrives. Children that fail to decode are dropped; the caller
+    still parses the full text at the end, so nothing is lost.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._target_seen = False
+        self.done = False
+
+    def _is_target(self, kind: str, parent) -> bool:
+        raise NotImplementedError
+
+    def _emit(self, frame, raw: str, out: list):
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return
+        out.append(self._make_item(frame, value))
+
+    def _make_item(self, frame, value):
+        return value
+
+    def _flush_child(self, frame, end: int, out: list):
+        if frame.child_start is None:
+            return
+        raw = self._buf[frame.child_start:end].strip()
+        frame.child_start = None
+        if raw:
+            self._emit(frame, raw, out)
+
+    def _begin_child(self, frame, pos: int):
+        """Mark the start of a direct child value of the target container."""
+        if frame.is_target and frame.child_start is None and not frame.expect_key:
+            frame.child_start = pos
+            frame.child_key = frame.key
+
+    def feed(self, text: str) -> list:
+        """
+        Add a chunk of response text.
+
+        Returns:
+            Items that became complete with this chunk (possibly empty)
+        """
+        out = []
+        if self.done or not text:
+            return out
+        self._buf += text
+        buf = self._buf
+        stack = self._stack
+        i = self._pos
+        n = len(buf)
+        while i < n and not self.done:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    top = stack[-1] if stack else None
+                    if top is not None and top.kind == "{" and top.expect_key:
+                        try:
+                            top.key = json.loads(buf[self._string_start:i + 1])
+                        except ValueError:
+                            top.key = None
+                i += 1
+                continue
+
+            top = stack[-1] if stack else None
+            if ch == '"':
+                if top is not None:
+                    self._in_string = True
+                    self._string_start = i
+                    self._begin_child(top, i)
+            elif ch in "[{":
+                if top is not None:
+                    self._begin_child(top, i)
+                is_target = not self._target_seen and self._is_target(ch, top)
+                if is_target:
+                    self._target_seen = True
+                stack.append(_Frame(ch, is_target))
+            elif ch in "]}":
+                if top is None:
+                    pass
+                else:
+                    closed = stack.pop()
+                    if closed.is_target:
+                        self._flush_child(closed, i, out)
+                        self.done = True
+                    elif stack and stack[-1].is_target:
+                        # A nested container just closed: that is a complete child
+                        self._flush_child(stack[-1], i + 1, out)
+                    elif not stack and not self._target_seen:
+                        # Root closed without ever finding a target
+                        self.done = True
+            elif top is not None:
+                if ch == ",":
+                    if top.is_target:
+                        self._flush_child(top, i, out)
+                    if top.kind == "{":
+                        top.expect_key = True
+                elif ch == ":":
+                    if top.kind == "{":
+                        top.expect_key = False
+                elif not ch.isspace():
+                    # Start of a number / true / false / null
+                    self._begin_child(top, i)
+            i += 1
+        self._pos = i
+        return out
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return self._buf
+
+
+class JSONArrayStreamParser(_IncrementalJSONScanner):
+    """
+    Emit the elements of a streamed JSON array one at a time.
+
+    Args:
+        key: Member name of the array when the response is an object
+            (e.g. "nodes" for {"nodes": [...]}). With no key, a top-level
+            array is used, or else the first array-valued member of a
+            top-level object.
+    """
+
+    def __init__(self, key: str = None):
+        super().__init__()
+        self.key = key
+        self.items = []
+
+    def _is_target(self, kind, parent):
+        if kind != "[":
+            return False
+        if parent is None:
+            return self.key is None
+        # Only members of the root object are considered
+        return (parent.kind == "{" and len(self._stack) == 1
+                and (self.key is None or parent.key == self.key))
+
+    def feed(self, text: str) -> list:
+        new_items = super().feed(text)
+        self.items.extend(new_items)
+        return new_items
+
+
+class JSONObjectStreamParser(_IncrementalJSONScanner):
+    """Emit (key, value) for each member of a streamed top-level JSON object."""
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+
+    def _is_target(self, kind, parent):
+        return kind == "{" and parent is None
+
+    def _make_item(self, frame, value):
+        return frame.child_key, value
+
+    def feed(self, text: str) -> list:
+        new_items = super().feed(text)
+        self.fields.update(new_items)
+        return new_items
+
+
+# ==========================================
+# STREAM CONSUMPTION
+# ==========================================
+
+def chunk_text(chunk) -> str:
+    """
+    Answer text carried by one streamed chunk.
+
+    Thought-summary parts and function calls are skipped (chunk.text would
+    warn on mixed parts), so the result matches what response.text gives
+    for the assembled response.
+    """
+    candidates = getattr(chunk, "candidates", None)
+    if not candidates:
+        return ""
+    content = getattr(candidates[0], "content", None)
+    parts = getattr(content, "parts", None) or []
+    pieces = []
+    for part in parts:
+        text = getattr(part, "text", None)
+        if text and not getattr(part, "thought", False):
+            pieces.append(text)
+    return "".join(pieces)
+
+
+class StreamResult:
+    """Text and raw chunks collected from one streamed call."""
+
+    __slots__ = ("text", "chunks")
+
+    def __init__(self, text: str, chunks: list):
+        self.text = text
+        self.chunks = chunks
+
+
+def collect_stream(stream, on_text=None, parser=None, on_item=None) -> StreamResult:
+    """
+    Drain a generate_content_stream iterator.
+
+    Args:
+        stream: Iterator returned by client.models.generate_content_stream
+        on_text: Optional callback(full_text_so_far), called after each chunk
+            that added text
+        parser: Optional JSONArrayStreamParser / JSONObjectStreamParser fed
+            with each chunk's text
+        on_item: Optional callback(index, item) for every item the parser
+            completes; index counts from 0 within this stream
+
+    Returns:
+        StreamResult with the concatenated text and every chunk received
+    """
+    pieces = []
+    chunks = []
+    count = 0
+    for chunk in stream:
+        chunks.append(chunk)
+        text = chunk_text(chunk)
+        if not text:
+            continue
+        pieces.append(text)
+        if parser is not None:
+            for item in parser.feed(text):
+                if on_item is not None:
+                    on_item(count, item)
+                count += 1
+        if on_text is not None:
+            on_text("".join(pieces))
+    return StreamResult("".join(pieces), chunks)
@@ -0,0 +1,453 @@
+"""
+Model Cascade Runner for Gemini Calls
+
+Runs a prioritized list of candidate models (see get_smart_model_cascade in
+streamlit_app.py) and returns the first valid response.
+
+Two modes:
+1. Sequential: try each model in order, moving on when one fails
+2. Hedged: if the current model has not answered within an adaptive delay,
+   start the next candidate in parallel and take whichever valid response
+   arrives first. Failures start the next candidate immediately.
+
+Per-model latency and outcome are recorded in a process-wide registry so the
+hedge delay tracks how fast each model actually answers for each task.
+
+The same registry runs a circuit breaker per (API key, model): quota errors
+(429 / RESOURCE_EXHAUSTED) open the breaker for the cooldown the API asks
+for, so later calls - from any session in the worker - skip that model
+instead of paying for another doomed round trip.
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+# Set CPQ_HEDGED_CASCADE=0 to fall back to strictly sequential cascading
+HEDGE_ENABLED_ENV = "CPQ_HEDGED_CASCADE"
+
+DEFAULT_HEDGE_DELAY = 10.0   # Seconds before hedging when a model has no history
+MIN_HEDGE_DELAY = 2.0
+MAX_HEDGE_DELAY = 45.0
+EWMA_ALPHA = 0.3             # Weight of the newest latency sample
+SEQUENTIAL_FAILURE_PAUSE = 0.3
+
+# Circuit breaker tuning
+DEFAULT_QUOTA_COOLDOWN = 60.0        # Used when the error does not say how long to wait
+DAILY_QUOTA_COOLDOWN = 3600.0        # "PerDay" quota: don't hammer it every minute
+MAX_COOLDOWN = 6 * 3600.0
+ERROR_COOLDOWN = 30.0                # After repeated non-quota failures
+ERROR_THRESHOLD = 3                  # Consecutive non-quota failures before opening
+PROBE_TIMEOUT = 60.0                 # A half-open probe that never reports back expires
+MIN_SAMPLES_FOR_DEMOTION = 4
+DEMOTION_SUCCESS_RATE = 0.5
+
+
+def is_hedging_enabled() -> bool:
+    return os.environ.get(HEDGE_ENABLED_ENV, "1").lower() not in ("0", "false", "no", "n")
+
+
+# ==========================================
+# ERROR CLASSIFICATION
+# ==========================================
+
+_RETRY_DELAY_PATTERNS = [
+    re.compile(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE),
+    re.compile(r"retry in\s+(\d+(?:\.\d+)?)\s*(?:s\b|sec|second)", re.IGNORECASE),
+    re.compile(r"retry after\s+(\d+(?:\.\d+)?)\s*(?:s\b|sec|second)?", re.IGNORECASE),
+]
+
+
+def is_quota_error(error: str) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED / quota errors."""
+    if not error:
+        return False
+    lowered = error.lower()
+    return "429" in error or "resource_exhausted" in lowered or "quota" in lowered
+
+
+def parse_retry_delay(error: str):
+    """Extract the server-suggested retry delay (seconds) from a quota error, if any."""
+    if not error:
+        return None
+    for pattern in _RETRY_DELAY_PATTERNS:
+        match = pattern.search(error)
+        if match:
+            try:
+                return float(match.group(1))
+            except ValueError:
+                continue
+    return None
+
+
+def quota_cooldown(error: str, consecutive: int = 1) -> float:
+    """Cooldown for a quota error: server hint first, else backoff by repeat count."""
+    hinted = parse_retry_delay(error)
+    if hinted is not None:
+        return min(max(hinted, 1.0), MAX_COOLDOWN)
+    if "perday" in (error or "").lower().replace(" ", "").replace("_", ""):
+        return DAILY_QUOTA_COOLDOWN
+    return min(DEFAULT_QUOTA_COOLDOWN * (2 ** max(0, consecutive - 1)), MAX_COOLDOWN)
+
+
+def client_scope(client) -> str:
+    """
+    Short, non-reversible identifier for the API key behind a genai client.
+
+    Quota is per key, so breaker state is scoped by key: one user's exhausted
+    free-tier key must not make every other session skip the model.
+    """
+    if client is None:
+        return ""
+    api_key = getattr(getattr(client, "_api_client", None), "api_key", None)
+    if not api_key:
+        return f"client-{id(client)}"
+    return hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()[:16]
+
+
+# ==========================================
+# PER-MODEL STATISTICS
+# ==========================================
+
+class ModelStats:
+    """Rolling latency and outcome statistics for one (model, task) pair."""
+
+    __slots__ = ("latency_ewma", "latency_dev", "successes", "failures", "last_error", "last_used")
+
+    def __init__(self):
+        self.latency_ewma = None
+        self.latency_dev = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.last_error = ""
+        self.last_used = 0.0
+
+    def record(self, latency: float, ok: bool, error: str = ""):
+        self.last_used = time.time()
+        if ok:
+            self.successes += 1
+            # Only successful calls say anything about how long a real answer takes
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+                self.latency_dev = latency / 2
+            else:
+                diff = latency - self.latency_ewma
+                self.latency_ewma += EWMA_ALPHA * diff
+                self.latency_dev += EWMA_ALPHA * (abs(diff) - self.latency_dev)
+        else:
+            self.failures += 1
+            self.last_error = (error or "")[:200]
+
+    def as_dict(self) -> dict:
+        total = self.successes + self.failures
+        return {
+            "latency_ewma": self.latency_ewma,
+            "latency_dev": self.latency_dev,
+            "successes": self.successes,
+            "failures": self.failures,
+            "success_rate": (self.successes / total) if total else None,
+            "last_error": self.last_error,
+        }
+
+
+class CircuitState:
+    """Breaker for one (scope, model): closed, open until a time, or half-open."""
+
+    __slots__ = ("open_until", "consecutive_quota", "consecutive_errors", "probe_started", "reason")
+
+    def __init__(self):
+        self.open_until = 0.0
+        self.consecutive_quota = 0
+        self.consecutive_errors = 0
+        self.probe_started = 0.0
+        self.reason = ""
+
+    def record(self, ok: bool, error: str, now: float):
+        if ok:
+            self.open_until = 0.0
+            self.consecutive_quota = 0
+            self.consecutive_errors = 0
+            self.probe_started = 0.0
+            self.reason = ""
+            return
+        self.probe_started = 0.0
+        if is_quota_error(error):
+            self.consecutive_quota += 1
+            self.open_until = now + quota_cooldown(error, self.consecutive_quota)
+            self.reason = "quota"
+        else:
+            self.consecutive_errors += 1
+            if self.consecutive_errors >= ERROR_THRESHOLD:
+                self.open_until = now + ERROR_COOLDOWN
+                self.reason = "errors"
+
+
+class ModelHealthRegistry:
+    """Process-wide record of how each model has been behaving."""
+
+    def __init__(self):
+        self._stats = {}
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _get(self, model: str, task: str) -> ModelStats:
+        key = (model, task or "")
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ModelStats()
+        return stats
+
+    def record(self, model: str, latency: float, ok: bool, task: str = "", error: str = "",
+               scope: str = ""):
+        with self._lock:
+            self._get(model, task).record(latency, ok, error)
+            circuit = self._circuits.get((scope, model))
+            if circuit is None:
+                circuit = self._circuits[(scope, model)] = CircuitState()
+            circuit.record(ok, error, time.time())
+
+    # --- circuit breaker ---
+
+    def cooldown_remaining(self, model: str, scope: str = "") -> float:
+        """Seconds until the model's breaker closes again (0 when usable)."""
+        with self._lock:
+            circuit = self._circuits.get((scope, model))
+            if circuit is None:
+                return 0.0
+            return max(0.0, circuit.open_until - time.time())
+
+    def is_available(self, model: str, scope: str = "") -> bool:
+        """
+        Whether a call to this model should be attempted now (no side effects).
+
+        After the cooldown expires the model is available again until a caller
+        takes the half-open probe with claim_probe(); everyone else then skips
+        it until that probe reports back.
+        """
+        with self._lock:
+            circuit = self._circuits.get((scope, model))
+            if circuit is None or circuit.open_until == 0.0:
+                return True
+            now = time.time()
+            if circuit.open_until > now:
+                return False
+            return not (circuit.probe_started and now - circuit.probe_started < PROBE_TIMEOUT)
+
+    def claim_probe(self, model: str, scope: str = "") -> bool:
+        """
+        Called when an attempt on model actually starts.
+
+        If the breaker is half-open this attempt becomes the probe; returns
+        False when another probe is already in flight (the caller should skip
+        the model). Closed breakers, and attempts a caller makes on a model
+        that is still cooling down because nothing else is left, need no claim.
+        """
+        with self._lock:
+            circuit = self._circuits.get((scope, model))
+            if circuit is None or circuit.open_until == 0.0:
+                return True
+            now = time.time()
+            if circuit.open_until > now:
+                return True
+            if circuit.probe_started and now - circuit.probe_started < PROBE_TIMEOUT:
+                return False
+            circuit.probe_started = now
+            return True
+
+    def _success_rate(self, model: str):
+        successes = failures = 0
+        for (m, _), stats in self._stats.items():
+            if m == model:
+                successes += stats.successes
+                failures += stats.failures
+        total = successes + failures
+        if total < MIN_SAMPLES_FOR_DEMOTION:
+            return None
+        return successes / total
+
+    def order_candidates(self, candidates, scope: str = ""):
+        """
+        Filter and reorder a model cascade using current health.
+
+        Models with an open breaker are dropped; models with a poor rolling
+        success rate move behind healthy ones (priority order is otherwise kept).
+        If every model is cooling down, the one that reopens soonest is
+        returned so the caller still has something to try.
+        """
+        candidates = list(dict.fromkeys(candidates))
+        usable = [m for m in candidates if self.is_available(m, scope)]
+        if not usable:
+            if not candidates:
+                return []
+            return [min(candidates, key=lambda m: self.cooldown_remaining(m, scope))]
+        with self._lock:
+            rates = {m: self._success_rate(m) for m in usable}
+        healthy = [m for m in usable if rates[m] is None or rates[m] >= DEMOTION_SUCCESS_RATE]
+        demoted = [m for m in usable if m not in healthy]
+        return healthy + demoted
+
+    def hedge_delay(self, model: str, task: str = "", default: float = DEFAULT_HEDGE_DELAY,
+                    cap: float = MAX_HEDGE_DELAY) -> float:
+        """
+        Seconds to wait on a model before starting the next candidate.
+
+        Uses the smoothed latency plus two deviations, so a hedge only fires
+        when the model is slower than it usually is for this task.
+        """
+        with self._lock:
+            stats = self._stats.get((model, task or ""))
+            if stats is None or stats.latency_ewma is None:
+                delay = default
+            else:
+                delay = stats.latency_ewma + 2 * stats.latency_dev
+        return max(MIN_HEDGE_DELAY, min(delay, cap, MAX_HEDGE_DELAY))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {f"{m}|{t}" if t else m: s.as_dict() for (m, t), s in self._stats.items()}
+            now = time.time()
+            out["_circuits"] = {
+                f"{scope}|{m}": {"open_for": max(0.0, c.open_until - now), "reason": c.reason}
+                for (scope, m), c in self._circuits.items() if c.open_until > now
+            }
+            return out
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._circuits.clear()
+
+
+_registry = ModelHealthRegistry()
+
+
+def get_model_health() -> ModelHealthRegistry:
+    return _registry
+
+
+# ==========================================
+# CASCADE RUNNERS
+# ==========================================
+
+class CascadeResult:
+    """Outcome of a cascade run: winning model/value plus per-model failures."""
+
+    __slots__ = ("model", "value", "ok", "failures")
+
+    def __init__(self):
+        self.model = None
+        self.value = None
+        self.ok = False
+        self.failures = []  # list of (model, error_str)
+
+
+def _timed_attempt(attempt, model, registry, task, scope=""):
+    """Run attempt(model) and record its latency/outcome. Returns (ok, value, error)."""
+    if not registry.claim_probe(model, scope):
+        # Another caller is probing this model's breaker; don't record a failure
+        return False, None, "skipped: breaker probe in flight"
+    start = time.monotonic()
+    try:
+        ok, value = attempt(model)
+        error = "" if ok else "invalid response"
+    except Exception as e:
+        ok, value, error = False, None, str(e)
+    registry.record(model, time.monotonic() - start, ok, task=task, error=error, scope=scope)
+    return ok, value, error
+
+
+def run_sequential(candidates, attempt, task: str = "", registry: ModelHealthRegistry = None,
+                   pause: float = SEQUENTIAL_FAILURE_PAUSE, scope: str = "") -> CascadeResult:
+    """
+    Try each candidate in order until attempt(model) returns (True, value).
+
+    Args:
+        candidates: Ordered model names
+        attempt: Callable(model) -> (ok, value); may raise on API errors
+        task: Label used to bucket latency statistics
+        registry: Health registry (defaults to the process-wide one)
+        pause: Seconds to sleep between failed candidates (skipped after quota errors,
+            since the next model has its own quota)
+        scope: Breaker scope (see client_scope)
+    """
+    registry = registry or _registry
+    result = CascadeResult()
+    for i, model in enumerate(candidates):
+        ok, value, error = _timed_attempt(attempt, model, registry, task, scope)
+        if ok:
+            result.model, result.value, result.ok = model, value, True
+            return result
+        result.failures.append((model, error))
+        if pause and i + 1 < len(candidates) and not is_quota_error(error):
+            time.sleep(pause)
+    return result
+
+
+def run_hedged(candidates, attempt, task: str = "", registry: ModelHealthRegistry = None,
+               hedge_delay: float = None, max_delay: float = MAX_HEDGE_DELAY,
+               scope: str = "") -> CascadeResult:
+    """
+    Hedged cascade: start the next candidate when the running ones are slow or fail.
+
+    The first valid response wins; slower in-flight calls are abandoned (their
+    results are ignored, pending ones are cancelled).
+
+    Args:
+        candidates: Ordered model names
+        attempt: Callable(model) -> (ok, value); must not touch Streamlit APIs
+            because it runs on a worker thread
+        task: Label used to bucket latency statistics
+        registry: Health registry (defaults to the process-wide one)
+        hedge_delay: Fixed hedge delay in seconds; None adapts per model
+        max_delay: Upper bound for the adaptive delay
+        scope: Breaker scope (see client_scope)
+    """
+    registry = registry or _registry
+    result = CascadeResult()
+    if not candidates:
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="cpq-hedge")
+    in_flight = {}
+    next_idx = 0
+
+    def launch():
+        nonlocal next_idx
+        model = candidates[next_idx]
+        next_idx += 1
+        in_flight[executor.submit(_timed_attempt, attempt, model, registry, task, scope)] = model
+        return model
+
+    try:
+        launch()
+        while in_flight:
+            if next_idx < len(candidates):
+                newest = candidates[next_idx - 1]
+                timeout = hedge_delay if hedge_delay is not None else registry.hedge_delay(newest, task, cap=max_delay)
+            else:
+                timeout = None
+            done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Running candidates are slower than expected: hedge with the next one
+                launch()
+                continue
+            for fut in done:
+                model = in_flight.pop(fut)
+                ok, value, error = fut.result()
+                if ok:
+                    result.model, result.value, result.ok = model, value, True
+                    return result
+                result.failures.append((model, error))
+            # Every finished future here failed: start the next candidate right away
+            if next_idx < len(candidates):
+                launch()
+        return result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,316 @@
+"""
+Large-Pathway Scale Mode
+
+Splits institution-size pathways (hundreds of nodes) into sub-pathways
+that are drawn separately. The flat diagram puts every node, every
+Decision rank group, every End sink and one giant notes legend into a
+single dot layout, which takes tens of seconds at that size and yields an
+unreadable SVG.
+
+How it works:
+1. Nodes are grouped into contiguous clusters: by clinical stage when the
+   nodes carry a 'stage' field, otherwise at Decision nodes where few
+   edges cross the cut (the start of a decision subtree)
+2. Cluster size is capped, so each cluster's layout cost stays bounded
+   however large the pathway grows
+3. An overview diagram shows one box per cluster with the paths between them
+4. Each cluster has its own DOT (stub nodes for links to other clusters,
+   a per-cluster notes legend) and its own content key, so editing one
+   cluster leaves the others cached
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from diagram_cache import diagram_key
+from pathway_ir import DEFAULT_STYLE, LEGEND_FILL, compile_pathway, escape_dot, wrap_label
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+SCALE_MODE_ENV = "CPQ_SCALE_MODE_NODES"    # Node count at which scale mode turns on
+DEFAULT_SCALE_THRESHOLD = 150
+MAX_CLUSTER_SIZE = 40                      # Nodes per cluster (bounds each layout)
+MIN_CLUSTER_SIZE = 12                      # Smallest cluster produced by a size cut
+PLAN_CACHE_SIZE = 16
+STUB_FILL = '#EEEEEE'
+OVERVIEW_FILL = DEFAULT_STYLE[1]
+
+
+def scale_mode_threshold() -> int:
+    try:
+        return max(1, int(os.environ.get(SCALE_MODE_ENV, DEFAULT_SCALE_THRESHOLD)))
+    except ValueError:
+        return DEFAULT_SCALE_THRESHOLD
+
+
+def needs_scale_mode(nodes, threshold: Optional[int] = None) -> bool:
+    """True if the pathway is large enough to be drawn as clusters."""
+    return len(nodes or []) >= (threshold or scale_mode_threshold())
+
+
+# ==========================================
+# CLUSTERING
+# ==========================================
+
+def _crossings(n: int, edges) -> List[int]:
+    """crossings[b] = number of edges crossing the cut between node b-1 and node b."""
+    diff = [0] * (n + 2)
+    for src, dst, _ in edges:
+        lo, hi = min(src, dst) + 1, max(src, dst)
+        if lo <= hi:
+            diff[lo] += 1
+            diff[hi + 1] -= 1
+    crossings, running = [0] * (n + 1), 0
+    for b in range(n + 1):
+        running += diff[b]
+        crossings[b] = running
+    return crossings
+
+
+def _split_run(run: List[int], types: List[str], crossings: List[int],
+               max_size: int, min_size: int) -> List[List[int]]:
+    """
+    Cut a contiguous run into pieces of at most max_size nodes. Each cut is
+    placed min_size..max_size nodes after the previous one, where the fewest
+    edges cross it, preferring cuts just before a Decision.
+    """
+    groups, start = [], 0
+    while len(run) - start > max_size:
+        window = range(start + min_size, start + max_size + 1)
+        cut = min(window, key=lambda b: (crossings[run[b]], types[run[b]] != 'Decision', b))
+        groups.append(run[start:cut])
+        start = cut
+    groups.append(run[start:])
+    return groups
+
+
+def cluster_indices(types: List[str], edges, stages: Optional[List[Any]] = None,
+                    max_size: int = MAX_CLUSTER_SIZE, min_size: int = MIN_CLUSTER_SIZE) -> List[List[int]]:
+    """
+    Partition node indices 0..n-1 into contiguous clusters.
+
+    Args:
+        types: Node type per index
+        edges: (src, dst, label) edges
+        stages: Optional clinical stage per index; consecutive nodes of the
+            same stage are kept together (then split if larger than max_size)
+        max_size: Largest cluster
+        min_size: Smallest cluster produced by a size cut
+    """
+    n = len(types)
+    if n == 0:
+        return []
+    crossings = _crossings(n, edges)
+    runs = [list(range(n))]
+    if stages and all(stages):
+        runs, start = [], 0
+        for i in range(1, n + 1):
+            if i == n or stages[i] != stages[start]:
+                runs.append(list(range(start, i)))
+                start = i
+    groups = []
+    for run in runs:
+        groups.extend(_split_run(run, types, crossings, max_size, min(min_size, max_size)))
+    return groups
+
+
+# ==========================================
+# SCALE PLAN
+# ==========================================
+
+class PathwayCluster:
+    __slots__ = ('number', 'id', 'title', 'members', 'decisions', 'key')
+
+    def __init__(self, number, title, members, decisions, key):
+        self.number = number
+        self.id = f"C{number}"
+        self.title = title
+        self.members = members          # Node indices (contiguous)
+        self.decisions = decisions      # Decision count
+        self.key = key                  # Content key for caching this cluster's artifacts
+
+
+class ScalePlan:
+    """A compiled pathway split into clusters, with the links between them."""
+
+    __slots__ = ('ir', 'clusters', 'cluster_of', 'links')
+
+    def __init__(self, ir, clusters):
+        self.ir = ir
+        self.clusters: List[PathwayCluster] = clusters
+        self.cluster_of = [0] * len(ir.nodes)
+        for cluster in clusters:
+            for i in cluster.members:
+                self.cluster_of[i] = cluster.number
+        # (from cluster, to cluster) -> [edge]
+        self.links: Dict[tuple, list] = OrderedDict()
+        for edge in ir.edges:
+            a, b = self.cluster_of[edge.src], self.cluster_of[edge.dst]
+            if a != b:
+                self.links.setdefault((a, b), []).append(edge)
+
+
+def build_scale_plan(ir, nodes: List[Dict[str, Any]], max_size: int = MAX_CLUSTER_SIZE,
+                     min_size: int = MIN_CLUSTER_SIZE) -> ScalePlan:
+    """Cluster a compiled IR; nodes are the prepared nodes the IR was built from."""
+    edges = [(e.src, e.dst, e.label) for e in ir.edges]
+    stages = [node.get('stage') for node in nodes] if len(nodes) == len(ir.nodes) else None
+    groups = cluster_indices([node.type for node in ir.nodes], edges, stages, max_size, min_size)
+
+    cluster_of = [0] * len(ir.nodes)
+    for number, members in enumerate(groups):
+        for i in members:
+            cluster_of[i] = number
+    # Edges crossing into or out of each cluster are part of its content key
+    boundary = [[] for _ in groups]
+    for e in ir.edges:
+        a, b = cluster_of[e.src], cluster_of[e.dst]
+        if a != b:
+            boundary[a].append((e.src, e.dst, e.label))
+            boundary[b].append((e.src, e.dst, e.label))
+
+    titles = []
+    for number, members in enumerate(groups):
+        stage = stages[members[0]] if stages and all(stages) else None
+        if stage:
+            # A stage larger than one cluster continues into the next
+            title = str(stage) + (" (cont.)" if number and stages[groups[number - 1][0]] == stage else "")
+        else:
+            title = wrap_label(ir.nodes[members[0]].label, max_width=40).split("\n")[0]
+        titles.append(f"{number + 1}. {title}")
+
+    clusters = []
+    for number, members in enumerate(groups):
+        # Stub nodes show linked clusters' titles, so those are part of the key too
+        linked = sorted({titles[cluster_of[i]] for edge in boundary[number] for i in edge[:2]})
+        key = diagram_key([nodes[i] for i in members] + [members[0], boundary[number], linked], ir.orientation)
+        decisions = sum(1 for i in members if ir.nodes[i].type == 'Decision')
+        clusters.append(PathwayCluster(number, titles[number], members, decisions, key))
+    return ScalePlan(ir, clusters)
+
+
+_plan_cache = OrderedDict()
+_plan_lock = threading.Lock()
+
+
+def compile_scale_plan(nodes: List[Dict[str, Any]], orientation: str = "TD",
+                       role_colors: Optional[Dict[str, str]] = None, prepare=None) -> ScalePlan:
+    """Scale plan for a node list, memoized by content (arguments as compile_pathway)."""
+    colors = tuple(sorted(role_colors.items())) if role_colors else None
+    key = (diagram_key(nodes, orientation), colors, prepare is not None)
+    with _plan_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+            return plan
+    ir = compile_pathway(nodes, orientation, role_colors=role_colors, prepare=prepare)
+    prepared = prepare(nodes) if prepare else [n if isinstance(n, dict) else {} for n in nodes or []]
+    plan = build_scale_plan(ir, prepared)
+    with _plan_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+# ==========================================
+# EMITTERS
+# ==========================================
+
+def _header(rankdir: str) -> List[str]:
+    return [
+        "digraph G {",
+        f"  rankdir={rankdir};",
+        "  splines=polyline;",
+        "  nodesep=0.8;",
+        "  ranksep=1.0;",
+        "  node [fontname=Helvetica, fontsize=11];",
+        "  edge [fontname=Helvetica, fontsize=10];",
+    ]
+
+
+def _edge_line(src: str, dst: str, dot_label: str, extra: str = "") -> str:
+    attrs = [f'label="{dot_label}"'] if dot_label else []
+    if extra:
+        attrs.append(extra)
+    return f"  {src} -> {dst}" + (f" [{', '.join(attrs)}];" if attrs else ";")
+
+
+def emit_overview_dot(plan: ScalePlan) -> str:
+    """One box per cluster, with the paths between clusters."""
+    lines = _header(plan.ir.rankdir)
+    for cluster in plan.clusters:
+        detail = f"{len(cluster.members)} steps"
+        if cluster.decisions:
+            detail += f", {cluster.decisions} decision" + ("s" if cluster.decisions != 1 else "")
+        label = escape_dot(wrap_label(cluster.title, width=28) + f"\n({detail})")
+        lines.append(f'  {cluster.id} [label="{label}", shape=box, style="rounded,filled", fillcolor="{OVERVIEW_FILL}"];')
+    lines.append("")
+    for (a, b), edges in plan.links.items():
+        labels = list(dict.fromkeys(e.dot_label for e in edges if e.dot_label))
+        label = labels[0] if len(edges) == 1 and labels else (f"{len(edges)} paths" if len(edges) > 1 else "")
+        lines.append(_edge_line(f"C{a}", f"C{b}", label))
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def emit_cluster_dot(plan: ScalePlan, number: int) -> str:
+    """
+    DOT for one cluster: its nodes and internal edges, stub nodes for links
+    to and from other clusters, and a legend of this cluster's notes only.
+    """
+    ir, cluster = plan.ir, plan.clusters[number]
+    members = set(cluster.members)
+    lines = _header(ir.rankdir)
+
+    notes = []
+    for i in cluster.members:
+        node = ir.nodes[i]
+        label = wrap_label(node.label, width=25)
+        if node.note is not None:
+            notes.append((len(notes) + 1, ir.notes[node.note - 1][1]))
+            label += f"\n(Note {len(notes)})"
+        lines.append(f'  {node.id} [label="{escape_dot(label)}", shape={node.shape}, style=filled, fillcolor="{node.fill}"];')
+
+    stubs = OrderedDict()
+    edge_lines = []
+    for edge in ir.edges:
+        src_in, dst_in = edge.src in members, edge.dst in members
+        if src_in and dst_in:
+            edge_lines.append(_edge_line(f"N{edge.src}", f"N{edge.dst}", edge.dot_label))
+        elif src_in:
+            other = plan.clusters[plan.cluster_of[edge.dst]]
+            stubs.setdefault(f"To{other.id}", f"→ {other.title}")
+            edge_lines.append(_edge_line(f"N{edge.src}", f"To{other.id}", edge.dot_label, "style=dashed"))
+        elif dst_in:
+            other = plan.clusters[plan.cluster_of[edge.src]]
+            stubs.setdefault(f"From{other.id}", f"from {other.title}")
+            edge_lines.append(_edge_line(f"From{other.id}", f"N{edge.dst}", edge.dot_label, "style=dashed"))
+    for stub_id, text in stubs.items():
+        label = escape_dot(wrap_label(text, width=25))
+        lines.append(f'  {stub_id} [label="{label}", shape=box, style="dashed,filled", fillcolor="{STUB_FILL}", fontsize=10];')
+    lines.append("")
+
+    if ir.source_rank and int(ir.source_rank[1:]) in members:
+        lines.append(f"  {{ rank=source; {ir.source_rank}; }}")
+    sinks = [nid for nid in ir.sink_rank if int(nid[1:]) in members]
+    if sinks:
+        lines.append(f"  {{ rank=sink; {'; '.join(sinks)}; }}")
+    for group in ir.same_ranks:
+        if all(int(nid[1:]) in members for nid in group):
+            lines.append(f"  {{ rank=same; {'; '.join(group)}; }}")
+    lines.append("")
+
+    if notes:
+        legend = ["NOTES:"] + [f"[{num}] {wrap_label(text, max_width=60)}" for num, text in notes]
+        lines.append(f'  NotesLegend [label="{escape_dot(chr(10).join(legend))}", shape=box, style=filled, fillcolor="{LEGEND_FILL}", fontsize=10];')
+        lines.append("  { rank=max; NotesLegend; }")
+        lines.append("")
+
+    lines.extend(edge_lines)
+    lines.append("}")
+    return "\n".join(lines)
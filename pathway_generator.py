@@ -21,8 +21,7 @@ from dataclasses import dataclass, field
 from typing import List, Dict, Optional, Any, Union
 from enum import Enum
 import json
-import re
-import textwrap
+from pathway_ir import compile_pathway, emit_dot, emit_mermaid
 
 
 class NodeType(Enum):
@@ -436,219 +435,8 @@ class PathwayGenerator:
             nodes: List of node dictionaries in app format
             include_styling: Whether to include CSS styling classes
         """
-        if not nodes:
-            return "graph TD\n    NoNodes[No pathway nodes defined]"
-        
-        lines = ["graph TD"]
-        
-        # Collect note references
-        notes_list = []
-        notes_node_map = {}
-        note_counter = 1
-        for i, node in enumerate(nodes):
-            notes_text = node.get('notes', '') or node.get('detail', '')
-            if notes_text and str(notes_text).strip():
-                notes_list.append((note_counter, str(notes_text).strip()))
-                notes_node_map[i] = note_counter
-                note_counter += 1
-        
-        if include_styling:
-            lines.extend([
-                "",
-                "    %% Styling",
-                "    classDef startEnd fill:#d4edda,stroke:#28a745,stroke-width:2px,color:#155724,font-weight:bold",
-                "    classDef decision fill:#f8d7da,stroke:#dc3545,stroke-width:2px,color:#721c24,font-weight:bold",
-                "    classDef process fill:#fff3cd,stroke:#ffc107,stroke-width:1px,color:#856404",
-                "    classDef reeval fill:#ffe0b2,stroke:#e65100,stroke-width:2px,color:#bf360c",
-                "    classDef noteBox fill:#bbdefb,stroke:#1565c0,stroke-width:1px,color:#0d47a1,font-size:11px",
-                ""
-            ])
-        
-        # Generate node definitions
-        start_nodes = []
-        decision_nodes = []
-        process_nodes = []
-        end_nodes = []
-        reeval_nodes = []
-        
-        for i, node in enumerate(nodes):
-            node_id = f"N{i}"
-            node_type = node.get("type", "Process")
-            label = self._escape_mermaid_label(node.get("label", f"Step {i}"))
-            
-            # Add note reference to label
-            if i in notes_node_map:
-                label = f"{label} &#91;Note {notes_node_map[i]}&#93;"
-            
-            # Determine shape based on type
-            if node_type == "Start":
-                lines.append(f'    {node_id}(["{label}"])')
-                start_nodes.append(node_id)
-            elif node_type == "End":
-                lines.append(f'    {node_id}(["{label}"])')
-                end_nodes.append(node_id)
-            elif node_type == "Decision":
-                lines.append(f'    {node_id}{{"{label}"}}')
-                decision_nodes.append(node_id)
-            elif node_type == "Reevaluation":
-                lines.append(f'    {node_id}[/"{label}"\\]')
-                reeval_nodes.append(node_id)
-            else:  # Process
-                lines.append(f'    {node_id}["{label}"]')
-                process_nodes.append(node_id)
-        
-        lines.append("")
-        
-        # Generate edges using branch-aware logic
-        computed_edges = self._compute_edges(nodes)
-        for src_idx, dst_idx, lbl in computed_edges:
-            src = f"N{src_idx}"
-            dst = f"N{dst_idx}"
-            if lbl:
-                safe_lbl = self._escape_mermaid_label(lbl, max_length=35)
-                lines.append(f'    {src} -->|"{safe_lbl}"| {dst}')
-            else:
-                lines.append(f'    {src} --> {dst}')
-        
-        # Add notes legend as a separate subgraph
-        if notes_list:
-            lines.append("")
-            lines.append("    subgraph Notes Legend")
-            lines.append("    direction TB")
-            for note_num, note_text in notes_list:
-                escaped_note = self._escape_mermaid_label(note_text, max_length=80)
-                note_id = f"NOTE{note_num}"
-                lines.append(f'    {note_id}["{note_num}. {escaped_note}"]')
-            lines.append("    end")
-            # Style note nodes
-            note_ids = [f"NOTE{n}" for n, _ in notes_list]
-            lines.append(f"    class {','.join(note_ids)} noteBox")
-        
-        # Apply styling classes
-        if include_styling:
-            lines.append("")
-            if start_nodes or end_nodes:
-                lines.append(f"    class {','.join(start_nodes + end_nodes)} startEnd")
-            if decision_nodes:
-                lines.append(f"    class {','.join(decision_nodes)} decision")
-            if process_nodes:
-                lines.append(f"    class {','.join(process_nodes)} process")
-            if reeval_nodes:
-                lines.append(f"    class {','.join(reeval_nodes)} reeval")
-        
-        return "\n".join(lines)
-    
-    def _escape_mermaid_label(self, text: str, max_length: int = 60) -> str:
-        """Escape and truncate label for Mermaid compatibility.
-        
-        Mermaid is sensitive to: quotes, parentheses, brackets, angle brackets,
-        curly braces, pipe characters, and hash symbols in labels.
-        """
-        if not text:
-            return "Step"
-        # Replace problematic characters for Mermaid
-        text = str(text).replace('"', "'").replace('\n', ' ').replace('\\n', ' ')
-        # Characters that break Mermaid syntax when inside quoted labels
-        # IMPORTANT: & must be escaped FIRST to &amp; so subsequent &#xx; entities stay intact
-        text = text.replace('&', '&amp;')
-        text = text.replace('#', '&#35;')
-        text = text.replace('<', '&lt;')
-        text = text.replace('>', '&gt;')
-        # Pipe chars break edge-label syntax -->|"..."|  
-        text = text.replace('|', '&#124;')
-        # Collapse whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
-        # Truncate if too long
-        if len(text) > max_length:
-            text = text[:max_length-3] + "..."
-        return text
+        return emit_mermaid(compile_pathway(nodes, "TD"), include_styling)
     
-    def _compute_edges(self, nodes: List[Dict[str, Any]]):
-        """
-        Compute edges with branch-aware logic so that nodes inside a
-        Decision branch region do NOT spuriously connect across branches.
-
-        Logic:
-        - Decision nodes: explicit branch targets with labels
-        - End nodes: terminal, no outgoing edges
-        - Nodes with explicit 'target': use that target
-        - Nodes inside a branch region: sequential within that region,
-          last node connects to reconvergence point
-        - Other nodes: sequential to next node
-
-        Returns list of (src_idx, dst_idx, label_str) tuples.
-        """
-        if not nodes:
-            return []
-
-        n = len(nodes)
-        edges = []
-
-        # Step 1: Build decision-branch structure
-        decision_targets = {}
-        for i, node in enumerate(nodes):
-            if node.get('type') == 'Decision' and node.get('branches'):
-                fwd = []
-                for b in node.get('branches', []):
-                    t = b.get('target')
-                    if isinstance(t, (int, float)) and 0 <= int(t) < n:
-                        fwd.append(int(t))
-                if fwd:
-                    decision_targets[i] = sorted(fwd)
-
-        # Step 2: Compute branch regions
-        branch_region_of = {}
-        for dec_idx, sorted_tgts in decision_targets.items():
-            fwd_tgts = sorted([t for t in sorted_tgts if t > dec_idx])
-            if len(fwd_tgts) < 2:
-                continue
-            reconverge = max(fwd_tgts) + 1
-            for b_idx, tgt in enumerate(fwd_tgts):
-                if b_idx + 1 < len(fwd_tgts):
-                    region_end = fwd_tgts[b_idx + 1] - 1
-                else:
-                    region_end = reconverge - 1
-                for node_idx in range(tgt, min(region_end + 1, n)):
-                    if node_idx not in branch_region_of:
-                        branch_region_of[node_idx] = (region_end, reconverge)
-
-        # Step 3: Generate edges
-        for i, node in enumerate(nodes):
-            ntype = node.get('type', 'Process')
-
-            if ntype == 'Decision' and node.get('branches'):
-                for b in node.get('branches', []):
-                    t = b.get('target')
-                    lbl = b.get('label', '')
-                    if isinstance(t, (int, float)) and 0 <= int(t) < n:
-                        edges.append((i, int(t), lbl))
-            elif ntype == 'End':
-                pass
-            else:
-                explicit = node.get('target')
-                if explicit is not None and isinstance(explicit, (int, float)):
-                    target_idx = int(explicit)
-                    if 0 <= target_idx < n:
-                        edges.append((i, target_idx, ''))
-                elif i in branch_region_of:
-                    region_end, reconverge = branch_region_of[i]
-                    if i == region_end:
-                        if reconverge < n:
-                            edges.append((i, reconverge, ''))
-                        else:
-                            # Reconvergence beyond array — connect to nearest End node or next
-                            end_indices = [j for j in range(i + 1, n) if nodes[j].get('type') == 'End']
-                            if end_indices:
-                                edges.append((i, end_indices[0], ''))
-                            elif i + 1 < n:
-                                edges.append((i, i + 1, ''))
-                    elif i + 1 < n:
-                        edges.append((i, i + 1, ''))
-                elif i + 1 < n:
-                    edges.append((i, i + 1, ''))
-
-        return edges
-
     def generate_graphviz_dot(self, pathway: ClinicalPathway, orientation: str = "TD") -> str:
         """
         Generate Graphviz DOT source from pathway.
@@ -664,7 +452,7 @@ class PathwayGenerator:
     def dot_from_app_nodes(self, nodes: List[Dict[str, Any]], orientation: str = "TD") -> str:
         """
         Generate Graphviz DOT source from app node format with clean decision tree layout.
-        Compatible with streamlit_app.py's dot_from_nodes function.
+        Emitted from the same compiled IR as streamlit_app.py's dot_from_nodes.
         
         LAYOUT PRINCIPLES:
         1. Start node at top (rank=source)
@@ -678,107 +466,7 @@ class PathwayGenerator:
         """
         if not nodes:
             return "digraph G {\n  // No nodes\n}"
-        
-        # Identify special nodes
-        start_node_idx = None
-        end_node_indices = []
-        decision_node_indices = []
-        
-        for i, node in enumerate(nodes):
-            node_type = node.get("type", "Process")
-            if node_type == "Start" and start_node_idx is None:
-                start_node_idx = i
-            elif node_type == "End":
-                end_node_indices.append(i)
-            elif node_type == "Decision":
-                decision_node_indices.append(i)
-        
-        rankdir = 'TB' if orientation == 'TD' else 'LR'
-        lines = [
-            "digraph G {",
-            f"  rankdir={rankdir};",
-            "  splines=ortho;",
-            "  nodesep=0.8;",
-            "  ranksep=1.0;",
-            "  node [fontname=Helvetica, fontsize=11];",
-            "  edge [fontname=Helvetica, fontsize=10];"
-        ]
-        
-        # Node definitions
-        for i, node in enumerate(nodes):
-            node_id = f"N{i}"
-            label = self._escape_dot_label(node.get("label", f"Step {i}"))
-            node_type = node.get("type", "Process")
-            
-            # Determine shape and color
-            if node_type == "Decision":
-                shape, fill = "diamond", "#F8CECC"
-            elif node_type == "Start":
-                shape, fill = "oval", "#D5E8D4"
-            elif node_type == "End":
-                shape, fill = "oval", "#D5E8D4"
-            else:
-                shape, fill = "box", "#FFF2CC"
-            
-            # Add notes reference if present
-            notes = node.get("notes", "")
-            if notes:
-                label += f"\\n(Note {i+1})"
-            
-            lines.append(f'  {node_id} [label="{label}", shape={shape}, style=filled, fillcolor="{fill}"];')
-        
-        lines.append("")
-        
-        # Layout constraints
-        if start_node_idx is not None:
-            lines.append(f"  {{ rank=source; N{start_node_idx}; }}")
-        
-        if end_node_indices:
-            end_nids = [f"N{i}" for i in end_node_indices]
-            lines.append(f"  {{ rank=sink; {'; '.join(end_nids)}; }}")
-        
-        # Group Decision branch targets at same rank
-        for dec_idx in decision_node_indices:
-            dec_node = nodes[dec_idx]
-            branches = dec_node.get("branches", [])
-            if len(branches) >= 2:
-                branch_targets = []
-                for b in branches:
-                    t = b.get("target")
-                    if isinstance(t, int) and 0 <= t < len(nodes):
-                        branch_targets.append(f"N{t}")
-                if len(branch_targets) >= 2:
-                    lines.append(f"  {{ rank=same; {'; '.join(branch_targets)}; }}")
-        
-        lines.append("")
-        
-        # Edges — use branch-aware logic to avoid cross-branch connections
-        computed_edges = self._compute_edges(nodes)
-        for src_idx, dst_idx, lbl in computed_edges:
-            src = f"N{src_idx}"
-            dst = f"N{dst_idx}"
-            if lbl:
-                safe_lbl = self._escape_dot_label(lbl)
-                lines.append(f'  {src} -> {dst} [label="{safe_lbl}"];')
-            else:
-                lines.append(f'  {src} -> {dst};')
-        
-        lines.append("}")
-        return "\n".join(lines)
-    
-    def _escape_dot_label(self, text: str, max_length: int = 40) -> str:
-        """Escape label for DOT format"""
-        if not text:
-            return "Step"
-        # Escape quotes and backslashes
-        text = str(text).replace("\\", "\\\\").replace('"', "'")
-        # Replace newlines with DOT newline
-        text = text.replace("\n", "\\n").replace("\\n", " ")
-        # Collapse whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
-        # Wrap text
-        wrapped = textwrap.wrap(text, width=max_length)
-        return "\\n".join(wrapped) if wrapped else text
+        return emit_dot(compile_pathway(nodes, orientation))
     
     def generate_markdown(self, pathway: ClinicalPathway) -> str:
         """Generate markdown documentation for pathway"""
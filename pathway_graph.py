@@ -0,0 +1,415 @@
+"""
+Pathway Graph Analysis
+
+Shared graph model for pathway node lists. Edges follow the renderer
+semantics (_compute_edges): Decision branches, End nodes as terminals,
+explicit targets, and branch regions that reconverge. Validators therefore
+judge the same graph that users see.
+
+GraphIndex is built once per node list and holds:
+1. Adjacency and reverse adjacency
+2. BFS reachability from the Start node
+3. Iterative Tarjan strongly-connected components for cycle detection (no
+   recursion, so 1,000+ node imported guidelines are fine)
+4. Kahn topological order when the graph is a DAG
+
+Everything is O(V + E). Edges are memoized by a fingerprint of the
+edge-relevant node fields, so the renderers and validators on one rerun
+share a single computation; after an edit the edges are recomputed in one
+linear pass that re-emits only the nodes whose edge inputs changed.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+Edge = Tuple[int, int, str]
+
+
+# ==========================================
+# EDGE COMPUTATION
+# ==========================================
+
+def _as_node(node) -> Dict[str, Any]:
+    """Treat malformed (non-dict) entries as empty Process nodes so indices stay aligned."""
+    return node if isinstance(node, dict) else {}
+
+
+def _numeric_target(value, n: int) -> Optional[int]:
+    if not isinstance(value, (int, float)):
+        return None
+    target = int(value)
+    return target if 0 <= target < n else None
+
+
+def edge_signature(node) -> tuple:
+    """
+    The part of a node that edges depend on: type, explicit target, and
+    Decision branch (target, label) pairs. Labels, notes and evidence are
+    excluded, so editing text never invalidates edges.
+    """
+    node = _as_node(node)
+    ntype = node.get('type', 'Process')
+    if ntype == 'Decision' and node.get('branches'):
+        branches = tuple(
+            (int(b.get('target')) if isinstance(b.get('target'), (int, float)) else None, b.get('label', ''))
+            for b in node.get('branches', []) if isinstance(b, dict)
+        )
+        return ('Decision', None, branches)
+    explicit = node.get('target')
+    explicit = int(explicit) if isinstance(explicit, (int, float)) else None
+    return (ntype, explicit, None)
+
+
+def edge_fingerprint(nodes: List[Dict[str, Any]]) -> str:
+    """Stable hash of the edge-relevant structure of a node list."""
+    data = repr([edge_signature(node) for node in nodes or []])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _branch_regions(sigs: List[tuple]) -> List[Optional[Tuple[int, int]]]:
+    """
+    For each Decision with >=2 forward targets, define contiguous regions:
+      branch_k region = [target_k, target_{k+1} - 1]
+      last branch region = [target_last, reconverge - 1]
+      reconverge = max(targets) + 1
+    Returns region_of[node_idx] = (region_end, reconverge) or None.
+
+    The first decision to claim a node keeps it (inner regions are not
+    overwritten); next_free skips claimed nodes, path-compressed, so every
+    node is visited once overall.
+    """
+    n = len(sigs)
+    region_of = [None] * n
+    next_free = list(range(n + 1))
+
+    def _find_free(idx):
+        root = idx
+        while next_free[root] != root:
+            root = next_free[root]
+        while next_free[idx] != root:
+            next_free[idx], idx = root, next_free[idx]
+        return root
+
+    for dec_idx, (ntype, _, branches) in enumerate(sigs):
+        if branches is None:
+            continue
+        # Only handle forward targets past the decision node
+        fwd_tgts = sorted(t for t, _ in branches if t is not None and dec_idx < t < n)
+        if len(fwd_tgts) < 2:
+            continue
+
+        reconverge = max(fwd_tgts) + 1
+        for b_idx, tgt in enumerate(fwd_tgts):
+            if b_idx + 1 < len(fwd_tgts):
+                region_end = fwd_tgts[b_idx + 1] - 1
+            else:
+                region_end = reconverge - 1
+            stop = min(region_end + 1, n)
+            node_idx = _find_free(tgt)
+            while node_idx < stop:
+                region_of[node_idx] = (region_end, reconverge)
+                next_free[node_idx] = node_idx + 1
+                node_idx = _find_free(node_idx + 1)
+    return region_of
+
+
+def _next_ends(sigs: List[tuple]) -> List[Optional[int]]:
+    """Nearest End node at or after each index (for branches reconverging past the array)."""
+    n = len(sigs)
+    next_end = [None] * (n + 1)
+    for j in range(n - 1, -1, -1):
+        next_end[j] = j if sigs[j][0] == 'End' else next_end[j + 1]
+    return next_end
+
+
+def _edge_inputs(i: int, sigs, region_of, next_end) -> tuple:
+    """Everything the outgoing edges of node i depend on."""
+    region = region_of[i]
+    tail_end = next_end[i + 1] if region and i == region[0] and region[1] >= len(sigs) else None
+    return (sigs[i], region, tail_end)
+
+
+def _node_edges(i: int, n: int, inputs: tuple) -> List[Edge]:
+    """
+    Outgoing edges of node i:
+    - Decision nodes: explicit branch targets with labels
+    - End nodes: no outgoing edges (terminal)
+    - Process/Start with explicit 'target': use that target
+    - Process/Start inside a branch region: flow sequentially within the
+      branch, and the LAST node in each branch connects to the
+      reconvergence point (first node after all branch targets)
+    - Process/Start not in any branch region: sequential to next node
+    """
+    (ntype, explicit, branches), region, tail_end = inputs
+    if branches is not None:
+        return [(i, t, lbl) for t, lbl in branches if t is not None and 0 <= t < n]
+    if ntype == 'End':
+        return []  # Terminal
+    if explicit is not None:
+        return [(i, explicit, '')] if 0 <= explicit < n else []
+    if region is not None:
+        region_end, reconverge = region
+        if i == region_end:
+            # Last node in this branch -> connect to reconvergence
+            if reconverge < n:
+                return [(i, reconverge, '')]
+            # Reconvergence beyond array — connect to nearest End node or next node
+            if tail_end is not None:
+                return [(i, tail_end, '')]
+    if i + 1 < n:
+        return [(i, i + 1, '')]  # Sequential (within branch or normal flow)
+    return []
+
+
+def compute_edges(nodes: List[Dict[str, Any]]) -> List[Edge]:
+    """
+    Compute edges for a pathway graph, properly handling Decision branches
+    and sequential flow without creating spurious cross-branch edges.
+
+    Returns: list of (src_idx, dst_idx, label_str) tuples
+    """
+    if not nodes:
+        return []
+    sigs = [edge_signature(node) for node in nodes]
+    region_of = _branch_regions(sigs)
+    next_end = _next_ends(sigs)
+    n = len(sigs)
+    edges = []
+    for i in range(n):
+        edges.extend(_node_edges(i, n, _edge_inputs(i, sigs, region_of, next_end)))
+    return edges
+
+
+class EdgeIndex:
+    """
+    Edges for a pathway that is being edited, reusing unchanged nodes' edges.
+
+    update(nodes) is still O(n): signatures, branch regions and per-node
+    edge inputs are recomputed for every node on each call. Only edge
+    emission is skipped for nodes whose inputs are unchanged (the edited
+    nodes plus the branch regions of any Decision whose targets moved are
+    re-emitted). The fingerprint memo in cached_edges() is what makes
+    repeated renders of the same pathway cheap.
+    """
+
+    def __init__(self):
+        self._inputs: List[tuple] = []
+        self._by_node: List[List[Edge]] = []
+        self.last_dirty = 0   # Nodes re-emitted by the last update
+
+    def update(self, nodes: List[Dict[str, Any]]) -> List[Edge]:
+        sigs = [edge_signature(node) for node in nodes or []]
+        n = len(sigs)
+        region_of = _branch_regions(sigs)
+        next_end = _next_ends(sigs)
+        if n != len(self._inputs):
+            # Inserts/deletes shift every index after them
+            self._inputs = [None] * n
+            self._by_node = [[] for _ in range(n)]
+        dirty = 0
+        for i in range(n):
+            inputs = _edge_inputs(i, sigs, region_of, next_end)
+            if inputs != self._inputs[i]:
+                self._inputs[i] = inputs
+                self._by_node[i] = _node_edges(i, n, inputs)
+                dirty += 1
+        self.last_dirty = dirty
+        return [edge for node_edges in self._by_node for edge in node_edges]
+
+
+# ==========================================
+# MEMOIZED EDGES
+# ==========================================
+
+EDGE_CACHE_SIZE = 64
+
+
+class _EdgeMemo:
+    """LRU of edges by edge_fingerprint(), shared by all renderers and validators."""
+
+    def __init__(self, maxsize: int = EDGE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._index = EdgeIndex()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def edges(self, nodes: List[Dict[str, Any]]) -> List[Edge]:
+        key = edge_fingerprint(nodes)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(cached)
+            self.misses += 1
+            edges = tuple(self._index.update(nodes))
+            self._entries[key] = edges
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return list(edges)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index = EdgeIndex()
+            self.hits = self.misses = 0
+
+
+_edge_memo = _EdgeMemo()
+
+
+def cached_edges(nodes: List[Dict[str, Any]]) -> List[Edge]:
+    """
+    Edges for a node list, memoized by edge_fingerprint().
+
+    One Phase 3/4 rerun renders the same pathway several times (Mermaid,
+    DOT, Graphviz, validation); only the first call computes.
+    """
+    return _edge_memo.edges(nodes)
+
+
+def get_edge_memo() -> _EdgeMemo:
+    """Process-wide edge memo (for stats and tests)."""
+    return _edge_memo
+
+
+# ==========================================
+# GRAPH INDEX
+# ==========================================
+
+class GraphIndex:
+    """
+    Read-only graph view of one pathway node list, built in O(V + E).
+
+    Attributes:
+        n: Node count
+        edges: (src, dst, label) tuples (memoized compute_edges)
+        succ / pred: Adjacency and reverse adjacency (lists of index lists)
+        reachable: Per-node bool, True if reachable from node 0 (Start)
+        sccs: Strongly connected components that form cycles
+        has_cycle: True if any cycle exists
+    """
+
+    def __init__(self, nodes: List[Dict[str, Any]], edges: Optional[List[Edge]] = None):
+        self.nodes = list(nodes or [])
+        self.n = len(self.nodes)
+        self.edges = cached_edges(self.nodes) if edges is None else list(edges)
+        self.succ: List[List[int]] = [[] for _ in range(self.n)]
+        self.pred: List[List[int]] = [[] for _ in range(self.n)]
+        for src, dst, _ in self.edges:
+            self.succ[src].append(dst)
+            self.pred[dst].append(src)
+        self.reachable = self._bfs(0)
+        self.sccs = self._cyclic_components()
+        self.has_cycle = bool(self.sccs)
+        self._topo = None
+
+    # --- reachability ---
+
+    def _bfs(self, start: int) -> List[bool]:
+        seen = [False] * self.n
+        if not (0 <= start < self.n):
+            return seen
+        seen[start] = True
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for nxt in self.succ[node]:
+                if not seen[nxt]:
+                    seen[nxt] = True
+                    queue.append(nxt)
+        return seen
+
+    def reachable_from(self, start: int) -> List[bool]:
+        """Per-node reachability from an arbitrary node."""
+        return self.reachable if start == 0 else self._bfs(start)
+
+    def unreachable(self) -> List[int]:
+        return [i for i in range(self.n) if not self.reachable[i]]
+
+    # --- cycles ---
+
+    def _cyclic_components(self) -> List[List[int]]:
+        """Iterative Tarjan SCC; returns only components that contain a cycle."""
+        index_of = [-1] * self.n
+        low = [0] * self.n
+        on_stack = [False] * self.n
+        stack = []
+        cyclic = []
+        counter = 0
+        for root in range(self.n):
+            if index_of[root] != -1:
+                continue
+            # Each frame: (node, position in its successor list)
+            work = [(root, 0)]
+            index_of[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            while work:
+                node, pos = work[-1]
+                succ = self.succ[node]
+                if pos < len(succ):
+                    work[-1] = (node, pos + 1)
+                    nxt = succ[pos]
+                    if index_of[nxt] == -1:
+                        index_of[nxt] = low[nxt] = counter
+                        counter += 1
+                        stack.append(nxt)
+                        on_stack[nxt] = True
+                        work.append((nxt, 0))
+                    elif on_stack[nxt]:
+                        low[node] = min(low[node], index_of[nxt])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index_of[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in self.succ[node]:
+                        cyclic.append(sorted(component))
+        return cyclic
+
+    # --- ordering ---
+
+    def topological_order(self) -> Optional[List[int]]:
+        """Kahn's algorithm; None when the graph has a cycle."""
+        if self._topo is None and not self.has_cycle:
+            indegree = [len(p) for p in self.pred]
+            queue = deque(i for i in range(self.n) if indegree[i] == 0)
+            order = []
+            while queue:
+                node = queue.popleft()
+                order.append(node)
+                for nxt in self.succ[node]:
+                    indegree[nxt] -= 1
+                    if indegree[nxt] == 0:
+                        queue.append(nxt)
+            self._topo = order
+        return None if self.has_cycle else list(self._topo)
+
+    # --- node helpers ---
+
+    def node(self, idx: int) -> Dict[str, Any]:
+        return _as_node(self.nodes[idx])
+
+    def node_type(self, idx: int) -> str:
+        return self.node(idx).get('type', 'Process')
+
+    def branch_targets(self, idx: int) -> List[int]:
+        """Numeric branch targets of a Decision node as written (may be out of range)."""
+        return [
+            int(b.get('target')) for b in self.node(idx).get('branches', []) or []
+            if isinstance(b, dict) and isinstance(b.get('target'), (int, float))
+        ]
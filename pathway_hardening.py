@@ -0,0 +1,204 @@
+"""
+Pathway Node Hardening
+
+Normalizes pathway nodes before rendering and validation: fills missing
+ids, types and labels, cleans label/notes whitespace, and repairs Decision
+branches (labels, out-of-range targets, missing or single branches).
+
+The old harden_nodes rewrote the caller's dicts in place, compiled its
+regex inside the per-node loop and scanned forward for alternative and End
+targets per Decision, which is quadratic on large pathways. Since every
+renderer calls it on every rerun:
+1. Results are new dicts; the input is never modified
+2. Each applied fix is recorded in a compact journal of (index, fix, detail)
+3. End-node lookups use precomputed next-End indices; one compiled regex
+4. Re-hardening an unchanged node list is skipped via a content fingerprint
+"""
+
+import hashlib
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+_WHITESPACE = re.compile(r'\s+')
+
+JournalEntry = Tuple[int, str, Any]
+
+
+def _clean_text(value) -> str:
+    """Remove literal \\n sequences (from AI generation) and collapse whitespace."""
+    text = str(value).replace('\\n', ' ').replace('\n', ' ')
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def nodes_fingerprint(nodes) -> str:
+    """Exact content hash of a raw node list (repr keeps tuple/list and int/bool apart)."""
+    return hashlib.sha256(repr(nodes).encode('utf-8')).hexdigest()
+
+
+def copy_nodes(nodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copy node dicts and their branch dicts (the parts hardening touches)."""
+    copies = []
+    for node in nodes:
+        node = dict(node)
+        if isinstance(node.get('branches'), list):
+            node['branches'] = [dict(b) if isinstance(b, dict) else b for b in node['branches']]
+        copies.append(node)
+    return copies
+
+
+# ==========================================
+# HARDENING
+# ==========================================
+
+def _harden_branches(i: int, node: dict, n: int, next_end: List[int], journal: list) -> list:
+    """Valid Decision branches for node i, preserving existing valid branching."""
+    valid = []
+    existing = node.get('branches', [])
+    if isinstance(existing, list):
+        for b_idx, branch in enumerate(existing):
+            if not isinstance(branch, dict):
+                continue
+            target = branch.get('target')
+            if not isinstance(target, (int, float)):
+                continue
+            branch = dict(branch)
+            if not (0 <= int(target) < n):
+                # Target out of range - clamp it
+                branch['target'] = max(0, min(int(target), n - 1))
+                journal.append((i, 'branch_clamped', (b_idx, target, branch['target'])))
+            if 'label' not in branch or not branch.get('label'):
+                branch['label'] = 'Option'
+                journal.append((i, 'branch_label', b_idx))
+            valid.append(branch)
+        if len(valid) < len(existing):
+            journal.append((i, 'branches_dropped', len(existing) - len(valid)))
+
+    if len(valid) >= 2:
+        return valid
+
+    if len(valid) == 1:
+        # Only one valid branch - add the first later node that is not its target
+        existing_target = int(valid[0].get('target', i + 1))
+        alt_idx = i + 1 if i + 1 != existing_target else i + 2
+        if alt_idx >= n:
+            alt_idx = min(i + 1, n - 1)
+        journal.append((i, 'branch_added', alt_idx))
+        return valid + [{'label': 'No', 'target': alt_idx}]
+
+    # No valid branches - create default divergent branches, preferring End nodes
+    first_end = next_end[i + 1] if i + 1 <= n else None
+    second_end = next_end[first_end + 1] if first_end is not None else None
+    if second_end is not None:
+        branches = [{'label': 'Yes', 'target': first_end}, {'label': 'No', 'target': second_end}]
+    elif first_end is not None and i + 1 < n and i + 1 != first_end:
+        branches = [{'label': 'Yes', 'target': i + 1}, {'label': 'No', 'target': first_end}]
+    else:
+        # Fallback: sequential branches (less ideal but functional)
+        next_idx = min(i + 1, n - 1)
+        alt_idx = min(i + 2, n - 1) if i + 2 < n else next_idx
+        branches = [{'label': 'Yes', 'target': next_idx}, {'label': 'No', 'target': alt_idx}]
+    journal.append((i, 'branches_default', tuple(b['target'] for b in branches)))
+    return branches
+
+
+def harden_nodes_with_journal(nodes_list) -> Tuple[List[Dict[str, Any]], List[JournalEntry]]:
+    """
+    Normalize pathway nodes without modifying the input.
+
+    Returns:
+        (hardened_nodes, journal) where journal lists (node_index, fix, detail)
+        for every change applied. Indices refer to positions in the input;
+        non-dict entries are dropped ('dropped') but keep their index slot.
+    """
+    if not isinstance(nodes_list, list):
+        return [], []
+    n = len(nodes_list)
+    journal = []
+
+    # next_end[j] = first End node at index >= j (None if there is none)
+    next_end = [None] * (n + 1)
+    for j in range(n - 1, -1, -1):
+        node = nodes_list[j]
+        next_end[j] = j if isinstance(node, dict) and node.get('type') == 'End' else next_end[j + 1]
+
+    validated = []
+    for i, source in enumerate(nodes_list):
+        if not isinstance(source, dict):
+            journal.append((i, 'dropped', type(source).__name__))
+            continue
+        node = dict(source)
+        # Ensure required fields
+        if 'id' not in node or not node['id']:
+            node['id'] = f"{str(node.get('type') or 'P')[0].upper()}{i+1}"
+            journal.append((i, 'id', node['id']))
+        if 'type' not in node:
+            node['type'] = 'Process'
+            journal.append((i, 'type', 'Process'))
+        if 'label' not in node or not node.get('label'):
+            node['label'] = f"Step {i+1}"
+            journal.append((i, 'label', node['label']))
+
+        label = _clean_text(node['label'])
+        if label != node['label']:
+            journal.append((i, 'label_cleaned', None))
+        node['label'] = label
+
+        for notes_field in ('notes', 'detail'):
+            if node.get(notes_field):
+                notes = _clean_text(node[notes_field])
+                if notes != node[notes_field]:
+                    journal.append((i, f'{notes_field}_cleaned', None))
+                node[notes_field] = notes
+
+        if node['type'] == 'Decision':
+            node['branches'] = _harden_branches(i, node, n, next_end, journal)
+
+        validated.append(node)
+    return validated, journal
+
+
+# ==========================================
+# MEMOIZED ENTRY POINT
+# ==========================================
+
+class _LastHardened:
+    """Remembers the last normalized version so unchanged reruns skip the work."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._nodes = None
+        self._journal = None
+        self.hits = 0
+
+    def harden(self, nodes_list):
+        if not isinstance(nodes_list, list):
+            return [], []
+        key = nodes_fingerprint(nodes_list)
+        with self._lock:
+            if key == self._key:
+                self.hits += 1
+                return copy_nodes(self._nodes), list(self._journal)
+        nodes, journal = harden_nodes_with_journal(nodes_list)
+        with self._lock:
+            self._key, self._nodes, self._journal = key, copy_nodes(nodes), list(journal)
+        return nodes, journal
+
+
+_last_hardened = _LastHardened()
+
+
+def harden_nodes(nodes_list) -> List[Dict[str, Any]]:
+    """Validate and fix node structure, ensuring Decision nodes have proper branches.
+
+    IMPORTANT: Preserves existing branch structure when valid. Only creates default
+    branches when none exist or when branches are malformed. The input is not
+    modified; see harden_nodes_with_journal for the list of applied fixes.
+    """
+    return _last_hardened.harden(nodes_list)[0]
+
+
+def last_harden_journal(nodes_list) -> List[JournalEntry]:
+    """Journal of fixes for a node list (memoized like harden_nodes)."""
+    return _last_hardened.harden(nodes_list)[1]
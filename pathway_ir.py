@@ -0,0 +1,393 @@
+"""
+Pathway Diagram IR
+
+One compiled intermediate representation of a pathway node list, shared
+by every diagram exporter. DOT, graphviz.Digraph, Mermaid and Markdown
+used to be produced by separate serializers, each re-running harden_nodes,
+label wrapping/escaping, edge computation and notes numbering.
+
+compile_pathway() does that work once per node list (memoized by content)
+and produces slotted node/edge records with:
+1. Pre-wrapped, pre-escaped DOT and Mermaid labels (note references included)
+2. Shapes and fills (with role colors)
+3. Rank constraints (Start at source, End nodes at sink, Decision branch
+   targets side by side)
+4. Numbered notes for the legend
+
+The emit_* functions are thin formatters over that record set.
+"""
+
+import re
+import textwrap
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from diagram_cache import diagram_key
+from pathway_graph import cached_edges
+
+try:
+    import graphviz  # optional: only needed for emit_graphviz
+except ImportError:
+    graphviz = None
+
+# ==========================================
+# STYLING
+# ==========================================
+
+NODE_STYLES = {
+    'Decision': ('diamond', '#F8CECC'),      # Red/pink for decisions
+    'Start': ('oval', '#D5E8D4'),            # Green for start
+    'End': ('oval', '#D5E8D4'),              # Green for end
+    'Reevaluation': ('box', '#FFCC80'),      # Orange for reevaluation
+}
+DEFAULT_STYLE = ('box', '#FFF2CC')           # Yellow for process
+LEGEND_FILL = '#B3D9FF'
+
+MERMAID_CLASS_DEFS = [
+    "    classDef startEnd fill:#d4edda,stroke:#28a745,stroke-width:2px,color:#155724,font-weight:bold",
+    "    classDef decision fill:#f8d7da,stroke:#dc3545,stroke-width:2px,color:#721c24,font-weight:bold",
+    "    classDef process fill:#fff3cd,stroke:#ffc107,stroke-width:1px,color:#856404",
+    "    classDef reeval fill:#ffe0b2,stroke:#e65100,stroke-width:2px,color:#bf360c",
+    "    classDef noteBox fill:#bbdefb,stroke:#1565c0,stroke-width:1px,color:#0d47a1,font-size:11px",
+]
+
+IR_CACHE_SIZE = 32
+
+
+# ==========================================
+# LABEL HELPERS
+# ==========================================
+
+def escape_dot(text) -> str:
+    """Escape quotes and backslashes for DOT labels; newlines become DOT line breaks."""
+    if text is None:
+        return ""
+    # Note: \n in DOT is the line break character, don't double-escape it
+    s = str(text).replace("\\", "\\\\").replace('"', "'")
+    return s.replace("\n", "\\n")
+
+
+def wrap_label(text, width: int = 22, max_width: int = None) -> str:
+    if not text:
+        return ""
+    # Clean up any literal \n sequences before wrapping, then collapse spaces
+    clean_text = str(text).replace('\\n', ' ').replace('\n', ' ')
+    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+    wrapped = textwrap.wrap(clean_text, width=max_width or width)
+    return "\n".join(wrapped) if wrapped else clean_text
+
+
+def escape_mermaid(text, max_length: int = 60) -> str:
+    """Escape and truncate text for Mermaid compatibility.
+
+    Mermaid is sensitive to quotes, parentheses, brackets, angle brackets,
+    curly braces, pipe characters, and hash symbols inside labels.
+    """
+    if not text:
+        return "Step"
+    text = str(text).replace('"', "'").replace('\n', ' ').replace('\\n', ' ')
+    # IMPORTANT: & must be escaped FIRST to &amp; so subsequent &#xx; entities stay intact
+    text = text.replace('&', '&amp;')
+    text = text.replace('#', '&#35;')
+    text = text.replace('<', '&lt;')
+    text = text.replace('>', '&gt;')
+    # Pipe chars break edge-label syntax -->|"..."|
+    text = text.replace('|', '&#124;')
+    text = re.sub(r'\s+', ' ', text).strip()
+    if len(text) > max_length:
+        text = text[:max_length - 3] + "..."
+    return text
+
+
+def role_fill(role, default_fill: str, role_colors: Optional[Dict[str, str]] = None) -> str:
+    if not role or not role_colors:
+        return default_fill
+    return role_colors.get(role, role_colors.get(str(role).title(), default_fill))
+
+
+# ==========================================
+# IR RECORDS
+# ==========================================
+
+class IRNode:
+    __slots__ = ('index', 'id', 'type', 'label', 'dot_label', 'mermaid_label', 'shape', 'fill', 'note')
+
+    def __init__(self, index, ntype, label, dot_label, mermaid_label, shape, fill, note):
+        self.index = index
+        self.id = f"N{index}"
+        self.type = ntype
+        self.label = label                  # Cleaned, unescaped
+        self.dot_label = dot_label          # Wrapped + escaped, with note reference
+        self.mermaid_label = mermaid_label  # Escaped + truncated, with note reference
+        self.shape = shape
+        self.fill = fill
+        self.note = note                    # Legend number or None
+
+
+class IREdge:
+    __slots__ = ('src', 'dst', 'label', 'dot_label', 'mermaid_label')
+
+    def __init__(self, src, dst, label):
+        self.src = src
+        self.dst = dst
+        self.label = label
+        self.dot_label = escape_dot(label) if label else ''
+        self.mermaid_label = escape_mermaid(label, max_length=35) if label else ''
+
+
+class PathwayIR:
+    """Compiled, read-only diagram model of one node list in one orientation."""
+
+    __slots__ = ('orientation', 'rankdir', 'nodes', 'edges', 'notes', 'source_rank',
+                 'sink_rank', 'same_ranks', 'legend_label')
+
+    def __init__(self, orientation, nodes, edges, notes, source_rank, sink_rank, same_ranks):
+        self.orientation = orientation
+        self.rankdir = 'TB' if orientation == 'TD' else 'LR'
+        self.nodes: List[IRNode] = nodes
+        self.edges: List[IREdge] = edges
+        self.notes = notes                  # [(number, text)]
+        self.source_rank = source_rank      # Node id or None
+        self.sink_rank = sink_rank          # [node id]
+        self.same_ranks = same_ranks        # [[node id]] per Decision
+        self.legend_label = None
+        if notes:
+            legend_lines = ["NOTES:"] + [f"[{num}] {wrap_label(text, max_width=60)}" for num, text in notes]
+            self.legend_label = escape_dot("\n".join(legend_lines))
+
+
+# ==========================================
+# COMPILATION
+# ==========================================
+
+def build_ir(nodes: List[Dict[str, Any]], orientation: str = "TD",
+             role_colors: Optional[Dict[str, str]] = None) -> PathwayIR:
+    """Compile already-prepared nodes into a PathwayIR (no caching)."""
+    nodes = [node if isinstance(node, dict) else {} for node in nodes or []]
+    n = len(nodes)
+
+    notes = []
+    note_of = {}
+    for i, node in enumerate(nodes):
+        notes_text = node.get('notes', '') or node.get('detail', '')
+        if notes_text and str(notes_text).strip():
+            notes.append((len(notes) + 1, str(notes_text).strip()))
+            note_of[i] = len(notes)
+
+    ir_nodes = []
+    source_rank = None
+    sink_rank = []
+    same_ranks = []
+    for i, node in enumerate(nodes):
+        ntype = node.get('type', 'Process')
+        raw_label = str(node.get('label', 'Step')).replace('\\n', ' ').replace('\n', ' ')
+        wrapped = wrap_label(raw_label, width=25)
+        mermaid_label = escape_mermaid(node.get('label', f"Step {i}"))
+        if i in note_of:
+            wrapped += f"\n(Note {note_of[i]})"
+            mermaid_label += f" &#91;Note {note_of[i]}&#93;"
+        shape, fill = NODE_STYLES.get(ntype, DEFAULT_STYLE)
+        fill = role_fill(node.get('role', ''), fill, role_colors)
+        ir_nodes.append(IRNode(i, ntype, raw_label, escape_dot(wrapped), mermaid_label, shape, fill, note_of.get(i)))
+
+        if ntype == 'Start' and source_rank is None:
+            source_rank = f"N{i}"
+        elif ntype == 'End':
+            sink_rank.append(f"N{i}")
+        elif ntype == 'Decision':
+            branches = node.get('branches', []) or []
+            if len(branches) >= 2:
+                targets = [
+                    f"N{int(b['target'])}" for b in branches
+                    if isinstance(b, dict) and isinstance(b.get('target'), (int, float)) and 0 <= int(b['target']) < n
+                ]
+                if len(targets) >= 2:
+                    same_ranks.append(targets)
+
+    edges = [IREdge(src, dst, lbl) for src, dst, lbl in cached_edges(nodes)]
+    return PathwayIR(orientation, ir_nodes, edges, notes, source_rank, sink_rank, same_ranks)
+
+
+_ir_cache = OrderedDict()
+_ir_lock = threading.Lock()
+
+
+def compile_pathway(nodes: List[Dict[str, Any]], orientation: str = "TD",
+                    role_colors: Optional[Dict[str, str]] = None, prepare=None) -> PathwayIR:
+    """
+    Compiled IR for a node list, memoized by content and orientation.
+
+    Args:
+        nodes: App-format pathway nodes
+        orientation: "TD" (top-down) or "LR" (left-right)
+        role_colors: Optional {role: fill} overrides for node fills
+        prepare: Optional normalizer (e.g. harden_nodes) applied before
+            compiling; skipped entirely on a cache hit
+    """
+    colors = tuple(sorted(role_colors.items())) if role_colors else None
+    key = (diagram_key(nodes, orientation), colors, prepare is not None)
+    with _ir_lock:
+        ir = _ir_cache.get(key)
+        if ir is not None:
+            _ir_cache.move_to_end(key)
+            return ir
+    ir = build_ir(prepare(nodes) if prepare else nodes, orientation, role_colors)
+    with _ir_lock:
+        _ir_cache[key] = ir
+        while len(_ir_cache) > IR_CACHE_SIZE:
+            _ir_cache.popitem(last=False)
+    return ir
+
+
+# ==========================================
+# EMITTERS
+# ==========================================
+
+def emit_dot(ir: PathwayIR) -> str:
+    """Graphviz DOT source."""
+    lines = [
+        "digraph G {",
+        f"  rankdir={ir.rankdir};",
+        "  splines=polyline;",  # Polyline edges (ortho doesn't support edge labels)
+        "  nodesep=0.8;",
+        "  ranksep=1.0;",
+        "  node [fontname=Helvetica, fontsize=11];",
+        "  edge [fontname=Helvetica, fontsize=10];",
+    ]
+    for node in ir.nodes:
+        lines.append(f'  {node.id} [label="{node.dot_label}", shape={node.shape}, style=filled, fillcolor="{node.fill}"];')
+    lines.append("")
+    if ir.source_rank:
+        lines.append(f"  {{ rank=source; {ir.source_rank}; }}")
+    if ir.sink_rank:
+        lines.append(f"  {{ rank=sink; {'; '.join(ir.sink_rank)}; }}")
+    for group in ir.same_ranks:
+        lines.append(f"  {{ rank=same; {'; '.join(group)}; }}")
+    lines.append("")
+    if ir.legend_label:
+        lines.append(f'  NotesLegend [label="{ir.legend_label}", shape=box, style=filled, fillcolor="{LEGEND_FILL}", fontsize=10];')
+        lines.append("  { rank=max; NotesLegend; }")
+    lines.append("")
+    for edge in ir.edges:
+        if edge.dot_label:
+            lines.append(f'  N{edge.src} -> N{edge.dst} [label="{edge.dot_label}"];')
+        else:
+            lines.append(f'  N{edge.src} -> N{edge.dst};')
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def emit_graphviz(ir: PathwayIR):
+    """graphviz.Digraph (None if the graphviz package is not installed)."""
+    if graphviz is None:
+        return None
+    g = graphviz.Digraph(format='svg')
+    g.attr(rankdir=ir.rankdir)
+    g.attr(splines='polyline')    # Polyline edges (ortho doesn't support edge labels)
+    g.attr(nodesep='0.8')
+    g.attr(ranksep='1.0')
+    g.attr('node', fontname='Helvetica', fontsize='11')
+    g.attr('edge', fontname='Helvetica', fontsize='10')
+    for node in ir.nodes:
+        g.node(node.id, node.dot_label, shape=node.shape, style='filled', fillcolor=node.fill)
+    if ir.source_rank:
+        with g.subgraph() as s:
+            s.attr(rank='source')
+            s.node(ir.source_rank)
+    if ir.sink_rank:
+        with g.subgraph() as s:
+            s.attr(rank='sink')
+            for nid in ir.sink_rank:
+                s.node(nid)
+    for group in ir.same_ranks:
+        with g.subgraph() as s:
+            s.attr(rank='same')
+            for nid in group:
+                s.node(nid)
+    if ir.legend_label:
+        g.node('NotesLegend', ir.legend_label, shape='box', style='filled', fillcolor=LEGEND_FILL, fontsize='10')
+        with g.subgraph() as s:
+            s.attr(rank='max')
+            s.node('NotesLegend')
+    for edge in ir.edges:
+        if edge.dot_label:
+            g.edge(f"N{edge.src}", f"N{edge.dst}", label=edge.dot_label)
+        else:
+            g.edge(f"N{edge.src}", f"N{edge.dst}")
+    return g
+
+
+def emit_mermaid(ir: PathwayIR, include_styling: bool = True) -> str:
+    """Mermaid flowchart source."""
+    if not ir.nodes:
+        return f"graph {ir.orientation}\n    NoNodes[No pathway nodes defined]"
+    lines = [f"graph {ir.orientation}"]
+    if include_styling:
+        lines.extend(["", "    %% Styling"] + MERMAID_CLASS_DEFS + [""])
+
+    for node in ir.nodes:
+        if node.type in ('Start', 'End'):
+            lines.append(f'    {node.id}(["{node.mermaid_label}"])')
+        elif node.type == 'Decision':
+            lines.append(f'    {node.id}{{"{node.mermaid_label}"}}')
+        elif node.type == 'Reevaluation':
+            lines.append(f'    {node.id}[/"{node.mermaid_label}"\\]')
+        else:
+            lines.append(f'    {node.id}["{node.mermaid_label}"]')
+    lines.append("")
+
+    for edge in ir.edges:
+        if edge.mermaid_label:
+            lines.append(f'    N{edge.src} -->|"{edge.mermaid_label}"| N{edge.dst}')
+        else:
+            lines.append(f'    N{edge.src} --> N{edge.dst}')
+
+    if ir.notes:
+        lines.append("")
+        lines.append("    subgraph Notes Legend")
+        lines.append("    direction TB")
+        for num, text in ir.notes:
+            lines.append(f'    NOTE{num}["{num}. {escape_mermaid(text, max_length=80)}"]')
+        lines.append("    end")
+        lines.append(f"    class {','.join(f'NOTE{num}' for num, _ in ir.notes)} noteBox")
+
+    if include_styling:
+        lines.append("")
+        # Start and End share a class, listed Start nodes first
+        starts = [n.id for n in ir.nodes if n.type == 'Start']
+        ends = [n.id for n in ir.nodes if n.type == 'End']
+        decisions = [n.id for n in ir.nodes if n.type == 'Decision']
+        reevals = [n.id for n in ir.nodes if n.type == 'Reevaluation']
+        processes = [n.id for n in ir.nodes if n.type not in ('Start', 'End', 'Decision', 'Reevaluation')]
+        if starts or ends:
+            lines.append(f"    class {','.join(starts + ends)} startEnd")
+        if decisions:
+            lines.append(f"    class {','.join(decisions)} decision")
+        if processes:
+            lines.append(f"    class {','.join(processes)} process")
+        if reevals:
+            lines.append(f"    class {','.join(reevals)} reeval")
+    return "\n".join(lines)
+
+
+def emit_markdown(ir: PathwayIR, title: str = "Clinical Pathway") -> str:
+    """Markdown document: Mermaid flowchart, numbered steps with branches, and notes."""
+    md = [f"# {title}", "", "## Pathway Flowchart", "", "```mermaid", emit_mermaid(ir), "```", ""]
+    if ir.nodes:
+        md += ["## Pathway Steps", ""]
+        branches = {}
+        for edge in ir.edges:
+            if edge.label:
+                branches.setdefault(edge.src, []).append(edge)
+        for node in ir.nodes:
+            ref = f" *(Note {node.note})*" if node.note else ""
+            md.append(f"{node.index + 1}. **{node.type}:** {node.label}{ref}")
+            for edge in branches.get(node.index, []):
+                md.append(f"   - {edge.label} → step {edge.dst + 1}")
+        md.append("")
+    if ir.notes:
+        md += ["## Notes", ""]
+        md += [f"{num}. {text}" for num, text in ir.notes]
+        md.append("")
+    return "\n".join(md)
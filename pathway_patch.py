@@ -0,0 +1,293 @@
+"""
+Pathway Patches
+
+Edit-list protocol for pathway refinement. Refinement used to send the whole
+node list to Gemini and ask for the whole pathway back, so output tokens (and
+latency) grew with the pathway even for a one-node tweak. With patches the
+model returns only the edits (the patch_pathway_nodes function declaration
+in gemini_functions.py) and they are applied locally.
+
+How it works:
+1. The model sees the pathway as numbered lines (format_indexed_nodes) and
+   answers with operations that refer to those numbers: insert (before an
+   index, or at the end), update (changed fields only), delete and retarget
+   (replace a Decision's branches)
+2. Branch targets in a patch use the current indices; the k-th inserted node
+   (0-based, in operation order) is addressed as N + k, N being the current
+   node count
+3. validate_patch() lists malformed or contradictory operations; nothing is
+   applied unless the patch is clean. Deleting a node that a branch still
+   points to is one of them: the patch must also update, retarget or delete
+   that Decision, so no branch is ever rewired behind the model's back
+4. apply_patch() builds the new list in one pass and rewrites every branch
+   target through an old -> new index map
+
+Set CPQ_PATHWAY_PATCHES=0 to always request whole pathways.
+"""
+
+import copy
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from prompt_budget import NODE_KEY_LEGEND, compact_node
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+PATCHES_ENV = "CPQ_PATHWAY_PATCHES"
+OPERATIONS = ("insert", "update", "delete", "retarget")
+NODE_TYPES = ("Start", "Decision", "Process", "End")
+NODE_FIELDS = ("type", "label", "evidence", "notes", "branches")
+
+# Marks where a prompt shows the pathway (numbered for patches, compact JSON otherwise)
+PATHWAY_SLOT = "\x00PATHWAY\x00"
+
+PATCH_INSTRUCTIONS = """OUTPUT: Do NOT return the whole pathway. Call patch_pathway_nodes with only the edits needed:
+- update: index + node with ONLY the fields that change (type, label, evidence, notes, branches)
+- insert: node (type, label, evidence, optional notes/branches) placed BEFORE index (omit index to append)
+- delete: index (also retarget or update every Decision whose branches point to it)
+- retarget: index of a Decision node + its complete new branches list
+Indices are the numbers shown before each node. Branch targets use those numbers; to point at a node you
+insert, use {count} + k where k is the 0-based position of that insert among your insert operations.
+Follow every clinical rule above; unchanged nodes need no operation."""
+
+
+class PatchError(ValueError):
+    """A patch that can't be applied; problems lists every reason."""
+
+    def __init__(self, problems: List[str]):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+def patches_enabled() -> bool:
+    return os.environ.get(PATCHES_ENV, "1") != "0"
+
+
+# ==========================================
+# PROMPT
+# ==========================================
+
+def format_indexed_nodes(nodes: Sequence[Dict[str, Any]]) -> str:
+    """Pathway as numbered compact-JSON lines, the form patch indices refer to."""
+    lines = [NODE_KEY_LEGEND]
+    for i, node in enumerate(nodes or []):
+        node = compact_node(node) if isinstance(node, dict) else node
+        lines.append(f"{i}: {json.dumps(node, separators=(',', ':'), ensure_ascii=False)}")
+    return "\n".join(lines)
+
+
+def patch_instructions(nodes: Sequence[Dict[str, Any]]) -> str:
+    return PATCH_INSTRUCTIONS.format(count=len(nodes or []))
+
+
+# ==========================================
+# VALIDATION
+# ==========================================
+
+def _is_index(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _as_index(value):
+    # Function-call arguments can carry integers as floats (3.0)
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def _normalized(operations):
+    if not isinstance(operations, list):
+        return operations
+    result = []
+    for op in operations:
+        if isinstance(op, dict):
+            op = copy.deepcopy(op)
+            if "index" in op:
+                op["index"] = _as_index(op["index"])
+            node = op.get("node") if isinstance(op.get("node"), dict) else {}
+            for branches in (op.get("branches"), node.get("branches")):
+                for branch in branches if isinstance(branches, list) else ():
+                    if isinstance(branch, dict) and "target" in branch:
+                        branch["target"] = _as_index(branch["target"])
+        result.append(op)
+    return result
+
+
+def _branch_problems(where: str, branches, limit: int, deleted: set) -> List[str]:
+    if not isinstance(branches, list) or not branches:
+        return [f"{where}: branches must be a non-empty list"]
+    problems = []
+    for branch in branches:
+        target = branch.get("target") if isinstance(branch, dict) else None
+        if not _is_index(target) or not 0 <= target < limit:
+            problems.append(f"{where}: branch target {target!r} is out of range")
+        elif target in deleted:
+            problems.append(f"{where}: branch target {target} is deleted by this patch")
+    return problems
+
+
+def _node_problems(where: str, node, full: bool) -> List[str]:
+    if not isinstance(node, dict) or not any(k in node for k in NODE_FIELDS):
+        return [f"{where}: node must be an object with {', '.join(NODE_FIELDS)}"]
+    problems = []
+    if "type" in node or full:
+        if node.get("type") not in NODE_TYPES:
+            problems.append(f"{where}: type must be one of {', '.join(NODE_TYPES)}")
+    if full and not str(node.get("label") or "").strip():
+        problems.append(f"{where}: label is required")
+    return problems
+
+
+def validate_patch(nodes: Sequence[Dict[str, Any]], operations) -> List[str]:
+    """Every reason the patch can't be applied to nodes (empty when it is clean)."""
+    operations = _normalized(operations)
+    if not isinstance(operations, list):
+        return ["operations must be a list"]
+    count = len(nodes or [])
+    inserts = sum(1 for op in operations if isinstance(op, dict) and op.get("op") == "insert")
+    deleted = {op.get("index") for op in operations
+               if isinstance(op, dict) and op.get("op") == "delete" and _is_index(op.get("index"))}
+    limit = count + inserts
+    problems = []
+    seen_deletes = set()
+    for position, op in enumerate(operations):
+        where = f"operation {position}"
+        if not isinstance(op, dict) or op.get("op") not in OPERATIONS:
+            problems.append(f"{where}: op must be one of {', '.join(OPERATIONS)}")
+            continue
+        kind, index = op["op"], op.get("index")
+        where = f"{where} ({kind})"
+        if kind == "insert":
+            if index is not None and (not _is_index(index) or not 0 <= index <= count):
+                problems.append(f"{where}: index {index!r} is out of range")
+            problems += _node_problems(where, op.get("node"), full=True)
+            if isinstance(op.get("node"), dict) and "branches" in op["node"]:
+                problems += _branch_problems(where, op["node"]["branches"], limit, deleted)
+            continue
+        if not _is_index(index) or not 0 <= index < count:
+            problems.append(f"{where}: index {index!r} is out of range")
+            continue
+        if kind == "delete":
+            if index in seen_deletes:
+                problems.append(f"{where}: node {index} is deleted twice")
+            seen_deletes.add(index)
+        elif index in deleted:
+            problems.append(f"{where}: node {index} is also deleted")
+        elif kind == "update":
+            problems += _node_problems(where, op.get("node"), full=False)
+            if isinstance(op.get("node"), dict) and "branches" in op["node"]:
+                problems += _branch_problems(where, op["node"]["branches"], limit, deleted)
+        else:
+            problems += _branch_problems(where, op.get("branches"), limit, deleted)
+    problems += _dangling_branch_problems(nodes, operations, deleted)
+    if count and len(deleted) == count and not inserts:
+        problems.append("patch deletes every node")
+    return problems
+
+
+def _dangling_branch_problems(nodes, operations, deleted: set) -> List[str]:
+    # Unpatched branches into a deleted node would otherwise lose their target
+    rebranched = {op.get("index") for op in operations if isinstance(op, dict) and (
+        op.get("op") == "retarget"
+        or (op.get("op") == "update" and isinstance(op.get("node"), dict) and "branches" in op["node"]))}
+    problems = []
+    for index, node in enumerate(nodes or []):
+        if index in deleted or index in rebranched or not isinstance(node, dict):
+            continue
+        branches = node.get("branches")
+        for branch in branches if isinstance(branches, list) else ():
+            target = _as_index(branch.get("target")) if isinstance(branch, dict) else None
+            if target in deleted:
+                problems.append(f"node {target} is deleted but node {index} branch "
+                                f"{branch.get('label', '')!r} still points to it; retarget node {index}")
+    return problems
+
+
+# ==========================================
+# APPLY
+# ==========================================
+
+def apply_patch(nodes: Sequence[Dict[str, Any]], operations) -> List[Dict[str, Any]]:
+    """
+    New node list with the patch applied; the input is not modified.
+
+    Raises:
+        PatchError: the patch fails validate_patch()
+    """
+    problems = validate_patch(nodes, operations)
+    if problems:
+        raise PatchError(problems)
+    operations = _normalized(operations)
+    count = len(nodes)
+    edited = {}                 # old index -> (node, branches come from the patch)
+    deleted = set()
+    inserts = {}                # position -> [insert number, ...]
+    inserted = []
+    for op in operations:
+        kind, index = op["op"], op.get("index")
+        if kind == "insert":
+            inserts.setdefault(count if index is None else index, []).append(len(inserted))
+            inserted.append(copy.deepcopy(op["node"]))
+        elif kind == "delete":
+            deleted.add(index)
+        else:
+            node, patched = edited.get(index, (copy.deepcopy(nodes[index]), False))
+            if kind == "update":
+                node.update(copy.deepcopy(op["node"]))
+                patched = patched or "branches" in op["node"]
+            else:
+                node["branches"] = copy.deepcopy(op["branches"])
+                patched = True
+            edited[index] = (node, patched)
+
+    result = []
+    old_to_new, insert_to_new = {}, {}
+    entries = []                # (node, branches use patch indices)
+    for position in range(count + 1):
+        for number in inserts.get(position, ()):
+            insert_to_new[number] = len(result)
+            result.append(inserted[number])
+            entries.append(True)
+        if position == count:
+            break
+        if position in deleted:
+            continue
+        node, patched = edited.get(position, (copy.deepcopy(nodes[position]), False))
+        old_to_new[position] = len(result)
+        result.append(node)
+        entries.append(patched)
+
+    def remap(target, from_patch: bool) -> Optional[int]:
+        if not _is_index(target):
+            return target
+        if from_patch and target >= count:
+            return insert_to_new.get(target - count)
+        if not 0 <= target < count:
+            return target       # Pre-existing bad target: left for pathway hardening to repair
+        return old_to_new.get(target)
+
+    for node, from_patch in zip(result, entries):
+        branches = node.get("branches")
+        if not isinstance(branches, list):
+            continue
+        rewired = []
+        for branch in branches:
+            if not isinstance(branch, dict) or "target" not in branch:
+                rewired.append(branch)
+                continue
+            target = remap(branch["target"], from_patch)
+            if target is not None:
+                rewired.append({**branch, "target": target})
+        node["branches"] = rewired
+    return result
+
+
+def describe_patch(operations) -> str:
+    """Short summary such as "2 updated, 1 inserted"."""
+    words = {"update": "updated", "insert": "inserted", "delete": "deleted", "retarget": "retargeted"}
+    counts = {}
+    for op in operations or []:
+        if isinstance(op, dict) and op.get("op") in words:
+            counts[op["op"]] = counts.get(op["op"], 0) + 1
+    return ", ".join(f"{n} {words[k]}" for k, n in counts.items()) or "no changes"
@@ -0,0 +1,253 @@
+"""
+Pathway Version Store
+
+Versioned history of the pathway node list with undo/redo and diffs.
+Phase 4 used to keep a nodes_history list of copy.deepcopy snapshots, so a
+long refinement session held (pathway size x edit count) node copies,
+and redo was impossible.
+
+How it works:
+1. Each node is frozen into an immutable NodeRecord with a cached
+   fingerprint; identical nodes are interned, so versions share records
+   and memory grows only with the nodes that actually changed
+2. A version is a tuple of record references plus a fingerprint derived
+   from the node fingerprints; snapshotting an existing version is O(1)
+3. Undo/redo move a cursor through a linear history; committing after an
+   undo discards the redo branch
+4. diff() aligns two versions by node fingerprint and reports added,
+   removed and changed nodes (with the changed fields)
+"""
+
+import difflib
+import hashlib
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+DEFAULT_MAX_VERSIONS = 200      # Oldest versions are dropped beyond this
+
+
+# ==========================================
+# PERSISTENT NODE RECORDS
+# ==========================================
+
+def _freeze(value):
+    """Hashable, order-independent form of JSON-like data."""
+    if isinstance(value, dict):
+        return ('d', tuple(sorted((str(k), _freeze(v)) for k, v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return ('l', tuple(_freeze(v) for v in value))
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, tuple) and len(value) == 2 and value[0] in ('d', 'l'):
+        if value[0] == 'd':
+            return {k: _thaw(v) for k, v in value[1]}
+        return [_thaw(v) for v in value[1]]
+    return value
+
+
+class NodeRecord:
+    """Immutable node; shared between every version that contains it."""
+
+    __slots__ = ('frozen', 'fingerprint', '__weakref__')
+
+    def __init__(self, frozen, fingerprint):
+        self.frozen = frozen
+        self.fingerprint = fingerprint
+
+    def to_dict(self) -> Dict[str, Any]:
+        """A fresh, mutable copy of the node."""
+        node = _thaw(self.frozen)
+        return node if isinstance(node, dict) else {}
+
+
+def _fingerprint(frozen) -> str:
+    return hashlib.blake2b(repr(frozen).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def node_fingerprint(node) -> str:
+    return _fingerprint(_freeze(node))
+
+
+class PathwayVersion:
+    __slots__ = ('number', 'records', 'fingerprint', 'label', 'created')
+
+    def __init__(self, number, records, label):
+        self.number = number
+        self.records = records          # tuple of NodeRecord
+        self.fingerprint = hashlib.blake2b(
+            "".join(r.fingerprint for r in records).encode('ascii'), digest_size=12).hexdigest()
+        self.label = label
+        self.created = time.time()
+
+    def __len__(self):
+        return len(self.records)
+
+    def nodes(self) -> List[Dict[str, Any]]:
+        return [record.to_dict() for record in self.records]
+
+
+# ==========================================
+# DIFFS
+# ==========================================
+
+class VersionDiff:
+    __slots__ = ('added', 'removed', 'changed')
+
+    def __init__(self):
+        self.added = []         # [(index in new, node)]
+        self.removed = []       # [(index in old, node)]
+        self.changed = []       # [(index in new, [field, ...])]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self) -> str:
+        parts = [f"{len(items)} {name}" for name, items in
+                 (("changed", self.changed), ("added", self.added), ("removed", self.removed)) if items]
+        return ", ".join(parts) if parts else "no changes"
+
+
+def _changed_fields(a: NodeRecord, b: NodeRecord) -> List[str]:
+    old = dict(a.frozen[1]) if a.frozen[0] == 'd' else {}
+    new = dict(b.frozen[1]) if b.frozen[0] == 'd' else {}
+    # repr comparison so NaN cells (from DataFrame round trips) compare equal
+    return sorted(k for k in old.keys() | new.keys() if repr(old.get(k)) != repr(new.get(k)))
+
+
+def diff_versions(old: PathwayVersion, new: PathwayVersion) -> VersionDiff:
+    """Nodes added, removed and changed going from old to new."""
+    result = VersionDiff()
+    if old.fingerprint == new.fingerprint:
+        return result
+    a = [r.fingerprint for r in old.records]
+    b = [r.fingerprint for r in new.records]
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == 'equal':
+            continue
+        paired = min(i2 - i1, j2 - j1) if op == 'replace' else 0
+        for k in range(paired):
+            result.changed.append((j1 + k, _changed_fields(old.records[i1 + k], new.records[j1 + k])))
+        for i in range(i1 + paired, i2):
+            result.removed.append((i, old.records[i].to_dict()))
+        for j in range(j1 + paired, j2):
+            result.added.append((j, new.records[j].to_dict()))
+    return result
+
+
+# ==========================================
+# VERSION STORE
+# ==========================================
+
+class VersionStore:
+    """
+    Linear version history with a cursor.
+
+    Args:
+        max_versions: History length kept; older versions are dropped
+    """
+
+    def __init__(self, max_versions: int = DEFAULT_MAX_VERSIONS):
+        self.max_versions = max(2, max_versions)
+        self._versions: List[PathwayVersion] = []
+        self._cursor = -1
+        self._counter = 0
+        # Interning pool; records disappear once no version references them
+        self._pool = weakref.WeakValueDictionary()
+
+    # ---------- snapshots ----------
+
+    def _record(self, node) -> NodeRecord:
+        frozen = _freeze(node if isinstance(node, dict) else {})
+        fingerprint = _fingerprint(frozen)
+        record = self._pool.get(fingerprint)
+        if record is None:
+            record = NodeRecord(frozen, fingerprint)
+            self._pool[fingerprint] = record
+        return record
+
+    def snapshot(self, nodes) -> PathwayVersion:
+        """Freeze a node list into an (uncommitted) version."""
+        records = tuple(self._record(node) for node in nodes or [])
+        return PathwayVersion(self._counter + 1, records, "")
+
+    def commit(self, nodes, label: str = "") -> PathwayVersion:
+        """
+        Record nodes as the newest version, unless they equal the current one.
+
+        Versions after the cursor (the redo branch) are discarded.
+        """
+        version = self.snapshot(nodes)
+        head = self.head
+        if head is not None and head.fingerprint == version.fingerprint:
+            return head
+        self._counter += 1
+        version.label = label
+        del self._versions[self._cursor + 1:]
+        self._versions.append(version)
+        if len(self._versions) > self.max_versions:
+            del self._versions[:len(self._versions) - self.max_versions]
+        self._cursor = len(self._versions) - 1
+        return version
+
+    # ---------- navigation ----------
+
+    @property
+    def head(self) -> Optional[PathwayVersion]:
+        return self._versions[self._cursor] if self._cursor >= 0 else None
+
+    @property
+    def undo_depth(self) -> int:
+        return max(0, self._cursor)
+
+    @property
+    def redo_depth(self) -> int:
+        return len(self._versions) - 1 - self._cursor
+
+    def can_undo(self) -> bool:
+        return self._cursor > 0
+
+    def can_redo(self) -> bool:
+        return self._cursor < len(self._versions) - 1
+
+    def undo(self) -> Optional[List[Dict[str, Any]]]:
+        """Step back one version; returns its nodes (fresh copies) or None."""
+        if not self.can_undo():
+            return None
+        self._cursor -= 1
+        return self.head.nodes()
+
+    def redo(self) -> Optional[List[Dict[str, Any]]]:
+        if not self.can_redo():
+            return None
+        self._cursor += 1
+        return self.head.nodes()
+
+    def history(self) -> List[PathwayVersion]:
+        """Every retained version, oldest first."""
+        return list(self._versions)
+
+    def diff(self, old: Optional[PathwayVersion] = None, new: Optional[PathwayVersion] = None) -> VersionDiff:
+        """Diff between two versions (default: the previous version and the head)."""
+        if new is None:
+            new = self.head
+        if old is None and self._cursor > 0:
+            old = self._versions[self._cursor - 1]
+        if old is None or new is None:
+            return VersionDiff()
+        return diff_versions(old, new)
+
+    def stats(self) -> dict:
+        return {
+            "versions": len(self._versions),
+            "cursor": self._cursor,
+            "records": len(self._pool),
+            "node_refs": sum(len(v) for v in self._versions),
+        }
@@ -16,10 +16,20 @@ from difflib import SequenceMatcher
 # Import Gemini API types for thinking config
 try:
     from google.genai import types
-    from gemini_functions import get_generation_config, extract_function_call_result
+    from gemini_functions import get_generation_config, extract_function_call_result, MODEL_CASCADE
     GEMINI_FUNCTIONS_AVAILABLE = True
 except ImportError:
     GEMINI_FUNCTIONS_AVAILABLE = False
+    MODEL_CASCADE = []
+
+# Shared response cache (same instance used by get_gemini_response in streamlit_app.py)
+from response_cache import get_response_cache, request_fingerprint, is_cache_enabled
+# Shared model health registry: skip models whose quota is exhausted for this key
+from model_cascade import get_model_health, client_scope, is_quota_error
+# Streamed generation so long JSON answers can be shown field by field
+from llm_streaming import JSONObjectStreamParser, collect_stream, is_streaming_enabled
+# LLM sections are reused across regenerations unless the inputs they were derived from changed
+from phase5_sections import get_section_cache, node_labels, node_counts
 
 # ==========================================
 # HELPER FUNCTIONS 
@@ -892,9 +902,22 @@ Make scenarios specific to {condition} in {care_setting or 'the care setting'}.
     pathway_button_html = ""
     pathway_script = ""
     
-    scenarios = build_beta_test_scenarios(
-        condition_clean, nodes or [], care_setting_clean, genai_client,
-        phase1_data, phase2_data, phase3_data, phase4_data
+    p1 = phase1_data or {}
+    scenario_inputs = {
+        "context": [condition_clean, care_setting_clean],
+        "scope": [p1.get(k, '') for k in ('problem', 'objectives', 'inclusion', 'exclusion')],
+        "decision_nodes": node_labels(nodes, "Decision", 6),
+        "endpoints": node_labels(nodes, "End", 4),
+        "key_steps": node_labels(nodes, limit=10),
+        "evidence": len((phase2_data or {}).get('pubmed_abstracts', [])),
+        "heuristics": bool((phase4_data or {}).get('heuristics_data')),
+    }
+    scenarios = get_section_cache().get_or_build(
+        "beta", "scenarios", scenario_inputs,
+        lambda: build_beta_test_scenarios(
+            condition_clean, nodes or [], care_setting_clean, genai_client,
+            phase1_data, phase2_data, phase3_data, phase4_data
+        )
     )
     scenario_blocks = []
     for idx, scenario in enumerate(scenarios, start=1):
@@ -1157,15 +1180,41 @@ document.addEventListener('DOMContentLoaded', initializeHeuristics);
     return html
 
 
-def _call_genai_with_retry(genai_client, prompt: str, model: str = "gemini-2.5-flash", max_retries: int = 3):
+def _generate_text(genai_client, call_kwargs: dict, on_field=None) -> str:
+    """
+    Run one generate_content call and return its text.
+
+    With on_field the call is streamed and on_field(key, value) fires for
+    each top-level member of the JSON object as soon as it is complete. The
+    returned text is the same either way.
+    """
+    if on_field is None or not is_streaming_enabled():
+        return genai_client.models.generate_content(**call_kwargs).text
+    parser = JSONObjectStreamParser()
+    streamed = collect_stream(
+        genai_client.models.generate_content_stream(**call_kwargs),
+        parser=parser,
+        on_item=lambda _index, field: on_field(*field),
+    )
+    return streamed.text
+
+
+def _call_genai_with_retry(genai_client, prompt: str, model: str = "gemini-2.5-flash", max_retries: int = 3,
+                           on_field=None):
     """
-    Call Gemini API with exponential backoff retry for rate limits.
+    Call Gemini API with quota-aware retry.
+
+    Each attempt uses the first healthy model (the requested one, then the
+    MODEL_CASCADE fallbacks). A 429 moves straight to the next model; we only
+    back off when every model is cooling down.
     
     Args:
         genai_client: Google Generative AI client
         prompt: The prompt to send
-        model: Model to use (default: gemini-flash-latest)
+        model: Preferred model (default: gemini-2.5-flash)
         max_retries: Maximum retry attempts (default 3)
+        on_field: Optional callback(key, value); streams the response and reports
+            each completed member of the returned JSON object
         
     Returns:
         API response text
@@ -1175,29 +1224,52 @@ def _call_genai_with_retry(genai_client, prompt: str, model: str = "gemini-2.5-f
     """
     import time as time_module
     
+    cache = get_response_cache() if is_cache_enabled() else None
+    cache_key = None
+    if cache is not None:
+        cache_key = request_fingerprint(
+            call="_call_genai_with_retry", model=model, contents=prompt,
+            enable_thinking=GEMINI_FUNCTIONS_AVAILABLE, thinking_budget=1024
+        )
+        hit, cached = cache.get(cache_key)
+        if hit:
+            return cached
+    
+    health = get_model_health()
+    scope = client_scope(genai_client)
+    cascade = [model] + list(MODEL_CASCADE)
+    
     for attempt in range(max_retries):
+        current = health.order_candidates(cascade, scope=scope)[0]
+        cooldown = health.cooldown_remaining(current, scope)
+        if cooldown > 0:
+            # Every model is cooling down: short backoff (5s, 10s, 15s) capped by the cooldown
+            time_module.sleep(min(cooldown, 5 * (attempt + 1)))
+        health.claim_probe(current, scope)
+        started = time_module.monotonic()
         try:
-            # Build config with thinking enabled for Gemini 3+ models
+            # Build config with thinking enabled for models that support it
             call_kwargs = {
-                "model": model,
+                "model": current,
                 "contents": prompt
             }
-            if GEMINI_FUNCTIONS_AVAILABLE:
+            if GEMINI_FUNCTIONS_AVAILABLE and ("gemini-2.5" in current or "gemini-3" in current):
                 call_kwargs["config"] = get_generation_config(
                     enable_thinking=True, 
                     thinking_budget=1024
                 )
             
-            response = genai_client.models.generate_content(**call_kwargs)
-            return response.text
+            text = _generate_text(genai_client, call_kwargs, on_field)
+            health.record(current, time_module.monotonic() - started, True, task="phase5_text", scope=scope)
+            if cache is not None and text:
+                cache.set(cache_key, text)
+            return text
         except Exception as e:
-            error_str = str(e).lower()
+            health.record(current, time_module.monotonic() - started, False,
+                          task="phase5_text", error=str(e), scope=scope)
             # Check if it's a rate limit error
-            if '429' in str(e) or 'resource_exhausted' in error_str or 'quota' in error_str:
+            if is_quota_error(str(e)):
                 if attempt < max_retries - 1:
-                    # Short backoff: 5s, 10s, 15s
-                    wait_time = 5 * (attempt + 1)
-                    time_module.sleep(wait_time)
                     continue
                 raise Exception(f"API rate limit reached after {max_retries} attempts. Please wait 30-60 seconds and try again.")
             # For other errors, raise immediately
@@ -1205,16 +1277,33 @@ def _call_genai_with_retry(genai_client, prompt: str, model: str = "gemini-2.5-f
     raise Exception("Unable to connect to AI service. Please check your API key and try again.")
 
 
-def _simple_genai_call(genai_client, prompt: str):
-    """Simple single-shot API call without retries for faster response."""
+def _simple_genai_call(genai_client, prompt: str, on_field=None):
+    """Simple single-shot API call without retries for faster response.
+
+    on_field works as in _call_genai_with_retry.
+    """
+    cache = get_response_cache() if is_cache_enabled() else None
+    cache_key = None
+    if cache is not None:
+        cache_key = request_fingerprint(call="_simple_genai_call", model="gemini-2.5-flash", contents=prompt)
+        hit, cached = cache.get(cache_key)
+        if hit:
+            return cached
+    health = get_model_health()
+    scope = client_scope(genai_client)
+    # Single shot, so spend it on a model that isn't known to be out of quota
+    model = health.order_candidates(["gemini-2.5-flash"] + list(MODEL_CASCADE), scope=scope)[0]
+    health.claim_probe(model, scope)
+    started = time.monotonic()
     try:
-        response = genai_client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        return response.text
+        text = _generate_text(genai_client, {"model": model, "contents": prompt}, on_field)
+        health.record(model, time.monotonic() - started, True, task="phase5_text", scope=scope)
+        if cache is not None and text:
+            cache.set(cache_key, text)
+        return text
     except Exception as e:
-        if '429' in str(e) or 'quota' in str(e).lower():
+        health.record(model, time.monotonic() - started, False, task="phase5_text", error=str(e), scope=scope)
+        if is_quota_error(str(e)):
             raise Exception("API rate limit. Please wait 30 seconds and try again.")
         raise e
 
@@ -1224,7 +1313,8 @@ def generate_education_module_html(
     nodes: list = None,
     target_audience: str = "",
     care_setting: str = "",
-    genai_client=None
+    genai_client=None,
+    on_progress=None
 ) -> str:
     """
     Generate comprehensive single-page education module with AI-generated content,
@@ -1236,6 +1326,8 @@ def generate_education_module_html(
         target_audience: Who this education is for
         care_setting: Setting where pathway is used
         genai_client: Google Generative AI client (required)
+        on_progress: Optional callback(section, value), called as each section
+            (learning_objectives, teaching_points, quiz_questions) finishes streaming
         
     Returns:
         Complete standalone HTML string
@@ -1308,21 +1400,39 @@ Example quiz_questions item:
 
 JSON only:"""
 
-    # Single fast API call
-    response_text = _simple_genai_call(genai_client, prompt)
-    
-    # Parse the consolidated response
-    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-    if json_match:
+    def _build_content():
+        # Single fast API call
+        response_text = _simple_genai_call(genai_client, prompt, on_field=on_progress)
+
+        # Parse the consolidated response
+        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        if not json_match:
+            raise ValueError("Failed to generate education content. Please try again.")
         try:
             content = json.loads(json_match.group())
-            learning_objectives = content.get('learning_objectives', [])[:4]
-            teaching_points = content.get('teaching_points', [])[:5]
-            questions = content.get('quiz_questions', [])[:5]
         except json.JSONDecodeError:
             raise ValueError("Failed to parse AI response. Please try again.")
-    else:
-        raise ValueError("Failed to generate education content. Please try again.")
+        return {
+            'learning_objectives': content.get('learning_objectives', [])[:4],
+            'teaching_points': content.get('teaching_points', [])[:5],
+            'quiz_questions': content.get('quiz_questions', [])[:5],
+        }
+
+    def _replay_content(content):
+        if on_progress:
+            for section, value in content.items():
+                on_progress(section, value)
+
+    # The prompt only reads the audience, scope and node counts
+    content = get_section_cache().get_or_build(
+        "edu", "content",
+        {"context": [audience_clean, condition_clean, care_setting_clean],
+         "node_counts": node_counts(nodes, ("Decision", "Process"))},
+        _build_content, on_reuse=_replay_content
+    )
+    learning_objectives = content.get('learning_objectives', [])
+    teaching_points = content.get('teaching_points', [])
+    questions = content.get('quiz_questions', [])
     
     # Validate we got enough content
     if len(learning_objectives) < 2:
@@ -2308,7 +2418,7 @@ Return ONLY valid JSON, no other text."""
     return metadata
 
 
-def create_phase5_executive_summary_docx(data: dict, condition: str, genai_client=None):
+def create_phase5_executive_summary_docx(data: dict, condition: str, genai_client=None, on_progress=None):
     """
     Create a professional Word document executive summary for Phase 5.
     Designed for C-suite and leadership audiences with formal business language.
@@ -2317,6 +2427,8 @@ def create_phase5_executive_summary_docx(data: dict, condition: str, genai_clien
         data: Session data with phase1, phase2, phase3, phase4, phase5 info
         condition: Clinical condition name
         genai_client: Optional Google Generative AI client for content generation
+        on_progress: Optional callback(section, text), called as each summary
+            section finishes streaming
         
     Returns:
         BytesIO buffer with .docx content, or None if python-docx unavailable
@@ -2389,10 +2501,27 @@ REQUIREMENTS:
 
 Return ONLY valid JSON."""
 
-                response_text = _call_genai_with_retry(genai_client, prompt)
-                json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                if json_match:
-                    ai_content = json.loads(json_match.group())
+                def _build_summary():
+                    response_text = _call_genai_with_retry(genai_client, prompt, on_field=on_progress)
+                    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+                    return json.loads(json_match.group()) if json_match else {}
+
+                def _replay_summary(content):
+                    if on_progress:
+                        for section, text in content.items():
+                            on_progress(section, text)
+
+                # The prompt only reads the scope fields, evidence/node counts and validation status
+                ai_content = get_section_cache().get_or_build(
+                    "exec", "summary",
+                    {
+                        "scope": [condition, setting_text, problem_text, objectives_text],
+                        "counts": [len(evidence), len(nodes)],
+                        "validation": [bool(p4_data.get('heuristics_data')), bool(p5_data.get('expert_html')),
+                                       bool(p5_data.get('beta_html'))],
+                    },
+                    _build_summary, on_reuse=_replay_summary
+                )
             except Exception:
                 pass
         
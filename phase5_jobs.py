@@ -0,0 +1,317 @@
+"""
+Phase 5 Deliverable Job Queue
+
+Runs the Phase 5 deliverables (expert form, beta guide, education module,
+executive summary) on a worker pool instead of the Streamlit script thread.
+Each Generate button used to block the session on its LLM calls, retries
+and back-off sleeps, so producing the full packet took the sum of all four.
+
+How it works:
+1. submit() starts a job and returns its Phase5Job record at once; a job
+   already queued or running for the same (owner, deliverable) is reused
+2. Up to four jobs run concurrently, so the packet takes about as long as
+   the slowest deliverable
+3. Workers publish streamed sections into job.progress; the UI polls the
+   record and shows results as each job finishes
+4. Job records (status, error, result) are persisted to SQLite, so a
+   session that reconnects after a restart still finds finished results.
+   Polling reads only the newest record's status for deliverables with no
+   live job; the result blob is loaded once, when it is applied
+5. The queue is process-wide, so finished jobs do not stay in memory: a
+   persisted job drops its result once saved, and finished jobs leave the
+   queue after FINISHED_JOB_TTL
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Sequence
+
+from sqlite_connections import SQLiteConnections
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+PHASE5_JOBS_ENV = "CPQ_PHASE5_JOBS"             # "0" runs jobs inline on the caller's thread
+PHASE5_JOB_DB_ENV = "CPQ_PHASE5_JOB_DB"         # SQLite file for job records ("0" disables)
+DEFAULT_JOB_DB = os.path.join("data", "jobs", "phase5_jobs.sqlite")
+DEFAULT_WORKERS = 4                             # One per deliverable
+JOB_RETENTION = 7 * 24 * 3600.0                 # Persisted records older than this are pruned
+STALE_AFTER = 15 * 60.0                         # Unfinished persisted jobs older than this were lost
+FINISHED_JOB_TTL = 3600.0                       # Finished jobs are dropped from memory after this
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "error"
+
+
+class Phase5Job:
+    """One deliverable build. progress maps section -> latest streamed value."""
+
+    __slots__ = ('id', 'owner', 'kind', 'status', 'progress', 'result', 'error',
+                 'created', 'started', 'finished')
+
+    def __init__(self, owner: str, kind: str, job_id: Optional[str] = None):
+        self.id = job_id or secrets.token_hex(8)
+        self.owner = owner
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+# ==========================================
+# PERSISTED JOB RECORDS
+# ==========================================
+
+class JobRecords:
+    """SQLite table of job records, one row per job."""
+
+    def __init__(self, path: str = DEFAULT_JOB_DB):
+        self.path = path
+        self._db = SQLiteConnections(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            conn = self._db.connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS phase5_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " error TEXT,"
+                " result BLOB,"
+                " result_is_text INTEGER NOT NULL DEFAULT 0,"
+                " created REAL NOT NULL,"
+                " started REAL,"
+                " finished REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS phase5_jobs_owner ON phase5_jobs (owner, kind, created)")
+            conn.execute("DELETE FROM phase5_jobs WHERE created < ?", (time.time() - JOB_RETENTION,))
+            conn.commit()
+
+    def save(self, job: Phase5Job):
+        result = job.result if job.status == DONE else None
+        is_text = isinstance(result, str)
+        if is_text:
+            result = result.encode("utf-8")
+        with self._lock:
+            conn = self._db.connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO phase5_jobs"
+                    " (id, owner, kind, status, error, result, result_is_text, created, started, finished)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.owner, job.kind, job.status, job.error, result, int(is_text),
+                     job.created, job.started, job.finished))
+
+    def latest(self, owner: str, kinds: Optional[Sequence[str]] = None) -> Dict[str, Phase5Job]:
+        """
+        Newest persisted job per deliverable for an owner (all deliverables,
+        or only kinds). Results are not loaded; see result().
+        """
+        query = ("SELECT j.id, j.kind, j.status, j.error, j.created, j.started, j.finished"
+                 " FROM phase5_jobs j JOIN ("
+                 "  SELECT kind, MAX(created) AS newest FROM phase5_jobs WHERE owner = ?{}"
+                 "  GROUP BY kind) n ON j.kind = n.kind AND j.created = n.newest"
+                 " WHERE j.owner = ?")
+        params = [owner]
+        if kinds is not None:
+            kinds = list(kinds)
+            if not kinds:
+                return {}
+            query = query.format(f" AND kind IN ({', '.join('?' * len(kinds))})")
+            params += kinds
+        else:
+            query = query.format("")
+        params.append(owner)
+        with self._lock:
+            rows = self._db.connection().execute(query, params).fetchall()
+        jobs = {}
+        for job_id, kind, status, error, created, started, finished in rows:
+            job = Phase5Job(owner, kind, job_id)
+            job.status, job.error = status, error
+            job.created, job.started, job.finished = created, started, finished
+            if not job.done() and time.time() - created > STALE_AFTER:
+                # Its worker process went away before finishing
+                job.status, job.error = FAILED, "Interrupted by a server restart; please generate again."
+            jobs[kind] = job
+        return jobs
+
+    def result(self, job_id: str):
+        """Stored deliverable of a finished job (HTML text or DOCX bytes), or None."""
+        with self._lock:
+            row = self._db.connection().execute(
+                "SELECT result, result_is_text FROM phase5_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return bytes(row[0]).decode("utf-8") if row[1] else bytes(row[0])
+
+
+# ==========================================
+# JOB QUEUE
+# ==========================================
+
+class Phase5JobQueue:
+    """
+    Concurrent Phase 5 deliverable builds.
+
+    Job functions take one argument, a progress callback(section, value),
+    and return the deliverable (HTML text or DOCX bytes). Exceptions are
+    captured on the job record rather than raised into the UI.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, records: Optional[JobRecords] = None,
+                 inline: bool = False, finished_ttl: float = FINISHED_JOB_TTL):
+        self.records = records
+        self.inline = inline
+        self.finished_ttl = finished_ttl
+        self.last_error = None
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "reused": 0}
+        self._jobs: Dict[tuple, Phase5Job] = {}     # (owner, kind) -> latest job
+        self._lock = threading.Lock()
+        self._pool = None if inline else ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="cpq-phase5")
+
+    def submit(self, owner: str, kind: str, fn: Callable) -> Phase5Job:
+        """Start building a deliverable, or return the build already in progress."""
+        with self._lock:
+            self._evict_finished(time.time())
+            current = self._jobs.get((owner, kind))
+            if current is not None and not current.done():
+                self.stats["reused"] += 1
+                return current
+            job = Phase5Job(owner, kind)
+            self._jobs[(owner, kind)] = job
+            self.stats["submitted"] += 1
+        self._persist(job)
+        if self.inline:
+            self._run(job, fn)
+        else:
+            self._pool.submit(self._run, job, fn)
+        return job
+
+    def job(self, owner: str, kind: str) -> Optional[Phase5Job]:
+        """Latest job for one deliverable; the database is read only when none is live."""
+        with self._lock:
+            live = self._jobs.get((owner, kind))
+        if live is not None:
+            return live
+        return self._persisted(owner, [kind]).get(kind)
+
+    def jobs(self, owner: str) -> Dict[str, Phase5Job]:
+        """Latest job per deliverable for an owner, including persisted ones."""
+        with self._lock:
+            live = {kind: job for (o, kind), job in self._jobs.items() if o == owner}
+        for kind, job in self._persisted(owner).items():
+            if kind not in live:
+                live[kind] = job
+        return live
+
+    def result(self, job: Phase5Job):
+        """The job's deliverable, loaded from its record when the job was persisted."""
+        result = job.result
+        if result is not None or self.records is None or job.status != DONE:
+            return result
+        try:
+            return self.records.result(job.id)
+        except sqlite3.Error as e:
+            self.last_error = str(e)
+            return None
+
+    def _persisted(self, owner: str, kinds: Optional[Sequence[str]] = None) -> Dict[str, Phase5Job]:
+        if self.records is None:
+            return {}
+        try:
+            return self.records.latest(owner, kinds)
+        except sqlite3.Error as e:
+            self.last_error = str(e)
+            return {}
+
+    def _persist(self, job: Phase5Job) -> bool:
+        if self.records is None:
+            return False
+        try:
+            self.records.save(job)
+            return True
+        except sqlite3.Error as e:
+            self.last_error = str(e)
+            return False
+
+    def _evict_finished(self, now: float):
+        """Forget finished jobs older than finished_ttl (caller holds the lock)."""
+        cutoff = now - self.finished_ttl
+        expired = [key for key, job in self._jobs.items()
+                   if job.done() and (job.finished or job.created) <= cutoff]
+        for key in expired:
+            del self._jobs[key]
+
+    def _run(self, job: Phase5Job, fn: Callable):
+        job.status = RUNNING
+        job.started = time.time()
+        self._persist(job)
+
+        def report(section, value):
+            job.progress[section] = value
+
+        try:
+            job.result = fn(report)
+            job.status = DONE
+            outcome = "completed"
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.status = FAILED
+            outcome = "failed"
+        job.finished = time.time()
+        with self._lock:
+            self.stats[outcome] += 1
+        if self._persist(job) and job.status == DONE:
+            # The record holds the deliverable now; result() reloads it on demand
+            job.result = None
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_queue = None
+_shared_lock = threading.Lock()
+
+
+def is_phase5_queue_enabled() -> bool:
+    return os.environ.get(PHASE5_JOBS_ENV, "1").lower() not in ("0", "false", "no", "n")
+
+
+def get_phase5_queue() -> Phase5JobQueue:
+    """Return the process-wide Phase 5 job queue, shared by every session."""
+    global _shared_queue
+    if _shared_queue is None:
+        with _shared_lock:
+            if _shared_queue is None:
+                path = os.environ.get(PHASE5_JOB_DB_ENV, DEFAULT_JOB_DB)
+                records = None
+                if path.lower() not in ("0", "false", "no", "n", ""):
+                    try:
+                        records = JobRecords(path)
+                    except (sqlite3.Error, OSError):
+                        records = None
+                _shared_queue = Phase5JobQueue(records=records, inline=not is_phase5_queue_enabled())
+    return _shared_queue
@@ -0,0 +1,144 @@
+"""
+Phase 5 Section Cache
+
+Dependency-tracked reuse of the LLM-generated sections of the Phase 5
+deliverables (beta test scenarios, education content, executive summary
+text). Regenerating a deliverable after a pathway edit used to repeat every
+LLM call, even when the edit touched nothing a section was derived from.
+
+How it works:
+1. Each section names its inputs: the exact pathway slice its prompt reads
+   (e.g. decision node labels, node counts) plus the scope fields it uses
+2. Every input is reduced to a fingerprint; the section is keyed on the
+   artifact, section name and those fingerprints
+3. get_or_build() returns the stored section when no input changed and
+   calls the builder (the LLM) only otherwise; the HTML/DOCX is then
+   re-assembled around cached and fresh sections alike
+4. Stored entries record the input fingerprints they were derived from
+
+Sections live in the shared response cache (memory, plus its SQLite tier
+when configured) with a longer TTL than raw responses.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from response_cache import get_response_cache, request_fingerprint, is_cache_enabled
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+SECTION_CACHE_ENV = "CPQ_SECTION_CACHE"     # "0" always regenerates every section
+SECTION_TTL = 7 * 24 * 3600.0               # Sections outlive raw responses
+
+
+# ==========================================
+# DEPENDENCIES
+# ==========================================
+
+def input_fingerprint(value) -> str:
+    """Stable fingerprint of a JSON-like section input."""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def node_labels(nodes, node_type: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+    """Non-empty labels of the nodes (optionally of one type), in pathway order."""
+    labels = [n.get("label", "") for n in (nodes or [])
+              if isinstance(n, dict) and n.get("label") and (node_type is None or n.get("type") == node_type)]
+    return labels[:limit] if limit is not None else labels
+
+
+def node_counts(nodes, node_types=None) -> Dict[str, int]:
+    """Total node count plus a count per node type (only node_types, when given)."""
+    counts = {"total": len(nodes or [])}
+    for node_type in node_types or ():
+        counts[node_type] = 0
+    for n in nodes or []:
+        if isinstance(n, dict):
+            node_type = n.get("type", "")
+            if node_types is None or node_type in counts:
+                counts[node_type] = counts.get(node_type, 0) + 1
+    return counts
+
+
+# ==========================================
+# SECTION CACHE
+# ==========================================
+
+class SectionCache:
+    """
+    Build-or-reuse for deliverable sections.
+
+    Args:
+        store: ResponseCache-like object (get -> (hit, value), set), or None
+            to always rebuild
+        ttl: Seconds a stored section stays reusable
+    """
+
+    def __init__(self, store=None, ttl: float = SECTION_TTL):
+        self.store = store
+        self.ttl = ttl
+        self.stats = {"reused": 0, "built": 0}
+        self._lock = threading.Lock()
+
+    def _key(self, artifact: str, section: str, fingerprints: Dict[str, str]) -> str:
+        return request_fingerprint(call="phase5_section", artifact=artifact, section=section,
+                                   inputs=fingerprints)
+
+    def get_or_build(self, artifact: str, section: str, inputs: Dict[str, Any], build: Callable,
+                     on_reuse: Optional[Callable] = None):
+        """
+        Stored section for these inputs, or build() and store it.
+
+        Args:
+            artifact: Deliverable name (beta, edu, exec)
+            section: Section name within the deliverable
+            inputs: Named inputs the section is derived from
+            build: Zero-argument callable producing the section (JSON-like);
+                falsy results are returned but not stored
+            on_reuse: Optional callback(value) run when a stored section is reused
+        """
+        fingerprints = {name: input_fingerprint(value) for name, value in inputs.items()}
+        key = self._key(artifact, section, fingerprints)
+        if self.store is not None:
+            hit, entry = self.store.get(key)
+            if hit and isinstance(entry, dict) and "value" in entry:
+                with self._lock:
+                    self.stats["reused"] += 1
+                if on_reuse is not None:
+                    on_reuse(entry["value"])
+                return entry["value"]
+        value = build()
+        with self._lock:
+            self.stats["built"] += 1
+        if self.store is not None and value:
+            self.store.set(key, {"inputs": fingerprints, "value": value}, ttl=self.ttl)
+        return value
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_sections = None
+_shared_lock = threading.Lock()
+
+
+def is_section_cache_enabled() -> bool:
+    return os.environ.get(SECTION_CACHE_ENV, "1").lower() not in ("0", "false", "no", "n")
+
+
+def get_section_cache() -> SectionCache:
+    """Return the process-wide section cache, backed by the shared response cache."""
+    global _shared_sections
+    if _shared_sections is None:
+        with _shared_lock:
+            if _shared_sections is None:
+                enabled = is_section_cache_enabled() and is_cache_enabled()
+                _shared_sections = SectionCache(get_response_cache() if enabled else None)
+    return _shared_sections
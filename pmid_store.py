@@ -0,0 +1,269 @@
+"""
+Persistent PMID Metadata Store
+
+Local SQLite store of parsed PubMed citations, shared by every session,
+pathway project and worker process on this machine. Pathways on overlapping
+conditions cite the same trials over and over. Without the store, each
+project re-downloaded and re-parsed the same efetch XML: search_pubmed was
+cached for an hour per query string, and single-PMID fetches were not
+cached at all.
+
+Two tables:
+1. citations - one row per PMID (title, authors, year, journal, abstract,
+   url) with the time it was fetched
+2. searches  - the PMID list an esearch query returned, so a repeated query
+   is answered without touching NCBI
+
+Both are read-through: fetch() and search() serve fresh rows locally and
+only ask the PubMedClient for PMIDs that are missing or older than the
+staleness window. If NCBI is unreachable, stale rows are returned instead of
+nothing.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from sqlite_connections import SQLiteConnections
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+DEFAULT_STORE_PATH = os.path.join("data", "pubmed", "pmid_store.sqlite")
+CITATION_MAX_AGE = 30 * 24 * 3600     # Citation metadata rarely changes
+SEARCH_MAX_AGE = 24 * 3600            # New papers appear daily
+SQLITE_VARIABLE_LIMIT = 500           # PMIDs per IN (...) lookup
+
+# Set CPQ_PMID_STORE=0 to disable the store (always fetch from NCBI)
+STORE_ENABLED_ENV = "CPQ_PMID_STORE"
+# Override the SQLite location (e.g. a shared volume for several workers)
+STORE_PATH_ENV = "CPQ_PMID_STORE_PATH"
+
+CITATION_FIELDS = ("title", "authors", "year", "journal", "abstract", "url")
+
+
+# ==========================================
+# STORE
+# ==========================================
+
+class PMIDStore:
+    """
+    SQLite-backed cache of parsed citation records keyed by PMID.
+
+    Args:
+        path: SQLite file (":memory:" works for tests)
+        max_age: Seconds before a citation is considered stale
+        search_max_age: Seconds before a cached esearch result is stale
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH, max_age: float = CITATION_MAX_AGE,
+                 search_max_age: float = SEARCH_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.search_max_age = search_max_age
+        self._db = SQLiteConnections(path)
+        self._shared_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "fetched": 0}
+        conn = self._db.connection()
+        with self._write():
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS citations ("
+                " pmid TEXT PRIMARY KEY,"
+                " title TEXT, authors TEXT, year TEXT, journal TEXT,"
+                " abstract TEXT, url TEXT,"
+                " fetched_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                " query_key TEXT PRIMARY KEY,"
+                " pmids TEXT NOT NULL,"
+                " fetched_at REAL NOT NULL)"
+            )
+            conn.commit()
+
+    def _write(self):
+        """Serialize access to the shared in-memory connection; a no-op for files."""
+        if self._db.in_memory:
+            return self._shared_lock
+        return _NullLock()
+
+    # --- citations ---
+
+    def get_many(self, pmids, max_age: float = None, include_stale: bool = False) -> dict:
+        """
+        Bulk lookup by PMID set.
+
+        Returns:
+            Dict of PMID -> citation dict for rows that exist (and are fresh,
+            unless include_stale). Each dict carries a "fetched_at" timestamp.
+        """
+        pmids = [str(p).strip() for p in pmids if str(p).strip()]
+        if not pmids:
+            return {}
+        max_age = self.max_age if max_age is None else max_age
+        cutoff = time.time() - max_age
+        found = {}
+        conn = self._db.connection()
+        unique = list(dict.fromkeys(pmids))
+        for i in range(0, len(unique), SQLITE_VARIABLE_LIMIT):
+            batch = unique[i:i + SQLITE_VARIABLE_LIMIT]
+            placeholders = ",".join("?" * len(batch))
+            with self._write():
+                rows = conn.execute(
+                    f"SELECT pmid, {', '.join(CITATION_FIELDS)}, fetched_at FROM citations"
+                    f" WHERE pmid IN ({placeholders})",
+                    batch,
+                ).fetchall()
+            for row in rows:
+                fetched_at = row[-1]
+                if fetched_at < cutoff and not include_stale:
+                    continue
+                record = {"id": row[0], **dict(zip(CITATION_FIELDS, row[1:-1])), "fetched_at": fetched_at}
+                found[row[0]] = record
+        return found
+
+    def put_many(self, citations) -> int:
+        """Insert or refresh citation dicts (as produced by pubmed_client). Returns rows written."""
+        now = time.time()
+        rows = []
+        for c in citations:
+            pmid = str(c.get("id") or "").strip()
+            if not pmid:
+                continue
+            rows.append((pmid, *[c.get(f) for f in CITATION_FIELDS], c.get("fetched_at") or now))
+        if not rows:
+            return 0
+        conn = self._db.connection()
+        with self._write():
+            conn.executemany(
+                f"INSERT OR REPLACE INTO citations (pmid, {', '.join(CITATION_FIELDS)}, fetched_at)"
+                f" VALUES ({','.join('?' * (len(CITATION_FIELDS) + 2))})",
+                rows,
+            )
+            conn.commit()
+        return len(rows)
+
+    def fetch(self, client, pmids) -> dict:
+        """
+        Read-through lookup: local rows first, NCBI only for missing/stale PMIDs.
+
+        Args:
+            client: PubMedClient (anything with fetch_citations(pmids) -> dict)
+            pmids: Iterable of PMIDs
+
+        Returns:
+            Dict of PMID -> citation dict (same shape as PubMedClient returns)
+        """
+        wanted = list(dict.fromkeys(str(p).strip() for p in pmids if str(p).strip()))
+        if not wanted:
+            return {}
+        known = self.get_many(wanted, include_stale=True)
+        cutoff = time.time() - self.max_age
+        fresh = {p: c for p, c in known.items() if c["fetched_at"] >= cutoff}
+        to_fetch = [p for p in wanted if p not in fresh]
+        self.stats["hits"] += len(fresh)
+        self.stats["misses"] += sum(1 for p in to_fetch if p not in known)
+        self.stats["stale"] += sum(1 for p in to_fetch if p in known)
+        if not to_fetch:
+            return _strip(fresh)
+        try:
+            fetched = client.fetch_citations(to_fetch)
+        except Exception:
+            if not known:
+                raise
+            # NCBI unavailable: stale metadata beats no metadata
+            return _strip({p: known[p] for p in wanted if p in known})
+        self.put_many(fetched.values())
+        self.stats["fetched"] += len(fetched)
+        result = dict(fresh)
+        for p in to_fetch:
+            if p in fetched:
+                result[p] = fetched[p]
+            elif p in known:
+                result[p] = known[p]
+        return _strip(result)
+
+    # --- searches ---
+
+    @staticmethod
+    def _query_key(query: str, retmax: int, sort: str) -> str:
+        return json.dumps([" ".join(str(query).split()), int(retmax), sort or ""])
+
+    def search(self, client, query: str, retmax: int = 50, sort: str = "relevance") -> list:
+        """
+        Cached esearch + read-through citation fetch.
+
+        Returns:
+            Citation dicts in PubMed's order for the query
+        """
+        key = self._query_key(query, retmax, sort)
+        conn = self._db.connection()
+        with self._write():
+            row = conn.execute("SELECT pmids, fetched_at FROM searches WHERE query_key = ?", (key,)).fetchone()
+        pmids = None
+        if row is not None and row[1] >= time.time() - self.search_max_age:
+            pmids = json.loads(row[0])
+        if pmids is None:
+            try:
+                pmids = client.esearch(query, retmax=retmax, sort=sort)
+            except Exception:
+                if row is None:
+                    raise
+                pmids = json.loads(row[0])
+            else:
+                with self._write():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO searches (query_key, pmids, fetched_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(pmids), time.time()),
+                    )
+                    conn.commit()
+        found = self.fetch(client, pmids)
+        return [found[p] for p in pmids if p in found]
+
+    def __len__(self):
+        conn = self._db.connection()
+        with self._write():
+            return conn.execute("SELECT COUNT(*) FROM citations").fetchone()[0]
+
+
+def _strip(found: dict) -> dict:
+    """Drop the store's bookkeeping so callers get plain citation dicts."""
+    return {p: {k: v for k, v in c.items() if k != "fetched_at"} for p, c in found.items()}
+
+
+class _NullLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def is_store_enabled() -> bool:
+    return os.environ.get(STORE_ENABLED_ENV, "1").lower() not in ("0", "false", "no", "n")
+
+
+def get_pmid_store():
+    """Return the process-wide store, or None when disabled or the file can't be opened."""
+    global _shared_store
+    if not is_store_enabled():
+        return None
+    if _shared_store is None:
+        with _shared_lock:
+            if _shared_store is None:
+                try:
+                    _shared_store = PMIDStore(os.environ.get(STORE_PATH_ENV) or DEFAULT_STORE_PATH)
+                except (sqlite3.Error, OSError):
+                    return None
+    return _shared_store
@@ -0,0 +1,431 @@
+"""
+Durable Project Store
+
+Persists each session's project state (the phase1-phase5 dicts in
+st.session_state.data) outside the Streamlit process. Until now a worker
+restart, or a user reconnecting to a different replica, lost the whole
+project, and every regenerated LLM output cost quota again.
+
+How it works:
+1. State is stored per (project, phase, field): one row (SQLite) or one
+   JSON file (filesystem) per top-level field of a phase dict
+2. save() hashes each field and writes only fields that changed since
+   the last save or load (plus deletions), never the whole project
+3. open() returns a ProjectData dict that loads each phase on first access
+4. ProjectAutosaver saves tracked sessions on a background thread every
+   few seconds, so the script thread never waits on disk
+
+Any replica pointed at the same SQLite file or directory (a shared volume)
+can resume a project by its id. Concurrent writers are last-write-wins per
+field.
+"""
+
+import copy
+import datetime
+import hashlib
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlite_connections import SQLiteConnections
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+# CPQ_PROJECT_STORE=sqlite (default), fs, or 0 to keep projects in memory only
+PROJECT_STORE_ENV = "CPQ_PROJECT_STORE"
+# SQLite file or directory (e.g. a volume shared by several replicas)
+PROJECT_STORE_PATH_ENV = "CPQ_PROJECT_STORE_PATH"
+DEFAULT_SQLITE_PATH = os.path.join("data", "projects", "projects.sqlite")
+DEFAULT_FS_PATH = os.path.join("data", "projects")
+AUTOSAVE_INTERVAL = 5.0         # Seconds between background saves
+TRACK_TTL = 3600.0              # Stop autosaving sessions idle this long
+
+_PROJECT_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+_FIELD_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+_WHOLE = "__value__"            # Field name used when a phase is not a dict
+# Per-session caches and flags that are never persisted
+TRANSIENT_FIELDS = frozenset({"viz_cache", "applying_heuristics"})
+
+
+def new_project_id() -> str:
+    return secrets.token_urlsafe(12)
+
+
+def is_valid_project_id(project_id) -> bool:
+    return isinstance(project_id, str) and bool(_PROJECT_ID.match(project_id))
+
+
+def _json_default(value):
+    # Dates (e.g. the Phase 1 schedule) round-trip as tagged ISO strings
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"__date__": value.isoformat()}
+    return str(value)
+
+
+def _json_hook(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return datetime.date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def _encode(value) -> str:
+    return json.dumps(value, sort_keys=True, default=_json_default)
+
+
+def _decode(encoded: str):
+    return json.loads(encoded, object_hook=_json_hook)
+
+
+def _digest(encoded: str) -> str:
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# ==========================================
+# BACKENDS
+# ==========================================
+
+class SQLiteBackend:
+    """One row per (project, phase, field) in a SQLite file."""
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._db = SQLiteConnections(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            conn = self._db.connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS project_fields ("
+                " project TEXT NOT NULL,"
+                " phase TEXT NOT NULL,"
+                " field TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (project, phase, field))"
+            )
+            conn.commit()
+
+    def read_phase(self, project: str, phase: str) -> Dict[str, str]:
+        with self._lock:
+            rows = self._db.connection().execute(
+                "SELECT field, value FROM project_fields WHERE project = ? AND phase = ?",
+                (project, phase)).fetchall()
+        return dict(rows)
+
+    def write_phase(self, project: str, phase: str, changed: Dict[str, str], removed: Iterable[str]):
+        now = time.time()
+        with self._lock:
+            conn = self._db.connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO project_fields (project, phase, field, value, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [(project, phase, field, value, now) for field, value in changed.items()])
+                conn.executemany(
+                    "DELETE FROM project_fields WHERE project = ? AND phase = ? AND field = ?",
+                    [(project, phase, field) for field in removed])
+
+    def exists(self, project: str) -> bool:
+        with self._lock:
+            return self._db.connection().execute(
+                "SELECT 1 FROM project_fields WHERE project = ? LIMIT 1", (project,)).fetchone() is not None
+
+    def delete(self, project: str):
+        with self._lock:
+            conn = self._db.connection()
+            with conn:
+                conn.execute("DELETE FROM project_fields WHERE project = ?", (project,))
+
+
+class FileSystemBackend:
+    """One JSON file per field: <root>/<project>/<phase>/<field>.json, written atomically."""
+
+    def __init__(self, root: str = DEFAULT_FS_PATH):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _phase_dir(self, project: str, phase: str) -> str:
+        return os.path.join(self.root, project, phase)
+
+    def read_phase(self, project: str, phase: str) -> Dict[str, str]:
+        directory = self._phase_dir(project, phase)
+        fields = {}
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return fields
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name), "r", encoding="utf-8") as fh:
+                    fields[name[:-5]] = fh.read()
+            except OSError:
+                continue
+        return fields
+
+    def write_phase(self, project: str, phase: str, changed: Dict[str, str], removed: Iterable[str]):
+        directory = self._phase_dir(project, phase)
+        os.makedirs(directory, exist_ok=True)
+        for field, value in changed.items():
+            path = os.path.join(directory, f"{field}.json")
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                fh.write(value)
+            os.replace(tmp, path)
+        for field in removed:
+            try:
+                os.remove(os.path.join(directory, f"{field}.json"))
+            except FileNotFoundError:
+                pass
+
+    def exists(self, project: str) -> bool:
+        return os.path.isdir(os.path.join(self.root, project))
+
+    def delete(self, project: str):
+        import shutil
+        shutil.rmtree(os.path.join(self.root, project), ignore_errors=True)
+
+
+# ==========================================
+# LAZY PROJECT DATA
+# ==========================================
+
+class ProjectData(dict):
+    """
+    Session data dict whose phases are loaded from the store on first access.
+
+    Only phases that have been accessed are materialized; save() therefore
+    never touches phases this session has not read.
+    """
+
+    def __init__(self, store: "ProjectStore", project_id: str, defaults: Dict[str, Any]):
+        super().__init__()
+        self.store = store
+        self.project_id = project_id
+        self._defaults = defaults
+
+    def __missing__(self, phase):
+        if phase not in self._defaults:
+            raise KeyError(phase)
+        value = self.store.load_phase(self.project_id, phase, self._defaults[phase])
+        dict.__setitem__(self, phase, value)
+        return value
+
+    def __contains__(self, phase):
+        return dict.__contains__(self, phase) or phase in self._defaults
+
+    def get(self, phase, default=None):
+        if dict.__contains__(self, phase) or phase in self._defaults:
+            return self[phase]
+        return default
+
+    def setdefault(self, phase, default=None):
+        if phase in self:
+            return self[phase]
+        dict.__setitem__(self, phase, default)
+        return default
+
+    def loaded(self) -> Dict[str, Any]:
+        """Phases materialized so far."""
+        return dict(dict.items(self))
+
+
+# ==========================================
+# STORE
+# ==========================================
+
+class ProjectStore:
+    """
+    Field-level delta persistence for project state.
+
+    Args:
+        backend: SQLiteBackend, FileSystemBackend or anything with the same
+            read_phase / write_phase / exists / delete methods
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._saved: Dict[Tuple[str, str], Dict[str, str]] = {}   # (project, phase) -> {field: digest}
+        self._lock = threading.RLock()
+        self.stats = {"saves": 0, "fields_written": 0, "fields_deleted": 0, "phases_loaded": 0}
+
+    def open(self, project_id: str, defaults: Dict[str, Any]) -> ProjectData:
+        return ProjectData(self, project_id, defaults)
+
+    def exists(self, project_id: str) -> bool:
+        return self.backend.exists(project_id)
+
+    def load_phase(self, project_id: str, phase: str, default=None):
+        """Stored phase merged over a copy of its default."""
+        rows = self.backend.read_phase(project_id, phase)
+        value = copy.deepcopy(default) if default is not None else {}
+        digests = {}
+        for field, encoded in rows.items():
+            try:
+                decoded = _decode(encoded)
+            except ValueError:
+                continue
+            digests[field] = _digest(encoded)
+            if field == _WHOLE:
+                value = decoded
+            elif isinstance(value, dict):
+                value[field] = decoded
+        with self._lock:
+            self._saved[(project_id, phase)] = digests
+            self.stats["phases_loaded"] += 1
+        return value
+
+    def _delta(self, project_id: str, phase: str, value) -> Tuple[Dict[str, str], list, Dict[str, str]]:
+        fields = value if isinstance(value, dict) else {_WHOLE: value}
+        encoded = {str(k): _encode(v) for k, v in list(fields.items())
+                   if _FIELD_NAME.match(str(k)) and k not in TRANSIENT_FIELDS}
+        digests = {k: _digest(v) for k, v in encoded.items()}
+        saved = self._saved.get((project_id, phase), {})
+        changed = {k: encoded[k] for k, d in digests.items() if saved.get(k) != d}
+        removed = [k for k in saved if k not in digests]
+        return changed, removed, digests
+
+    def save(self, project_id: str, data) -> int:
+        """
+        Write the fields that changed since the last save/load.
+
+        Returns:
+            Number of fields written or deleted
+        """
+        phases = data.loaded() if isinstance(data, ProjectData) else dict(data)
+        written = 0
+        with self._lock:
+            for phase, value in phases.items():
+                changed, removed, digests = self._delta(project_id, str(phase), value)
+                if not changed and not removed:
+                    continue
+                self.backend.write_phase(project_id, str(phase), changed, removed)
+                self._saved[(project_id, str(phase))] = digests
+                written += len(changed) + len(removed)
+                self.stats["fields_written"] += len(changed)
+                self.stats["fields_deleted"] += len(removed)
+            if written:
+                self.stats["saves"] += 1
+        return written
+
+    def delete(self, project_id: str):
+        with self._lock:
+            self.backend.delete(project_id)
+            for key in [k for k in self._saved if k[0] == project_id]:
+                del self._saved[key]
+
+
+# ==========================================
+# AUTOSAVE
+# ==========================================
+
+class ProjectAutosaver:
+    """Background thread that periodically saves every tracked session's data."""
+
+    def __init__(self, store: ProjectStore, interval: float = AUTOSAVE_INTERVAL, ttl: float = TRACK_TTL):
+        self.store = store
+        self.interval = interval
+        self.ttl = ttl
+        self.last_error = None
+        self._tracked: Dict[str, Tuple[Any, float]] = {}     # project -> (data, last seen)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def track(self, project_id: str, data):
+        """Register (or refresh) a session's data for autosave; starts the thread lazily."""
+        with self._lock:
+            self._tracked[project_id] = (data, time.time())
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="cpq-autosave", daemon=True)
+                self._thread.start()
+
+    def untrack(self, project_id: str):
+        with self._lock:
+            self._tracked.pop(project_id, None)
+
+    def flush(self) -> int:
+        """Save every tracked session now; returns fields written."""
+        now = time.time()
+        with self._lock:
+            items = list(self._tracked.items())
+            for project_id, (_, seen) in items:
+                if now - seen > self.ttl:
+                    del self._tracked[project_id]
+        written = 0
+        for project_id, (data, _) in items:
+            try:
+                written += self.store.save(project_id, data)
+            except RuntimeError:
+                # The session mutated the dict mid-save; the next pass retries
+                continue
+            except (sqlite3.Error, OSError) as e:
+                self.last_error = str(e)
+        return written
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_store = None
+_shared_autosaver = None
+_shared_lock = threading.Lock()
+
+
+def project_store_backend() -> str:
+    """'sqlite', 'fs', or '' when persistence is disabled."""
+    mode = os.environ.get(PROJECT_STORE_ENV, "sqlite").strip().lower()
+    if mode in ("0", "false", "no", "n", "off", "none", ""):
+        return ""
+    return "fs" if mode in ("fs", "file", "files", "filesystem") else "sqlite"
+
+
+def get_project_store() -> Optional[ProjectStore]:
+    """Return the process-wide project store, or None when disabled or unavailable."""
+    global _shared_store
+    backend = project_store_backend()
+    if not backend:
+        return None
+    if _shared_store is None:
+        with _shared_lock:
+            if _shared_store is None:
+                path = os.environ.get(PROJECT_STORE_PATH_ENV)
+                try:
+                    if backend == "fs":
+                        _shared_store = ProjectStore(FileSystemBackend(path or DEFAULT_FS_PATH))
+                    else:
+                        _shared_store = ProjectStore(SQLiteBackend(path or DEFAULT_SQLITE_PATH))
+                except (sqlite3.Error, OSError):
+                    return None
+    return _shared_store
+
+
+def get_project_autosaver() -> Optional[ProjectAutosaver]:
+    global _shared_autosaver
+    store = get_project_store()
+    if store is None:
+        return None
+    if _shared_autosaver is None:
+        with _shared_lock:
+            if _shared_autosaver is None:
+                _shared_autosaver = ProjectAutosaver(store)
+    return _shared_autosaver
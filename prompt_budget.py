@@ -0,0 +1,214 @@
+"""
+Prompt Budget
+
+Token-budgeted assembly of the pathway prompts. Prompts were built by
+f-string concatenation with fixed cut-offs: the first 20 evidence items with
+abstracts cut to 200 characters, and the pathway as json.dumps(nodes,
+indent=2). Large pathways inflated every call while relevant evidence past
+item 20 never reached the model.
+
+How it works:
+1. token_budget() gives the prompt budget for the models a call may cascade
+   through (the smallest one wins; CPQ_PROMPT_TOKENS overrides)
+2. compact_nodes() serializes the pathway without indentation, with short
+   keys (see NODE_KEY_LEGEND) and without empty or default-valued fields
+3. rank_evidence() orders the evidence by BM25 relevance to the refinement
+   request, then to the node labels (see faq_index); unmatched items keep
+   their order after the matched ones
+4. fill_slot() takes a prompt built with a slot marker, measures what the
+   rest of the prompt costs, and fills the slot greedily with as many
+   ranked items as the remaining budget allows (items that don't fit are
+   skipped so smaller ones further down can still get in)
+
+Token counts are estimated (about four characters per token), which is
+close enough for budgeting and needs no tokenizer.
+"""
+
+import json
+import math
+import os
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from faq_index import FaqIndex
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+CHARS_PER_TOKEN = 4
+# Prompt budgets (input tokens) by model. These are cost/latency targets, not
+# context limits: every model here accepts far longer prompts.
+MODEL_TOKEN_BUDGETS = {
+    "gemini-2.5-pro": 16000,
+    "gemini-3-flash": 12000,
+    "gemini-2.5-flash": 12000,
+    "gemini-2.0-flash-lite": 8000,
+}
+DEFAULT_TOKEN_BUDGET = 10000
+# Override every budget (e.g. CPQ_PROMPT_TOKENS=20000)
+PROMPT_TOKENS_ENV = "CPQ_PROMPT_TOKENS"
+ABSTRACT_CHARS = 400
+
+EVIDENCE_SLOT = "\x00EVIDENCE\x00"
+
+# Short keys used in compact node JSON; branch entries use l/to
+NODE_KEYS = {"type": "t", "label": "l", "evidence": "e", "notes": "n", "branches": "b", "detail": "d"}
+BRANCH_KEYS = {"label": "l", "target": "to"}
+NODE_KEY_LEGEND = ("Pathway keys: t=type, l=label, e=evidence (PMID; omitted when N/A), n=notes, "
+                   "b=branches (l=label, to=target node index), d=detail.")
+_DEFAULT_VALUES = {"evidence": ("N/A", "n/a", "")}
+
+
+# ==========================================
+# BUDGETS
+# ==========================================
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def token_budget(models: Optional[Sequence[str]] = None) -> int:
+    """Budget for a call that may run on any of models (the smallest budget applies)."""
+    override = os.environ.get(PROMPT_TOKENS_ENV)
+    if override:
+        try:
+            return max(1000, int(override))
+        except ValueError:
+            pass
+    budgets = [MODEL_TOKEN_BUDGETS.get(m, DEFAULT_TOKEN_BUDGET) for m in (models or ())]
+    return min(budgets) if budgets else DEFAULT_TOKEN_BUDGET
+
+
+def fill_greedy(items: Iterable[str], budget_tokens: int, separator: str = "\n") -> Tuple[List[str], int]:
+    """Keep items in order while they fit in budget_tokens; returns (kept, dropped count)."""
+    kept, dropped, used = [], 0, 0
+    sep_tokens = estimate_tokens(separator)
+    for item in items:
+        cost = estimate_tokens(item) + (sep_tokens if kept else 0)
+        if used + cost <= budget_tokens:
+            kept.append(item)
+            used += cost
+        else:
+            dropped += 1
+    return kept, dropped
+
+
+def fill_slot(prompt: str, slot: str, items: Iterable[str], budget_tokens: int, min_items: int = 0,
+              separator: str = "\n", empty: str = "No specific evidence provided.") -> Tuple[str, int]:
+    """
+    Replace slot in prompt with as many items as the rest of the budget allows.
+
+    The first min_items items are always kept, even when the rest of the
+    prompt already uses up the budget.
+
+    Returns:
+        (prompt, dropped item count)
+    """
+    items = list(items)
+    head, tail = items[:min_items], items[min_items:]
+    remaining = budget_tokens - estimate_tokens(prompt.replace(slot, "") + separator.join(head))
+    kept, dropped = fill_greedy(tail, max(0, remaining), separator)
+    kept = head + kept
+    return prompt.replace(slot, separator.join(kept) if kept else empty), dropped
+
+
+# ==========================================
+# PATHWAY NODES
+# ==========================================
+
+def _is_empty(key: str, value: Any) -> bool:
+    if value is None or value == "" or value == [] or value == {}:
+        return True
+    return isinstance(value, str) and value.strip() in _DEFAULT_VALUES.get(key, ())
+
+
+def compact_node(node: Dict[str, Any]) -> Dict[str, Any]:
+    compact = {}
+    for key, value in node.items():
+        if _is_empty(key, value):
+            continue
+        if key == "branches" and isinstance(value, list):
+            value = [{BRANCH_KEYS.get(k, k): v for k, v in b.items() if not _is_empty(k, v)}
+                     if isinstance(b, dict) else b for b in value]
+        compact[NODE_KEYS.get(key, key)] = value
+    return compact
+
+
+def compact_nodes(nodes: Sequence[Dict[str, Any]]) -> str:
+    """Pathway nodes as compact JSON (pair with NODE_KEY_LEGEND in the prompt)."""
+    return json.dumps([compact_node(n) for n in nodes or [] if isinstance(n, dict)],
+                      separators=(",", ":"), ensure_ascii=False)
+
+
+def expand_nodes(nodes: Any) -> Any:
+    """Map short keys back to full names, for replies that echo the compact form."""
+    if not isinstance(nodes, list):
+        return nodes
+    long_keys = {v: k for k, v in NODE_KEYS.items()}
+    long_branch_keys = {v: k for k, v in BRANCH_KEYS.items()}
+    expanded = []
+    for node in nodes:
+        if not isinstance(node, dict):
+            expanded.append(node)
+            continue
+        full = {long_keys.get(k, k): v for k, v in node.items()}
+        if isinstance(full.get("branches"), list):
+            full["branches"] = [{long_branch_keys.get(k, k): v for k, v in b.items()}
+                                if isinstance(b, dict) else b for b in full["branches"]]
+        expanded.append(full)
+    return expanded
+
+
+# ==========================================
+# EVIDENCE
+# ==========================================
+
+def _trim_abstract(abstract: str, limit: int) -> str:
+    abstract = " ".join((abstract or "").split())
+    if len(abstract) <= limit:
+        return abstract
+    cut = abstract.rfind(". ", 0, limit)
+    return abstract[:cut + 1] if cut > limit // 2 else abstract[:limit].rstrip() + "…"
+
+
+def evidence_line(item: Dict[str, Any], abstract_chars: int = ABSTRACT_CHARS) -> str:
+    line = f"- PMID {item.get('id', 'N/A')}: {item.get('title', 'Unknown')}"
+    if item.get("grade") and item.get("grade") != "Un-graded":
+        line += f" [GRADE: {item['grade']}]"
+    abstract = _trim_abstract(item.get("abstract", ""), abstract_chars)
+    return f"{line} | Abstract: {abstract or 'N/A'}"
+
+
+def rank_evidence(evidence: Sequence[Dict[str, Any]], query: str = "",
+                  context: str = "") -> List[Dict[str, Any]]:
+    """
+    Evidence ordered by relevance: BM25 score against query (e.g. the
+    refinement request) first, then against context (e.g. the node labels).
+    Items matching neither keep their original order at the end.
+    """
+    items = [e for e in evidence or [] if isinstance(e, dict)]
+    if len(items) < 2 or not (query.strip() or context.strip()):
+        return items
+    titles = [e.get('title', '') for e in items]
+    # Titles are indexed twice so they outweigh abstract text
+    index = FaqIndex([(title, f"{title} {title} {e.get('abstract', '')}", "", "")
+                      for title, e in zip(titles, items)])
+
+    def scores(text):
+        hits = index.search(text, limit=len(items)) if text.strip() else []
+        return {hit.index: hit.score for hit in hits}
+
+    primary, secondary = scores(query), scores(context)
+    order = sorted(range(len(items)), key=lambda i: (-primary.get(i, 0.0), -secondary.get(i, 0.0), i))
+    return [items[i] for i in order]
+
+
+def node_label_text(nodes: Optional[Sequence[Dict[str, Any]]]) -> str:
+    """Node labels joined into one string (the context for rank_evidence)."""
+    return " ".join(str(n.get("label", "")) for n in nodes or [] if isinstance(n, dict))
+
+
+def evidence_lines(evidence: Sequence[Dict[str, Any]], query: str = "", context: str = "",
+                   abstract_chars: int = ABSTRACT_CHARS) -> List[str]:
+    """Ranked evidence as prompt lines, ready for fill_slot()."""
+    return [evidence_line(e, abstract_chars) for e in rank_evidence(evidence, query, context)]
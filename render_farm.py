@@ -0,0 +1,211 @@
+"""
+Graphviz Render Farm
+
+Renders DOT source to SVG/PNG/PDF off the Streamlit script thread.
+graph.pipe() used to run dot synchronously on every Phase 4 rerun, so a
+large pathway froze the session, and there was no PNG/PDF path for print
+packets.
+
+How it works:
+1. submit() returns a Future at once; the UI keeps drawing and picks the
+   bytes up when the job is done
+2. One job renders every requested format from a single dot invocation
+   (one layout, several -T outputs)
+3. Each dot run is its own OS process with a hard timeout, so a runaway
+   layout is killed instead of hanging a worker
+4. Outputs are cached per (DOT hash, format, engine), and identical jobs
+   already in flight are shared, so exports are instant after the first render
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+RENDER_FARM_ENV = "CPQ_RENDER_FARM"       # "0" renders inline on the caller's thread
+EXPORT_FORMATS = ("svg", "png", "pdf")
+DEFAULT_WORKERS = 2                       # Concurrent dot processes
+DEFAULT_TIMEOUT = 30.0                    # Seconds before a dot process is killed
+DEFAULT_CACHE_ENTRIES = 96                # Rendered outputs kept in memory
+
+
+class RenderError(RuntimeError):
+    """Graphviz is missing, failed, or timed out."""
+
+
+def dot_hash(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+# ==========================================
+# DOT EXECUTION
+# ==========================================
+
+def run_dot(source: str, formats, engine: str = "dot", timeout: float = DEFAULT_TIMEOUT) -> dict:
+    """
+    Lay out DOT source once and write it in every requested format.
+
+    Args:
+        source: DOT source text
+        formats: Output formats (e.g. ("svg", "png", "pdf"))
+        engine: Graphviz layout executable (dot, neato, ...)
+        timeout: Seconds before the process is killed
+
+    Returns:
+        {format: bytes}
+
+    Raises:
+        RenderError: Executable missing, non-zero exit, or timeout
+    """
+    exe = shutil.which(engine)
+    if exe is None:
+        raise RenderError(f"Graphviz executable '{engine}' not found")
+    with tempfile.TemporaryDirectory(prefix="cpq-render-") as tmp:
+        args = [exe]
+        outputs = {}
+        for fmt in formats:
+            outputs[fmt] = os.path.join(tmp, f"pathway.{fmt}")
+            args += [f"-T{fmt}", f"-o{outputs[fmt]}"]
+        try:
+            proc = subprocess.run(args, input=source.encode("utf-8"), capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise RenderError(f"{engine} timed out after {timeout:.0f}s")
+        if proc.returncode != 0:
+            raise RenderError(proc.stderr.decode("utf-8", "replace").strip()[:300] or f"{engine} failed")
+        rendered = {}
+        for fmt, path in outputs.items():
+            with open(path, "rb") as fh:
+                rendered[fmt] = fh.read()
+        return rendered
+
+
+# ==========================================
+# RENDER FARM
+# ==========================================
+
+class RenderFarm:
+    """
+    Cached, asynchronous Graphviz rendering.
+
+    Job results are {format: bytes or None}; a failed render yields None
+    for that format (the reason is kept in last_error) rather than raising
+    into the UI.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, timeout: float = DEFAULT_TIMEOUT,
+                 cache_entries: int = DEFAULT_CACHE_ENTRIES, renderer=run_dot, inline: bool = False):
+        self.timeout = timeout
+        self.cache_entries = cache_entries
+        self.renderer = renderer
+        self.inline = inline
+        self.last_error = None
+        self.stats = {"hits": 0, "renders": 0, "failures": 0}
+        self._cache = OrderedDict()    # (dot hash, format, engine) -> bytes
+        self._inflight = {}            # (dot hash, formats, engine) -> Future
+        self._lock = threading.Lock()
+        self._pool = None if inline else ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="cpq-render")
+
+    def cached(self, source: str, fmt: str = "svg", engine: str = "dot"):
+        """Rendered bytes if this exact output is cached, else None."""
+        with self._lock:
+            return self._cache.get((dot_hash(source), fmt, engine))
+
+    def submit(self, source: str, formats=("svg",), engine: str = "dot") -> Future:
+        """
+        Start rendering and return a Future of {format: bytes or None}.
+
+        Fully cached requests return an already-completed Future.
+        """
+        formats = tuple(dict.fromkeys(f.lower() for f in formats))
+        digest = dot_hash(source)
+        with self._lock:
+            results = {f: self._cache.get((digest, f, engine)) for f in formats}
+            missing = tuple(f for f in formats if results[f] is None)
+            if not missing:
+                for fmt in formats:
+                    self._cache.move_to_end((digest, fmt, engine))
+                self.stats["hits"] += 1
+                done = Future()
+                done.set_result(results)
+                return done
+            job_key = (digest, formats, engine)
+            if job_key in self._inflight:
+                return self._inflight[job_key]
+            if not self.inline:
+                future = self._pool.submit(self._run, source, digest, formats, missing, engine)
+                self._inflight[job_key] = future
+        if self.inline:
+            future = Future()
+            future.set_result(self._run(source, digest, formats, missing, engine))
+            return future
+        future.add_done_callback(lambda _f: self._forget(job_key))
+        return future
+
+    def render(self, source: str, fmt: str = "svg", engine: str = "dot", wait: float = None):
+        """Blocking convenience: bytes for one format, or None on failure/timeout."""
+        try:
+            results = self.submit(source, (fmt,), engine).result(
+                timeout=wait if wait is not None else self.timeout + 5)
+        except Exception as e:
+            self.last_error = str(e) or type(e).__name__
+            return None
+        return results.get(fmt)
+
+    def _forget(self, job_key):
+        with self._lock:
+            self._inflight.pop(job_key, None)
+
+    def _run(self, source, digest, formats, missing, engine) -> dict:
+        try:
+            rendered = self.renderer(source, missing, engine, self.timeout)
+            self.stats["renders"] += 1
+        except Exception as e:
+            rendered = {}
+            self.last_error = str(e)
+            self.stats["failures"] += 1
+        with self._lock:
+            for fmt, data in rendered.items():
+                if data:
+                    self._cache[(digest, fmt, engine)] = data
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+            return {f: rendered.get(f) or self._cache.get((digest, f, engine)) for f in formats}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_farm = None
+_shared_lock = threading.Lock()
+
+
+def is_render_farm_enabled() -> bool:
+    return os.environ.get(RENDER_FARM_ENV, "1").lower() not in ("0", "false", "no", "n")
+
+
+def get_render_farm() -> RenderFarm:
+    """Return the process-wide render farm, shared by every session."""
+    global _shared_farm
+    if _shared_farm is None:
+        with _shared_lock:
+            if _shared_farm is None:
+                _shared_farm = RenderFarm(inline=not is_render_farm_enabled())
+    return _shared_farm
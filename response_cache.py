@@ -0,0 +1,331 @@
+"""
+Response Cache for Gemini Calls
+
+Content-addressed cache for LLM responses. Every Streamlit rerun that
+re-triggers a draft would otherwise pay full model latency and quota for a
+request that is byte-identical to an earlier one.
+
+Two tiers:
+1. In-memory LRU (process-wide, shared by every session in the worker)
+2. Optional on-disk SQLite tier shared across sessions, workers and restarts
+
+Entries are keyed on a SHA-256 hash of the full request (prompt, contents,
+model choice, json_mode, function declaration, thinking budget) and carry a
+per-entry TTL. Values are stored as JSON so every hit returns a fresh copy
+that callers can mutate freely.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from sqlite_connections import SQLiteConnections
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+DEFAULT_TTL_SECONDS = 3600          # Matches the @st.cache_data(ttl=3600) used elsewhere
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024         # In-memory tier budget
+DEFAULT_DISK_MAX_BYTES = 256 * 1024 * 1024   # SQLite tier budget
+
+# Set CPQ_RESPONSE_CACHE=0 to disable caching entirely
+CACHE_ENABLED_ENV = "CPQ_RESPONSE_CACHE"
+# Set CPQ_RESPONSE_CACHE_PATH=data/cache/responses.sqlite to enable the disk tier
+CACHE_PATH_ENV = "CPQ_RESPONSE_CACHE_PATH"
+
+
+# ==========================================
+# REQUEST FINGERPRINTING
+# ==========================================
+
+def _to_jsonable(obj):
+    """Fallback serializer for SDK objects (pydantic models, bytes, sets)."""
+    if hasattr(obj, "model_dump"):
+        try:
+            return obj.model_dump(mode="json", exclude_none=True)
+        except Exception:
+            pass
+    if isinstance(obj, (bytes, bytearray)):
+        return hashlib.sha256(bytes(obj)).hexdigest()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(str(x) for x in obj)
+    return repr(obj)
+
+
+def request_fingerprint(**parts) -> str:
+    """
+    Build a stable cache key from the parts of an LLM request.
+
+    Args:
+        **parts: Anything that affects the response (prompt, contents, model,
+            json_mode, function_declaration, thinking_budget, ...)
+
+    Returns:
+        Hex SHA-256 digest of the canonical JSON encoding
+    """
+    canonical = json.dumps(parts, sort_keys=True, default=_to_jsonable, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# ==========================================
+# DISK TIER
+# ==========================================
+
+class _SQLiteTier:
+    """SQLite-backed tier shared across processes via WAL mode."""
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_DISK_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._db = SQLiteConnections(path, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            conn = self._db.connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+            conn.commit()
+
+    def get(self, key: str):
+        """Return (value, expires_at) for a live entry, or None."""
+        with self._lock:
+            conn = self._db.connection()
+            row = conn.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            now = time.time()
+            if expires_at < now:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return value, expires_at
+
+    def set(self, key: str, value: str, ttl: float) -> int:
+        """Store a value and return how many entries were evicted to fit it."""
+        with self._lock:
+            return self._set_locked(key, value, ttl)
+
+    def _set_locked(self, key: str, value: str, ttl: float) -> int:
+        conn = self._db.connection()
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, value, size, now + ttl, now),
+        )
+        evicted = conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used rows until we are back under budget
+            overflow = total - self.max_bytes
+            for old_key, old_size in conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC"
+            ).fetchall():
+                if overflow <= 0 or old_key == key:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                overflow -= old_size
+                evicted += 1
+        conn.commit()
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            conn = self._db.connection()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+
+# ==========================================
+# RESPONSE CACHE
+# ==========================================
+
+class ResponseCache:
+    """
+    Two-tier LRU cache for LLM responses with TTL and size-based eviction.
+
+    Args:
+        max_entries: Maximum number of entries kept in memory
+        max_bytes: Maximum serialized bytes kept in memory
+        default_ttl: Seconds an entry stays valid unless overridden per entry
+        disk_path: Optional SQLite file for the shared on-disk tier
+        disk_max_bytes: Size budget for the on-disk tier
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        default_ttl: float = DEFAULT_TTL_SECONDS,
+        disk_path: str = None,
+        disk_max_bytes: int = DEFAULT_DISK_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (serialized, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {
+            "hits": 0, "misses": 0, "disk_hits": 0,
+            "sets": 0, "evictions": 0, "expired": 0,
+        }
+        self._disk = None
+        if disk_path:
+            try:
+                self._disk = _SQLiteTier(disk_path, disk_max_bytes)
+            except (sqlite3.Error, OSError):
+                self._disk = None
+
+    # --- internal helpers ---
+
+    def _evict_locked(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._stats["evictions"] += 1
+
+    def _store_locked(self, key, serialized, expires_at):
+        size = len(serialized)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (serialized, size, expires_at)
+        self._bytes += size
+        self._evict_locked()
+
+    # --- public API ---
+
+    def get(self, key: str):
+        """
+        Look up a cached value.
+
+        Returns:
+            (hit, value) tuple; value is a fresh deserialized copy on hit
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                serialized, size, expires_at = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return True, json.loads(serialized)
+                self._entries.pop(key, None)
+                self._bytes -= size
+                self._stats["expired"] += 1
+
+        if self._disk is not None:
+            try:
+                stored = self._disk.get(key)
+            except sqlite3.Error:
+                stored = None
+            if stored is not None:
+                serialized, expires_at = stored
+                with self._lock:
+                    # Promote into memory; it expires when the disk entry does
+                    self._store_locked(key, serialized, expires_at)
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                return True, json.loads(serialized)
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return False, None
+
+    def set(self, key: str, value, ttl: float = None) -> bool:
+        """
+        Store a JSON-serializable value. Returns False if it could not be cached.
+        """
+        if value is None:
+            return False
+        try:
+            serialized = json.dumps(value, separators=(",", ":"))
+        except (TypeError, ValueError):
+            return False
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._store_locked(key, serialized, time.time() + ttl)
+            self._stats["sets"] += 1
+        if self._disk is not None:
+            try:
+                evicted = self._disk.set(key, serialized, ttl)
+                with self._lock:
+                    self._stats["evictions"] += evicted
+            except sqlite3.Error:
+                pass
+        return True
+
+    def get_or_compute(self, key: str, compute, ttl: float = None):
+        """Return the cached value for key, calling compute() and caching its result on a miss."""
+        hit, value = self.get(key)
+        if hit:
+            return value
+        value = compute()
+        self.set(key, value, ttl=ttl)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._disk is not None:
+            try:
+                self._disk.clear()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> dict:
+        """Hit/miss counters plus current memory footprint."""
+        with self._lock:
+            out = dict(self._stats)
+            out["entries"] = len(self._entries)
+            out["bytes"] = self._bytes
+            lookups = out["hits"] + out["misses"]
+            out["hit_rate"] = (out["hits"] / lookups) if lookups else 0.0
+            out["disk_enabled"] = self._disk is not None
+        return out
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+# ==========================================
+# PROCESS-WIDE INSTANCE
+# ==========================================
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def is_cache_enabled() -> bool:
+    return os.environ.get(CACHE_ENABLED_ENV, "1").lower() not in ("0", "false", "no", "n")
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide cache, configured from the environment on first use."""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = ResponseCache(disk_path=os.environ.get(CACHE_PATH_ENV) or None)
+    return _shared_cache
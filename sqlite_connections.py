@@ -0,0 +1,60 @@
+"""
+SQLite Connections
+
+Connection handling shared by the SQLite-backed stores.
+
+How it works:
+1. File databases get one connection per thread, opened on first use in WAL
+   mode so readers don't block the writer and several app processes can
+   share the file; the parent directory is created up front
+2. ":memory:" databases are private to the connection that opens them, so
+   one connection is shared by every thread instead. Stores that allow
+   concurrent access serialize on their own lock when in_memory is set
+"""
+
+import os
+import sqlite3
+import threading
+
+MEMORY_PATH = ":memory:"
+DEFAULT_TIMEOUT = 10.0          # Seconds to wait on another writer's lock
+
+
+class SQLiteConnections:
+    """
+    Per-thread connections to one SQLite database.
+
+    Args:
+        path: SQLite file, or ":memory:" (tests)
+        timeout: Busy timeout for file databases
+    """
+
+    def __init__(self, path: str, timeout: float = DEFAULT_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._shared = None
+        if path == MEMORY_PATH:
+            self._shared = sqlite3.connect(path, check_same_thread=False)
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    @property
+    def in_memory(self) -> bool:
+        return self._shared is not None
+
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection (the shared one for ":memory:")."""
+        if self._shared is not None:
+            return self._shared
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.DatabaseError:
+                pass
+            self._local.conn = conn
+        return conn
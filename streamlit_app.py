@@ -1,8 +1,10 @@
 import streamlit as st
 # Version info sidebar caption (admin-only)
 import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import os
 import json
+import copy
 import pandas as pd
 import altair as alt
 import urllib.request
@@ -13,12 +15,10 @@ import base64
 from io import BytesIO
 import datetime
 from datetime import date, timedelta
-import copy
-import xml.etree.ElementTree as ET
 from contextlib import contextmanager
 import requests
 import hashlib
-import textwrap
+import threading
 from google import genai
 from google.genai import types
 
@@ -27,17 +27,68 @@ from gemini_functions import (
     PRIMARY_MODEL, MODEL_CASCADE,
     GENERATE_PATHWAY_NODES, DEFINE_PATHWAY_SCOPE, CREATE_IHI_CHARTER,
     GRADE_EVIDENCE, ANALYZE_HEURISTICS, APPLY_HEURISTICS,
-    GENERATE_BETA_TEST_SCENARIOS, ANALYZE_AUDIENCE,
-    get_tool, get_tools, get_generation_config, extract_function_call_result,
+    GENERATE_BETA_TEST_SCENARIOS, ANALYZE_AUDIENCE, PATCH_PATHWAY_NODES,
+    get_tool, get_tools, get_generation_config, extract_function_call_result, argument_schema,
     DEFAULT_THINKING_CONFIG, COMPLEX_THINKING_CONFIG, LIGHT_THINKING_CONFIG
 )
 
+# Content-addressed cache shared by every LLM call path
+from response_cache import get_response_cache, request_fingerprint, is_cache_enabled
+# Sequential / hedged model cascade with per-model latency tracking
+from model_cascade import run_hedged, run_sequential, is_hedging_enabled, get_model_health, client_scope
+# Incremental parsing for streamed generations
+from llm_streaming import JSONArrayStreamParser, collect_stream, is_streaming_enabled
+# PubMed E-utilities client and the local PMID metadata store
+from pubmed_client import get_pubmed_client, default_retmax
+from pmid_store import get_pmid_store
+# Chunked, concurrent GRADE auto-grading
+from evidence_grading import grade_evidence, apply_grades, extract_grades
+# Shared single-pass graph analysis for validators and renderers
+from pathway_graph import GraphIndex
+# Background, cached Graphviz rendering (SVG/PNG/PDF)
+from render_farm import get_render_farm, EXPORT_FORMATS
+# Cross-session, byte-bounded cache of rendered diagram artifacts
+from diagram_cache import get_diagram_cache, diagram_key
+# One compiled diagram IR shared by the DOT, Graphviz and Mermaid exporters
+from pathway_ir import compile_pathway, emit_dot, emit_graphviz, emit_mermaid
+# Non-mutating node normalization with a journal of applied fixes
+from pathway_hardening import harden_nodes
+# Clustered overview + drill-down rendering for very large pathways
+from pathway_clusters import needs_scale_mode, compile_scale_plan, emit_overview_dot, emit_cluster_dot
+# In-process layered layout + SVG writer used when Graphviz/dot is unavailable
+from fallback_layout import render_svg as render_fallback_svg
+# Structurally shared pathway versions for undo/redo and diffs
+from pathway_versions import VersionStore
+# Durable per-phase project persistence (SQLite or filesystem) with background autosave
+from project_store import get_project_store, get_project_autosaver, new_project_id, is_valid_project_id
+# Background job queue for the Phase 5 deliverables
+from phase5_jobs import get_phase5_queue
+# Append-only survey feedback log with running aggregates
+from feedback_store import get_feedback_store, DEFAULT_PAGE_SIZE as FEEDBACK_PAGE_SIZE
+# BM25 retrieval over the FAQ and user guides for the in-app assistant
+from faq_index import get_faq_index, HELP_TOPICS
+# Hash-keyed cache of uploaded guidelines (text, Files API URIs, reviews)
+from document_ingest import (
+    get_ingest_cache, content_hash, iter_markdown, block_separator, is_docx,
+    split_sections, select_sections, format_sections, LARGE_DOCUMENT_CHARS,
+)
+# Token-budgeted prompt pieces: compact node JSON and relevance-ranked evidence
+from prompt_budget import (
+    compact_nodes, expand_nodes, NODE_KEY_LEGEND, EVIDENCE_SLOT,
+    evidence_lines, fill_slot, node_label_text, token_budget,
+)
+# Refinement as edit lists (insert/update/delete/retarget) instead of whole pathways
+from pathway_patch import (
+    PATHWAY_SLOT, PatchError, apply_patch, describe_patch, format_indexed_nodes,
+    patch_instructions, patches_enabled,
+)
+
 # Clinical pathway generation modules
 try:
     from pathway_generator import (
         PathwayGenerator, Order, EvidenceBasedAddition,
         DispositionCriteria, DispositionType,
-        create_mermaid_from_nodes, create_dot_from_nodes,
+        create_dot_from_nodes,
         export_pathway_markdown
     )
     PATHWAY_GENERATOR_AVAILABLE = True
@@ -131,11 +182,6 @@ def regenerate_nodes_with_refinement(nodes, refine_text, heuristics_data=None):
     setting = st.session_state.data['phase1'].get('setting') or "care setting"
     evidence_list = st.session_state.data['phase2'].get('evidence', [])
 
-    ev_context = "\n".join([
-        f"- PMID {e['id']}: {e['title']} | Abstract: {e.get('abstract', 'N/A')[:200]}"
-        for e in evidence_list[:20]
-    ])
-
     heuristics_summary = ""
     if heuristics_data:
         bullet_lines = []
@@ -156,10 +202,10 @@ def regenerate_nodes_with_refinement(nodes, refine_text, heuristics_data=None):
     CRITICAL: Apply refinements while PRESERVING and potentially ENHANCING clinical complexity.
     
     Current pathway for {cond} in {setting}:
-    {json.dumps(nodes, indent=2)}
+    {PATHWAY_SLOT}
 
     Available Evidence:
-    {ev_context}
+    {EVIDENCE_SLOT}
 
     User's refinement request: "{refine_text}"
     {heuristics_summary}
@@ -211,7 +257,6 @@ def regenerate_nodes_with_refinement(nodes, refine_text, heuristics_data=None):
        - Educational content: Note hyperlink candidates (score calculators, drug info, evidence citations)
        - Disposition specificity: Never vague "discharge" - specify follow-up provider, timing, virtual alternatives
     
-    OUTPUT: Complete revised JSON array of nodes with fields: type, label, evidence, (optional) notes
     Rules:
     - type: "Start" | "Decision" | "Process" | "End"
     - First node: type "Start", label "patient present to {setting} with {cond}"
@@ -223,6 +268,16 @@ def regenerate_nodes_with_refinement(nodes, refine_text, heuristics_data=None):
     - Apply sophisticated patterns above to make pathway immediately implementable by clinicians
     """
 
+    # Ask for just the edits first; the whole pathway only if no clean patch comes back
+    patched, _ = request_pathway_patch(prompt, nodes, evidence_list, refine_text)
+    if patched:
+        return patched
+
+    prompt = prompt.replace(PATHWAY_SLOT, pathway_prompt_text(nodes)) + """
+    OUTPUT: Complete revised JSON array of nodes with fields: type, label, evidence, (optional) notes
+    """
+    prompt = fill_evidence_slot(prompt, evidence_list, refine_text, nodes)
+
     # Use native function calling for structured output (with json_mode fallback)
     result = get_gemini_response(
         prompt, 
@@ -230,16 +285,78 @@ def regenerate_nodes_with_refinement(nodes, refine_text, heuristics_data=None):
         thinking_budget=2048  # Complex pathway generation needs more reasoning
     )
     
-    # Extract nodes from function call result or fall back to legacy parsing
+    nodes = pathway_nodes_from_result(result)
+    if nodes is not None:
+        return nodes
+
+    # Fallback to json_mode if function calling didn't work
+    return pathway_nodes_from_result(get_gemini_response(prompt, json_mode=True))
+
+
+def fill_evidence_slot(prompt, evidence_list, query="", nodes=None):
+    """
+    Fill EVIDENCE_SLOT in a pathway prompt with Phase 2 evidence ranked by
+    relevance to the query (then the node labels), as far as the token budget
+    of the current model cascade allows. The five most relevant items always
+    go in, however large the pathway.
+    """
+    lines = evidence_lines(evidence_list, query, node_label_text(nodes))
+    prompt, _ = fill_slot(prompt, EVIDENCE_SLOT, lines, token_budget(get_smart_model_cascade()), min_items=5)
+    return prompt
+
+
+def pathway_prompt_text(nodes):
+    """The pathway as compact JSON, for prompts that ask for the whole node list back."""
+    return f"{NODE_KEY_LEGEND}\n{compact_nodes(nodes)}"
+
+
+def request_pathway_patch(prompt, nodes, evidence_list=None, query="", file_parts=None, thinking_budget=1024):
+    """
+    Ask Gemini for only the edits that carry out a pathway prompt (see pathway_patch.py).
+
+    The prompt shows the pathway at PATHWAY_SLOT and may leave an EVIDENCE_SLOT
+    to fill. Returns (patched_nodes, function arguments), or (None, None) when
+    patches are disabled or no clean patch came back; callers then request the
+    whole pathway as before.
+    """
+    if not nodes or not patches_enabled():
+        return None, None
+    patch_prompt = prompt.replace(PATHWAY_SLOT, format_indexed_nodes(nodes)) + "\n\n" + patch_instructions(nodes)
+    if EVIDENCE_SLOT in patch_prompt:
+        patch_prompt = fill_evidence_slot(patch_prompt, evidence_list or [], query, nodes)
+    contents = [{"parts": [{"text": patch_prompt}] + list(file_parts)}] if file_parts else None
+    result = get_gemini_response(
+        patch_prompt,
+        function_declaration=PATCH_PATHWAY_NODES,
+        thinking_budget=thinking_budget,
+        contents=contents
+    )
+    args = result.get('arguments', result) if isinstance(result, dict) else None
+    operations = args.get('operations') if isinstance(args, dict) else None
+    if not operations:
+        return None, None
+    try:
+        return apply_patch(nodes, operations), args
+    except PatchError:
+        return None, None
+
+
+def pathway_nodes_from_result(result):
+    """
+    Node list from a whole-pathway reply: a GENERATE_PATHWAY_NODES function
+    call, its bare arguments or a plain JSON array. Short keys echoed from
+    pathway_prompt_text() are expanded. Returns None for any other reply, so
+    callers can fall back to json_mode.
+    """
     if isinstance(result, dict) and 'arguments' in result:
-        return result['arguments'].get('nodes', [])
+        nodes = result['arguments'].get('nodes', [])
     elif isinstance(result, dict) and 'nodes' in result:
-        return result.get('nodes', [])
+        nodes = result.get('nodes', [])
     elif isinstance(result, list):
-        return result
-    
-    # Fallback to json_mode if function calling didn't work
-    return get_gemini_response(prompt, json_mode=True)
+        nodes = result
+    else:
+        return None
+    return expand_nodes(nodes)
 
 # --- LIBRARY HANDLING ---
 try:
@@ -882,12 +999,17 @@ def styled_info(text):
 def upload_and_review_file(uploaded_file, phase_key: str, context: str = ""):
     """
     Upload a file to Gemini, auto-review it, and return markdown summary + file URI.
+
+    Uploads are keyed by content hash: a guideline already uploaded (in any
+    phase) reuses its Files API URI, extracted text and review for the same
+    context instead of uploading and reviewing it again.
+
     Args:
         uploaded_file: Streamlit UploadedFile object
         phase_key: Unique key for session state (e.g., 'p1_refine')
         context: Optional context about what the file is for (e.g., 'clinical pathway')
     Returns:
-        dict with 'review' (markdown), 'file_uri', and 'filename'
+        dict with 'review' (markdown), 'file_uri', 'filename' and 'reused'
     """
     if not uploaded_file:
         return None
@@ -897,93 +1019,148 @@ def upload_and_review_file(uploaded_file, phase_key: str, context: str = ""):
         st.error("API connection error. Cannot upload file.")
         return None
 
+    import tempfile
+    import os
+    import shutil
+
+    cache = get_ingest_cache()
     try:
-        # Read file bytes
-        file_bytes = uploaded_file.read()
-        
-        # Convert DOCX to markdown, then upload as .md file
-        if uploaded_file.name.lower().endswith('.docx'):
-            try:
-                from io import BytesIO
-                from docx import Document
-                doc = Document(BytesIO(file_bytes))
-                
-                # Convert to markdown with structure preserved
-                md_lines = []
-                for para in doc.paragraphs:
-                    text = para.text.strip()
-                    if not text:
-                        continue
-                    # Detect headings by style
-                    style_name = para.style.name.lower() if para.style else ""
-                    if 'heading 1' in style_name:
-                        md_lines.append(f"# {text}")
-                    elif 'heading 2' in style_name:
-                        md_lines.append(f"## {text}")
-                    elif 'heading 3' in style_name:
-                        md_lines.append(f"### {text}")
-                    elif 'title' in style_name:
-                        md_lines.append(f"# {text}")
-                    else:
-                        md_lines.append(text)
-                
-                md_content = "\n\n".join(md_lines)
-                file_bytes = md_content.encode('utf-8')
+        uploaded_file.seek(0)
+        digest = content_hash(uploaded_file)
+        # Uploaded files are only visible to the API key that uploaded them
+        scope = client_scope(client)
+        file_uri = cache.file_uri(digest, scope) if cache else None
+        text = cache.text(digest) if cache else None
+        reused = file_uri is not None
+
+        if not file_uri:
+            docx = is_docx(uploaded_file.name)
+            if docx:
+                # DOCX is uploaded as markdown with structure preserved
                 mime_type = 'text/markdown'
                 display_name = uploaded_file.name.replace('.docx', '.md').replace('.DOCX', '.md')
-            except Exception as docx_err:
-                st.error(f"Could not convert DOCX file: {docx_err}")
-                return None
-        else:
-            # Build MIME type for other supported files
-            mime_type = uploaded_file.type or "application/octet-stream"
-            if uploaded_file.name.endswith('.pdf'):
-                mime_type = 'application/pdf'
-            elif uploaded_file.name.endswith('.txt'):
-                mime_type = 'text/plain'
-            elif uploaded_file.name.endswith('.md'):
-                mime_type = 'text/markdown'
-            display_name = uploaded_file.name
+                ext = '.md'
+            else:
+                # Build MIME type for other supported files
+                mime_type = uploaded_file.type or "application/octet-stream"
+                if uploaded_file.name.endswith('.pdf'):
+                    mime_type = 'application/pdf'
+                elif uploaded_file.name.endswith('.txt'):
+                    mime_type = 'text/plain'
+                elif uploaded_file.name.endswith('.md'):
+                    mime_type = 'text/markdown'
+                display_name = uploaded_file.name
+                ext = os.path.splitext(uploaded_file.name)[1]
+
+            # Write to temp file (SDK expects file path or bytes), streaming the content
+            with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+                tmp_path = tmp.name
+                if docx and text is None:
+                    try:
+                        blocks = []
+                        for i, block in enumerate(iter_markdown(uploaded_file.name, uploaded_file)):
+                            tmp.write((("\n\n" if i else "") + block).encode('utf-8'))
+                            blocks.append(block)
+                        text = "\n\n".join(blocks)
+                    except Exception as docx_err:
+                        tmp.close()
+                        os.unlink(tmp_path)
+                        st.error(f"Could not convert DOCX file: {docx_err}")
+                        return None
+                elif docx:
+                    tmp.write(text.encode('utf-8'))
+                else:
+                    uploaded_file.seek(0)
+                    shutil.copyfileobj(uploaded_file, tmp)
 
-        # Upload to Gemini Files API
-        # New SDK expects: file=bytes/path, config with mimeType
-        import tempfile
-        import os
-        
-        # Determine file extension for temp file
-        ext = '.md' if uploaded_file.name.lower().endswith('.docx') else os.path.splitext(uploaded_file.name)[1]
-        
-        # Write to temp file (SDK expects file path or bytes)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-            tmp.write(file_bytes)
-            tmp_path = tmp.name
-        
-        try:
-            uploaded = client.files.upload(
-                file=tmp_path,
-                config=types.UploadFileConfig(
-                    mime_type=mime_type,
-                    display_name=display_name
+            try:
+                uploaded = client.files.upload(
+                    file=tmp_path,
+                    config=types.UploadFileConfig(
+                        mime_type=mime_type,
+                        display_name=display_name
+                    )
                 )
-            )
-        finally:
-            # Clean up temp file
-            os.unlink(tmp_path)
+            finally:
+                # Clean up temp file
+                os.unlink(tmp_path)
+            file_uri = uploaded.uri
+            if cache:
+                expires = getattr(uploaded, "expiration_time", None)
+                cache.put_file_uri(digest, scope, file_uri, expires.timestamp() if expires else None)
+
+        if cache and text is None:
+            # Keep the text for section-level prompts (PDF text needs pypdf)
+            try:
+                uploaded_file.seek(0)
+                text = block_separator(uploaded_file.name).join(iter_markdown(uploaded_file.name, uploaded_file))
+                cache.put_text(digest, uploaded_file.name, uploaded_file.size or 0, text)
+            except Exception:
+                pass
+
+        review_text = cache.review(digest, context) if cache else None
+        if review_text is None:
+            review_text = review_document(file_uri, context)
+            # Failed reviews come back as warnings/fallback notes; only keep real ones
+            if cache and not review_text.startswith(("⚠️", "✓ File uploaded")):
+                cache.put_review(digest, context, review_text)
 
-        review_text = review_document(uploaded.uri, context)
         # Store the URI directly for easy retrieval
-        st.session_state[f"file_{phase_key}"] = uploaded.uri
-        st.session_state[f"file_{phase_key}_info"] = f"File: {uploaded_file.name} ({uploaded.uri})"
+        st.session_state[f"file_{phase_key}"] = file_uri
+        st.session_state[f"file_{phase_key}_info"] = f"File: {uploaded_file.name} ({file_uri})"
+        st.session_state.setdefault('document_hashes', {})[file_uri] = (digest, uploaded_file.name)
         return {
             "review": review_text,
-            "file_uri": uploaded.uri,
+            "file_uri": file_uri,
             "filename": uploaded_file.name,
+            "reused": reused,
         }
     except Exception as e:
         st.error(f"File upload failed: {e}")
         return None
 
 
+def collect_uploaded_documents(prefix: str, query: str = ""):
+    """
+    Gather the documents uploaded under a phase prefix for a refinement prompt.
+
+    Small documents are attached by Files API URI. Large documents whose text
+    is cached are sent as the sections most relevant to the query instead, so
+    the prompt does not carry the whole guideline.
+
+    Returns:
+        (file_uris, file_texts)
+    """
+    file_uris = []
+    file_texts = []
+    cache = get_ingest_cache()
+    hashes = st.session_state.get('document_hashes', {})
+    for key in list(st.session_state.keys()):
+        if key.startswith(f"file_{prefix}") and "_info" not in key:
+            val = st.session_state.get(key, '')
+            if val:
+                uri = None
+                # Check if it's a direct URI (new format)
+                if val.startswith("https://generativelanguage.googleapis.com"):
+                    uri = val
+                # Check if it's old format "File: name (uri)"
+                elif "File:" in val and "(" in val and val.endswith(")"):
+                    candidate = val.split("(")[-1].rstrip(")")
+                    if candidate.startswith("https://"):
+                        uri = candidate
+                # Check if it's extracted text content (from DOCX)
+                elif len(val) > 100:  # Assume long text is document content
+                    file_texts.append(val)
+                if uri:
+                    digest, filename = hashes.get(uri, (None, ""))
+                    text = cache.text(digest) if cache and digest else None
+                    if text and len(text) > LARGE_DOCUMENT_CHARS:
+                        file_texts.append(format_sections(filename, select_sections(split_sections(text), query)))
+                    else:
+                        file_uris.append(uri)
+    return file_uris, file_texts
+
+
 def review_document(file_uri: str, context: str = "") -> str:
     """
     Review an uploaded file using Gemini API and return a markdown summary.
@@ -1608,68 +1785,53 @@ def create_exec_summary_docx(summary_text, condition):
     buffer = BytesIO(); doc.save(buffer); buffer.seek(0)
     return buffer
 
-def auto_grade_evidence_list(evidence_list: list):
+def _grade_evidence_chunk(prompt):
+    """Grade one chunk: native function calling, then json_mode if the shape is wrong."""
+    # Use native function calling for reliable structured output
+    result = get_gemini_response(
+        prompt, 
+        function_declaration=GRADE_EVIDENCE,
+        thinking_budget=1024
+    )
+    if extract_grades(result):
+        return result
+    # Fallback to json_mode
+    return get_gemini_response(prompt, json_mode=True)
+
+def auto_grade_evidence_list(evidence_list: list, on_progress=None):
     """
     Auto-grade a list of evidence items using GRADE criteria via Gemini API.
     Updates each item in the list with 'grade' and 'rationale' fields.
     
+    Articles are graded in concurrent chunks (see evidence_grading.py), so
+    large evidence sets neither truncate nor take proportionally longer.
+    
     Args:
         evidence_list: List of evidence dictionaries with at least 'id' and 'title' keys
+        on_progress: Optional callback(graded_count, total)
     """
     if not evidence_list:
         return
     
+    # Worker threads need this run's script context to use session state
+    ctx = get_script_run_ctx()
+    initializer = (lambda: add_script_run_ctx(threading.current_thread(), ctx)) if ctx else None
     try:
-        prompt = (
-            "Assign GRADE quality of evidence (use EXACTLY one of: 'High (A)', 'Moderate (B)', 'Low (C)', or 'Very Low (D)') "
-            "and provide a brief Rationale (1-2 sentences) for each article. "
-            f"{json.dumps([{k:v for k,v in e.items() if k in ['id','title']} for e in evidence_list])}. "
-            "Return ONLY valid JSON object where keys are PMID strings and values are objects with 'grade' and 'rationale' fields. "
-            '{\"12345678\": {\"grade\": \"High (A)\", \"rationale\": \"text here\"}}'
-        )
-        
-        # Use native function calling for reliable structured output
-        result = get_gemini_response(
-            prompt, 
-            function_declaration=GRADE_EVIDENCE,
-            thinking_budget=1024
+        report = grade_evidence(
+            evidence_list,
+            _grade_evidence_chunk,
+            initializer=initializer,
+            on_progress=on_progress,
         )
-        # Extract grades from function call or fall back
-        if isinstance(result, dict) and 'arguments' in result:
-            grades = result['arguments'].get('grades', {})
-        elif isinstance(result, dict) and 'grades' in result:
-            grades = result['grades']
-        elif isinstance(result, dict):
-            grades = result  # Already in expected {pmid: {grade, rationale}} format
-        else:
-            # Fallback to json_mode
-            grades = get_gemini_response(prompt, json_mode=True)
-        
-        if grades and isinstance(grades, dict):
-            for e in evidence_list:
-                pmid_str = str(e.get('id', ''))
-                if pmid_str in grades:
-                    grade_data = grades[pmid_str]
-                    if isinstance(grade_data, dict):
-                        e['grade'] = grade_data.get('grade', 'Un-graded')
-                        e['rationale'] = grade_data.get('rationale', 'Not provided.')
-                    else:
-                        e['grade'] = 'Un-graded'
-                        e['rationale'] = 'Not provided.'
-                else:
-                    e.setdefault('grade', 'Un-graded')
-                    e.setdefault('rationale', 'Not yet evaluated.')
-        else:
-            # If API call fails, set defaults
-            for e in evidence_list:
-                e.setdefault('grade', 'Un-graded')
-                e.setdefault('rationale', 'Auto-grading unavailable.')
-    
     except Exception as ex:
         # On error, set defaults and log
         for e in evidence_list:
             e.setdefault('grade', 'Un-graded')
             e.setdefault('rationale', f'Auto-grading error: {str(ex)}')
+        return
+    if report.failed:
+        debug_log(f"Grading: {len(report.failed)} article(s) left un-graded after retries")
+    apply_grades(evidence_list, report.grades)
 
 def format_citation_line(entry, style="APA"):
     """Lightweight formatter for citation strings based on available PubMed fields.
@@ -1716,7 +1878,7 @@ TASK: Apply feasible heuristics to improve this clinical decision pathway while
 CRITICAL PRINCIPLE: This is NOT about simplification. Improvements should make the pathway MORE usable, more complete, and more clinically rigorous—not less complex.
 
 Current pathway ({len(nodes)} nodes):
-{json.dumps(nodes)}
+{PATHWAY_SLOT}
 
 Heuristic Assessment:
 {insights_text}
@@ -1741,13 +1903,6 @@ BEFORE/AFTER RULE:
 - If no: Skip it
 - NEVER: Reduce complexity, remove branches, generalize clinical steps, or simplify decision trees
 
-Return ONLY valid JSON:
-{{
-  "updated_nodes": [array of modified node objects with enhanced detail and annotations],
-  "applied_heuristics": ["H2", "H4", "H5", ...list of heuristics that genuinely improved the pathway],
-  "applied_summary": "Detailed explanation of improvements made and how each enhances clinical decision-making"
-}}
-
 VALIDATION CHECKLIST BEFORE RETURNING:
 - Node count maintained or INCREASED (not decreased)
 - All Decision node branches still present and distinct
@@ -1757,37 +1912,55 @@ VALIDATION CHECKLIST BEFORE RETURNING:
 - All 4 clinical stages still represented: Initial Evaluation, Diagnosis/Treatment, Re-evaluation, Final Disposition
 - Clinical depth enhanced, not reduced"""
 
-    # Use native function calling for reliable structured output
-    result = get_gemini_response(
-        prompt, 
-        function_declaration=APPLY_HEURISTICS,
-        thinking_budget=2048  # Complex heuristics application
-    )
-    # Extract from function call or fall back
+    # Ask for just the edits first (applied heuristics and summary ride along);
+    # the whole node list only if no clean patch comes back
+    patched, patch_args = request_pathway_patch(prompt, nodes, thinking_budget=2048)
     response = None
-    if isinstance(result, dict) and 'arguments' in result:
-        response = result['arguments']
-    elif isinstance(result, dict) and 'updated_nodes' in result:
-        response = result
-    elif isinstance(result, str) and result.strip():
-        # Model returned text instead of function call — try to parse JSON
-        try:
-            cleaned = result.replace('```json', '').replace('```', '').strip()
-            match = re.search(r'(\{[\s\S]*\})', cleaned)
-            if match:
-                parsed = json.loads(match.group(0))
-                if isinstance(parsed, dict) and 'updated_nodes' in parsed:
-                    response = parsed
-        except (json.JSONDecodeError, Exception):
-            pass
-    # If still no result, fallback to json_mode (separate API call)
-    if not response or not isinstance(response, dict) or 'updated_nodes' not in response:
-        fallback = get_gemini_response(prompt, json_mode=True)
-        if isinstance(fallback, dict) and 'updated_nodes' in fallback:
-            response = fallback
+    if patched:
+        response = {
+            "updated_nodes": patched,
+            "applied_heuristics": patch_args.get("applied_heuristics") or [],
+            "applied_summary": patch_args.get("summary") or describe_patch(patch_args.get("operations")),
+        }
+    else:
+        prompt = prompt.replace(PATHWAY_SLOT, pathway_prompt_text(nodes)) + """
+
+Return ONLY valid JSON:
+{
+  "updated_nodes": [array of modified node objects with enhanced detail and annotations],
+  "applied_heuristics": ["H2", "H4", "H5", ...list of heuristics that genuinely improved the pathway],
+  "applied_summary": "Detailed explanation of improvements made and how each enhances clinical decision-making"
+}"""
+        # Use native function calling for reliable structured output
+        result = get_gemini_response(
+            prompt, 
+            function_declaration=APPLY_HEURISTICS,
+            thinking_budget=2048  # Complex heuristics application
+        )
+        # Extract from function call or fall back
+        if isinstance(result, dict) and 'arguments' in result:
+            response = result['arguments']
+        elif isinstance(result, dict) and 'updated_nodes' in result:
+            response = result
+        elif isinstance(result, str) and result.strip():
+            # Model returned text instead of function call — try to parse JSON
+            try:
+                cleaned = result.replace('```json', '').replace('```', '').strip()
+                match = re.search(r'(\{[\s\S]*\})', cleaned)
+                if match:
+                    parsed = json.loads(match.group(0))
+                    if isinstance(parsed, dict) and 'updated_nodes' in parsed:
+                        response = parsed
+            except (json.JSONDecodeError, Exception):
+                pass
+        # If still no result, fallback to json_mode (separate API call)
+        if not response or not isinstance(response, dict) or 'updated_nodes' not in response:
+            fallback = get_gemini_response(prompt, json_mode=True)
+            if isinstance(fallback, dict) and 'updated_nodes' in fallback:
+                response = fallback
     
     if response and isinstance(response, dict):
-        updated_nodes = response.get("updated_nodes")
+        updated_nodes = expand_nodes(response.get("updated_nodes"))
         applied = response.get("applied_heuristics", [])
         summary = response.get("applied_summary", "")
         
@@ -1834,119 +2007,16 @@ def create_references_docx(citations, style="APA"):
     buffer = BytesIO(); doc.save(buffer); buffer.seek(0)
     return buffer
 
-def harden_nodes(nodes_list):
-    """Validate and fix node structure, ensuring Decision nodes have proper branches.
-    
-    IMPORTANT: Preserves existing branch structure when valid. Only creates default
-    branches when none exist or when branches are malformed.
-    """
-    if not isinstance(nodes_list, list): return []
-    validated = []
-    n = len(nodes_list)
-    
-    for i, node in enumerate(nodes_list):
-        if not isinstance(node, dict): continue
-        # Ensure required fields
-        if 'id' not in node or not node['id']: 
-            node['id'] = f"{node.get('type', 'P')[0].upper()}{i+1}"
-        if 'type' not in node: 
-            node['type'] = 'Process'
-        if 'label' not in node or not node.get('label'):
-            node['label'] = f"Step {i+1}"
-        
-        # Clean up label text - remove literal \n, collapse whitespace
-        label = str(node.get('label', ''))
-        # Remove literal backslash-n sequences (from AI generation)
-        label = label.replace('\\n', ' ').replace('\n', ' ')
-        # Collapse multiple spaces
-        import re
-        label = re.sub(r'\s+', ' ', label).strip()
-        node['label'] = label
-        
-        # Also clean notes field if present
-        for notes_field in ['notes', 'detail']:
-            if notes_field in node and node[notes_field]:
-                notes = str(node[notes_field])
-                notes = notes.replace('\\n', ' ').replace('\n', ' ')
-                notes = re.sub(r'\s+', ' ', notes).strip()
-                node[notes_field] = notes
-        
-        # Validate Decision nodes have branches - PRESERVE existing valid branches
-        if node['type'] == 'Decision':
-            existing_branches = node.get('branches', [])
-            
-            # Check if existing branches are valid
-            valid_branches = []
-            if isinstance(existing_branches, list):
-                for branch in existing_branches:
-                    if isinstance(branch, dict):
-                        target = branch.get('target')
-                        # Check if target is valid (numeric and in range)
-                        if isinstance(target, (int, float)) and 0 <= int(target) < n:
-                            # Keep this branch, just ensure it has a label
-                            if 'label' not in branch or not branch.get('label'):
-                                branch['label'] = 'Option'
-                            valid_branches.append(branch)
-                        elif isinstance(target, (int, float)):
-                            # Target out of range - clamp it
-                            branch['target'] = max(0, min(int(target), n - 1))
-                            if 'label' not in branch or not branch.get('label'):
-                                branch['label'] = 'Option'
-                            valid_branches.append(branch)
-            
-            if len(valid_branches) >= 2:
-                # Keep the existing valid branches - PRESERVE branching logic
-                node['branches'] = valid_branches
-            elif len(valid_branches) == 1:
-                # Only one valid branch - try to find another appropriate target
-                existing_target = int(valid_branches[0].get('target', i + 1))
-                # Find an End node or another branch point
-                alt_targets = []
-                for j in range(i + 1, n):
-                    if j != existing_target:
-                        alt_targets.append(j)
-                if alt_targets:
-                    alt_idx = alt_targets[0]  # Use first available alternative
-                    node['branches'] = valid_branches + [{'label': 'No', 'target': alt_idx}]
-                else:
-                    # No alternative found, create default
-                    node['branches'] = valid_branches + [{'label': 'No', 'target': min(i + 1, n - 1)}]
-            else:
-                # No valid branches - create default divergent branches
-                # Look for End nodes to create meaningful branches
-                end_nodes = [j for j in range(i + 1, n) if nodes_list[j].get('type') == 'End']
-                
-                if len(end_nodes) >= 2:
-                    # Branch to different End nodes
-                    node['branches'] = [
-                        {'label': 'Yes', 'target': end_nodes[0]}, 
-                        {'label': 'No', 'target': end_nodes[1]}
-                    ]
-                elif len(end_nodes) == 1 and i + 1 < n and i + 1 != end_nodes[0]:
-                    # Branch to next node and End node
-                    node['branches'] = [
-                        {'label': 'Yes', 'target': i + 1}, 
-                        {'label': 'No', 'target': end_nodes[0]}
-                    ]
-                else:
-                    # Fallback: sequential branches (less ideal but functional)
-                    next_idx = min(i + 1, n - 1)
-                    alt_idx = min(i + 2, n - 1) if i + 2 < n else next_idx
-                    node['branches'] = [
-                        {'label': 'Yes', 'target': next_idx}, 
-                        {'label': 'No', 'target': alt_idx}
-                    ]
-        
-        validated.append(node)
-    return validated
-
-def validate_pathway_flow(nodes_list):
+def validate_pathway_flow(nodes_list, index=None):
     """
     Validate pathway for common flow issues:
     - Unreachable nodes (orphaned)
     - Invalid branch targets
     - Missing End nodes
     - Cycles (if DAG-only enforcement needed)
+
+    Reachability follows the rendered edges (pathway_graph) from the Start
+    node. Pass a prebuilt GraphIndex to share one analysis across validators.
     Returns: (is_valid, issues_list)
     """
     if not isinstance(nodes_list, list) or len(nodes_list) == 0:
@@ -1954,49 +2024,45 @@ def validate_pathway_flow(nodes_list):
     
     issues = []
     n = len(nodes_list)
-    reachable = set([0])  # Start node is always index 0
+    index = index or GraphIndex(nodes_list)
     
-    # Build reachability graph
     for i, node in enumerate(nodes_list):
         if not isinstance(node, dict):
             issues.append(f"Node {i}: Invalid node structure")
             continue
         
-        node_type = node.get('type', 'Process')
-        
-        if node_type == 'Decision':
+        if node.get('type', 'Process') == 'Decision':
             branches = node.get('branches', [])
             if not branches:
                 issues.append(f"Node {i} ({node.get('label', 'N/A')}): Decision node has no branches")
             for branch in branches:
+                if not isinstance(branch, dict):
+                    issues.append(f"Node {i}: Branch has invalid structure: {branch}")
+                    continue
                 target = branch.get('target')
                 if not isinstance(target, (int, float)):
                     issues.append(f"Node {i}: Branch '{branch.get('label', 'N/A')}' has invalid target: {target}")
                 elif not (0 <= int(target) < n):
                     issues.append(f"Node {i}: Branch '{branch.get('label', 'N/A')}' points to out-of-bounds index: {target}")
-                else:
-                    reachable.add(int(target))
-        elif i + 1 < n:
-            # Non-decision nodes implicitly connect to next node
-            reachable.add(i + 1)
     
     # Check for unreachable nodes (except End nodes which are terminal)
     unreachable = []
-    for i, node in enumerate(nodes_list):
-        if i not in reachable and node.get('type') != 'End':
+    for i in index.unreachable():
+        node = index.node(i)
+        if node.get('type') != 'End':
             unreachable.append(f"Node {i} ({node.get('label', 'N/A')})")
     
     if unreachable:
         issues.append(f"Unreachable nodes: {', '.join(unreachable)}")
     
     # Check for at least one End node
-    has_end = any(node.get('type') == 'End' for node in nodes_list)
+    has_end = any(index.node_type(i) == 'End' for i in range(n))
     if not has_end:
         issues.append("Pathway has no End nodes")
     
     # Check for Start node
-    if nodes_list[0].get('type') != 'Start':
-        issues.append(f"First node should be Start, found: {nodes_list[0].get('type')}")
+    if index.node(0).get('type') != 'Start':
+        issues.append(f"First node should be Start, found: {index.node(0).get('type')}")
     
     return len(issues) == 0, issues
 
@@ -2135,9 +2201,10 @@ def normalize_or_logic(nodes_list):
     
     return final_result
 
-def assess_clinical_complexity(nodes_list):
+def assess_clinical_complexity(nodes_list, index=None):
     """
     Assess whether a pathway has appropriate clinical complexity per decision science standards.
+    An optional prebuilt GraphIndex avoids re-deriving branch targets.
     
     Returns: dict with complexity metrics
     {
@@ -2207,13 +2274,14 @@ def assess_clinical_complexity(nodes_list):
     
     # Assess divergence: check if Decision nodes lead to distinct downstream paths
     divergent_decisions = 0
-    for i, node in enumerate(nodes_list):
-        if not isinstance(node, dict) or node.get('type') != 'Decision':
+    index = index or GraphIndex(nodes_list)
+    for i in range(index.n):
+        if index.node_type(i) != 'Decision':
             continue
-        branches = node.get('branches', [])
+        branches = index.node(i).get('branches', [])
         if len(branches) >= 2:
             # Check if branches lead to truly different sequences (not immediate reconvergence)
-            branch_targets = [b.get('target') for b in branches if isinstance(b.get('target'), (int, float))]
+            branch_targets = index.branch_targets(i)
             if len(set(branch_targets)) == len(branch_targets):  # All unique targets
                 divergent_decisions += 1
     
@@ -2248,9 +2316,11 @@ def assess_clinical_complexity(nodes_list):
     
     return metrics
 
-def assess_decision_science_integrity(nodes_list):
+def assess_decision_science_integrity(nodes_list, index=None):
     """
     Assess whether pathway follows decision science best practices per Medical Decision Analysis framework.
+    Cycle detection uses the (optionally prebuilt) GraphIndex, so it is
+    iterative and linear in pathway size.
     
     Returns: dict with integrity metrics and violations
     {
@@ -2274,32 +2344,9 @@ def assess_decision_science_integrity(nodes_list):
         'violations': []
     }
     
-    # Check for cycles (simple reachability check)
-    visited = set()
-    def has_cycle(node_idx, path):
-        if node_idx in path:
-            return True
-        if node_idx in visited:
-            return False
-        visited.add(node_idx)
-        path.add(node_idx)
-        
-        node = nodes_list[node_idx] if 0 <= node_idx < len(nodes_list) else None
-        if not node or not isinstance(node, dict):
-            return False
-        
-        if node.get('type') == 'Decision':
-            for branch in node.get('branches', []):
-                target = branch.get('target')
-                if isinstance(target, (int, float)) and has_cycle(int(target), path.copy()):
-                    return True
-        elif node_idx + 1 < len(nodes_list):
-            if has_cycle(node_idx + 1, path.copy()):
-                return True
-        
-        return False
-    
-    if has_cycle(0, set()):
+    # Check for cycles along the rendered edges
+    index = index or GraphIndex(nodes_list)
+    if index.has_cycle:
         integrity['is_dag'] = False
         integrity['violations'].append('🔄 Cycle detected: pathway has backward loops')
     
@@ -2350,11 +2397,13 @@ def assess_decision_science_integrity(nodes_list):
 def validate_decision_science_pathway(nodes_list):
     """
     Comprehensive validation: combines complexity assessment and integrity check.
+    Builds the graph index once and shares it across all three checks.
     Returns: dict with detailed diagnostic info
     """
-    complexity = assess_clinical_complexity(nodes_list)
-    integrity = assess_decision_science_integrity(nodes_list)
-    flow_valid, flow_issues = validate_pathway_flow(nodes_list)
+    index = GraphIndex(nodes_list) if isinstance(nodes_list, list) and nodes_list else None
+    complexity = assess_clinical_complexity(nodes_list, index=index)
+    integrity = assess_decision_science_integrity(nodes_list, index=index)
+    flow_valid, flow_issues = validate_pathway_flow(nodes_list, index=index)
     
     return {
         'complexity': complexity,
@@ -2371,33 +2420,22 @@ def validate_decision_science_pathway(nodes_list):
         ]) / 6
     }
 
-def _escape_mermaid_text(text, max_length=60):
-    """Escape text for Mermaid compatibility.
-    
-    Mermaid is sensitive to quotes, parentheses, brackets, angle brackets,
-    curly braces, pipe characters, and hash symbols inside labels.
-    """
-    if not text:
-        return "Step"
-    text = str(text).replace('"', "'").replace('\n', ' ').replace('\\n', ' ')
-    # Characters that break Mermaid syntax inside quoted labels
-    # IMPORTANT: & must be escaped FIRST to &amp; so subsequent &#xx; entities stay intact
-    text = text.replace('&', '&amp;')
-    text = text.replace('#', '&#35;')
-    text = text.replace('<', '&lt;')
-    text = text.replace('>', '&gt;')
-    # Pipe chars break edge-label syntax -->|"..."|  
-    text = text.replace('|', '&#124;')
-    # Collapse whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    if len(text) > max_length:
-        text = text[:max_length - 3] + "..."
-    return text
+def set_pathway_nodes(nodes, label=""):
+    """Replace the Phase 3 node list and record it as a pathway version (no-op if unchanged)."""
+    st.session_state.data['phase3']['nodes'] = nodes
+    if "pathway_versions" not in st.session_state:
+        st.session_state.pathway_versions = VersionStore()
+    st.session_state.pathway_versions.commit(nodes, label)
+
+def _pathway_ir(nodes, orientation="TD"):
+    """Compiled diagram IR for a node list (hardened, memoized by content)."""
+    return compile_pathway(nodes or [], orientation, role_colors=ROLE_COLORS, prepare=harden_nodes)
 
 def generate_mermaid_code(nodes, orientation="TD"):
     """
     Generate Mermaid flowchart code from pathway nodes.
-    Uses pathway_generator module if available, otherwise builds inline.
+    Shares one compiled IR with the DOT and Graphviz exporters, so every
+    format draws the same hardened graph.
     
     Args:
         nodes: List of pathway node dictionaries
@@ -2406,174 +2444,12 @@ def generate_mermaid_code(nodes, orientation="TD"):
     Returns:
         Mermaid diagram source code string
     """
-    if PATHWAY_GENERATOR_AVAILABLE:
-        try:
-            return create_mermaid_from_nodes(nodes, include_styling=True)
-        except Exception as e:
-            debug_log(f"Mermaid generation error: {e}")
-    
-    # Inline fallback — produce valid Mermaid without pathway_generator
     if not nodes:
         return "graph TD\n    NoNodes[No pathway nodes defined]"
-    
-    valid_nodes = harden_nodes(nodes)
-    lines = [f"graph {orientation}"]
-    
-    for i, n in enumerate(valid_nodes):
-        nid = f"N{i}"
-        label = _escape_mermaid_text(n.get('label', f'Step {i}'), max_length=120)
-        ntype = n.get('type', 'Process')
-        if ntype in ('Start', 'End'):
-            lines.append(f'    {nid}(["{label}"])')
-        elif ntype == 'Decision':
-            lines.append(f'    {nid}{{"{label}"}}')
-        else:
-            lines.append(f'    {nid}["{label}"]')
-    
-    lines.append("")
-    # Use branch-aware edge computation (same logic as Graphviz)
-    computed_edges = _compute_edges(valid_nodes)
-    for src_idx, dst_idx, lbl in computed_edges:
-        src = f"N{src_idx}"
-        dst = f"N{dst_idx}"
-        safe_lbl = _escape_mermaid_text(lbl, max_length=35) if lbl else ''
-        if safe_lbl:
-            lines.append(f'    {src} -->|"{safe_lbl}"| {dst}')
-        else:
-            lines.append(f'    {src} --> {dst}')
-    
-    return "\n".join(lines)
+    return emit_mermaid(_pathway_ir(nodes, orientation))
 
 # --- GRAPH EXPORT HELPERS (Graphviz/DOT) ---
 
-def _compute_edges(nodes):
-    """
-    Compute edges for a pathway graph, properly handling Decision branches
-    and sequential flow without creating spurious cross-branch edges.
-
-    Key logic:
-    - Decision nodes: use explicit branch targets with labels
-    - End nodes: no outgoing edges (terminal)
-    - Process/Start with explicit 'target': use that target
-    - Process/Start inside a branch region: flow sequentially within the
-      branch, and the LAST node in each branch connects to the
-      reconvergence point (first node after all branch targets)
-    - Process/Start not in any branch region: sequential to next node
-
-    Returns: list of (src_idx, dst_idx, label_str) tuples
-    """
-    if not nodes:
-        return []
-
-    n = len(nodes)
-    edges = []
-
-    # --- Step 1: Build decision-branch structure ---
-    # decision_idx -> sorted list of forward target indices
-    decision_targets = {}
-    for i, node in enumerate(nodes):
-        if node.get('type') == 'Decision' and node.get('branches'):
-            fwd = []
-            for b in node.get('branches', []):
-                t = b.get('target')
-                if isinstance(t, (int, float)) and 0 <= int(t) < n:
-                    fwd.append(int(t))
-            if fwd:
-                decision_targets[i] = sorted(fwd)
-
-    # --- Step 2: Compute branch regions ---
-    # For each decision with >=2 forward targets, define contiguous regions:
-    #   branch_k region = [target_k, target_{k+1} - 1]
-    #   last branch region = [target_last, reconverge - 1]
-    #   reconverge = max(targets) + 1
-    # branch_region_of[node_idx] = (region_end, reconverge)
-    branch_region_of = {}
-
-    for dec_idx, sorted_tgts in decision_targets.items():
-        # Only handle forward targets past the decision node
-        fwd_tgts = sorted([t for t in sorted_tgts if t > dec_idx])
-        if len(fwd_tgts) < 2:
-            continue
-
-        reconverge = max(fwd_tgts) + 1
-        for b_idx, tgt in enumerate(fwd_tgts):
-            if b_idx + 1 < len(fwd_tgts):
-                region_end = fwd_tgts[b_idx + 1] - 1
-            else:
-                region_end = reconverge - 1
-
-            for node_idx in range(tgt, min(region_end + 1, n)):
-                # Don't overwrite inner decision regions
-                if node_idx not in branch_region_of:
-                    branch_region_of[node_idx] = (region_end, reconverge)
-
-    # --- Step 3: Generate edges ---
-    for i, node in enumerate(nodes):
-        ntype = node.get('type', 'Process')
-
-        if ntype == 'Decision' and node.get('branches'):
-            for b in node.get('branches', []):
-                t = b.get('target')
-                lbl = b.get('label', '')
-                if isinstance(t, (int, float)) and 0 <= int(t) < n:
-                    edges.append((i, int(t), lbl))
-
-        elif ntype == 'End':
-            pass  # Terminal
-
-        else:
-            explicit = node.get('target')
-            if explicit is not None and isinstance(explicit, (int, float)):
-                target_idx = int(explicit)
-                if 0 <= target_idx < n:
-                    edges.append((i, target_idx, ''))
-            elif i in branch_region_of:
-                region_end, reconverge = branch_region_of[i]
-                if i == region_end:
-                    # Last node in this branch -> connect to reconvergence
-                    if reconverge < n:
-                        edges.append((i, reconverge, ''))
-                    else:
-                        # Reconvergence beyond array — connect to nearest End node or next node
-                        end_indices = [j for j in range(i + 1, n) if nodes[j].get('type') == 'End']
-                        if end_indices:
-                            edges.append((i, end_indices[0], ''))
-                        elif i + 1 < n:
-                            edges.append((i, i + 1, ''))
-                elif i + 1 < n:
-                    edges.append((i, i + 1, ''))  # Sequential within branch
-            elif i + 1 < n:
-                edges.append((i, i + 1, ''))  # Normal sequential
-
-    return edges
-
-
-def _escape_label(text: str) -> str:
-    if text is None:
-        return ""
-    # Escape quotes and backslashes for DOT labels
-    # Note: \n in DOT is the line break character, don't double-escape it
-    s = str(text).replace("\\", "\\\\").replace('"', "'")
-    # Convert actual newlines to graphviz newlines
-    s = s.replace("\n", "\\n")
-    return s
-
-def _wrap_label(text: str, width: int = 22, max_width: int = None) -> str:
-    if not text:
-        return ""
-    # Clean up any literal \n sequences before wrapping
-    clean_text = str(text).replace('\\n', ' ').replace('\n', ' ')
-    # Collapse multiple spaces
-    import re
-    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-    wrapped = textwrap.wrap(clean_text, width=max_width or width)
-    return "\n".join(wrapped) if wrapped else clean_text
-
-def _role_fill(role: str, default_fill: str) -> str:
-    if not role:
-        return default_fill
-    return ROLE_COLORS.get(role, ROLE_COLORS.get(str(role).title(), default_fill))
-
 def dot_from_nodes(nodes, orientation="TD") -> str:
     """Generate Graphviz DOT source from pathway nodes with clean decision tree layout.
     
@@ -2586,149 +2462,12 @@ def dot_from_nodes(nodes, orientation="TD") -> str:
     """
     if not nodes:
         return "digraph G {\n  // No nodes\n}"
-    valid_nodes = harden_nodes(nodes)
-    
-    # Identify special nodes for layout control
-    start_node_idx = None
-    end_node_indices = []
-    decision_node_indices = []
-    
-    for i, n in enumerate(valid_nodes):
-        ntype = n.get('type', 'Process')
-        if ntype == 'Start' and start_node_idx is None:
-            start_node_idx = i
-        elif ntype == 'End':
-            end_node_indices.append(i)
-        elif ntype == 'Decision':
-            decision_node_indices.append(i)
-    
-    rankdir = 'TB' if orientation == 'TD' else 'LR'
-    
-    # Build DOT with graph attributes for clean decision tree layout
-    lines = [
-        "digraph G {",
-        f"  rankdir={rankdir};",
-        "  splines=polyline;",  # Polyline edges (ortho doesn't support edge labels)
-        "  nodesep=0.8;",   # Horizontal spacing between nodes
-        "  ranksep=1.0;",   # Vertical spacing between ranks
-        "  node [fontname=Helvetica, fontsize=11];",
-        "  edge [fontname=Helvetica, fontsize=10];",
-    ]
-    
-    node_id_map = {}
-    notes_list = []  # Collect notes for numbered legend
-    notes_node_map = {}  # Map node index to note number
-    
-    # First pass: identify all nodes with notes and assign note numbers
-    note_counter = 1
-    for i, n in enumerate(valid_nodes):
-        notes_text = n.get('notes', '') or n.get('detail', '')
-        if notes_text and str(notes_text).strip():
-            notes_list.append((note_counter, str(notes_text).strip()))
-            notes_node_map[i] = note_counter
-            note_counter += 1
-    
-    # Create all nodes WITHOUT swimlane clustering (cleaner layout)
-    for i, n in enumerate(valid_nodes):
-        nid = f"N{i}"
-        node_id_map[i] = nid
-        
-        # Build label
-        raw_label = n.get('label', 'Step')
-        raw_label = str(raw_label).replace('\\n', ' ').replace('\n', ' ')
-        wrapped_label = _wrap_label(raw_label, width=25)  # Slightly wider for readability
-        
-        # Add note reference if applicable
-        if i in notes_node_map:
-            wrapped_label = wrapped_label + f"\n(Note {notes_node_map[i]})"
-        
-        full_label = _escape_label(wrapped_label)
-        ntype = n.get('type', 'Process')
-        
-        # Node styling based on type
-        if ntype == 'Decision':
-            shape, fill = 'diamond', '#F8CECC'  # Red/pink for decisions
-        elif ntype == 'Start':
-            shape, fill = 'oval', '#D5E8D4'  # Green for start
-        elif ntype == 'End':
-            shape, fill = 'oval', '#D5E8D4'  # Green for end
-        elif ntype == 'Reevaluation':
-            shape, fill = 'box', '#FFCC80'  # Orange for reevaluation
-        else:  # Process
-            shape, fill = 'box', '#FFF2CC'  # Yellow for process
-        
-        # Apply role-based coloring if role is specified
-        role = n.get('role', '')
-        if role:
-            fill = _role_fill(role, fill)
-        
-        lines.append(f'  {nid} [label="{full_label}", shape={shape}, style=filled, fillcolor="{fill}"];')
-    
-    lines.append("")
-    
-    # LAYOUT CONSTRAINTS for proper decision tree structure
-    # 1. Start node at source rank (top)
-    if start_node_idx is not None:
-        start_nid = node_id_map.get(start_node_idx)
-        if start_nid:
-            lines.append(f"  {{ rank=source; {start_nid}; }}")
-    
-    # 2. End nodes at sink rank (bottom)
-    if end_node_indices:
-        end_nids = [node_id_map.get(i) for i in end_node_indices if node_id_map.get(i)]
-        if end_nids:
-            lines.append(f"  {{ rank=sink; {'; '.join(end_nids)}; }}")
-    
-    # 3. Group Decision nodes with their immediate branches for better alignment
-    for dec_idx in decision_node_indices:
-        dec_node = valid_nodes[dec_idx]
-        branches = dec_node.get('branches', [])
-        if len(branches) >= 2:
-            # Get target nodes for each branch
-            branch_targets = []
-            for b in branches:
-                t = b.get('target')
-                if isinstance(t, (int, float)) and 0 <= int(t) < len(valid_nodes):
-                    target_nid = node_id_map.get(int(t))
-                    if target_nid:
-                        branch_targets.append(target_nid)
-            # Put branch targets at same rank for proper side-by-side branching
-            if len(branch_targets) >= 2:
-                lines.append(f"  {{ rank=same; {'; '.join(branch_targets)}; }}")
-    
-    lines.append("")
-    
-    # Add notes legend at the bottom
-    if notes_list:
-        legend_lines = ["NOTES:"]
-        for note_num, note_text in notes_list:
-            wrapped_note = _wrap_label(note_text, max_width=60)
-            legend_lines.append(f"[{note_num}] {wrapped_note}")
-        legend_text = _escape_label("\n".join(legend_lines))
-        lines.append(f'  NotesLegend [label="{legend_text}", shape=box, style=filled, fillcolor="#B3D9FF", fontsize=10];')
-        lines.append("  { rank=max; NotesLegend; }")
-    
-    lines.append("")
-    
-    # EDGES - Use branch-aware edge computation for correct decision trees
-    computed_edges = _compute_edges(valid_nodes)
-    for src_idx, dst_idx, lbl in computed_edges:
-        src = node_id_map.get(src_idx)
-        dst = node_id_map.get(dst_idx)
-        if src and dst:
-            escaped_lbl = _escape_label(lbl) if lbl else ''
-            if escaped_lbl:
-                lines.append(f'  {src} -> {dst} [label="{escaped_lbl}"];')
-            else:
-                lines.append(f'  {src} -> {dst};')
-    
-    lines.append("}")
-    return "\n".join(lines)
+    return emit_dot(_pathway_ir(nodes, orientation))
 
 def build_graphviz_from_nodes(nodes, orientation="TD"):
     """Build a graphviz.Digraph from nodes with clean decision tree layout.
     
-    LAYOUT PRINCIPLES (same as dot_from_nodes):
+    LAYOUT PRINCIPLES (same as dot_from_nodes, from the same compiled IR):
     1. Start node at top (rank=source)
     2. Clear top-to-bottom flow
     3. Decision nodes create true branching with distinct paths
@@ -2737,148 +2476,158 @@ def build_graphviz_from_nodes(nodes, orientation="TD"):
     """
     if graphviz is None:
         return None
-    valid_nodes = harden_nodes(nodes or [])
-    
-    # Identify special nodes for layout control
-    start_node_idx = None
-    end_node_indices = []
-    decision_node_indices = []
-    
-    for i, n in enumerate(valid_nodes):
-        ntype = n.get('type', 'Process')
-        if ntype == 'Start' and start_node_idx is None:
-            start_node_idx = i
-        elif ntype == 'End':
-            end_node_indices.append(i)
-        elif ntype == 'Decision':
-            decision_node_indices.append(i)
-    
-    rankdir = 'TB' if orientation == 'TD' else 'LR'
-    
-    g = graphviz.Digraph(format='svg')
-    g.attr(rankdir=rankdir)
-    g.attr(splines='polyline')    # Polyline edges (ortho doesn't support edge labels)
-    g.attr(nodesep='0.8')        # Horizontal spacing
-    g.attr(ranksep='1.0')        # Vertical spacing
-    g.attr('node', fontname='Helvetica', fontsize='11')
-    g.attr('edge', fontname='Helvetica', fontsize='10')
-    
-    node_id_map = {}
-    notes_list = []
-    notes_node_map = {}
-    
-    # First pass: identify all nodes with notes
-    note_counter = 1
-    for i, n in enumerate(valid_nodes):
-        notes_text = n.get('notes', '') or n.get('detail', '')
-        if notes_text and str(notes_text).strip():
-            notes_list.append((note_counter, str(notes_text).strip()))
-            notes_node_map[i] = note_counter
-            note_counter += 1
-    
-    # Create all nodes WITHOUT swimlane clustering
-    for i, n in enumerate(valid_nodes):
-        nid = f"N{i}"
-        node_id_map[i] = nid
-        
-        raw_label = n.get('label', 'Step')
-        raw_label = str(raw_label).replace('\\n', ' ').replace('\n', ' ')
-        wrapped_label = _wrap_label(raw_label, width=25)
-        
-        if i in notes_node_map:
-            wrapped_label = wrapped_label + f"\n(Note {notes_node_map[i]})"
-        
-        full_label = _escape_label(wrapped_label)
-        ntype = n.get('type', 'Process')
-        
-        if ntype == 'Decision':
-            shape, fill = 'diamond', '#F8CECC'
-        elif ntype == 'Start':
-            shape, fill = 'oval', '#D5E8D4'
-        elif ntype == 'End':
-            shape, fill = 'oval', '#D5E8D4'
-        elif ntype == 'Reevaluation':
-            shape, fill = 'box', '#FFCC80'
-        else:
-            shape, fill = 'box', '#FFF2CC'
-        
-        role = n.get('role', '')
-        if role:
-            fill = _role_fill(role, fill)
-        
-        g.node(nid, full_label, shape=shape, style='filled', fillcolor=fill)
-    
-    # LAYOUT CONSTRAINTS
-    # 1. Start node at source rank
-    if start_node_idx is not None:
-        start_nid = node_id_map.get(start_node_idx)
-        if start_nid:
-            with g.subgraph() as s:
-                s.attr(rank='source')
-                s.node(start_nid)
-    
-    # 2. End nodes at sink rank
-    if end_node_indices:
-        with g.subgraph() as s:
-            s.attr(rank='sink')
-            for end_idx in end_node_indices:
-                end_nid = node_id_map.get(end_idx)
-                if end_nid:
-                    s.node(end_nid)
-    
-    # 3. Group Decision branch targets at same rank for side-by-side branching
-    for dec_idx in decision_node_indices:
-        dec_node = valid_nodes[dec_idx]
-        branches = dec_node.get('branches', [])
-        if len(branches) >= 2:
-            branch_targets = []
-            for b in branches:
-                t = b.get('target')
-                if isinstance(t, (int, float)) and 0 <= int(t) < len(valid_nodes):
-                    target_nid = node_id_map.get(int(t))
-                    if target_nid:
-                        branch_targets.append(target_nid)
-            if len(branch_targets) >= 2:
-                with g.subgraph() as s:
-                    s.attr(rank='same')
-                    for tnid in branch_targets:
-                        s.node(tnid)
-    
-    # Add notes legend
-    if notes_list:
-        legend_lines = ["NOTES:"]
-        for note_num, note_text in notes_list:
-            wrapped_note = _wrap_label(note_text, max_width=60)
-            legend_lines.append(f"[{note_num}] {wrapped_note}")
-        legend_text = _escape_label("\n".join(legend_lines))
-        g.node('NotesLegend', legend_text, shape='box', style='filled', fillcolor='#B3D9FF', fontsize='10')
-        with g.subgraph() as s:
-            s.attr(rank='max')
-            s.node('NotesLegend')
-    
-    # EDGES - Use branch-aware edge computation for correct decision trees
-    computed_edges = _compute_edges(valid_nodes)
-    for src_idx, dst_idx, lbl in computed_edges:
-        src = node_id_map.get(src_idx)
-        dst = node_id_map.get(dst_idx)
-        if src and dst:
-            escaped_lbl = _escape_label(lbl) if lbl else ''
-            if escaped_lbl:
-                g.edge(src, dst, label=escaped_lbl)
-            else:
-                g.edge(src, dst)
-    
-    return g
+    return emit_graphviz(_pathway_ir(nodes, orientation))
 
 def render_graphviz_bytes(graph, fmt="svg"):
-    """Render a graphviz.Digraph to bytes if possible, else return None."""
+    """Render a graphviz.Digraph to bytes if possible, else return None.
+
+    Goes through the shared render farm, so a diagram already rendered
+    (e.g. by Phase 4's background export job) is returned from cache.
+    """
     if graphviz is None or graph is None:
         return None
     try:
-        return graph.pipe(format=fmt)
+        return get_render_farm().render(graph.source, fmt, engine=graph.engine)
     except Exception:
         return None
 
+def get_pathway_export(nodes, fmt="svg", orientation="TD"):
+    """Rendered diagram bytes for a node list, shared with Phase 4 via the diagram cache."""
+    diagrams = get_diagram_cache()
+    sig = diagram_key(nodes, orientation)
+    data = diagrams.get(sig, fmt)
+    if data is None:
+        g = build_graphviz_from_nodes(nodes, orientation)
+        data = render_graphviz_bytes(g, fmt) if g else None
+        if data is None and fmt == "svg":
+            # No graphviz/dot, or dot failed or timed out: lay the diagram out in-process
+            data = render_fallback_svg(_pathway_ir(nodes, orientation))
+        diagrams.put(sig, fmt, data)
+    return data
+
+_EXPORT_DOWNLOADS = {
+    "svg": ("📊 Download SVG", "image/svg+xml", "High-quality vector graphic for presentations and email"),
+    "png": ("🖼️ Download PNG", "image/png", "Raster image for slides and documents"),
+    "pdf": ("🖨️ Download PDF", "application/pdf", "Print-ready diagram for pathway packets"),
+}
+
+def _render_export_downloads(export_job, fallback_svg=None):
+    """Download buttons for background-rendered exports; polls until the job finishes.
+
+    fallback_svg is offered when Graphviz is unavailable or its SVG render failed.
+    """
+    if export_job is None:
+        if fallback_svg:
+            label, mime, help_text = _EXPORT_DOWNLOADS["svg"]
+            st.download_button(label, fallback_svg, file_name="pathway.svg", mime=mime,
+                               help=help_text, width='stretch', key="p4_dl_svg")
+        return
+
+    pending = not export_job.done()
+
+    def _downloads():
+        if not export_job.done():
+            st.caption("⏳ Rendering SVG, PNG and PDF exports…")
+            return
+        if pending:
+            st.rerun()  # Finished while polling: refresh once so the page stops polling
+        for fmt, data in export_job.result().items():
+            if fmt == "svg" and not data:
+                data = fallback_svg
+            if not data:
+                continue
+            label, mime, help_text = _EXPORT_DOWNLOADS[fmt]
+            st.download_button(label, data, file_name=f"pathway.{fmt}", mime=mime,
+                               help=help_text, width='stretch', key=f"p4_dl_{fmt}")
+
+    # Re-run only this fragment while rendering, so the rest of the page stays interactive
+    st.fragment(_downloads, run_every=1.0 if pending else None)()
+
+def _render_pathway_chart(nodes, dot_code, orientation="TD"):
+    """Draw the pathway; large pathways get a cluster overview plus one sub-pathway at a time."""
+    if not needs_scale_mode(nodes):
+        st.graphviz_chart(dot_code, width='stretch')
+        return
+    plan = compile_scale_plan(nodes, orientation, role_colors=ROLE_COLORS, prepare=harden_nodes)
+    diagrams = get_diagram_cache()
+    st.caption(f"🗂️ Scale mode: {len(plan.ir.nodes)} steps grouped into {len(plan.clusters)} sub-pathways. "
+               "Pick one below to see its steps.")
+    overview = diagrams.get_or_build(diagram_key(nodes, orientation), "overview_dot",
+                                     lambda: emit_overview_dot(plan))
+    st.graphviz_chart(overview, width='stretch')
+    choice = st.selectbox(
+        "Sub-pathway",
+        options=range(len(plan.clusters)),
+        format_func=lambda k: plan.clusters[k].title,
+        key="p4_scale_cluster"
+    )
+    if choice is None or choice >= len(plan.clusters):
+        choice = 0
+    cluster = plan.clusters[choice]
+    # Keyed by the cluster's own content, so edits elsewhere leave it cached
+    cluster_dot = diagrams.get_or_build(cluster.key, "cluster_dot", lambda: emit_cluster_dot(plan, choice))
+    st.graphviz_chart(cluster_dot, width='stretch')
+
+# Phase 5 deliverables: job kind -> phase5 field holding the finished result
+_P5_RESULT_FIELDS = {"expert": "expert_html", "beta": "beta_html", "edu": "edu_html", "exec": "exec_summary"}
+
+def _phase5_job_owner():
+    """Jobs belong to the project when it is persisted, otherwise to this session."""
+    if st.session_state.get("project_id"):
+        return st.session_state.project_id
+    if "p5_job_owner" not in st.session_state:
+        st.session_state.p5_job_owner = new_project_id()
+    return st.session_state.p5_job_owner
+
+def _phase5_data_snapshot():
+    """Detached copy of the project data for a worker thread."""
+    return {phase: copy.deepcopy(st.session_state.data.get(phase, {}))
+            for phase in ("phase1", "phase2", "phase3", "phase4", "phase5")}
+
+def _apply_phase5_results(jobs, cond):
+    """Copy each finished job's result into session state once."""
+    applied = st.session_state.setdefault("p5_applied_jobs", {})
+    queue = get_phase5_queue()
+    for kind, job in jobs.items():
+        if job.status != "done" or applied.get(kind) == job.id:
+            continue
+        # Persisted jobs carry no result until it is needed here
+        result = queue.result(job)
+        if result is None:
+            continue
+        applied[kind] = job.id
+        if kind == "exec":
+            st.session_state['exec_docx_bytes'] = result
+            st.session_state.data['phase5']['exec_summary'] = f"Executive Summary for {cond}"
+        else:
+            st.session_state.data['phase5'][_P5_RESULT_FIELDS[kind]] = result
+
+def _render_phase5_job_status(owner, kind, format_progress=None):
+    """Live status of one deliverable job; polls until it finishes, then refreshes the page."""
+    queue = get_phase5_queue()
+    job = queue.job(owner, kind)
+    pending = job is not None and not job.done()
+
+    def _status():
+        current = queue.job(owner, kind)
+        if current is None:
+            return
+        if not current.done():
+            st.caption(f"⏳ Generating… {current.elapsed():.0f}s")
+            if format_progress and current.progress:
+                st.markdown(format_progress(dict(current.progress)))
+            return
+        if pending:
+            st.rerun()  # Finished while polling: refresh once to apply the result
+        if current.status == "error" and st.session_state.get("p5_applied_jobs", {}).get(kind) != current.id:
+            if '429' in current.error or 'quota' in current.error.lower():
+                st.error("⏳ API rate limit. Wait 15-30 seconds and try again.")
+            else:
+                st.error(f"Error: {current.error[:100]}")
+
+    # Re-run only this fragment while the job runs, so the other deliverables stay interactive
+    st.fragment(_status, run_every=1.0 if pending else None)()
+
 def get_smart_model_cascade(requires_vision=False, requires_json=False):
     """Return prioritized list of models for Auto mode based on task requirements.
     
@@ -2887,6 +2636,8 @@ def get_smart_model_cascade(requires_vision=False, requires_json=False):
     
     Strategy: Try models from most to least sophisticated. Auto mode cascades through
     available models until quota is found. User-selected models fall back to alternatives.
+    Models whose quota breaker is open for the current API key are skipped, and models
+    with a poor recent success rate are tried last (see model_cascade.py).
     """
     # Use current models with best free-tier quotas
     # gemini-2.5-flash supports thinking natively and has generous free limits
@@ -2895,10 +2646,13 @@ def get_smart_model_cascade(requires_vision=False, requires_json=False):
     PRO = "gemini-2.5-pro"
     
     if model_choice == "Auto":
-        return [FLASH, FLASH_LITE, PRO]
+        cascade = [FLASH, FLASH_LITE, PRO]
     else:
         # Use user-selected model with intelligent fallback
-        return [model_choice, FLASH, FLASH_LITE]
+        cascade = [model_choice, FLASH, FLASH_LITE]
+    # Drop models still cooling down from a 429 and deduplicate (so hedging never races
+    # a model against itself)
+    return get_model_health().order_candidates(cascade, scope=client_scope(get_genai_client()))
 
 def get_gemini_response(
     prompt, 
@@ -2909,7 +2663,11 @@ def get_gemini_response(
     function_declaration=None,
     enable_thinking=True,
     thinking_budget=1024,
-    contents=None
+    contents=None,
+    use_cache=True,
+    hedge=None,
+    on_item=None,
+    response_schema=None
 ):
     """
     Send a prompt (with optional image) to Gemini and get a response.
@@ -2921,13 +2679,22 @@ def get_gemini_response(
     Args:
         prompt: Text prompt string
         json_mode: If True, extract JSON from response (legacy mode, prefer function_declaration)
-        stream_container: Deprecated (v1 API)
+        stream_container: Optional st.empty() placeholder; when given the response is
+            streamed (generate_content_stream) and progress is shown in it as it arrives
         image_data: Optional dict with 'mime_type' and 'data' (base64 bytes) for image
-        timeout: Seconds to wait per model before moving to next
+        timeout: Upper bound (seconds) on how long to wait for a model before hedging
         function_declaration: Optional FunctionDeclaration for native function calling
         enable_thinking: Enable thought signature validation (required for Gemini 3+ function calling)
         thinking_budget: Token budget for internal reasoning (256-4096)
         contents: Optional pre-built contents array (for file URIs, etc.)
+        use_cache: Serve byte-identical requests from the shared response cache
+        hedge: Start the next cascade model in parallel when the current one is slow
+            (None = CPQ_HEDGED_CASCADE env default, on)
+        on_item: Optional callback(index, item) for json_mode; streams the response and
+            calls it for each array element as soon as it is complete. If a model fails
+            mid-stream, the next model starts again from index 0.
+        response_schema: Optional types.Schema for json_mode; the model's JSON is
+            constrained to it (see gemini_functions.argument_schema)
     
     Returns:
         - If function_declaration provided: dict with 'function_name' and 'arguments'
@@ -2939,9 +2706,6 @@ def get_gemini_response(
         st.error("AI Error. Please check API Key.")
         return None
 
-    # Smart cascade: if image provided, prioritize vision models
-    candidates = get_smart_model_cascade(requires_vision=bool(image_data), requires_json=json_mode)
-
     # Build contents array per official API structure
     # https://ai.google.dev/gemini-api/docs/api-overview#request-body
     if contents:
@@ -2982,70 +2746,41 @@ def get_gemini_response(
         fc_kwargs["tool_config"] = types.ToolConfig(
             function_calling_config=types.FunctionCallingConfig(mode="AUTO")
         )
+    if json_mode and response_schema is not None:
+        # Constrained decoding: same output guarantees as the matching function declaration
+        fc_kwargs["response_mime_type"] = "application/json"
+        fc_kwargs["response_schema"] = response_schema
+
+    # Identical requests (same prompt, contents, model choice and config) are served from
+    # cache. The key uses the model choice, not the health-ordered candidates, so requests
+    # still hit while a quota breaker has reshuffled the cascade
+    cache = get_response_cache() if (use_cache and is_cache_enabled()) else None
+    cache_key = None
+    if cache is not None:
+        cache_key = request_fingerprint(
+            model_choice=model_choice,
+            contents=contents,
+            json_mode=json_mode,
+            function_declaration=function_declaration,
+            response_schema=response_schema,
+            enable_thinking=enable_thinking,
+            thinking_budget=thinking_budget,
+        )
+        hit, cached = cache.get(cache_key)
+        if hit:
+            debug_log(f"Response cache hit ({cache_key[:8]})")
+            if on_item and isinstance(cached, list):
+                for index, item in enumerate(cached):
+                    on_item(index, item)
+            return cached
 
-    response = None
-    last_error = None
-    skipped_models = []
-    
-    for model_name in candidates:
-        try:
-            # Build per-model config: only add thinking for models that support it
-            config_kwargs = dict(fc_kwargs)  # Start with function calling config
-            model_base = model_name.split("-preview")[0].split("-exp")[0]  # Normalize name
-            if enable_thinking and any(t in model_base for t in THINKING_MODELS):
-                config_kwargs["thinking_config"] = types.ThinkingConfig(
-                    thinking_budget=thinking_budget
-                )
-            config = types.GenerateContentConfig(**config_kwargs) if config_kwargs else None
-            
-            # Build API call arguments
-            call_kwargs = {
-                "model": model_name,
-                "contents": contents,
-            }
-            if config:
-                call_kwargs["config"] = config
-            
-            response = client.models.generate_content(**call_kwargs)
-            
-            # Check for function call response
-            if function_declaration and response and response.candidates:
-                result = extract_function_call_result(response)
-                if result:
-                    return result
-            
-            # Check if response has valid text
-            if response and hasattr(response, 'text'):
-                break
-        except Exception as e:
-            error_str = str(e)
-            last_error = error_str
-
-            # Check if error is quota exhaustion (429 RESOURCE_EXHAUSTED)
-            if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                skipped_models.append(f"{model_name} (quota)")
-            else:
-                skipped_models.append(f"{model_name} ({error_str[:60]})")
-
-            # Continue to next candidate
-            time.sleep(0.3)
-            continue
-
-    if not response:
-        # Store the last error for debugging
-        if last_error:
-            st.session_state['_last_api_error'] = last_error
-        if skipped_models:
-            st.session_state['_skipped_models'] = skipped_models
-        return None
+    # Smart cascade: if image provided, prioritize vision models
+    candidates = get_smart_model_cascade(requires_vision=bool(image_data), requires_json=json_mode)
 
-    try:
-        # Access response.text per official API
-        text = response.text if hasattr(response, 'text') else ""
-        
+    def _parse_text(text):
+        """Turn the answer text into (ok, value); shared by streamed and blocking calls."""
         if not text:
-            return None
-
+            return False, None
         if json_mode:
             # Clean markdown code blocks (legacy JSON extraction mode)
             text = text.replace('```json', '').replace('```', '').strip()
@@ -3054,14 +2789,103 @@ def get_gemini_response(
             if match:
                 text = match.group(0)
             try:
-                return json.loads(text)
+                return True, json.loads(text)
             except Exception:
-                return None
-        return text
-    except Exception:
-        st.error("AI response parsing error. Please retry.")
+                return False, None
+        return True, text
+
+    def _parse_response(response):
+        """Turn a raw response into (ok, value). Runs on cascade worker threads."""
+        # Check for function call response
+        if function_declaration and response and response.candidates:
+            result = extract_function_call_result(response)
+            if result:
+                return True, result
+        # Access response.text per official API
+        return _parse_text(response.text if (response and hasattr(response, 'text')) else "")
+
+    def _call_kwargs(model_name):
+        # Build per-model config: only add thinking for models that support it
+        config_kwargs = dict(fc_kwargs)  # Start with function calling config
+        model_base = model_name.split("-preview")[0].split("-exp")[0]  # Normalize name
+        if enable_thinking and any(t in model_base for t in THINKING_MODELS):
+            config_kwargs["thinking_config"] = types.ThinkingConfig(
+                thinking_budget=thinking_budget
+            )
+        config = types.GenerateContentConfig(**config_kwargs) if config_kwargs else None
+        
+        # Build API call arguments
+        call_kwargs = {
+            "model": model_name,
+            "contents": contents,
+        }
+        if config:
+            call_kwargs["config"] = config
+        return call_kwargs
+
+    def _attempt(model_name):
+        return _parse_response(client.models.generate_content(**_call_kwargs(model_name)))
+
+    def _show_progress(text):
+        if json_mode or function_declaration:
+            stream_container.caption(f"Receiving response… {len(text):,} characters")
+        else:
+            stream_container.markdown(text + " ▌")
+
+    def _stream_attempt(model_name):
+        # Runs on the calling thread so the callbacks may update the UI
+        parser = JSONArrayStreamParser() if (json_mode and on_item) else None
+        streamed = collect_stream(
+            client.models.generate_content_stream(**_call_kwargs(model_name)),
+            on_text=_show_progress if stream_container is not None else None,
+            parser=parser,
+            on_item=on_item,
+        )
+        # Same parsing as the blocking path, over the assembled response
+        if function_declaration:
+            for chunk in streamed.chunks:
+                result = extract_function_call_result(chunk)
+                if result:
+                    return True, result
+        return _parse_text(streamed.text)
+
+    # Latency stats are bucketed by task so pathway generation and grading don't mix
+    task = getattr(function_declaration, 'name', None) or ("json" if json_mode else "text")
+    scope = client_scope(client)
+    stream = (stream_container is not None or on_item is not None) and is_streaming_enabled()
+    if hedge is None:
+        hedge = is_hedging_enabled()
+    if stream:
+        # A stream can't be hedged without showing two answers at once
+        outcome = run_sequential(candidates, _stream_attempt, task=task, scope=scope)
+    elif hedge and len(candidates) > 1:
+        # Start the next model if the current one is slower than usual (bounded by timeout)
+        outcome = run_hedged(candidates, _attempt, task=task, max_delay=timeout, scope=scope)
+    else:
+        outcome = run_sequential(candidates, _attempt, task=task, scope=scope)
+
+    skipped_models = []
+    for model_name, error_str in outcome.failures:
+        # Check if error is quota exhaustion (429 RESOURCE_EXHAUSTED)
+        if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+            skipped_models.append(f"{model_name} (quota)")
+        else:
+            skipped_models.append(f"{model_name} ({error_str[:60]})")
+    if skipped_models:
+        st.session_state['_skipped_models'] = skipped_models
+
+    if not outcome.ok:
+        # Store the last error for debugging
+        if outcome.failures:
+            st.session_state['_last_api_error'] = outcome.failures[-1][1]
         return None
 
+    if outcome.model != candidates[0]:
+        debug_log(f"Answered by {outcome.model}")
+    if cache is not None:
+        cache.set(cache_key, outcome.value)
+    return outcome.value
+
 @st.cache_data(ttl=3600)
 def get_available_models(api_key):
     """Fetch list of available models from Gemini API.
@@ -3125,112 +2949,48 @@ def validate_ai_connection() -> bool:
             st.session_state["ai_error"] = "AI service error. Please try again."
         return False
 
+def get_pubmed():
+    """Shared PubMed client; uses NCBI_API_KEY / NCBI_EMAIL from secrets or env when set."""
+    return get_pubmed_client(api_key=_get_secret("NCBI_API_KEY"), email=_get_secret("NCBI_EMAIL"))
+
+def lookup_citations(pmids):
+    """PMID -> citation dict, read through the local PMID store (NCBI only for missing/stale)."""
+    store = get_pmid_store()
+    if store is None:
+        return get_pubmed().fetch_citations(pmids)
+    return store.fetch(get_pubmed(), pmids)
+
 @st.cache_data(ttl=3600)
-def search_pubmed(query):
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+def search_pubmed(query, retmax=None):
+    """Search PubMed; retmax defaults to CPQ_PUBMED_RETMAX (50 unless configured)."""
+    retmax = retmax or default_retmax()
     try:
-        search_params = {'db': 'pubmed', 'term': f"{query}", 'retmode': 'json', 'retmax': 50, 'sort': 'relevance'}
-        url = base_url + "esearch.fcgi?" + urllib.parse.urlencode(search_params)
-        with urllib.request.urlopen(url) as response: id_list = json.loads(response.read().decode()).get('esearchresult', {}).get('idlist', [])
-        if not id_list: return []
-        fetch_params = {'db': 'pubmed', 'id': ','.join(id_list), 'retmode': 'xml'}
-        with urllib.request.urlopen(base_url + "efetch.fcgi?" + urllib.parse.urlencode(fetch_params)) as response: root = ET.fromstring(response.read().decode())
-        citations = []
-        for article in root.findall('.//PubmedArticle'):
-            medline = article.find('MedlineCitation')
-            pmid = medline.find('PMID').text
-            title = medline.find('Article/ArticleTitle').text
-            # Authors
-            author_list = article.findall('.//Author')
-            authors_str = "Unknown"
-            if author_list:
-                authors = []
-                for auth in author_list[:3]:
-                    lname = auth.find('LastName')
-                    init = auth.find('Initials')
-                    if lname is not None and init is not None: authors.append(f"{lname.text} {init.text}")
-                authors_str = ", ".join(authors)
-                if len(author_list) > 3: authors_str += ", et al."
-            # Year
-            year_node = article.find('.//PubDate/Year')
-            year = year_node.text if year_node is not None else "N/A"
-            # Journal
-            journal = medline.find('Article/Journal/Title').text if medline.find('Article/Journal/Title') is not None else "N/A"
-            # Abstract
-            abs_node = medline.find('Article/Abstract')
-            abstract_text = " ".join([e.text for e in abs_node.findall('AbstractText') if e.text]) if abs_node is not None else "No abstract."
-            citations.append({
-                "id": pmid, "title": title, "authors": authors_str, "year": year, "journal": journal,
-                "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/", "abstract": abstract_text,
-                "grade": "Un-graded", "rationale": "Not yet evaluated."
-            })
-        return citations
+        store = get_pmid_store()
+        if store is not None:
+            citations = store.search(get_pubmed(), query, retmax=retmax, sort="relevance")
+        else:
+            citations = get_pubmed().search(query, retmax=retmax, sort="relevance")
+        return [
+            {**c, "grade": "Un-graded", "rationale": "Not yet evaluated."}
+            for c in citations
+        ]
     except Exception as e: st.error(f"PubMed Search Error: {e}"); return []
 
 def fetch_single_pmid(pmid):
     """Fetch metadata for a single PMID from PubMed. Returns evidence dict with default grade."""
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
     try:
-        # With rate limiting: respect NCBI 3 requests/second limit
-        time.sleep(0.4)
-        
-        fetch_params = {'db': 'pubmed', 'id': pmid, 'retmode': 'xml'}
-        with urllib.request.urlopen(base_url + "efetch.fcgi?" + urllib.parse.urlencode(fetch_params)) as response:
-            root = ET.fromstring(response.read().decode())
-        
-        article = root.find('.//PubmedArticle')
-        if article is None:
-            return None
-        
-        medline = article.find('MedlineCitation')
-        if medline is None:
-            return None
-        
-        pmid_elem = medline.find('PMID')
-        title_elem = medline.find('Article/ArticleTitle')
-        
-        if pmid_elem is None or title_elem is None:
-            return None
-        
-        # Authors
-        author_list = article.findall('.//Author')
-        authors_str = "Unknown"
-        if author_list:
-            authors = []
-            for auth in author_list[:3]:
-                lname = auth.find('LastName')
-                init = auth.find('Initials')
-                if lname is not None and init is not None:
-                    authors.append(f"{lname.text} {init.text}")
-            authors_str = ", ".join(authors)
-            if len(author_list) > 3:
-                authors_str += ", et al."
-        
-        # Year
-        year_node = article.find('.//PubDate/Year')
-        year = year_node.text if year_node is not None else "N/A"
-        
-        # Journal
-        journal = medline.find('Article/Journal/Title').text if medline.find('Article/Journal/Title') is not None else "N/A"
-        
-        # Abstract
-        abs_node = medline.find('Article/Abstract')
-        abstract_text = " ".join([e.text for e in abs_node.findall('AbstractText') if e.text]) if abs_node is not None else "No abstract."
-        
-        return {
-            "id": pmid_elem.text,
-            "title": title_elem.text,
-            "authors": authors_str,
-            "year": year,
-            "journal": journal,
-            "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid_elem.text}/",
-            "abstract": abstract_text,
-            "grade": "Un-graded",
-            "rationale": "Auto-added; pending review",
-            "source": "enriched_from_phase3"
-        }
+        # Rate limiting is handled by the shared client's token bucket
+        citation = lookup_citations([pmid]).get(str(pmid).strip())
     except Exception as e:
         return None
+    if not citation:
+        return None
+    return {
+        **citation,
+        "grade": "Un-graded",
+        "rationale": "Auto-added; pending review",
+        "source": "enriched_from_phase3"
+    }
 
 def extract_pmids_from_nodes(nodes):
     """Extract all unique PMIDs from pathway nodes that are not 'N/A'."""
@@ -3251,11 +3011,22 @@ def enrich_phase2_with_new_pmids(new_pmids, existing_pmids):
     if not pmids_to_add:
         return []
     
+    # Local store first, then one batched efetch for the rest
+    try:
+        found = lookup_citations(sorted(pmids_to_add))
+    except Exception:
+        return []
+    
     new_evidence = []
     for pmid in sorted(pmids_to_add):
-        evidence_entry = fetch_single_pmid(pmid)
-        if evidence_entry:
-            new_evidence.append(evidence_entry)
+        citation = found.get(str(pmid).strip())
+        if citation:
+            new_evidence.append({
+                **citation,
+                "grade": "Un-graded",
+                "rationale": "Auto-added; pending review",
+                "source": "enriched_from_phase3"
+            })
     
     return new_evidence
 
@@ -3325,15 +3096,20 @@ def initialize_chat_state():
 
 
 def save_feedback_response(rating: int, feedback_text: str, phase: str = ""):
-    """Save feedback response as JSON to data/feedback/ folder."""
+    """Append a feedback response to the feedback store (a JSON file in data/feedback/ if it can't open)."""
     import datetime
-    os.makedirs("data/feedback", exist_ok=True)
     
     # Safely get pathway condition from session state
     pathway_condition = ""
     if hasattr(st.session_state, 'data') and isinstance(st.session_state.data, dict):
         pathway_condition = st.session_state.data.get("phase1", {}).get("condition", "")
     
+    store = get_feedback_store()
+    if store is not None:
+        store.append(rating, feedback_text, phase, pathway_condition)
+        return
+    
+    os.makedirs("data/feedback", exist_ok=True)
     feedback_data = {
         "timestamp": datetime.datetime.utcnow().isoformat(),
         "rating": rating,
@@ -3353,17 +3129,18 @@ def get_carepathiq_scoped_response(user_question: str) -> str:
     Get a response from Gemini scoped strictly to CarePathIQ app questions.
     Enhanced with comprehensive knowledge of app structure, files, and capabilities.
     """
-    # Try local FAQ first (lightweight, always works)
+    # Try the local FAQ index first: confident matches need no LLM call at all
     response = get_local_faq_answer(user_question)
     if response:
         return response
     
-    # Only try AI if client is available
+    # Only try AI if client is available; otherwise offer the closest local match
     client = get_genai_client()
     if not client:
-        return "Please enter your Gemini API key in the sidebar to enable AI-powered answers."
+        return get_local_faq_answer(user_question, min_confidence=0.0, min_terms=1) or (
+            HELP_TOPICS + " Enter your Gemini API key in the sidebar to enable AI-powered answers.")
     
-    scope_constraint = """You are the CarePathIQ AI Agent - an expert assistant with complete knowledge of the CarePathIQ clinical pathway development application.
+    scope_constraint = f"""You are the CarePathIQ AI Agent - an expert assistant with complete knowledge of the CarePathIQ clinical pathway development application.
 
 **The 5 Phases in Detail:**
 
@@ -3387,63 +3164,14 @@ def get_carepathiq_scoped_response(user_question: str) -> str:
 
     response = get_gemini_response(scope_constraint)
     if not response:
-        response = get_local_faq_answer(user_question)
+        response = get_local_faq_answer(user_question, min_confidence=0.0, min_terms=1) or HELP_TOPICS
     return response or "I'm not sure how to help with that. Please ask me about features in the CarePathIQ app!"
 
 
-def get_local_faq_answer(user_question: str) -> str:
-    """Provide lightweight built-in answers when AI is unavailable."""
-    q = (user_question or "").strip().lower()
-    if "5 phases" in q or "five phases" in q or "phases" in q:
-        return (
-            "CarePathIQ has 5 phases: 1) **Define Scope** — clarify condition, context, and goals. "
-            "2) **Appraise Evidence** — gather and grade studies with structured PICO/MESH support. "
-            "3) **Build Decision Tree** — design pathway logic and branches. "
-            "4) **Design Interface** — preview and optimize using Nielsen's usability heuristics. "
-            "5) **Operationalize** — export expert forms, beta testing, education modules, and executive summary."
-        )
-    if "decision tree" in q or "phase 3" in q or "nodes" in q or "pathway" in q:
-        return (
-            "In Phase 3, add nodes (decisions, actions, outcomes), connect them to form branches, "
-            "and iterate using evidence and heuristics. Use the refinement box to request changes, "
-            "then regenerate to update the pathway structure. The AI uses Phase 1 & 2 context to build logical flows."
-        )
-    if "evidence" in q or "phase 2" in q or "pubmed" in q or "mesh" in q:
-        return (
-            "Phase 2 enables intelligent PubMed searches with AI-powered query optimization. "
-            "The system auto-generates optimized queries using MeSH terms and field tags ([tiab], [mesh]) for precise results. "
-            "Include study PMID, title, abstract, GRADE quality assessment, and relevance notes. "
-            "Features: proximity search guidance ([tiab:~N] syntax), AI query optimization, PICO framework, and CSV export. "
-            "See PubMed Search Tips in the Refine search expander for advanced techniques."
-        )
-    if "phase 5" in q or "operationalize" in q or "export" in q or "expert" in q or "beta" in q:
-        return (
-            "Phase 5 generates 4 deliverables: Expert Panel Feedback Form (HTML), Beta Testing Form (HTML), "
-            "Interactive Education Module (HTML with quizzes & certificates), and Executive Summary (Word doc). "
-            "All are standalone files with no backend—users download, share, and collect responses via CSV."
-        )
-    if "heuristics" in q or "phase 4" in q or "usability" in q or "nielsen" in q:
-        return (
-            "Phase 4 applies Nielsen's 10 Usability Heuristics to your pathway. The AI analyzes each heuristic "
-            "(visibility, error prevention, consistency, etc.) and suggests improvements. You can apply or reject "
-            "each recommendation to optimize the user experience."
-        )
-    if "api" in q or "key" in q or "gemini" in q or "model" in q:
-        return (
-            "CarePathIQ uses Google Gemini API (get free key at https://aistudio.google.com/app/apikey). "
-            "Uses gemini-2.5-flash and gemini-2.5-pro models with automatic cascade fallback. "
-            "Enter your API key in the sidebar."
-        )
-    if "files" in q or "structure" in q or "code" in q:
-        return (
-            "Main files: streamlit_app.py (4200+ lines, 5-phase workflow), phase5_helpers.py (HTML generators), "
-            "education_template.py (quiz system). Documentation: PHASE5_GUIDE.md, API_ALIGNMENT.md, README.md. "
-            "Uses Streamlit, google-genai, Graphviz, python-docx."
-        )
-    return (
-        "I can help with: the 5 phases workflow, building decision trees, evidence appraisal, "
-        "usability heuristics, Phase 5 exports, API setup, or technical structure. What would you like to know?"
-    )
+def get_local_faq_answer(user_question: str, min_confidence=None, min_terms=None):
+    """Answer from the local FAQ/guide index, or None when no match clears the confidence threshold."""
+    hit = get_faq_index().answer(user_question or "", min_confidence=min_confidence, min_terms=min_terms)
+    return hit.answer if hit else None
 
 
 def render_satisfaction_survey():
@@ -3477,78 +3205,67 @@ def load_admin_feedback_dashboard():
         return
     
     with st.expander("🔧 Admin: Feedback Dashboard", expanded=False):
-        feedback_dir = "data/feedback"
-        
-        if not os.path.exists(feedback_dir):
-            st.info("No feedback collected yet.")
+        store = get_feedback_store()
+        if store is None:
+            st.error("Feedback store is unavailable.")
             return
         
-        feedback_files = [f for f in os.listdir(feedback_dir) if f.endswith(".json")]
-        
-        if not feedback_files:
+        # Aggregates are maintained on write, so this is constant-time however many responses exist
+        summary = store.summary()
+        if not summary["count"]:
             st.info("No feedback collected yet.")
             return
         
-        st.markdown(f"**Total Responses:** {len(feedback_files)}")
+        st.markdown(f"**Total Responses:** {summary['count']}")
         
-        all_ratings = []
-        for filename in feedback_files:
-            try:
-                with open(os.path.join(feedback_dir, filename)) as f:
-                    data = json.load(f)
-                    all_ratings.append(data.get("rating", 0))
-            except Exception:
-                continue
+        if summary["mean"] is not None:
+            st.metric("Average Rating", f"{summary['mean']:.1f}/10")
         
-        if all_ratings:
-            avg_rating = sum(all_ratings) / len(all_ratings)
-            st.metric("Average Rating", f"{avg_rating:.1f}/10")
+        for title, key, breakdown in (("By phase", "Phase", summary["by_phase"]),
+                                      ("By condition", "Condition", summary["by_condition"])):
+            if len(breakdown) > 1:
+                st.caption(title)
+                st.dataframe(pd.DataFrame([
+                    {key: name or "—", "Responses": entry["count"],
+                     "Average": round(entry["mean"], 1) if entry["mean"] is not None else None}
+                    for name, entry in sorted(breakdown.items(), key=lambda kv: -kv[1]["count"])
+                ]), hide_index=True)
         
         st.markdown("### Feedback Responses")
         
-        selected_file = st.selectbox(
+        # One page at a time, newest first; "Older" pages back by id
+        before_id = st.session_state.get("feedback_before_id")
+        page = store.page(before_id=before_id)
+        if not page:
+            st.session_state.pop("feedback_before_id", None)
+            page = store.page()
+        
+        selected = st.selectbox(
             "View feedback:",
-            feedback_files,
-            format_func=lambda x: x.replace("feedback_", "").replace(".json", "")
+            page,
+            format_func=lambda r: f"{r['timestamp'][:19]} · {r['rating'] if r['rating'] is not None else '–'}/10 · {r['phase'] or '—'}"
         )
         
-        if selected_file:
-            try:
-                with open(os.path.join(feedback_dir, selected_file)) as f:
-                    feedback = json.load(f)
-                    st.json(feedback)
-            except Exception as e:
-                st.error(f"Error loading feedback: {e}")
+        if selected:
+            st.json(selected)
         
-        if st.button("Export All Feedback as CSV"):
-            import csv
-            import io
-            
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(["timestamp", "rating", "feedback", "phase", "pathway_condition"])
-            
-            for filename in feedback_files:
-                try:
-                    with open(os.path.join(feedback_dir, filename)) as f:
-                        data = json.load(f)
-                        writer.writerow([
-                            data.get("timestamp", ""),
-                            data.get("rating", ""),
-                            data.get("feedback_text", ""),
-                            data.get("phase", ""),
-                            data.get("pathway_condition", "")
-                        ])
-                except Exception:
-                    continue
-            
-            csv_data = output.getvalue()
-            st.download_button(
-                label="Download CSV",
-                data=csv_data,
-                file_name="feedback_export.csv",
-                mime="text/csv"
-            )
+        nav_newer, nav_older = st.columns(2)
+        with nav_newer:
+            if before_id is not None and st.button("← Newest", key="feedback_newest"):
+                st.session_state.pop("feedback_before_id", None)
+                st.rerun()
+        with nav_older:
+            if len(page) == FEEDBACK_PAGE_SIZE and st.button("Older →", key="feedback_older"):
+                st.session_state.feedback_before_id = page[-1]["id"]
+                st.rerun()
+        
+        # The CSV is only built (in chunks) when the download is clicked
+        st.download_button(
+            label="Export All Feedback as CSV",
+            data=store.export_csv,
+            file_name="feedback_export.csv",
+            mime="text/csv"
+        )
 
 # ==========================================
 # 3B. SIDEBAR & SESSION INITIALIZATION
@@ -3729,15 +3446,39 @@ if "current_phase_label" not in st.session_state:
     st.session_state.current_phase_label = PHASES[0]
 
 if "data" not in st.session_state:
-    st.session_state.data = {
+    project_defaults = {
         "phase1": {"condition": "", "setting": "", "inclusion": "", "exclusion": "", "problem": "", "objectives": "", "schedule": [], "population": ""},
         "phase2": {"evidence": [], "mesh_query": ""},
         "phase3": {"nodes": []},
         "phase4": {"heuristics_data": {}},
         "phase5": {"exec_summary": "", "beta_html": "", "expert_html": "", "edu_html": ""}
     }
+    project_store = get_project_store()
+    if project_store is not None:
+        # The project id lives in the URL so a reload or another replica resumes the same project
+        project_id = _get_query_param("project")
+        if not is_valid_project_id(project_id):
+            project_id = new_project_id()
+            try:
+                st.query_params["project"] = project_id
+            except Exception:
+                pass
+        st.session_state.project_id = project_id
+        # Phases are loaded lazily on first access
+        st.session_state.data = project_store.open(project_id, project_defaults)
+    else:
+        st.session_state.data = project_defaults
 if "suggestions" not in st.session_state:
     st.session_state.suggestions = {}
+if "pathway_versions" not in st.session_state:
+    st.session_state.pathway_versions = VersionStore()
+    if st.session_state.get("project_id"):
+        # Resumed projects start their undo history at the stored pathway
+        st.session_state.pathway_versions.commit(
+            st.session_state.data["phase3"].get("nodes", []), "Resumed project")
+project_autosaver = get_project_autosaver()
+if project_autosaver is not None and st.session_state.get("project_id"):
+    project_autosaver.track(st.session_state.project_id, st.session_state.data)
 # --- FORCE MIGRATION FOR OLD DATA ---
 if "pico_p" in st.session_state.data.get("phase2", {}):
     # Old PICO structure detected; clear Phase 2 data to force new layout
@@ -3831,6 +3572,8 @@ with st.sidebar:
         if st.button(button_label, key=f"side_nav_{p.replace(' ', '_').replace('&', 'and')}", type=button_type):
             st.session_state.current_phase_label = p
             st.rerun()
+    if st.session_state.get("project_id"):
+        st.caption("Progress is saved automatically. Bookmark this page's URL to resume the project.")
 
 # Create columns with arrows between buttons for forward flow visualization
 # Pattern: [button] → [button] → [button] → [button] → [button]
@@ -4171,26 +3914,9 @@ Return clean JSON ONLY. No markdown, no explanation."""
     if submitted:
         refinement_text = st.session_state.get('p1_refine_input', '').strip()
         
-        # Collect all uploaded file URIs for Gemini context
-        file_uris = []
-        file_texts = []
-        
-        # Look for stored file URIs in session state
-        for key in list(st.session_state.keys()):
-            if key.startswith("file_p1_refine_") and "_info" not in key:
-                val = st.session_state.get(key, '')
-                if val:
-                    # Check if it's a direct URI (new format)
-                    if val.startswith("https://generativelanguage.googleapis.com"):
-                        file_uris.append(val)
-                    # Check if it's old format "File: name (uri)"
-                    elif "File:" in val and "(" in val and val.endswith(")"):
-                        uri = val.split("(")[-1].rstrip(")")
-                        if uri.startswith("https://"):
-                            file_uris.append(uri)
-                    # Check if it's extracted text content (from DOCX)
-                    elif len(val) > 100:  # Assume long text is document content
-                        file_texts.append(val)
+        # Collect uploaded documents: file URIs, or the relevant sections of large guidelines
+        cond_for_docs = st.session_state.data['phase1'].get('condition') or ''
+        file_uris, file_texts = collect_uploaded_documents("p1_refine_", f"{refinement_text} {cond_for_docs}")
         
         # Build context from files
         has_files = bool(file_uris or file_texts)
@@ -4225,7 +3951,7 @@ Return clean JSON ONLY. No markdown, no explanation."""
                 contents = [{"parts": parts}]
             
             # Prominent status indicator
-            doc_count = len(file_uris)
+            doc_count = len(file_uris) + len(file_texts)
             status_msg = f"Regenerating Phase 1 with {doc_count} document(s)…" if doc_count else "Regenerating Phase 1…"
             with st.status(status_msg, expanded=True) as status:
                 status.write("Sending request to AI agent…")
@@ -4371,34 +4097,8 @@ elif "Evidence" in phase or "Appraise" in phase:
             results = search_pubmed(full_query)
             st.session_state.data['phase2']['evidence'] = results
             if results:
-                prompt = (
-                    "Assign GRADE quality of evidence (use EXACTLY one of: 'High (A)', 'Moderate (B)', 'Low (C)', or 'Very Low (D)') "
-                    "and provide a brief Rationale (1-2 sentences) for each article. "
-                    f"{json.dumps([{k:v for k,v in e.items() if k in ['id','title']} for e in results])}. "
-                    "Return ONLY valid JSON object where keys are PMID strings and values are objects with 'grade' and 'rationale' fields. "
-                    "Example: {\"12345678\": {\"grade\": \"High (A)\", \"rationale\": \"text here\"}}"
-                )
-                # Use native function calling for reliable structured output
-                result = get_gemini_response(
-                    prompt, 
-                    function_declaration=GRADE_EVIDENCE,
-                    thinking_budget=1024
-                )
-                if isinstance(result, dict) and 'arguments' in result:
-                    grades = result['arguments'].get('grades', {})
-                elif isinstance(result, dict) and 'grades' in result:
-                    grades = result['grades']
-                elif isinstance(result, dict):
-                    grades = result
-                else:
-                    grades = get_gemini_response(prompt, json_mode=True)
-                if grades and isinstance(grades, dict):
-                    for e in st.session_state.data['phase2']['evidence']:
-                        pmid_str = str(e['id'])
-                        if pmid_str in grades:
-                            grade_data = grades[pmid_str]
-                            e['grade'] = grade_data.get('grade', 'Un-graded') if isinstance(grade_data, dict) else 'Un-graded'
-                            e['rationale'] = grade_data.get('rationale', 'Not provided.') if isinstance(grade_data, dict) else 'Not provided.'
+                # Chunked, concurrent grading (large result sets no longer truncate)
+                auto_grade_evidence_list(results)
                 # Ensure defaults if AI grading missed any
                 for e in st.session_state.data['phase2']['evidence']:
                     e.setdefault('grade', 'Un-graded')
@@ -4544,34 +4244,8 @@ Output: ("diabetes"[MeSH Terms]) AND ("clinical pathway"[tiab] OR Practice Guide
                         results = search_pubmed(search_term)
                         st.session_state.data['phase2']['evidence'] = results
                         if results:
-                            prompt = (
-                                "Assign GRADE quality of evidence (use EXACTLY one of: 'High (A)', 'Moderate (B)', 'Low (C)', or 'Very Low (D)') "
-                                "and provide a brief Rationale (1-2 sentences) for each article. "
-                                f"{json.dumps([{k:v for k,v in e.items() if k in ['id','title']} for e in results])}. "
-                                "Return ONLY valid JSON object where keys are PMID strings and values are objects with 'grade' and 'rationale' fields. "
-                                "Example: {\"12345678\": {\"grade\": \"High (A)\", \"rationale\": \"text here\"}}"
-                            )
-                            # Use native function calling for reliable structured output
-                            result = get_gemini_response(
-                                prompt, 
-                                function_declaration=GRADE_EVIDENCE,
-                                thinking_budget=1024
-                            )
-                            if isinstance(result, dict) and 'arguments' in result:
-                                grades = result['arguments'].get('grades', {})
-                            elif isinstance(result, dict) and 'grades' in result:
-                                grades = result['grades']
-                            elif isinstance(result, dict):
-                                grades = result
-                            else:
-                                grades = get_gemini_response(prompt, json_mode=True)
-                            if grades and isinstance(grades, dict):
-                                for e in st.session_state.data['phase2']['evidence']:
-                                    pmid_str = str(e['id'])
-                                    if pmid_str in grades:
-                                        grade_data = grades[pmid_str]
-                                        e['grade'] = grade_data.get('grade', 'Un-graded') if isinstance(grade_data, dict) else 'Un-graded'
-                                        e['rationale'] = grade_data.get('rationale', 'Not provided.') if isinstance(grade_data, dict) else 'Not provided.'
+                            # Chunked, concurrent grading (large result sets no longer truncate)
+                            auto_grade_evidence_list(results)
                         # Ensure defaults if AI response missing
                         for e in st.session_state.data['phase2']['evidence']:
                             e.setdefault('grade', 'Un-graded')
@@ -4781,7 +4455,6 @@ elif "Decision" in phase or "Tree" in phase:
     evidence_list = st.session_state.data['phase2']['evidence']
     
     if not st.session_state.data['phase3']['nodes'] and cond:
-        ev_context = "\n".join([f"- PMID {e['id']}: {e['title']} | Abstract: {e.get('abstract', 'N/A')[:200]}" for e in evidence_list[:20]])
         prompt = f"""
         Act as a CLINICAL DECISION SCIENTIST with expertise in Medical Decision Analysis and evidence-based medicine.
         
@@ -4851,7 +4524,7 @@ elif "Decision" in phase or "Tree" in phase:
            - Return precautions and red flag symptoms appropriate for THIS condition's discharge instructions
         
         Available Evidence Base:
-        {ev_context}
+        {EVIDENCE_SLOT}
         
         REQUIRED CLINICAL COVERAGE (4 Mandatory Stages - Each MUST Have Complexity):
         
@@ -5076,28 +4749,57 @@ elif "Decision" in phase or "Tree" in phase:
         ```
         This renders the decision meaningless. Each branch MUST point to a different target.
         """
-        with ai_activity("Generating..."):
-            # Use native function calling for reliable structured output
-            result = get_gemini_response(
-                prompt, 
-                function_declaration=GENERATE_PATHWAY_NODES,
+        prompt = fill_evidence_slot(prompt, evidence_list, f"{cond} {setting}")
+        nodes = None
+        if is_streaming_enabled():
+            # Function-call arguments arrive in one piece, so stream the JSON array instead,
+            # constrained to the generate_pathway_nodes schema, and show each node as soon
+            # as it is complete
+            live_preview = st.empty()
+            streamed_nodes = []
+
+            def _show_streamed_node(index, node):
+                del streamed_nodes[index:]
+                streamed_nodes.append(node)
+                lines = [f"**Drafting pathway… {len(streamed_nodes)} nodes so far**"]
+                for i, n in enumerate(streamed_nodes):
+                    if isinstance(n, dict) and n.get('label'):
+                        lines.append(f"{i + 1}. `{n.get('type', 'Process')}` {n.get('label')}")
+                live_preview.markdown("\n".join(lines))
+
+            nodes = get_gemini_response(
+                prompt,
+                json_mode=True,
+                response_schema=argument_schema(GENERATE_PATHWAY_NODES, "nodes"),
+                on_item=_show_streamed_node,
                 thinking_budget=2048  # Complex pathway generation
             )
-            # Extract nodes from function call or fall back to raw result
-            if isinstance(result, dict) and 'arguments' in result:
-                nodes = result['arguments'].get('nodes', [])
-            elif isinstance(result, dict) and 'nodes' in result:
-                nodes = result.get('nodes', [])
-            elif isinstance(result, list):
-                nodes = result
-            else:
-                # Fallback to json_mode
-                nodes = get_gemini_response(prompt, json_mode=True)
+            if isinstance(nodes, dict) and isinstance(nodes.get('nodes'), list):
+                nodes = nodes['nodes']
+            live_preview.empty()
+        if not (isinstance(nodes, list) and nodes):
+            with ai_activity("Generating..."):
+                # Use native function calling for reliable structured output
+                result = get_gemini_response(
+                    prompt, 
+                    function_declaration=GENERATE_PATHWAY_NODES,
+                    thinking_budget=2048  # Complex pathway generation
+                )
+                # Extract nodes from function call or fall back to raw result
+                if isinstance(result, dict) and 'arguments' in result:
+                    nodes = result['arguments'].get('nodes', [])
+                elif isinstance(result, dict) and 'nodes' in result:
+                    nodes = result.get('nodes', [])
+                elif isinstance(result, list):
+                    nodes = result
+                else:
+                    # Fallback to json_mode
+                    nodes = get_gemini_response(prompt, json_mode=True)
         if isinstance(nodes, list) and len(nodes) > 0:
             # Clean up common AI generation issues
             nodes = normalize_or_logic(nodes)  # Fix OR statements in End nodes
             nodes = fix_decision_flow_issues(nodes)  # Fix reconverging branches and non-terminal End nodes
-            st.session_state.data['phase3']['nodes'] = nodes
+            set_pathway_nodes(nodes, "Generated decision tree")
             st.rerun()
         elif not isinstance(nodes, list):
             st.warning(f"❌ Could not parse decision tree. The AI returned: {type(nodes).__name__}. Please manually add nodes in the table below, or try again.")
@@ -5149,8 +4851,10 @@ elif "Decision" in phase or "Tree" in phase:
         width="stretch",
         key="p3_editor"
     )
-    # Auto-save on edit
-    st.session_state.data['phase3']['nodes'] = edited_nodes.to_dict('records')
+    # Auto-save on edit. The DataFrame round trip adds empty columns (NaN), so only
+    # record a version when the table itself changed
+    if not df_nodes.equals(edited_nodes):
+        set_pathway_nodes(edited_nodes.to_dict('records'), "Edited decision tree")
     
     st.divider()
     
@@ -5276,25 +4980,9 @@ elif "Decision" in phase or "Tree" in phase:
     if submitted:
         refinement_request = st.session_state.get('p3_refine_input', '').strip()
         
-        # Collect all uploaded file URIs for Gemini context
-        file_uris = []
-        file_texts = []
-        for key in list(st.session_state.keys()):
-            if key.startswith("file_p3_refine_") and "_info" not in key:
-                val = st.session_state.get(key, '')
-                if val:
-                    # Check if it's a direct URI (new format)
-                    if val.startswith("https://generativelanguage.googleapis.com"):
-                        file_uris.append(val)
-                    # Check if it's old format "File: name (uri)"
-                    elif "File:" in val and "(" in val and val.endswith(")"):
-                        uri = val.split("(")[-1].rstrip(")")
-                        if uri.startswith("https://"):
-                            file_uris.append(uri)
-                    # Check if it's extracted text content (from DOCX)
-                    elif len(val) > 100:  # Assume long text is document content
-                        file_texts.append(val)
-        
+        # Collect uploaded documents: file URIs, or the relevant sections of large guidelines
+        cond_for_docs = st.session_state.data['phase1'].get('condition') or ''
+        file_uris, file_texts = collect_uploaded_documents("p3_refine_", f"{refinement_request} {cond_for_docs}")
         has_files = bool(file_uris or file_texts)
         
         if refinement_request or has_files:
@@ -5305,20 +4993,19 @@ elif "Decision" in phase or "Tree" in phase:
             user_input = refinement_request if refinement_request else "Use the uploaded documents to refine the pathway."
             
             if st.session_state.data['phase3']['nodes']:
-                doc_count = len(file_uris)
+                doc_count = len(file_uris) + len(file_texts)
                 status_msg = f"Regenerating pathway with {doc_count} document(s)…" if doc_count else "Regenerating pathway…"
                 with st.status(status_msg, expanded=True) as status:
                     status.write("Building prompt and sending to AI agent…")
                     current_nodes = st.session_state.data['phase3']['nodes']
-                    ev_context = "\n".join([f"- PMID {e['id']}: {e['title']} | Abstract: {e.get('abstract', 'N/A')[:200]}" for e in evidence_list[:20]])
                     prompt = f"""
                     Act as a Clinical Decision Scientist. Refine the existing pathway based on the user's request.
 
                     Current pathway for {cond} in {setting}:
-                    {json.dumps(current_nodes, indent=2)}
+                    {PATHWAY_SLOT}
 
                     Available Evidence:
-                    {ev_context}
+                    {EVIDENCE_SLOT}
                     {file_context}
 
                     User's refinement request: "{user_input}"
@@ -5330,45 +5017,44 @@ elif "Decision" in phase or "Tree" in phase:
                     - Specific discharge details (prescriptions with dose/route, referrals)
                     - Evidence citations (PMIDs where applicable)
 
-                    Output: Complete revised JSON array of nodes with fields: type, label, evidence.
                     Rules:
                     - type in [Start, Decision, Process, End]
                     - First node: type "Start", label "patient present to {setting} with {cond}"
                     - NO node count limit - build complete clinical flow
                     - If >20 nodes, organize into sections or sub-pathways
                     """
-                    # Build contents with file URIs if available
-                    contents = None
-                    if file_uris:
-                        parts = [{"text": prompt}]
-                        for uri in file_uris[:3]:
-                            parts.append({"file_data": {"file_uri": uri}})
-                        contents = [{"parts": parts}]
-                    
+                    file_parts = [{"file_data": {"file_uri": uri}} for uri in file_uris[:3]]
+
                     status.write("Waiting for AI response…")
-                    # Use native function calling for reliable structured output
-                    result = get_gemini_response(
-                        prompt, 
-                        function_declaration=GENERATE_PATHWAY_NODES,
-                        thinking_budget=2048,
-                        contents=contents
-                    )
-                    # Extract nodes from function call or fall back
-                    if isinstance(result, dict) and 'arguments' in result:
-                        nodes = result['arguments'].get('nodes', [])
-                    elif isinstance(result, dict) and 'nodes' in result:
-                        nodes = result.get('nodes', [])
-                    elif isinstance(result, list):
-                        nodes = result
+                    # Ask for just the edits first; the whole pathway only if no clean patch comes back
+                    nodes, patch_args = request_pathway_patch(prompt, current_nodes, evidence_list, user_input, file_parts)
+                    if nodes:
+                        status.write(f"Received edits: {describe_patch(patch_args.get('operations'))}")
                     else:
-                        # Fallback to json_mode
-                        nodes = get_gemini_response(prompt, json_mode=True)
+                        prompt = prompt.replace(PATHWAY_SLOT, pathway_prompt_text(current_nodes)) + """
+                        Output: Complete revised JSON array of nodes with fields: type, label, evidence.
+                        """
+                        prompt = fill_evidence_slot(prompt, evidence_list, user_input, current_nodes)
+                        # Build contents with file URIs if available
+                        contents = [{"parts": [{"text": prompt}] + file_parts}] if file_parts else None
+
+                        # Use native function calling for reliable structured output
+                        result = get_gemini_response(
+                            prompt, 
+                            function_declaration=GENERATE_PATHWAY_NODES,
+                            thinking_budget=2048,
+                            contents=contents
+                        )
+                        nodes = pathway_nodes_from_result(result)
+                        if nodes is None:
+                            # Fallback to json_mode
+                            nodes = pathway_nodes_from_result(get_gemini_response(prompt, json_mode=True))
                     if isinstance(nodes, list) and len(nodes) > 0:
                         status.write("Applying updates…")
                         # Clean up common AI generation issues
                         nodes = normalize_or_logic(nodes)
                         nodes = fix_decision_flow_issues(nodes)
-                        st.session_state.data['phase3']['nodes'] = nodes
+                        set_pathway_nodes(nodes, "Regenerated decision tree")
                         # Clear Phase 4 visualization cache so regenerated views/downloads reflect updates
                         st.session_state.data.setdefault('phase4', {}).pop('viz_cache', None)
                         status.update(label="Pathway regenerated!", state="complete", expanded=False)
@@ -5395,7 +5081,6 @@ elif "Interface" in phase or "UI" in phase:
         st.warning("No pathway nodes found. You can still review heuristics and apply custom refinements below.")
 
     # Initialize Phase 4 state defaults
-    p4_state.setdefault('nodes_history', [])
     p4_state.setdefault('heuristics_data', {})
     p4_state.setdefault('auto_heuristics_done', False)
     p4_state.setdefault('ui_apply_flags', {})
@@ -5446,7 +5131,7 @@ CRITICAL DISTINCTION - Do NOT confuse:
 - Only flag jargon when it's unclear or lacks clinical definition; literature citations are appropriate
 
 Pathway Overview: {pathway_summary}
-Nodes analyzed ({len(nodes_display)} sample): {json.dumps(nodes_display, indent=2)}
+Nodes analyzed ({len(nodes_display)} sample; {NODE_KEY_LEGEND}): {compact_nodes(nodes_display)}
 
 HEURISTIC DEFINITIONS:
 - H1 (Visibility): System keeps users informed of status, critical values, decision points
@@ -5517,40 +5202,51 @@ EXAMPLE FORMAT:
         p4_state['auto_heuristics_done'] = False
         st.rerun()
 
-    # Prepare nodes for visualization with a lightweight cache
+    # Prepare nodes for visualization from the shared diagram cache
     nodes_for_viz = nodes if nodes else [
         {"label": "Start", "type": "Start"},
         {"label": "Add nodes in Phase 3", "type": "Process"},
         {"label": "End", "type": "End"},
     ]
+    diagrams = get_diagram_cache()
+    sig = diagram_key(nodes_for_viz, "TD")
+    # viz_cache is this session's view of the shared entry; clearing it re-reads the shared cache
     cache = p4_state.setdefault('viz_cache', {})
-    sig = hashlib.md5(json.dumps(nodes_for_viz, sort_keys=True).encode('utf-8')).hexdigest()
+    if sig not in cache:
+        cache = {sig: diagrams.artifacts(sig)}
 
     # Generate DOT source for primary visualization (Graphviz renders natively in Streamlit)
     dot_code = cache.get(sig, {}).get("dot")
-    if dot_code is None or p4_state.get('applied_status'):
-        dot_code = dot_from_nodes(nodes_for_viz, "TD")
-        cache_entry = cache.get(sig, {})
-        cache_entry["dot"] = dot_code
-        cache[sig] = cache_entry
+    if dot_code is None:
+        dot_code = diagrams.get_or_build(sig, "dot", lambda: dot_from_nodes(nodes_for_viz, "TD"))
+        cache[sig]["dot"] = dot_code
 
-    # Also generate SVG for download if graphviz is available
+    # Also render SVG/PNG/PDF exports in the background if graphviz is available.
+    # The render farm caches outputs per DOT source, so resubmitting is a cache hit.
     svg_bytes = cache.get(sig, {}).get("svg")
-    if svg_bytes is None or p4_state.get('applied_status'):
-        g = build_graphviz_from_nodes(nodes_for_viz, "TD")
-        if g:
-            new_svg = render_graphviz_bytes(g, "svg")
-            if new_svg:
-                cache[sig]["svg"] = new_svg
-                svg_bytes = new_svg
+    gv_source = cache[sig].get("gv_source")
+    if gv_source is None:
+        def _gv_source():
+            g = build_graphviz_from_nodes(nodes_for_viz, "TD")
+            return g.source if g else ""
+        gv_source = cache[sig]["gv_source"] = diagrams.get_or_build(sig, "gv_source", _gv_source)
+    export_job = get_render_farm().submit(gv_source, EXPORT_FORMATS) if gv_source else None
+    if svg_bytes is None and export_job is not None and export_job.done():
+        new_svg = export_job.result().get("svg")
+        if new_svg:
+            diagrams.put(sig, "svg", new_svg)
+            cache[sig]["svg"] = new_svg
+            svg_bytes = new_svg
+    if svg_bytes is None and (export_job is None or export_job.done()):
+        # No graphviz/dot, or dot failed or timed out: lay the diagram out in-process
+        svg_bytes = diagrams.get_or_build(sig, "svg", lambda: render_fallback_svg(_pathway_ir(nodes_for_viz, "TD")))
+        cache[sig]["svg"] = svg_bytes
 
     # Generate Mermaid code for download/export only (not rendered inline)
     mermaid_code = cache.get(sig, {}).get("mermaid")
-    if mermaid_code is None or p4_state.get('applied_status'):
-        mermaid_code = generate_mermaid_code(nodes_for_viz, "TD")
-        cache_entry = cache.get(sig, {})
-        cache_entry["mermaid"] = mermaid_code
-        cache[sig] = cache_entry
+    if mermaid_code is None:
+        mermaid_code = diagrams.get_or_build(sig, "mermaid", lambda: generate_mermaid_code(nodes_for_viz, "TD"))
+        cache[sig]["mermaid"] = mermaid_code
 
     p4_state['viz_cache'] = {sig: cache.get(sig, {})}
 
@@ -5562,7 +5258,7 @@ EXAMPLE FORMAT:
     
     if dot_code:
         # Render Graphviz natively — scales properly in Streamlit
-        st.graphviz_chart(dot_code, width='stretch')
+        _render_pathway_chart(nodes_for_viz, dot_code)
         
         # Download options
         dl_col1, dl_col2, dl_col3 = st.columns(3)
@@ -5577,15 +5273,7 @@ EXAMPLE FORMAT:
                     width='stretch'
                 )
         with dl_col2:
-            if svg_bytes:
-                st.download_button(
-                    "📊 Download SVG",
-                    svg_bytes,
-                    file_name="pathway.svg",
-                    mime="image/svg+xml",
-                    help="High-quality vector graphic for presentations and email",
-                    width='stretch'
-                )
+            _render_export_downloads(export_job, svg_bytes)
         with dl_col3:
             if mermaid_code:
                 # Mermaid.live link
@@ -5675,52 +5363,59 @@ EXAMPLE FORMAT:
                     st.markdown("**Summary of Changes:**")
                     st.markdown(p4_state['applied_summary_detail'])
             
-            col_apply, col_undo = st.columns([1, 1])
+            versions = st.session_state.pathway_versions
+            col_apply, col_undo, col_redo = st.columns([1, 1, 1])
             with col_apply:
                 btn_applied = p4_state.get('applied_status', False)
                 btn_label = "Applied ✓" if btn_applied else "Apply"
                 btn_type = "primary" if btn_applied else "secondary"
                 if st.button(btn_label, key="p4_apply_all_actionable", type=btn_type, disabled=btn_applied):
-                    # Initialize history if needed
-                    if 'nodes_history' not in p4_state:
-                        p4_state['nodes_history'] = []
-                    
-                    # Save current state to history BEFORE applying
-                    p4_state['nodes_history'].append(copy.deepcopy(nodes))
+                    # Make sure the current pathway is a version to undo back to
+                    versions.commit(nodes, "Before heuristics")
                     p4_state['applying_heuristics'] = True  # Set flag to prevent re-analysis
                     
                     with ai_activity("Applying heuristics…"):
                         improved_nodes, applied_heuristics, apply_summary = apply_actionable_heuristics_incremental(nodes, h_data)
                         if improved_nodes and len(improved_nodes) > 0:
-                            st.session_state.data['phase3']['nodes'] = harden_nodes(improved_nodes)
+                            set_pathway_nodes(harden_nodes(improved_nodes), "Applied heuristics")
                             p4_state['viz_cache'] = {}
                             p4_state['applied_status'] = True
                             p4_state['applied_heuristics'] = applied_heuristics
                             p4_state['applied_summary_detail'] = apply_summary
                             st.rerun()
                         else:
-                            # Remove from history if apply failed
-                            if p4_state.get('nodes_history'):
-                                p4_state['nodes_history'].pop()
                             st.error("Could not process recommendations. AI returned no valid nodes. Please try again.")
 
             with col_undo:
-                history_count = len(p4_state.get('nodes_history', []))
-                undo_disabled = history_count == 0
-                if st.button("Undo Last Changes", key="p4_undo_all", type="secondary", disabled=undo_disabled):
-                    if p4_state.get('nodes_history') and len(p4_state['nodes_history']) > 0:
-                        prev_nodes = p4_state['nodes_history'].pop()
+                undo_label = versions.head.label if versions.can_undo() else ""
+                if st.button("Undo Last Changes", key="p4_undo_all", type="secondary",
+                             disabled=not versions.can_undo(), help=f"Undo: {undo_label}" if undo_label else None):
+                    undone = versions.diff()
+                    prev_nodes = versions.undo()
+                    if prev_nodes is not None:
                         st.session_state.data['phase3']['nodes'] = prev_nodes
+                        p4_state['applying_heuristics'] = True  # Moving between versions: keep heuristics
                         p4_state['viz_cache'] = {}
                         p4_state['applied_status'] = False
                         p4_state['applied_summary_detail'] = ""
                         p4_state['applied_heuristics'] = []
-                        st.success(f"✓ Reverted to previous version ({len(prev_nodes)} nodes)")
+                        st.success(f"✓ Reverted to previous version ({len(prev_nodes)} nodes; {undone.summary()})")
                         st.rerun()
                     else:
                         st.info("No changes to undo")
-                if history_count > 0:
-                    st.caption(f"{history_count} version(s) in history")
+                if versions.undo_depth > 0:
+                    st.caption(f"{versions.undo_depth} version(s) in history")
+
+            with col_redo:
+                if st.button("Redo", key="p4_redo_all", type="secondary", disabled=not versions.can_redo()):
+                    next_nodes = versions.redo()
+                    if next_nodes is not None:
+                        st.session_state.data['phase3']['nodes'] = next_nodes
+                        p4_state['applying_heuristics'] = True  # Moving between versions: keep heuristics
+                        p4_state['viz_cache'] = {}
+                        st.rerun()
+                if versions.redo_depth > 0:
+                    st.caption(f"{versions.redo_depth} version(s) to redo")
 
     st.divider()
 
@@ -5770,7 +5465,7 @@ EXAMPLE FORMAT:
             for idx, row in edited_p4_display.iterrows():
                 if 'evidence' in df_p4.columns and idx < len(df_p4):
                     edited_p4_display.at[idx, 'evidence'] = df_p4.at[idx, 'evidence']
-            st.session_state.data['phase3']['nodes'] = edited_p4_display.to_dict('records')
+            set_pathway_nodes(edited_p4_display.to_dict('records'), "Edited pathway data")
             p4_state['viz_cache'] = {}
             st.info("Nodes updated. Click 'Regenerate Visualization & Downloads' to refresh.")
 
@@ -5827,25 +5522,9 @@ EXAMPLE FORMAT:
         if regen_submitted:
             refine_notes = st.session_state.get('p4_refine_notes', '').strip()
             
-            # Collect all uploaded file URIs for context
-            file_uris = []
-            file_texts = []
-            for key in list(st.session_state.keys()):
-                if key.startswith("file_p4_refine_") and "_info" not in key:
-                    val = st.session_state.get(key, '')
-                    if val:
-                        # Check if it's a direct URI (new format)
-                        if val.startswith("https://generativelanguage.googleapis.com"):
-                            file_uris.append(val)
-                        # Check if it's old format "File: name (uri)"
-                        elif "File:" in val and "(" in val and val.endswith(")"):
-                            uri = val.split("(")[-1].rstrip(")")
-                            if uri.startswith("https://"):
-                                file_uris.append(uri)
-                        # Check if it's extracted text content (from DOCX)
-                        elif len(val) > 100:  # Assume long text is document content
-                            file_texts.append(val)
-            
+            # Collect uploaded documents: file URIs, or the relevant sections of large guidelines
+            cond_for_docs = st.session_state.data['phase1'].get('condition') or ''
+            file_uris, file_texts = collect_uploaded_documents("p4_refine_", f"{refine_notes} {cond_for_docs}")
             has_files = bool(file_uris or file_texts)
             
             if refine_notes or has_files:
@@ -5857,7 +5536,7 @@ EXAMPLE FORMAT:
                 if file_context:
                     refine_with_file += file_context
                 
-                doc_count = len(file_uris)
+                doc_count = len(file_uris) + len(file_texts)
                 status_msg = f"Regenerating pathway with {doc_count} document(s)…" if doc_count else "Regenerating pathway…"
                     
                 with st.status(status_msg, expanded=True) as status:
@@ -5867,53 +5546,47 @@ EXAMPLE FORMAT:
                         cond = st.session_state.data['phase1'].get('condition') or "Pathway"
                         setting = st.session_state.data['phase1'].get('setting') or "care setting"
                         evidence_list = st.session_state.data['phase2'].get('evidence', [])
-                        ev_context = "\n".join([f"- PMID {e['id']}: {e['title']} | Abstract: {e.get('abstract', 'N/A')[:200]}" for e in evidence_list[:20]])
                         
                         prompt = f"""
                         Act as a Clinical Decision Scientist. Refine the existing pathway based on the user's request and uploaded documents.
 
                         Current pathway for {cond} in {setting}:
-                        {json.dumps(nodes, indent=2)}
+                        {PATHWAY_SLOT}
 
                         Available Evidence:
-                        {ev_context}
+                        {EVIDENCE_SLOT}
                         {file_context}
 
                         User's refinement request: "{refine_with_file}"
 
                         IMPORTANT: Use information from the uploaded documents to enhance the pathway with more specific clinical details, evidence-based criteria, and actionable steps.
 
-                        OUTPUT: Complete revised JSON array of nodes with fields: type, label, evidence, (optional) notes
                         Rules:
                         - type: "Start" | "Decision" | "Process" | "End"
                         - First node: type "Start", label "patient present to {setting} with {cond}"
                         - Maintain clinical complexity and decision branches
                         - Apply any specific protocols, criteria, or guidelines from the uploaded documents
                         """
-                        
-                        # Build contents with file URIs
-                        parts = [{"text": prompt}]
-                        for uri in file_uris[:3]:
-                            parts.append({"file_data": {"file_uri": uri}})
-                        contents = [{"parts": parts}]
-                        
+                        file_parts = [{"file_data": {"file_uri": uri}} for uri in file_uris[:3]]
+
                         status.write("Waiting for AI response…")
-                        result = get_gemini_response(
-                            prompt,
-                            function_declaration=GENERATE_PATHWAY_NODES,
-                            thinking_budget=2048,
-                            contents=contents
-                        )
-                        
-                        # Extract nodes from result
-                        if isinstance(result, dict) and 'arguments' in result:
-                            refined = result['arguments'].get('nodes', [])
-                        elif isinstance(result, dict) and 'nodes' in result:
-                            refined = result.get('nodes', [])
-                        elif isinstance(result, list):
-                            refined = result
+                        # Ask for just the edits first; the whole pathway only if no clean patch comes back
+                        refined, patch_args = request_pathway_patch(prompt, nodes, evidence_list, refine_notes, file_parts)
+                        if refined:
+                            status.write(f"Received edits: {describe_patch(patch_args.get('operations'))}")
                         else:
-                            refined = None
+                            prompt = prompt.replace(PATHWAY_SLOT, pathway_prompt_text(nodes)) + """
+                            OUTPUT: Complete revised JSON array of nodes with fields: type, label, evidence, (optional) notes
+                            """
+                            prompt = fill_evidence_slot(prompt, evidence_list, refine_notes, nodes)
+                            contents = [{"parts": [{"text": prompt}] + file_parts}]
+                            result = get_gemini_response(
+                                prompt,
+                                function_declaration=GENERATE_PATHWAY_NODES,
+                                thinking_budget=2048,
+                                contents=contents
+                            )
+                            refined = pathway_nodes_from_result(result)
                     else:
                         # No file URIs, use the existing function
                         status.write("Waiting for AI response…")
@@ -5921,7 +5594,7 @@ EXAMPLE FORMAT:
                     
                     if refined:
                         status.write("Applying updates…")
-                        st.session_state.data['phase3']['nodes'] = refined
+                        set_pathway_nodes(refined, "Refined pathway")
                         p4_state['viz_cache'] = {}
                         status.update(label="Pathway regenerated!", state="complete", expanded=False)
                         st.success("✅ Pathway regenerated successfully!")
@@ -5951,7 +5624,7 @@ elif "Operationalize" in phase or "Deploy" in phase:
         st.stop()
     
     # Single info box at top
-    styled_info("<b>Tip:</b> Click 'Generate' for each deliverable you need. Downloads appear after generation completes.")
+    styled_info("<b>Tip:</b> Click 'Generate' for each deliverable you need, or 'Generate All Deliverables' to build them together. Downloads appear as each one completes.")
     
     cond = st.session_state.data['phase1']['condition'] or "Pathway"
     setting = st.session_state.data['phase1'].get('setting', '') or ""
@@ -5962,6 +5635,88 @@ elif "Operationalize" in phase or "Deploy" in phase:
         render_bottom_navigation()
         st.stop()
     
+    # Deliverables build concurrently on the shared job queue; results land in phase5 as each finishes
+    p5_queue = get_phase5_queue()
+    p5_owner = _phase5_job_owner()
+    _apply_phase5_results(p5_queue.jobs(p5_owner), cond)
+    genai_client = get_genai_client()
+
+    def _build_expert(report, nodes, svg, **_):
+        svg_b64 = base64.b64encode(svg).decode('utf-8') if svg else None
+        return ensure_carepathiq_branding(generate_expert_form_html(
+            condition=cond,
+            nodes=nodes,
+            organization=cond,
+            care_setting=setting,
+            pathway_svg_b64=svg_b64,
+            genai_client=genai_client
+        ))
+
+    def _build_beta(report, nodes, data, **_):
+        return ensure_carepathiq_branding(generate_beta_form_html(
+            condition=cond,
+            nodes=nodes,
+            organization=cond,
+            care_setting=setting,
+            genai_client=genai_client,
+            phase1_data=data['phase1'],
+            phase2_data=data['phase2'],
+            phase3_data=data['phase3'],
+            phase4_data=data['phase4']
+        ))
+
+    def _build_edu(report, nodes, audience, **_):
+        return ensure_carepathiq_branding(generate_education_module_html(
+            condition=cond,
+            nodes=nodes,
+            target_audience=audience,
+            care_setting=setting,
+            genai_client=genai_client,
+            on_progress=report
+        ))
+
+    def _build_exec(report, data, **_):
+        docx = create_phase5_executive_summary_docx(
+            data=data,
+            condition=cond,
+            genai_client=genai_client,
+            on_progress=report
+        )
+        return docx.getvalue() if hasattr(docx, 'getvalue') else docx
+
+    def _show_edu_sections(edu_sections):
+        lines = []
+        for obj in edu_sections.get('learning_objectives') or []:
+            lines.append(f"- {obj}")
+        if edu_sections.get('teaching_points'):
+            lines.append(f"\n✓ {len(edu_sections['teaching_points'])} teaching points drafted")
+        if edu_sections.get('quiz_questions'):
+            lines.append(f"✓ {len(edu_sections['quiz_questions'])} quiz questions drafted")
+        return "\n".join(lines)
+
+    def _show_exec_sections(exec_sections):
+        # Keyed by section so a retried stream overwrites rather than repeats
+        return "\n\n".join(f"**{str(section).replace('_', ' ').title()}**: {text}"
+                             for section, text in exec_sections.items())
+
+    def _submit_phase5(kinds, audience=""):
+        # Inputs are snapshotted on the script thread; workers never touch session state
+        job = {
+            "nodes": copy.deepcopy(nodes),
+            "data": _phase5_data_snapshot(),
+            "svg": get_pathway_export(nodes, "svg") if "expert" in kinds else None,
+            "audience": audience,
+        }
+        builders = {"expert": _build_expert, "beta": _build_beta, "edu": _build_edu, "exec": _build_exec}
+        for kind in kinds:
+            p5_queue.submit(p5_owner, kind, lambda report, build=builders[kind]: build(report, **job))
+        st.rerun()
+
+    if st.button("Generate All Deliverables", key="p5_gen_all", type="primary",
+                 help="Builds every deliverable at once; each download appears as soon as it is ready"):
+        edu_audience = st.session_state.get("p5_aud_edu_input", "")
+        _submit_phase5(["expert", "beta", "exec"] + (["edu"] if edu_audience else []), edu_audience)
+
     # 2x2 GRID LAYOUT - Each deliverable has Generate button + Download
     col1, col2 = st.columns(2)
 
@@ -5971,28 +5726,8 @@ elif "Operationalize" in phase or "Deploy" in phase:
         
         # Generate button
         if st.button("Generate Expert Feedback Form", key="p5_gen_expert", type="secondary"):
-            with st.spinner("Generating expert feedback form..."):
-                try:
-                    g = build_graphviz_from_nodes(nodes, "TD")
-                    svg_bytes = render_graphviz_bytes(g, "svg") if g else None
-                    svg_b64 = base64.b64encode(svg_bytes).decode('utf-8') if svg_bytes else None
-                    
-                    expert_html = generate_expert_form_html(
-                        condition=cond,
-                        nodes=nodes,
-                        organization=cond,
-                        care_setting=setting,
-                        pathway_svg_b64=svg_b64,
-                        genai_client=get_genai_client()
-                    )
-                    st.session_state.data['phase5']['expert_html'] = ensure_carepathiq_branding(expert_html)
-                    st.success("✓ Generated!")
-                    st.rerun()
-                except Exception as e:
-                    if '429' in str(e) or 'quota' in str(e).lower():
-                        st.error("⏳ API rate limit. Wait 15-30 seconds and try again.")
-                    else:
-                        st.error(f"Error: {str(e)[:100]}")
+            _submit_phase5(["expert"])
+        _render_phase5_job_status(p5_owner, "expert")
         
         # Download button (only shows if generated)
         if st.session_state.data['phase5'].get('expert_html'):
@@ -6011,27 +5746,8 @@ elif "Operationalize" in phase or "Deploy" in phase:
         
         # Generate button
         if st.button("Generate Beta Testing Guide", key="p5_gen_beta", type="secondary"):
-            with st.spinner("Generating beta testing guide..."):
-                try:
-                    beta_html = generate_beta_form_html(
-                        condition=cond,
-                        nodes=nodes,
-                        organization=cond,
-                        care_setting=setting,
-                        genai_client=get_genai_client(),
-                        phase1_data=st.session_state.data.get('phase1', {}),
-                        phase2_data=st.session_state.data.get('phase2', {}),
-                        phase3_data=st.session_state.data.get('phase3', {}),
-                        phase4_data=st.session_state.data.get('phase4', {})
-                    )
-                    st.session_state.data['phase5']['beta_html'] = ensure_carepathiq_branding(beta_html)
-                    st.success("✓ Generated!")
-                    st.rerun()
-                except Exception as e:
-                    if '429' in str(e) or 'quota' in str(e).lower():
-                        st.error("⏳ API rate limit. Wait 15-30 seconds and try again.")
-                    else:
-                        st.error(f"Error: {str(e)[:100]}")
+            _submit_phase5(["beta"])
+        _render_phase5_job_status(p5_owner, "beta")
         
         # Download button (only shows if generated)
         if st.session_state.data['phase5'].get('beta_html'):
@@ -6068,23 +5784,8 @@ elif "Operationalize" in phase or "Deploy" in phase:
             if not aud_edu:
                 st.warning("Please enter target audience first.")
             else:
-                with st.spinner("Generating education module..."):
-                    try:
-                        edu_html = generate_education_module_html(
-                            condition=cond,
-                            nodes=nodes,
-                            target_audience=aud_edu,
-                            care_setting=setting,
-                            genai_client=get_genai_client()
-                        )
-                        st.session_state.data['phase5']['edu_html'] = ensure_carepathiq_branding(edu_html)
-                        st.success("✓ Generated!")
-                        st.rerun()
-                    except Exception as e:
-                        if '429' in str(e) or 'quota' in str(e).lower():
-                            st.error("⏳ API rate limit. Wait 15-30 seconds and try again.")
-                        else:
-                            st.error(f"Error: {str(e)[:100]}")
+                _submit_phase5(["edu"], aud_edu)
+        _render_phase5_job_status(p5_owner, "edu", _show_edu_sections)
         
         # Download button (only shows if generated)
         if st.session_state.data['phase5'].get('edu_html'):
@@ -6103,22 +5804,8 @@ elif "Operationalize" in phase or "Deploy" in phase:
         
         # Generate button
         if st.button("Generate Executive Summary", key="p5_gen_exec", type="secondary"):
-            with st.spinner("Generating executive summary..."):
-                try:
-                    docx_bytes = create_phase5_executive_summary_docx(
-                        data=st.session_state.data,
-                        condition=cond,
-                        genai_client=get_genai_client()
-                    )
-                    st.session_state['exec_docx_bytes'] = docx_bytes
-                    st.session_state.data['phase5']['exec_summary'] = f"Executive Summary for {cond}"
-                    st.success("✓ Generated!")
-                    st.rerun()
-                except Exception as e:
-                    if '429' in str(e) or 'quota' in str(e).lower():
-                        st.error("⏳ API rate limit. Wait 15-30 seconds and try again.")
-                    else:
-                        st.error(f"Error: {str(e)[:100]}")
+            _submit_phase5(["exec"])
+        _render_phase5_job_status(p5_owner, "exec", _show_exec_sections)
         
         # Download button (only shows if generated)
         if st.session_state.get('exec_docx_bytes'):
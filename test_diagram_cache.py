@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Tests for diagram_cache.py (shared, byte-bounded diagram artifact cache).
+
+Run with pytest (make units).
+"""
+
+from diagram_cache import DiagramCache, diagram_key
+
+NODES = [{"type": "Start", "label": "Start"}, {"type": "End", "label": "Discharge"}]
+
+
+def test_key_is_content_addressed():
+    assert diagram_key(NODES, "TD") == diagram_key([dict(n) for n in NODES], "TD")
+    assert diagram_key(NODES, "TD") != diagram_key(NODES, "LR")
+    assert diagram_key(NODES) != diagram_key(NODES[:1])
+
+
+def test_toggling_between_versions_builds_once():
+    cache = DiagramCache()
+    builds = []
+    applied = NODES + [{"type": "Process", "label": "Recheck vitals"}]
+    for _ in range(3):   # original -> applied -> original -> ...
+        for nodes in (NODES, applied):
+            key = diagram_key(nodes)
+            cache.get_or_build(key, "dot", lambda: builds.append(key) or f"digraph {len(builds)}")
+    assert len(builds) == 2
+    assert cache.stats()["diagrams"] == 2
+
+
+def test_lru_eviction_by_bytes():
+    cache = DiagramCache(max_bytes=1000)
+    cache.put("a", "svg", b"x" * 400)
+    cache.put("b", "svg", b"x" * 400)
+    assert cache.get("a", "svg") is not None    # "a" is now most recent
+    cache.put("c", "svg", b"x" * 400)
+    assert cache.get("b", "svg") is None
+    assert cache.get("a", "svg") is not None and cache.get("c", "svg") is not None
+    assert cache.stats()["bytes"] == 800
+    # Oversized and empty artifacts are not stored
+    assert not cache.put("d", "pdf", b"x" * 2000) and not cache.put("e", "svg", None)
+
+
+def test_artifacts_for_one_version():
+    cache = DiagramCache()
+    key = diagram_key(NODES)
+    cache.put(key, "dot", "digraph {}")
+    cache.put(key, "mermaid", "graph TD")
+    cache.put(diagram_key(NODES, "LR"), "dot", "digraph LR {}")
+    assert cache.artifacts(key) == {"dot": "digraph {}", "mermaid": "graph TD"}
+    assert cache.artifacts("missing") == {}
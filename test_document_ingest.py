@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Tests for document_ingest.py (hash-keyed upload cache and section chunking).
+
+Run with pytest (make units).
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from document_ingest import (
+    IngestCache, URI_SAFETY_MARGIN, content_hash, iter_markdown, select_sections, split_sections,
+)
+
+GUIDELINE = """# Sepsis Guideline
+
+Scope of this guideline.
+
+## Screening
+
+Use qSOFA at triage. Repeat screening every 4 hours.
+
+## Antibiotics
+
+Give broad-spectrum antibiotics within one hour of recognition.
+
+### Penicillin allergy
+
+Use aztreonam plus vancomycin.
+
+```
+# not a heading
+```
+
+## Fluids
+
+30 mL/kg crystalloid for hypotension or lactate >= 4.
+"""
+
+def test_content_hash_streams_and_rewinds():
+    data = os.urandom(5000)
+    stream = io.BytesIO(data)
+    stream.read(10)
+    stream.seek(0)
+    assert content_hash(stream, chunk_size=64) == hashlib.sha256(data).hexdigest()
+    assert stream.tell() == 0
+
+
+def test_text_and_docx_extraction():
+    text = "Dosing: 30 mL/kg — reassess ✓\n" * 3
+    blocks = list(iter_markdown("notes.md", io.BytesIO(text.encode("utf-8")), chunk_size=5))
+    assert len(blocks) > 1 and "".join(blocks) == text
+
+    from docx import Document
+    doc = Document()
+    doc.add_heading("Chest Pain Pathway", level=1)
+    doc.add_paragraph("Obtain ECG within 10 minutes.")
+    doc.add_heading("Troponin", level=2)
+    doc.add_paragraph("Repeat high-sensitivity troponin at 3 hours.")
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    assert list(iter_markdown("pathway.DOCX", buffer)) == [
+        "# Chest Pain Pathway", "Obtain ECG within 10 minutes.",
+        "## Troponin", "Repeat high-sensitivity troponin at 3 hours."]
+
+
+def test_sections_follow_headings_and_split_long_bodies():
+    sections = split_sections(GUIDELINE)
+    titles = [t for t, _ in sections]
+    assert titles == ["Sepsis Guideline", "Sepsis Guideline › Screening", "Sepsis Guideline › Antibiotics",
+                      "Sepsis Guideline › Antibiotics › Penicillin allergy", "Sepsis Guideline › Fluids"]
+    assert "# not a heading" in sections[3][1]
+
+    long_body = "\n\n".join(f"Paragraph {i} " + "x" * 80 for i in range(10))
+    parts = split_sections(f"## Long\n\n{long_body}", max_chars=300)
+    assert len(parts) > 1 and all(len(body) <= 300 for _, body in parts)
+    assert parts[0][0] == f"Long (1/{len(parts)})"
+
+
+def test_selection_prefers_relevant_sections_within_budget():
+    sections = split_sections(GUIDELINE)
+    picked = select_sections(sections, "antibiotics for penicillin allergy", budget_chars=200)
+    assert [t for t, _ in picked] == ["Sepsis Guideline › Antibiotics",
+                                      "Sepsis Guideline › Antibiotics › Penicillin allergy"]
+    # Document order is kept regardless of rank
+    picked = select_sections(sections, "fluids lactate screening qsofa", budget_chars=1000)
+    assert [t for t, _ in picked][0] == "Sepsis Guideline › Screening"
+    # No matching terms: leading sections
+    assert select_sections(sections, "zebrafish", budget_chars=60)[0][0] == "Sepsis Guideline"
+    assert select_sections([], "anything") == []
+
+
+def test_cache_reuses_uris_until_expiry_and_reviews_per_context():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "ingest.sqlite")
+        cache = IngestCache(path)
+        cache.put_file_uri("abc", "key-a", "https://files/abc", expires_at=1000.0 + URI_SAFETY_MARGIN + 60)
+        assert cache.file_uri("abc", "key-a", now=1000.0) == "https://files/abc"
+        assert cache.file_uri("abc", "key-a", now=1100.0) is None
+        assert cache.file_uri("missing", "key-a") is None
+        # Another API key can't see key-a's upload, so it gets no URI
+        assert cache.file_uri("abc", "key-b", now=1000.0) is None
+        cache.put_file_uri("abc", "key-b", "https://files/abc-b", expires_at=1000.0 + URI_SAFETY_MARGIN + 60)
+        assert cache.file_uri("abc", "key-a", now=1000.0) == "https://files/abc"
+        assert cache.file_uri("abc", "key-b", now=1000.0) == "https://files/abc-b"
+
+        cache.put_review("abc", "decision tree pathway", "Review A")
+        cache.put_text("abc", "sepsis.md", 123, GUIDELINE)
+        reopened = IngestCache(path)
+        assert reopened.review("abc", "decision tree pathway") == "Review A"
+        assert reopened.review("abc", "clinical scope and charter") is None
+        assert reopened.text("abc") == GUIDELINE
+        assert len(reopened.sections("abc")) == 5 and reopened.sections("missing") == []
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for evidence_grading.py (chunked, concurrent GRADE auto-grading).
+
+Run with pytest (make units).
+"""
+
+import json
+import re
+import threading
+import time
+import uuid
+
+from evidence_grading import apply_grades, chunk_evidence, extract_grades, grade_evidence
+
+
+def _evidence(n, tag=""):
+    tag = tag or uuid.uuid4().hex[:8]
+    return [{"id": str(1000 + i), "title": f"Trial {i} {tag}", "abstract": "..."} for i in range(n)]
+
+
+class _Grader:
+    """Fake model: grades every PMID in the prompt, optionally dropping some."""
+
+    def __init__(self, delay=0.0, drop=(), fail_first=False):
+        self.delay = delay
+        self.drop = set(drop)
+        self.fail_first = fail_first
+        self.prompts = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt):
+        with self._lock:
+            self.prompts.append(prompt)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            first = len(self.prompts) == 1
+        try:
+            time.sleep(self.delay)
+            if self.fail_first and first:
+                raise RuntimeError("truncated response")
+            items = json.loads(re.search(r"(\[.*\])\. Return", prompt).group(1))
+            grades = {e["id"]: {"grade": "Moderate (B)", "rationale": "RCT"} for e in items}
+            with self._lock:
+                # Each dropped PMID is missing from its first response only
+                dropped = self.drop & set(grades)
+                self.drop -= dropped
+            for pmid in dropped:
+                del grades[pmid]
+            return {"function_name": "grade_evidence", "arguments": {"grades": grades}}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_chunks_bounded_by_count_and_size():
+    items = _evidence(40)
+    chunks = chunk_evidence(items, max_items=15)
+    assert [len(c) for c in chunks] == [15, 15, 10]
+    long_titles = [{"id": str(i), "title": "x" * 900} for i in range(10)]
+    assert all(len(c) <= 2 for c in chunk_evidence(long_titles, max_items=15, max_chars=2000))
+
+
+def test_200_articles_graded_concurrently():
+    grader = _Grader(delay=0.2)
+    start = time.monotonic()
+    report = grade_evidence(_evidence(200), grader, max_workers=14, chunk_size=15, use_cache=False)
+    elapsed = time.monotonic() - start
+    assert len(report.grades) == 200 and not report.failed
+    assert report.calls == 14
+    # One round of calls, not fourteen sequential ones
+    assert elapsed < 0.2 * 3
+    assert grader.peak > 1
+
+
+def test_only_failed_pmids_are_retried():
+    items = _evidence(30)
+    grader = _Grader(drop={"1003", "1017"})
+    report = grade_evidence(items, grader, max_workers=2, chunk_size=15, use_cache=False)
+    assert len(report.grades) == 30
+    retry_prompt = grader.prompts[-1]
+    assert len(grader.prompts) == 3
+    assert '"1003"' in retry_prompt and '"1017"' in retry_prompt and '"1000"' not in retry_prompt
+
+
+def test_failed_chunk_retried_in_smaller_pieces():
+    grader = _Grader(fail_first=True)
+    report = grade_evidence(_evidence(10), grader, max_workers=1, chunk_size=10, use_cache=False)
+    assert len(report.grades) == 10
+    assert len(grader.prompts) == 3   # 1 failed chunk of 10, then 2 chunks of 5
+
+
+def test_cached_grades_skip_the_model():
+    items = _evidence(12)
+    first = _Grader()
+    grade_evidence(items, first, chunk_size=5)
+    again = _Grader()
+    report = grade_evidence(items, again, chunk_size=5)
+    assert report.cached == 12 and again.prompts == []
+    # A changed abstract invalidates that article's cached grade only
+    items[0] = dict(items[0], abstract="retracted and replaced")
+    third = _Grader()
+    report = grade_evidence(items, third, chunk_size=5)
+    assert report.cached == 11 and len(third.prompts) == 1
+
+
+def test_extract_and_apply():
+    bare = {"1": {"grade": "High (A)", "rationale": "SR"}, "2": "junk"}
+    assert extract_grades(bare) == {"1": {"grade": "High (A)", "rationale": "SR"}}
+    assert extract_grades({"grades": bare}) == extract_grades(bare)
+    assert extract_grades(None) == {}
+    evidence = [{"id": "1"}, {"id": 2, "grade": "Low (C)", "rationale": "kept"}, {"id": "3"}]
+    apply_grades(evidence, extract_grades(bare))
+    assert evidence[0]["grade"] == "High (A)"
+    assert evidence[1]["grade"] == "Low (C)"
+    assert evidence[2] == {"id": "3", "grade": "Un-graded", "rationale": "Not yet evaluated."}
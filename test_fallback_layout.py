@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for fallback_layout.py (pure-Python layered layout and SVG writer).
+
+Run with pytest (make units).
+"""
+
+import time
+import xml.dom.minidom
+
+from fallback_layout import layout_ir, render_svg
+from pathway_hardening import harden_nodes
+from pathway_ir import compile_pathway
+
+CHEST_PAIN = [
+    {"type": "Start", "label": "Patient arrives with chest pain"},
+    {"type": "Process", "label": "Obtain ECG within 10 minutes", "notes": "Door-to-ECG < 10 min"},
+    {"type": "Decision", "label": "STEMI on ECG?", "branches": [{"label": "Yes", "target": 3}, {"label": "No", "target": 4}]},
+    {"type": "Process", "label": "Activate cath lab"},
+    {"type": "Decision", "label": "Troponin elevated?", "branches": [{"label": "Yes", "target": 5}, {"label": "No", "target": 6}]},
+    {"type": "End", "label": "Admit"},
+    {"type": "End", "label": "Discharge & follow up"},
+]
+
+
+def _long_pathway(n):
+    nodes = [{"type": "Start", "label": "Arrive"}]
+    for i in range(1, n - 2):
+        if i % 6 == 0:
+            nodes.append({"type": "Decision", "label": f"Check {i}?",
+                          "branches": [{"label": "Yes", "target": i + 1}, {"label": "No", "target": i + 2}]})
+        else:
+            nodes.append({"type": "Process", "label": f"Step {i}"})
+    return nodes + [{"type": "End", "label": "Admit"}, {"type": "End", "label": "Discharge"}]
+
+
+def test_layers_follow_edges_and_ends_share_bottom():
+    ir = compile_pathway(CHEST_PAIN, "TD", prepare=harden_nodes)
+    layout = layout_ir(ir)
+    real = {nd.key: nd for nd in layout.nodes if nd.key is not None}
+    for edge in ir.edges:
+        assert real[edge.src].y < real[edge.dst].y
+    assert real[5].y == real[6].y == max(nd.y for nd in real.values())
+    assert layout.crossings == 0
+
+
+def test_svg_is_well_formed_and_escaped():
+    svg = render_svg(compile_pathway(CHEST_PAIN, "LR", prepare=harden_nodes))
+    doc = xml.dom.minidom.parseString(svg)
+    assert doc.documentElement.tagName == "svg"
+    assert b"Discharge &amp; follow up" in svg and b"NOTES:" in svg
+    assert svg.count(b"<polygon") == 2 and svg.count(b"<ellipse") == 3
+
+
+def test_cycles_and_self_loops():
+    nodes = [{"type": "Start", "label": "S"},
+             {"type": "Decision", "label": "Q", "branches": [{"label": "Again", "target": 0}, {"label": "Stay", "target": 1}]},
+             {"type": "End", "label": "E"}]
+    svg = render_svg(compile_pathway(nodes, "TD"))
+    xml.dom.minidom.parseString(svg)
+    assert b"Again" in svg and b"Stay" in svg
+    xml.dom.minidom.parseString(render_svg(compile_pathway([], "TD")))
+
+
+def test_large_pathway_is_fast():
+    ir = compile_pathway(_long_pathway(500), "TD", prepare=harden_nodes)
+    start = time.perf_counter()
+    layout = layout_ir(ir)
+    render_svg(ir, layout)
+    assert time.perf_counter() - start < 2.0
+    assert layout.sweeps <= 8
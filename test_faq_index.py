@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for faq_index.py (BM25 retrieval for the in-app assistant).
+
+Run with pytest (make units).
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from faq_index import FaqIndex, build_default_index, load_guide_sections, tokenize
+
+
+def test_tokenize_drops_stopwords_and_normalizes():
+    assert tokenize("What are the five Phases?") == ["5", "phase"]
+    assert tokenize("Building decision trees") == ["build", "decision", "tree"]
+    assert tokenize("") == []
+
+
+def test_confident_questions_are_answered_locally():
+    index = build_default_index()
+    expected = {
+        "What are the 5 phases?": "The 5 phases",
+        "How do I add evidence in Phase 2?": "Phase 2: Appraise Evidence",
+        "How do I create a decision tree in Phase 3?": "Phase 3: Build Decision Tree",
+        "Where do I get a Gemini API key?": "API key and models",
+        "How do I resume my project later?": "Saving and resuming a project",
+    }
+    for question, title in expected.items():
+        hit = index.answer(question)
+        assert hit is not None and hit.title == title, (question, hit and hit.title)
+
+
+def test_out_of_scope_questions_fall_through():
+    index = build_default_index()
+    assert index.answer("How do I cook pasta?") is None
+    assert index.answer("What is the capital of France?") is None
+    assert index.answer("") is None
+    # One content word, or a weak partial match, is not enough to skip the LLM
+    assert index.answer("what is a pathway?") is None
+    assert index.answer("is my data stored") is None
+    assert index.answer("what is a pathway?", min_confidence=0.0, min_terms=1) is not None
+
+
+def test_confidence_and_ranking():
+    index = FaqIndex([
+        ("Sepsis", "sepsis lactate antibiotics", "A1", "faq"),
+        ("Chest pain", "chest pain troponin ecg", "A2", "faq"),
+        ("Stroke", "stroke imaging thrombolysis", "A3", "faq"),
+    ], min_confidence=0.3)
+    hits = index.search("troponin for chest pain")
+    assert hits[0].answer == "A2" and hits[0].matched == 3 and 0.3 < hits[0].confidence < 1.0
+    assert hits[0].index == 1
+    partial = index.search("troponin chest zebrafish")[0]
+    assert partial.matched == 2 and 0 < partial.confidence < 0.3
+    assert index.answer("troponin chest zebrafish") is None
+    assert index.answer("troponin chest zebrafish", min_confidence=0.0).answer == "A2"
+    # A single matched term never clears min_terms, whatever its confidence
+    assert index.answer("troponin", min_confidence=0.0) is None
+    assert index.answer("troponin", min_confidence=0.0, min_terms=1).answer == "A2"
+
+
+def test_guide_sections_and_query_speed():
+    tmp = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmp, "GUIDE.md"), "w") as fh:
+            fh.write("# Guide\n\n## Troubleshooting\n\n### CSV Download Not Working\n"
+                     "Open the HTML file in Chrome or Edge and allow downloads for local files.\n"
+                     "```\n# not a heading\n```\n")
+        sections = load_guide_sections(["GUIDE.md", "MISSING.md"], tmp)
+        assert [s[0] for s in sections] == ["Guide › Troubleshooting › CSV Download Not Working"]
+        assert "# not a heading" in sections[0][1]
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    index = build_default_index()
+    start = time.perf_counter()
+    for _ in range(100):
+        index.answer("How do I share the education module certificate?")
+    assert (time.perf_counter() - start) / 100 < 0.01
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for feedback_store.py (append-only feedback log with running aggregates).
+
+Run with pytest (make units).
+"""
+
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from feedback_store import CSV_HEADER, FeedbackStore
+
+
+def _filled(n=7):
+    store = FeedbackStore(":memory:")
+    for i in range(n):
+        store.append(i % 11, f"comment {i}", "sidebar" if i % 2 else "Phase 3",
+                     "Sepsis" if i < 4 else "", timestamp=f"2026-01-01T00:00:{i:02d}")
+    return store
+
+
+def test_aggregates_track_every_append():
+    store = _filled()
+    summary = store.summary()
+    assert summary["count"] == 7 and summary["mean"] == sum(range(7)) / 7
+    assert summary["by_phase"]["sidebar"] == {"count": 3, "mean": (1 + 3 + 5) / 3}
+    assert summary["by_condition"]["Sepsis"]["count"] == 4
+    store.append(None, "no rating")
+    summary = store.summary()
+    assert summary["count"] == 8 and summary["mean"] == sum(range(7)) / 7
+
+
+def test_pages_are_newest_first_and_keyed_by_id():
+    store = _filled()
+    first = store.page(limit=3)
+    assert [r["feedback_text"] for r in first] == ["comment 6", "comment 5", "comment 4"]
+    second = store.page(before_id=first[-1]["id"], limit=3)
+    assert [r["feedback_text"] for r in second] == ["comment 3", "comment 2", "comment 1"]
+    assert len(store.page(before_id=second[-1]["id"], limit=3)) == 1
+    assert store.get(first[0]["id"])["rating"] == 6 and store.get(999) is None
+
+
+def test_csv_export_streams_in_chunks():
+    store = _filled()
+    chunks = list(store.iter_csv(chunk_rows=3))
+    assert len(chunks) == 3
+    rows = list(csv.reader(io.StringIO("".join(chunks))))
+    assert tuple(rows[0]) == CSV_HEADER and len(rows) == 8
+    assert rows[1] == ["2026-01-01T00:00:00", "0", "comment 0", "Phase 3", "Sepsis"]
+    assert store.export_csv() == "".join(chunks)
+
+
+def test_legacy_json_files_are_imported_once():
+    tmp = tempfile.mkdtemp()
+    try:
+        for i, rating in enumerate((8, 10)):
+            with open(os.path.join(tmp, f"feedback_{1000 + i}.json"), "w") as f:
+                json.dump({"timestamp": f"2025-06-0{i + 1}T10:00:00", "rating": rating,
+                           "feedback_text": "ok", "phase": "sidebar", "pathway_condition": ""}, f)
+        store = FeedbackStore(os.path.join(tmp, "feedback.sqlite"))
+        assert store.import_legacy_dir(tmp) == 2
+        assert store.import_legacy_dir(tmp) == 0
+        reopened = FeedbackStore(os.path.join(tmp, "feedback.sqlite"))
+        assert reopened.import_legacy_dir(tmp) == 0
+        assert reopened.summary()["count"] == 2 and reopened.summary()["mean"] == 9
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
@@ -44,7 +44,7 @@ refine_checks = {
     "text_area": 'st.text_area(' in streamlit_code and 'p4_refine_notes' in streamlit_code,
     "apply_button": 'st.button("Apply Refinements"' in streamlit_code and 'p4_apply_refine' in streamlit_code,
     "regenerate_function_call": 'regenerate_nodes_with_refinement(nodes, refine_with_file, h_data)' in streamlit_code,
-    "updates_session_state": "st.session_state.data['phase3']['nodes'] = refined" in streamlit_code,
+    "updates_session_state": 'set_pathway_nodes(refined, "Refined pathway")' in streamlit_code,
     "clears_cache": "p4_state['viz_cache'] = {}" in streamlit_code,
     "triggers_rerun": "st.rerun()" in streamlit_code,
 }
@@ -82,7 +82,7 @@ print("=" * 60)
 
 flowchart_checks = {
     "cache_cleared_on_update": "p4_state['viz_cache'] = {}" in streamlit_code,
-    "nodes_updated": "st.session_state.data['phase3']['nodes'] = refined" in streamlit_code,
+    "nodes_updated": 'set_pathway_nodes(refined, "Refined pathway")' in streamlit_code,
     "rerun_triggered": "st.rerun()" in streamlit_code and "Apply Refinements" in streamlit_code,
     "graphviz_rebuild": "build_graphviz_from_nodes(nodes_for_viz, \"TD\")" in streamlit_code,
     "svg_recalculated": "svg_bytes = cache.get(sig, {}).get(\"svg\")" in streamlit_code,
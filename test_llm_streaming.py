@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests for llm_streaming.py (incremental JSON parsing of streamed responses).
+
+Run with pytest (make units).
+"""
+
+import json
+from types import SimpleNamespace
+
+from llm_streaming import JSONArrayStreamParser, JSONObjectStreamParser, collect_stream
+
+NODES = [
+    {"type": "Start", "label": "Chest pain [ED]", "evidence": "N/A"},
+    {"type": "Decision", "label": "STEMI on \"ECG\"?", "branches": [
+        {"label": "Yes", "target": 2}, {"label": "No", "target": 3}]},
+    {"type": "End", "label": "Cath lab, {activate}", "evidence": "12345678"},
+    {"type": "End", "label": "Serial troponin", "evidence": "N/A"},
+]
+
+
+def _chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _fake_chunk(text="", thought=False):
+    part = SimpleNamespace(text=text, thought=thought)
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+def test_array_elements_emitted_as_they_complete():
+    text = "```json\n" + json.dumps(NODES, indent=2) + "\n```"
+    for size in (1, 7, 64, len(text)):
+        parser = JSONArrayStreamParser()
+        seen = []
+        for piece in _chunks(text, size):
+            seen.extend(parser.feed(piece))
+        assert seen == NODES, size
+        assert parser.done
+
+
+def test_first_element_available_before_stream_ends():
+    text = json.dumps(NODES)
+    parser = JSONArrayStreamParser()
+    cut = text.index("}") + 2   # just past the first node and its comma
+    assert parser.feed(text[:cut]) == [NODES[0]]
+    assert parser.feed(text[cut:]) == NODES[1:]
+
+
+def test_array_inside_object_and_scalars():
+    parser = JSONArrayStreamParser(key="nodes")
+    assert parser.feed('{"meta": [9], "nodes": [1, "two", true, null, {"a": [3]}]}') == \
+        [1, "two", True, None, {"a": [3]}]
+    # Without a key the first array-valued member is used
+    assert JSONArrayStreamParser().feed('{"meta": [9], "nodes": [1]}') == [9]
+
+
+def test_object_fields_and_collect_stream():
+    payload = {"learning_objectives": ["a", "b"], "teaching_points": ["x, y"], "score": 3}
+    text = json.dumps(payload)
+    chunks = [_fake_chunk("thinking...", thought=True)] + [_fake_chunk(p) for p in _chunks(text, 5)]
+    fields = []
+    texts = []
+    result = collect_stream(iter(chunks), on_text=texts.append, parser=JSONObjectStreamParser(),
+                            on_item=lambda i, item: fields.append((i, item)))
+    # Thought parts are not part of the answer text
+    assert result.text == text
+    assert len(result.chunks) == len(chunks)
+    assert [item for _, item in fields] == list(payload.items())
+    assert [i for i, _ in fields] == [0, 1, 2]
+    assert texts[-1] == text
+
+
+def test_truncated_stream_yields_only_complete_items():
+    text = json.dumps(NODES)
+    parser = JSONArrayStreamParser()
+    seen = parser.feed(text[: text.index("Cath lab")])
+    assert seen == NODES[:2]
+    assert not parser.done
+
+
+def test_streamed_nodes_use_the_function_declaration_schema():
+    from gemini_functions import GENERATE_PATHWAY_NODES, argument_schema
+
+    schema = argument_schema(GENERATE_PATHWAY_NODES, "nodes")
+    assert schema is GENERATE_PATHWAY_NODES.parameters.properties["nodes"]
+    assert schema.items.required == ["type", "label", "evidence"]
+    assert list(schema.items.properties["type"].enum) == ["Start", "Decision", "Process", "End"]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests for model_cascade.py (sequential and hedged Gemini model cascades,
+quota circuit breaker).
+
+Run with pytest (make units).
+"""
+
+import time
+
+from model_cascade import ModelHealthRegistry, parse_retry_delay, run_hedged, run_sequential
+
+
+def _fake_attempt(behaviour):
+    """behaviour: model -> (delay_seconds, ok, value) or an Exception instance."""
+    calls = []
+
+    def attempt(model):
+        calls.append(model)
+        spec = behaviour[model]
+        if isinstance(spec, Exception):
+            raise spec
+        delay, ok, value = spec
+        time.sleep(delay)
+        return ok, value
+
+    return attempt, calls
+
+
+def test_sequential_skips_failures():
+    attempt, calls = _fake_attempt({
+        "flash": RuntimeError("429 RESOURCE_EXHAUSTED"),
+        "lite": (0, False, None),
+        "pro": (0, True, "answer"),
+    })
+    result = run_sequential(["flash", "lite", "pro"], attempt, registry=ModelHealthRegistry(), pause=0)
+    assert result.ok and result.model == "pro" and result.value == "answer"
+    assert calls == ["flash", "lite", "pro"]
+    assert [m for m, _ in result.failures] == ["flash", "lite"]
+
+
+def test_hedged_takes_first_valid_response():
+    attempt, calls = _fake_attempt({
+        "slow": (0.5, True, "slow answer"),
+        "fast": (0.01, True, "fast answer"),
+    })
+    start = time.monotonic()
+    result = run_hedged(["slow", "fast"], attempt, registry=ModelHealthRegistry(), hedge_delay=0.05)
+    elapsed = time.monotonic() - start
+    assert result.ok and result.value == "fast answer"
+    assert elapsed < 0.4
+    assert calls == ["slow", "fast"]
+
+
+def test_hedged_failure_starts_next_immediately():
+    attempt, calls = _fake_attempt({
+        "flash": RuntimeError("429 quota"),
+        "lite": (0, True, {"arguments": {"nodes": []}}),
+    })
+    start = time.monotonic()
+    result = run_hedged(["flash", "lite"], attempt, registry=ModelHealthRegistry(), hedge_delay=5)
+    assert result.ok and result.model == "lite"
+    assert time.monotonic() - start < 1
+
+
+def test_hedged_all_fail():
+    attempt, _ = _fake_attempt({"a": RuntimeError("boom"), "b": (0, False, None)})
+    result = run_hedged(["a", "b"], attempt, registry=ModelHealthRegistry(), hedge_delay=0.01)
+    assert not result.ok
+    assert sorted(m for m, _ in result.failures) == ["a", "b"]
+
+
+def test_hedge_delay_adapts_to_latency():
+    registry = ModelHealthRegistry()
+    assert registry.hedge_delay("flash", "grade_evidence") == 10.0
+    for _ in range(10):
+        registry.record("flash", 3.0, True, task="grade_evidence")
+    delay = registry.hedge_delay("flash", "grade_evidence")
+    assert 2.0 <= delay < 5.0
+    # A different task keeps its own history
+    assert registry.hedge_delay("flash", "generate_pathway_nodes") == 10.0
+    # Cap from the caller's timeout
+    assert registry.hedge_delay("other", cap=4.0) == 4.0
+
+
+def test_parse_retry_delay():
+    assert parse_retry_delay("429 RESOURCE_EXHAUSTED ... 'retryDelay': '37s'") == 37.0
+    assert parse_retry_delay("Quota exceeded. Please retry in 12.5s.") == 12.5
+    assert parse_retry_delay("500 internal") is None
+
+
+def test_quota_error_opens_breaker_for_that_key_only():
+    registry = ModelHealthRegistry()
+    registry.record("flash", 0.1, False, error="429 quota, retryDelay: '30s'", scope="key-a")
+    assert registry.order_candidates(["flash", "lite"], scope="key-a") == ["lite"]
+    assert 25 < registry.cooldown_remaining("flash", "key-a") <= 30
+    # Another API key is unaffected
+    assert registry.order_candidates(["flash", "lite"], scope="key-b") == ["flash", "lite"]
+
+
+def test_all_cooling_returns_soonest_and_half_open_probe():
+    registry = ModelHealthRegistry()
+    registry.record("flash", 0.1, False, error="429 retryDelay: '40s'")
+    registry.record("lite", 0.1, False, error="429 retryDelay: '5s'")
+    assert registry.order_candidates(["flash", "lite"]) == ["lite"]
+    # Expire the breaker: asking (even repeatedly) claims nothing
+    registry._circuits[("", "lite")].open_until = time.time() - 1
+    assert registry.is_available("lite") and registry.is_available("lite")
+    assert registry.order_candidates(["flash", "lite"]) == ["lite"]
+    # Exactly one starting attempt gets the probe
+    assert registry.claim_probe("lite")
+    assert not registry.claim_probe("lite") and not registry.is_available("lite")
+    registry.record("lite", 0.2, True)
+    assert registry.is_available("lite") and registry.cooldown_remaining("lite") == 0
+
+
+def test_runner_skips_model_whose_probe_is_in_flight():
+    registry = ModelHealthRegistry()
+    registry.record("flash", 0.1, False, error="429 retryDelay: '5s'")
+    registry._circuits[("", "flash")].open_until = time.time() - 1
+    assert registry.claim_probe("flash")
+    calls = []
+
+    def attempt(model):
+        calls.append(model)
+        return True, model
+
+    result = run_sequential(["flash", "lite"], attempt, registry=registry, pause=0)
+    assert result.value == "lite" and calls == ["lite"]
+    # The skip isn't recorded as a failure of the model being probed
+    assert registry._stats.get(("flash", "")).failures == 1
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for pathway_clusters.py (scale mode for very large pathways).
+
+Run with pytest (make units).
+"""
+
+from pathway_clusters import (cluster_indices, compile_scale_plan, emit_cluster_dot,
+                              emit_overview_dot, needs_scale_mode)
+from pathway_hardening import harden_nodes
+
+
+def _big_pathway(n, stage_every=None):
+    nodes = [{"type": "Start", "label": "Arrive"}]
+    for i in range(1, n - 2):
+        if i % 9 == 0:
+            nodes.append({"type": "Decision", "label": f"Check {i}?",
+                          "branches": [{"label": "Yes", "target": i + 1}, {"label": "No", "target": n - 1}]})
+        else:
+            nodes.append({"type": "Process", "label": f"Step {i}", "notes": f"Note for {i}" if i % 7 == 0 else ""})
+    nodes += [{"type": "End", "label": "Admit"}, {"type": "End", "label": "Discharge"}]
+    if stage_every:
+        for i, node in enumerate(nodes):
+            node["stage"] = f"Stage {i // stage_every}"
+    return nodes
+
+
+def test_threshold():
+    assert not needs_scale_mode(_big_pathway(50), threshold=150)
+    assert needs_scale_mode(_big_pathway(500), threshold=150)
+
+
+def test_clusters_partition_and_bounded_size():
+    nodes = _big_pathway(600)
+    plan = compile_scale_plan(nodes, "TD", prepare=harden_nodes)
+    members = [i for c in plan.clusters for i in c.members]
+    assert members == list(range(len(nodes)))
+    assert all(len(c.members) <= 40 for c in plan.clusters)
+    # Cuts prefer Decision nodes (decision subtrees)
+    assert all(plan.ir.nodes[c.members[0]].type == "Decision" for c in plan.clusters[1:-1])
+
+
+def test_stage_clustering():
+    types = ["Process"] * 30
+    groups = cluster_indices(types, [(i, i + 1, "") for i in range(29)], [f"S{i // 10}" for i in range(30)])
+    assert groups == [list(range(0, 10)), list(range(10, 20)), list(range(20, 30))]
+    plan = compile_scale_plan(_big_pathway(200, stage_every=50), "TD", prepare=harden_nodes)
+    assert [c.title for c in plan.clusters][:3] == ["1. Stage 0", "2. Stage 0 (cont.)", "3. Stage 1"]
+
+
+def test_cluster_dot_has_stubs_and_local_legend():
+    plan = compile_scale_plan(_big_pathway(300), "TD", prepare=harden_nodes)
+    dot = emit_cluster_dot(plan, 1)
+    assert "FromC0" in dot and "style=dashed" in dot
+    assert "(Note 1)" in dot and "NotesLegend" in dot
+    assert "Note for 7]" not in dot   # Notes of other clusters are not in this legend
+    overview = emit_overview_dot(plan)
+    assert all(c.id in overview for c in plan.clusters) and "C0 -> C1" in overview
+
+
+def test_edit_rekeys_only_its_cluster():
+    nodes = _big_pathway(400)
+    plan = compile_scale_plan(nodes, "TD", prepare=harden_nodes)
+    edited = [dict(n) for n in nodes]
+    target = plan.clusters[3].members[2]
+    edited[target]["label"] = "Renamed step"
+    plan2 = compile_scale_plan(edited, "TD", prepare=harden_nodes)
+    changed = [a.number for a, b in zip(plan.clusters, plan2.clusters) if a.key != b.key]
+    assert changed == [3]
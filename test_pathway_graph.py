@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tests for pathway_graph.py (shared edge computation and graph index).
+
+Run with pytest (make units).
+"""
+
+import sys
+import time
+
+from pathway_graph import EdgeIndex, GraphIndex, cached_edges, compute_edges, get_edge_memo
+
+
+def _branching():
+    return [
+        {"type": "Start", "label": "Chest pain"},
+        {"type": "Decision", "label": "STEMI?", "branches": [{"label": "Yes", "target": 2}, {"label": "No", "target": 4}]},
+        {"type": "Process", "label": "Activate cath lab"},
+        {"type": "Process", "label": "PCI"},
+        {"type": "Process", "label": "Serial troponin"},
+        {"type": "End", "label": "Admit"},
+    ]
+
+
+def _long_pathway(decisions):
+    """Start, then repeated Decision -> two Process branches -> reconverge, then End."""
+    nodes = [{"type": "Start", "label": "Start"}]
+    for _ in range(decisions):
+        i = len(nodes)
+        nodes.append({"type": "Decision", "label": "d", "branches": [
+            {"label": "Yes", "target": i + 1}, {"label": "No", "target": i + 2}]})
+        nodes.append({"type": "Process", "label": "yes"})
+        nodes.append({"type": "Process", "label": "no"})
+    nodes.append({"type": "End", "label": "End"})
+    return nodes
+
+
+def test_branch_regions_reconverge():
+    edges = compute_edges(_branching())
+    assert edges == [(0, 1, ""), (1, 2, "Yes"), (1, 4, "No"), (2, 3, ""), (3, 5, ""), (4, 5, "")]
+    index = GraphIndex(_branching())
+    assert index.succ[1] == [2, 4] and index.pred[5] == [3, 4]
+    assert all(index.reachable) and not index.has_cycle
+    order = index.topological_order()
+    assert order[0] == 0 and order[-1] == 5
+
+
+def test_unreachable_and_malformed_nodes():
+    nodes = [
+        {"type": "Start", "label": "s"},
+        {"type": "End", "label": "e"},
+        "not a node",
+        {"type": "Decision", "label": "d", "branches": [{"label": "x", "target": 99}, "junk"]},
+    ]
+    index = GraphIndex(nodes)
+    assert index.unreachable() == [2, 3]
+    assert index.branch_targets(3) == [99]
+    assert index.node_type(2) == "Process"
+
+
+def test_cycles_found_iteratively():
+    nodes = [
+        {"type": "Start", "label": "s"},
+        {"type": "Process", "label": "p"},
+        {"type": "Decision", "label": "again?", "branches": [{"label": "Yes", "target": 1}, {"label": "No", "target": 3}]},
+        {"type": "End", "label": "e"},
+    ]
+    index = GraphIndex(nodes)
+    assert index.has_cycle and index.sccs == [[1, 2]]
+    assert index.topological_order() is None
+    assert GraphIndex([{"type": "Process", "label": "self", "target": 0}]).sccs == [[0]]
+
+
+def test_thousand_node_pathway_is_linear_and_recursion_free():
+    nodes = _long_pathway(1500)   # 4,502 nodes; the old recursive DFS overflowed here
+    assert len(nodes) > sys.getrecursionlimit()
+    start = time.monotonic()
+    index = GraphIndex(nodes)
+    elapsed = time.monotonic() - start
+    assert all(index.reachable) and not index.has_cycle
+    assert len(index.topological_order()) == len(nodes)
+    nodes[-2]["target"] = 1
+    assert GraphIndex(nodes).has_cycle
+    assert elapsed < 2.0
+
+
+def test_memo_shared_and_ignores_text_edits():
+    memo = get_edge_memo()
+    memo.clear()
+    nodes = _branching()
+    for _ in range(4):   # Mermaid, DOT, Graphviz, validation on one rerun
+        assert cached_edges(nodes) == compute_edges(nodes)
+    assert (memo.hits, memo.misses) == (3, 1)
+    nodes[2]["label"] = "Activate cath lab within 90 min"
+    nodes[2]["notes"] = "door-to-balloon"
+    cached_edges(nodes)
+    assert memo.misses == 1
+    nodes[1]["branches"][0]["label"] = "Confirmed"
+    assert cached_edges(nodes)[1] == (1, 2, "Confirmed")
+    assert memo.misses == 2
+
+
+def test_update_reemits_only_edited_subtree():
+    nodes = _long_pathway(200)
+    index = EdgeIndex()
+    index.update(nodes)
+    assert index.last_dirty == len(nodes)
+    # Retarget one decision's "No" branch to its own "yes" node
+    nodes[301]["branches"][1]["target"] = 302
+    edges = index.update(nodes)
+    assert edges == compute_edges(nodes)
+    assert index.last_dirty <= 3
+    # Inserting a node shifts indices, so everything is rebuilt
+    nodes.insert(5, {"type": "Process", "label": "new"})
+    assert index.update(nodes) == compute_edges(nodes)
+    assert index.last_dirty == len(nodes)
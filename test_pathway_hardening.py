@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for pathway_hardening.py (non-mutating node normalization with a journal).
+
+Run with pytest (make units).
+"""
+
+import copy
+
+from pathway_hardening import harden_nodes, harden_nodes_with_journal, last_harden_journal
+import pathway_hardening
+
+RAW = [
+    {"type": "Start", "label": "Chest\\npain   arrives"},
+    {"type": "Decision", "label": "STEMI?", "branches": [{"target": 2}]},
+    {"type": "Process", "notes": "Give  ASA\n"},
+    {"type": "Decision", "label": "Troponin positive?"},
+    {"type": "End", "label": "Cath lab"},
+    {"type": "End", "label": "Discharge"},
+]
+
+
+def test_input_is_not_mutated():
+    raw = copy.deepcopy(RAW)
+    hardened, _ = harden_nodes_with_journal(raw)
+    assert raw == RAW
+    hardened[1]["branches"][0]["label"] = "changed"
+    assert "label" not in raw[1]["branches"][0]
+
+
+def test_normalization_and_journal():
+    hardened, journal = harden_nodes_with_journal(RAW)
+    assert hardened[0]["label"] == "Chest pain arrives"
+    assert hardened[2]["label"] == "Step 3" and hardened[2]["notes"] == "Give ASA"
+    assert hardened[1]["branches"] == [{"target": 2, "label": "Option"}, {"label": "No", "target": 3}]
+    # No valid branches: the two End nodes after the Decision are used
+    assert hardened[3]["branches"] == [{"label": "Yes", "target": 4}, {"label": "No", "target": 5}]
+    fixes = {(i, fix) for i, fix, _ in journal}
+    assert {(0, "label_cleaned"), (1, "branch_label"), (1, "branch_added"),
+            (2, "label"), (2, "notes_cleaned"), (3, "branches_default")} <= fixes
+    assert all(fix == "id" for i, fix, _ in journal if i == 4)
+
+
+def test_out_of_range_targets_clamped_and_junk_dropped():
+    nodes = [{"type": "Decision", "label": "Q", "branches": [{"target": 9, "label": "Y"}, "junk", {"target": -2}]},
+             {"type": "End", "label": "E"}]
+    hardened, journal = harden_nodes_with_journal(nodes + [42])
+    assert len(hardened) == 2
+    assert [b["target"] for b in hardened[0]["branches"]] == [2, 0]
+    assert (2, "dropped", "int") in journal
+    assert (0, "branches_dropped", 1) in journal
+
+
+def test_unchanged_input_skips_work():
+    nodes = copy.deepcopy(RAW)
+    first = harden_nodes(nodes)
+    hits = pathway_hardening._last_hardened.hits
+    second = harden_nodes(nodes)
+    assert second == first and second is not first
+    assert pathway_hardening._last_hardened.hits == hits + 1
+    assert last_harden_journal(nodes) == harden_nodes_with_journal(nodes)[1]
+    assert harden_nodes("not a list") == []
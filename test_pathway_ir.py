@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for pathway_ir.py (one compiled diagram IR, thin exporters).
+
+Run with pytest (make units).
+"""
+
+from pathway_ir import compile_pathway, emit_dot, emit_graphviz, emit_markdown, emit_mermaid, graphviz
+
+
+def _nodes():
+    return [
+        {"type": "Start", "label": 'Chest pain "acute"', "notes": "Triage < 10 min", "role": "Nurse"},
+        {"type": "Decision", "label": "STEMI? | ECG", "branches": [{"label": "Yes", "target": 2}, {"label": "No", "target": 3}]},
+        {"type": "Process", "label": "Activate the cardiac catheterization laboratory team"},
+        {"type": "Reevaluation", "label": "Serial troponin"},
+        {"type": "End", "label": "Admit"},
+    ]
+
+
+def test_compiled_once_per_version():
+    calls = []
+
+    def prepare(nodes):
+        calls.append(1)
+        return nodes
+
+    nodes = _nodes()
+    first = compile_pathway(nodes, "TD", prepare=prepare)
+    # DOT, Graphviz and Mermaid exports of the same version share the IR
+    assert compile_pathway(nodes, "TD", prepare=prepare) is first
+    assert compile_pathway(_nodes(), "TD", prepare=prepare) is first
+    assert len(calls) == 1
+    assert compile_pathway(nodes, "LR", prepare=prepare) is not first
+    nodes[2]["label"] = "PCI"
+    assert compile_pathway(nodes, "TD", prepare=prepare) is not first
+
+
+def test_records_are_pre_escaped():
+    ir = compile_pathway(_nodes(), "TD", role_colors={"Nurse": "#E8F5E9"})
+    start, decision, process = ir.nodes[0], ir.nodes[1], ir.nodes[2]
+    assert start.dot_label == "Chest pain 'acute'\\n(Note 1)" and start.fill == "#E8F5E9"
+    assert start.mermaid_label == "Chest pain 'acute' &#91;Note 1&#93;"
+    assert decision.mermaid_label == "STEMI? &#124; ECG" and decision.shape == "diamond"
+    assert "\\n" in process.dot_label           # wrapped at 25 characters
+    assert ir.source_rank == "N0" and ir.sink_rank == ["N4"] and ir.same_ranks == [["N2", "N3"]]
+    assert [(e.src, e.dst, e.label) for e in ir.edges][:3] == [(0, 1, ""), (1, 2, "Yes"), (1, 3, "No")]
+    assert ir.notes == [(1, "Triage < 10 min")]
+
+
+def test_emitters_agree():
+    ir = compile_pathway(_nodes(), "TD")
+    dot = emit_dot(ir)
+    mermaid = emit_mermaid(ir)
+    assert dot.startswith("digraph G {\n  rankdir=TB;") and '  N1 -> N2 [label="Yes"];' in dot
+    assert "NotesLegend" in dot and "{ rank=sink; N4; }" in dot
+    assert mermaid.startswith("graph TD") and '    N1 -->|"Yes"| N2' in mermaid
+    assert '    N3[/"Serial troponin"\\]' in mermaid and "class N0,N4 startEnd" in mermaid
+    assert "classDef" not in emit_mermaid(ir, include_styling=False)
+    markdown = emit_markdown(ir, title="Chest Pain")
+    assert markdown.startswith("# Chest Pain") and "```mermaid\n" + mermaid in markdown
+    assert "2. **Decision:** STEMI? | ECG" in markdown and "   - Yes → step 3" in markdown
+    if graphviz is not None:
+        g = emit_graphviz(ir)
+        assert 'N1 -> N2 [label=Yes]' in g.source and "rank=source" in g.source
+
+
+def test_empty_pathway():
+    ir = compile_pathway([], "TD")
+    assert emit_mermaid(ir) == "graph TD\n    NoNodes[No pathway nodes defined]"
+    assert "->" not in emit_dot(ir)
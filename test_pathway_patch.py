@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for pathway_patch.py (edit-list refinement protocol).
+
+Run with pytest (make units).
+"""
+
+import copy
+
+from pathway_patch import (
+    PatchError, apply_patch, describe_patch, format_indexed_nodes, patch_instructions, validate_patch,
+)
+
+NODES = [
+    {"type": "Start", "label": "Chest pain in ED", "evidence": "N/A"},                         # 0
+    {"type": "Process", "label": "ECG within 10 min", "evidence": "N/A"},                        # 1
+    {"type": "Decision", "label": "STEMI?", "evidence": "N/A",
+     "branches": [{"label": "Yes", "target": 3}, {"label": "No", "target": 4}]},                # 2
+    {"type": "End", "label": "Activate cath lab", "evidence": "N/A"},                           # 3
+    {"type": "Process", "label": "Troponin at 0 h", "evidence": "N/A"},                         # 4
+    {"type": "Decision", "label": "Troponin elevated?", "evidence": "N/A",
+     "branches": [{"label": "Yes", "target": 6}, {"label": "No", "target": 7}]},                # 5
+    {"type": "End", "label": "Admit to cardiology", "evidence": "N/A"},                         # 6
+    {"type": "End", "label": "Discharge with follow-up", "evidence": "N/A"},                    # 7
+]
+
+
+def test_update_only_touches_named_fields():
+    original = copy.deepcopy(NODES)
+    result = apply_patch(NODES, [{"op": "update", "index": 4, "node": {"label": "hs-troponin at 0 and 3 h",
+                                                                        "evidence": "PMID 123"}}])
+    assert NODES == original
+    assert result[4] == {"type": "Process", "label": "hs-troponin at 0 and 3 h", "evidence": "PMID 123"}
+    assert result[:4] == NODES[:4] and result[5:] == NODES[5:]
+
+
+def test_insert_and_delete_rewire_branch_targets():
+    result = apply_patch(NODES, [
+        {"op": "insert", "index": 3, "node": {"type": "Process", "label": "Aspirin 324 mg PO", "evidence": "N/A"}},
+        {"op": "delete", "index": 4},
+        {"op": "retarget", "index": 2, "branches": [{"label": "Yes", "target": 3}, {"label": "No", "target": 5}]},
+    ])
+    labels = [n["label"] for n in result]
+    assert labels[3] == "Aspirin 324 mg PO" and "Troponin at 0 h" not in labels and len(result) == 8
+    # Yes still reaches the cath lab (shifted by the insert); No skips the deleted node as retargeted
+    assert result[2]["branches"] == [{"label": "Yes", "target": 4}, {"label": "No", "target": 5}]
+    assert result[5]["label"] == "Troponin elevated?"
+    assert result[5]["branches"] == [{"label": "Yes", "target": 6}, {"label": "No", "target": 7}]
+
+
+def test_delete_of_a_branch_target_needs_the_decision_patched():
+    for end in (3, 7):
+        problems = validate_patch(NODES, [{"op": "delete", "index": end}])
+        assert len(problems) == 1 and f"node {end} is deleted" in problems[0]
+    try:
+        apply_patch(NODES, [{"op": "delete", "index": 3}])
+        assert False, "apply_patch rewired a branch into the next node"
+    except PatchError:
+        pass
+    result = apply_patch(NODES, [
+        {"op": "delete", "index": 3},
+        {"op": "update", "index": 2, "node": {"branches": [{"label": "Yes", "target": 6}, {"label": "No", "target": 4}]}},
+    ])
+    assert result[2]["branches"] == [{"label": "Yes", "target": 5}, {"label": "No", "target": 3}]
+    # Deleting the Decision together with its targets is fine
+    assert validate_patch(NODES, [{"op": "delete", "index": i} for i in (5, 6, 7)]) == []
+
+
+def test_new_nodes_are_addressed_as_count_plus_k():
+    n = len(NODES)
+    result = apply_patch(NODES, [
+        {"op": "insert", "index": 6, "node": {"type": "Process", "label": "Observation unit", "evidence": "N/A"}},
+        {"op": "insert", "node": {"type": "End", "label": "Transfer to PCI center", "evidence": "N/A"}},
+        {"op": "retarget", "index": 5, "branches": [{"label": "Yes", "target": 6}, {"label": "Equivocal", "target": n},
+                                                     {"label": "No", "target": 7}]},
+        {"op": "update", "index": 2, "node": {"branches": [{"label": "Yes, no cath lab", "target": float(n + 1)},
+                                                            {"label": "No", "target": 4}]}},
+    ])
+    assert result[6]["label"] == "Observation unit" and result[-1]["label"] == "Transfer to PCI center"
+    assert result[5]["branches"] == [{"label": "Yes", "target": 7}, {"label": "Equivocal", "target": 6},
+                                     {"label": "No", "target": 8}]
+    assert result[2]["branches"] == [{"label": "Yes, no cath lab", "target": 9}, {"label": "No", "target": 4}]
+
+
+def test_invalid_patches_are_rejected_whole():
+    bad = [
+        {"op": "rename", "index": 1},
+        {"op": "update", "index": 99, "node": {"label": "x"}},
+        {"op": "insert", "index": 2, "node": {"label": "No type"}},
+        {"op": "delete", "index": 4},
+        {"op": "update", "index": 4, "node": {"label": "also deleted"}},
+        {"op": "retarget", "index": 2, "branches": [{"label": "Yes", "target": 4}]},
+        {"op": "retarget", "index": 5, "branches": []},
+    ]
+    problems = validate_patch(NODES, bad)
+    assert len(problems) == 6       # The delete itself is fine
+    try:
+        apply_patch(NODES, bad)
+        assert False, "apply_patch accepted an invalid patch"
+    except PatchError as err:
+        assert err.problems == problems
+    assert validate_patch(NODES, {"operations": []}) == ["operations must be a list"]
+    assert validate_patch(NODES, [{"op": "delete", "index": i} for i in range(len(NODES))])[-1] == "patch deletes every node"
+
+
+def test_prompt_helpers():
+    text = format_indexed_nodes(NODES[:3])
+    lines = text.splitlines()
+    assert lines[0].startswith("Pathway keys:")
+    assert lines[3] == '2: {"t":"Decision","l":"STEMI?","b":[{"l":"Yes","to":3},{"l":"No","to":4}]}'
+    assert "use 8 + k" in patch_instructions(NODES)
+    assert describe_patch([{"op": "update"}, {"op": "update"}, {"op": "insert"}]) == "2 updated, 1 inserted"
+    assert describe_patch([]) == "no changes"
+
+
+def test_function_declaration_matches_operations():
+    from gemini_functions import PATCH_PATHWAY_NODES, PATHWAY_TOOLS
+    from pathway_patch import OPERATIONS
+
+    assert PATCH_PATHWAY_NODES in PATHWAY_TOOLS
+    op_schema = PATCH_PATHWAY_NODES.parameters.properties["operations"].items.properties["op"]
+    assert tuple(op_schema.enum) == OPERATIONS
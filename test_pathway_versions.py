@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for pathway_versions.py (structurally shared version store with undo/redo).
+
+Run with pytest (make units).
+"""
+
+from pathway_versions import VersionStore, node_fingerprint
+
+BASE = [
+    {"type": "Start", "label": "Arrive"},
+    {"type": "Decision", "label": "Sepsis screen positive?",
+     "branches": [{"label": "Yes", "target": 2}, {"label": "No", "target": 3}]},
+    {"type": "Process", "label": "Draw lactate", "notes": "Repeat in 2h if > 2"},
+    {"type": "End", "label": "Discharge"},
+]
+
+
+def _edited(nodes, index, **fields):
+    nodes = [dict(n) for n in nodes]
+    nodes[index].update(fields)
+    return nodes
+
+
+def test_unchanged_commit_is_noop_and_records_are_shared():
+    store = VersionStore()
+    v1 = store.commit(BASE, "base")
+    assert store.commit([dict(n) for n in BASE]) is v1
+    v2 = store.commit(_edited(BASE, 2, label="Draw lactate STAT"), "edit")
+    assert v2 is not v1
+    # Only the edited node got a new record
+    assert [a is b for a, b in zip(v1.records, v2.records)] == [True, True, False, True]
+    assert store.stats()["records"] == 5
+
+
+def test_undo_redo_and_branch_discard():
+    store = VersionStore()
+    store.commit(BASE, "base")
+    store.commit(_edited(BASE, 0, label="Arrive at ED"), "one")
+    store.commit(_edited(BASE, 0, label="Arrive at triage"), "two")
+    assert store.undo()[0]["label"] == "Arrive at ED"
+    assert store.undo()[0]["label"] == "Arrive"
+    assert store.undo() is None
+    assert store.redo()[0]["label"] == "Arrive at ED"
+    assert store.redo_depth == 1
+    store.commit(_edited(BASE, 3, label="Admit"), "three")
+    assert not store.can_redo() and store.undo_depth == 2
+
+
+def test_checkouts_are_independent_copies():
+    store = VersionStore()
+    store.commit(BASE)
+    store.commit(_edited(BASE, 0, label="x"))
+    nodes = store.undo()
+    nodes[1]["branches"][0]["target"] = 99
+    assert store.head.nodes()[1]["branches"][0]["target"] == 2
+    assert nodes[1] == {**BASE[1], "branches": [{"label": "Yes", "target": 99}, {"label": "No", "target": 3}]}
+
+
+def test_diff():
+    store = VersionStore()
+    store.commit(BASE)
+    changed = _edited(BASE, 2, notes="Repeat in 4h")
+    changed.insert(3, {"type": "Process", "label": "Start antibiotics"})
+    store.commit(changed)
+    diff = store.diff()
+    assert diff.changed == [(2, ["notes"])]
+    assert diff.added == [(3, {"type": "Process", "label": "Start antibiotics"})]
+    assert diff.summary() == "1 changed, 1 added"
+    assert not store.diff(store.head, store.head)
+
+
+def test_history_is_bounded():
+    store = VersionStore(max_versions=5)
+    for i in range(12):
+        store.commit(_edited(BASE, 0, label=f"v{i}"))
+    assert len(store.history()) == 5 and store.undo_depth == 4
+    assert node_fingerprint({"a": 1, "b": 2}) == node_fingerprint({"b": 2, "a": 1})
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for phase5_jobs.py (background job queue for Phase 5 deliverables).
+
+Run with pytest (make units).
+"""
+
+import threading
+import time
+
+from phase5_jobs import DONE, FAILED, JobRecords, Phase5JobQueue
+
+
+def _wait(job, timeout=5.0):
+    deadline = time.time() + timeout
+    while not job.done() and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_jobs_run_concurrently():
+    queue = Phase5JobQueue(max_workers=4)
+    barrier = threading.Barrier(4, timeout=5)
+
+    def build(report):
+        barrier.wait()       # Only passes if all four run at the same time
+        return "<html/>"
+
+    start = time.time()
+    jobs = [queue.submit("p1", kind, build) for kind in ("expert", "beta", "edu", "exec")]
+    assert all(_wait(job).status == DONE for job in jobs)
+    assert time.time() - start < 5
+    assert sorted(queue.jobs("p1")) == ["beta", "edu", "exec", "expert"]
+    queue.shutdown()
+
+
+def test_running_job_is_reused_and_progress_is_published():
+    queue = Phase5JobQueue(max_workers=2)
+    release = threading.Event()
+
+    def build(report):
+        report("learning_objectives", ["Recognize sepsis"])
+        release.wait(5)
+        return "done"
+
+    first = queue.submit("p1", "edu", build)
+    assert queue.submit("p1", "edu", build) is first
+    deadline = time.time() + 5
+    while not first.progress and time.time() < deadline:
+        time.sleep(0.01)
+    assert first.progress == {"learning_objectives": ["Recognize sepsis"]}
+    release.set()
+    assert _wait(first).result == "done"
+    assert queue.submit("p1", "edu", build) is not first
+    assert queue.stats["reused"] == 1
+    queue.shutdown()
+
+
+def test_failures_are_captured_on_the_record():
+    queue = Phase5JobQueue(inline=True)
+
+    def build(report):
+        raise RuntimeError("429 quota exceeded")
+
+    job = queue.submit("p1", "exec", build)
+    assert job.status == FAILED and "429" in job.error
+    assert queue.stats["failed"] == 1
+
+
+def test_records_survive_a_new_queue():
+    records = JobRecords(":memory:")
+    Phase5JobQueue(records=records, inline=True).submit("p1", "exec", lambda report: b"PK\x03\x04docx")
+    Phase5JobQueue(records=records, inline=True).submit("p1", "beta", lambda report: "<html>beta</html>")
+
+    restarted = Phase5JobQueue(records=records, inline=True)
+    jobs = restarted.jobs("p1")
+    # Status comes back without the result blobs; those load on demand
+    assert jobs["exec"].status == DONE and jobs["exec"].result is None
+    assert restarted.result(jobs["exec"]) == b"PK\x03\x04docx"
+    assert restarted.result(jobs["beta"]) == "<html>beta</html>"
+    assert restarted.jobs("p2") == {}
+
+
+def test_polling_reads_only_newest_rows_for_kinds_without_live_jobs():
+    records = JobRecords(":memory:")
+    old = Phase5JobQueue(records=records, inline=True)
+    old.submit("p1", "beta", lambda report: "<html>old</html>")
+    old.submit("p1", "beta", lambda report: "<html>new</html>")
+    old.submit("p1", "edu", lambda report: "<html>edu</html>")
+    newest = records.latest("p1")
+    assert sorted(newest) == ["beta", "edu"]
+    assert records.result(newest["beta"].id) == "<html>new</html>"
+    assert list(records.latest("p1", ["edu"])) == ["edu"] and records.latest("p1", []) == {}
+
+    calls = []
+    latest = records.latest
+    records.latest = lambda owner, kinds=None: calls.append(kinds) or latest(owner, kinds)
+    queue = Phase5JobQueue(records=records, inline=True)
+    live = queue.submit("p1", "beta", lambda report: "<html>live</html>")
+    assert queue.job("p1", "beta") is live and calls == []
+    assert queue.job("p1", "edu").status == DONE and calls == [["edu"]]
+    assert queue.jobs("p1")["beta"] is live
+
+
+def test_finished_jobs_do_not_accumulate_in_memory():
+    records = JobRecords(":memory:")
+    queue = Phase5JobQueue(records=records, inline=True, finished_ttl=0)
+    job = queue.submit("p1", "exec", lambda report: b"PK\x03\x04docx")
+    # The record holds the deliverable, so the live job lets go of it
+    assert job.status == DONE and job.result is None
+    assert queue.result(job) == b"PK\x03\x04docx"
+
+    queue.submit("p2", "beta", lambda report: "<html>beta</html>")
+    assert ("p1", "exec") not in queue._jobs
+    assert queue.job("p1", "exec").id == job.id
+
+    unpersisted = Phase5JobQueue(inline=True)
+    assert unpersisted.submit("p1", "edu", lambda report: "<html/>").result == "<html/>"
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for phase5_sections.py (dependency-tracked reuse of Phase 5 LLM sections).
+
+Run with pytest (make units).
+"""
+
+import json
+
+import phase5_sections
+from phase5_sections import SectionCache, input_fingerprint, node_counts, node_labels
+from response_cache import ResponseCache
+
+NODES = [
+    {"type": "Start", "label": "Arrive"},
+    {"type": "Decision", "label": "Sepsis screen positive?", "notes": "qSOFA >= 2"},
+    {"type": "Process", "label": "Draw lactate"},
+    {"type": "End", "label": "Admit"},
+]
+
+SCENARIOS = [{"title": f"Scenario {i}", "vignette": "65M febrile", "tasks": ["Screen"],
+              "success_criteria": "Admit", "notes_placeholder": "Notes"} for i in range(3)]
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeModels:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, **kwargs):
+        self.calls += 1
+        return _Response(json.dumps(SCENARIOS))
+
+
+class _FakeClient:
+    def __init__(self):
+        self.models = _FakeModels()
+
+
+def _fresh_shared_cache():
+    phase5_sections._shared_sections = SectionCache(ResponseCache())
+    return phase5_sections._shared_sections
+
+
+def test_sections_rebuild_only_when_inputs_change():
+    cache = SectionCache(ResponseCache())
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"text": f"build {len(builds)}"}
+
+    inputs = {"decision_nodes": ["Sepsis?"], "counts": [4, 1]}
+    first = cache.get_or_build("beta", "scenarios", inputs, build)
+    reused = []
+    again = cache.get_or_build("beta", "scenarios", dict(inputs), build, on_reuse=reused.append)
+    assert first == again == {"text": "build 1"} and reused == [first]
+    assert cache.get_or_build("beta", "scenarios", {**inputs, "counts": [5, 1]}, build) == {"text": "build 2"}
+    assert cache.get_or_build("edu", "scenarios", inputs, build) == {"text": "build 3"}
+    assert cache.stats == {"reused": 1, "built": 3}
+
+
+def test_empty_results_are_not_stored_and_disabled_cache_always_builds():
+    cache = SectionCache(ResponseCache())
+    assert cache.get_or_build("exec", "summary", {"a": 1}, dict) == {}
+    assert cache.get_or_build("exec", "summary", {"a": 1}, lambda: {"x": 1}) == {"x": 1}
+
+    disabled = SectionCache(None)
+    disabled.get_or_build("exec", "summary", {"a": 1}, lambda: {"x": 1})
+    disabled.get_or_build("exec", "summary", {"a": 1}, lambda: {"x": 1})
+    assert disabled.stats == {"reused": 0, "built": 2}
+
+
+def test_pathway_slices():
+    assert node_labels(NODES, "Decision") == ["Sepsis screen positive?"]
+    assert node_labels(NODES, limit=2) == ["Arrive", "Sepsis screen positive?"]
+    assert node_counts(NODES, ("Decision", "Process", "Info")) == {"total": 4, "Decision": 1, "Process": 1, "Info": 0}
+    assert input_fingerprint({"a": [1, 2]}) == input_fingerprint({"a": [1, 2]})
+    assert input_fingerprint({"a": [1, 2]}) != input_fingerprint({"a": [2, 1]})
+
+
+def test_beta_scenarios_survive_unrelated_node_edits():
+    from phase5_helpers import generate_beta_form_html
+
+    _fresh_shared_cache()
+    client = _FakeClient()
+    html = generate_beta_form_html("Sepsis section test", NODES, care_setting="ED", genai_client=client)
+    assert client.models.calls == 1 and "Scenario 0" in html
+
+    edited = [dict(n) for n in NODES]
+    edited[1]["notes"] = "qSOFA >= 2 or lactate > 2"      # Not part of the scenario prompt
+    generate_beta_form_html("Sepsis section test", edited, care_setting="ED", genai_client=client)
+    assert client.models.calls == 1
+
+    edited[1]["label"] = "Sepsis suspected?"               # A decision point the scenarios reference
+    generate_beta_form_html("Sepsis section test", edited, care_setting="ED", genai_client=client)
+    assert client.models.calls == 2
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for pmid_store.py (persistent read-through PMID metadata store).
+
+Run with pytest (make units).
+"""
+
+import os
+import tempfile
+import time
+
+from pmid_store import PMIDStore
+
+
+class _FakeClient:
+    """Stands in for PubMedClient and records what reached 'NCBI'."""
+
+    def __init__(self, known=None, fail=False):
+        self.known = set(known or [str(p) for p in range(1, 100)])
+        self.fail = fail
+        self.fetched = []
+        self.searches = 0
+
+    def fetch_citations(self, pmids):
+        if self.fail:
+            raise ConnectionError("NCBI unreachable")
+        self.fetched.append(list(pmids))
+        return {p: {"id": p, "title": f"Title {p}", "authors": "Smith J", "year": "2021",
+                    "journal": "J", "url": f"https://pubmed.ncbi.nlm.nih.gov/{p}/", "abstract": "A"}
+                for p in pmids if p in self.known}
+
+    def esearch(self, query, retmax=50, sort="relevance"):
+        if self.fail:
+            raise ConnectionError("NCBI unreachable")
+        self.searches += 1
+        return [str(p) for p in range(1, retmax + 1)]
+
+
+def test_read_through_fetches_only_missing():
+    store = PMIDStore(":memory:")
+    client = _FakeClient()
+    first = store.fetch(client, ["1", "2", "3"])
+    assert set(first) == {"1", "2", "3"}
+    assert first["1"]["title"] == "Title 1" and "fetched_at" not in first["1"]
+    second = store.fetch(client, ["2", "3", "4", "500"])
+    assert set(second) == {"2", "3", "4"}
+    # Only the PMIDs not already stored went to NCBI, in one batch
+    assert client.fetched == [["1", "2", "3"], ["4", "500"]]
+    assert store.stats["hits"] == 2
+
+
+def test_stale_rows_refresh_and_survive_outage():
+    store = PMIDStore(":memory:", max_age=3600)
+    store.put_many([{"id": "7", "title": "Old title", "fetched_at": time.time() - 7200}])
+    assert store.get_many(["7"]) == {}
+    assert "7" in store.get_many(["7"], include_stale=True)
+    # NCBI down: stale metadata is returned rather than nothing
+    offline = store.fetch(_FakeClient(fail=True), ["7"])
+    assert offline["7"]["title"] == "Old title"
+    # NCBI back: the row is refreshed
+    online = store.fetch(_FakeClient(), ["7"])
+    assert online["7"]["title"] == "Title 7"
+    assert store.get_many(["7"])["7"]["title"] == "Title 7"
+
+
+def test_search_cached_and_shared_across_instances():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "pmids.sqlite")
+        client = _FakeClient()
+        results = PMIDStore(path).search(client, "sepsis  guideline", retmax=5)
+        assert [c["id"] for c in results] == ["1", "2", "3", "4", "5"]
+        # A second store on the same file (another session/worker) answers locally
+        other = PMIDStore(path)
+        again = other.search(client, "sepsis guideline", retmax=5)
+        assert [c["id"] for c in again] == ["1", "2", "3", "4", "5"]
+        assert client.searches == 1 and len(client.fetched) == 1
+        assert len(other) == 5
+
+
+def test_bulk_lookup_handles_large_sets():
+    store = PMIDStore(":memory:")
+    store.put_many({"id": str(p), "title": "t"} for p in range(1200))
+    found = store.get_many(str(p) for p in range(0, 1500))
+    assert len(found) == 1200
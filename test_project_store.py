@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for project_store.py (durable per-phase project persistence).
+
+Run with pytest (make units).
+"""
+
+import datetime
+import shutil
+import tempfile
+
+from project_store import (
+    FileSystemBackend, ProjectAutosaver, ProjectStore, SQLiteBackend,
+    is_valid_project_id, new_project_id,
+)
+
+DEFAULTS = {
+    "phase1": {"condition": "", "schedule": []},
+    "phase3": {"nodes": []},
+    "phase4": {"heuristics_data": {}},
+}
+NODES = [{"type": "Start", "label": "Arrive"}, {"type": "End", "label": "Discharge"}]
+
+
+def _with_backends(check):
+    check(SQLiteBackend(":memory:"))
+    root = tempfile.mkdtemp()
+    try:
+        check(FileSystemBackend(root))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_resume_in_new_store_instance():
+    def check(backend):
+        pid = new_project_id()
+        data = ProjectStore(backend).open(pid, DEFAULTS)
+        data["phase1"]["condition"] = "Sepsis"
+        data["phase1"]["schedule"] = [{"Stage": "Kickoff", "Start": datetime.date(2026, 1, 5)}]
+        data["phase3"]["nodes"] = NODES
+        assert ProjectStore(backend).save(pid, data) == 3
+
+        resumed = ProjectStore(backend).open(pid, DEFAULTS)
+        assert resumed["phase1"]["condition"] == "Sepsis"
+        assert resumed["phase1"]["schedule"][0]["Start"] == datetime.date(2026, 1, 5)
+        assert resumed["phase3"]["nodes"] == NODES
+        assert resumed["phase4"] == {"heuristics_data": {}}
+    _with_backends(check)
+
+
+def test_save_writes_only_changed_fields():
+    def check(backend):
+        store = ProjectStore(backend)
+        pid = new_project_id()
+        data = store.open(pid, DEFAULTS)
+        data["phase3"]["nodes"] = NODES
+        data["phase1"]["condition"] = "Sepsis"
+        store.save(pid, data)
+        assert store.save(pid, data) == 0
+        data["phase1"]["condition"] = "Septic shock"
+        assert store.save(pid, data) == 1
+        del data["phase1"]["schedule"]
+        assert store.save(pid, data) == 1
+        assert "schedule" not in ProjectStore(backend).load_phase(pid, "phase1", {})
+    _with_backends(check)
+
+
+def test_phases_load_lazily_and_transient_fields_are_skipped():
+    store = ProjectStore(SQLiteBackend(":memory:"))
+    pid = new_project_id()
+    data = store.open(pid, DEFAULTS)
+    data["phase4"]["viz_cache"] = {"sig": {"svg": b"<svg/>"}}
+    store.save(pid, data)
+    assert list(data.loaded()) == ["phase4"] and "phase1" in data
+    assert store.stats["phases_loaded"] == 1
+
+    resumed = ProjectStore(store.backend).open(pid, DEFAULTS)
+    assert "viz_cache" not in resumed["phase4"]
+    assert resumed.get("phase9") is None
+
+
+def test_autosaver_flush_and_ids():
+    store = ProjectStore(SQLiteBackend(":memory:"))
+    saver = ProjectAutosaver(store, interval=3600)
+    pid = new_project_id()
+    data = store.open(pid, DEFAULTS)
+    data["phase3"]["nodes"] = NODES
+    saver.track(pid, data)
+    assert saver.flush() >= 1 and store.exists(pid)
+    assert saver.flush() == 0
+    store.delete(pid)
+    assert not store.exists(pid)
+    assert is_valid_project_id(pid)
+    assert not is_valid_project_id("../etc") and not is_valid_project_id(None)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for prompt_budget.py (token-budgeted pathway prompts).
+
+Run with pytest (make units).
+"""
+
+import json
+import os
+
+from llm_prompt_templates import build_evidence_context
+from prompt_budget import (
+    EVIDENCE_SLOT, compact_nodes, estimate_tokens, evidence_lines, expand_nodes, fill_greedy,
+    fill_slot, node_label_text, rank_evidence, token_budget,
+)
+
+NODES = [
+    {"type": "Start", "label": "Patient presents to ED with chest pain", "evidence": "N/A", "notes": ""},
+    {"type": "Decision", "label": "HEART score >= 4?", "evidence": "PMID 111", "notes": "Use troponin",
+     "branches": [{"label": "Yes", "target": 2}, {"label": "No", "target": 3}]},
+    {"type": "Process", "label": "Serial troponin at 0 and 3 h", "evidence": "N/A"},
+    {"type": "End", "label": "Discharge with cardiology follow-up"},
+]
+
+EVIDENCE = [
+    {"id": str(100 + i), "title": f"Unrelated study {chr(65 + i) * 3}", "abstract": "Dermatology outcomes. " * 30}
+    for i in range(25)
+] + [
+    {"id": "900", "title": "High-sensitivity troponin protocols", "abstract": "Serial troponin testing."},
+    {"id": "901", "title": "HEART score validation", "abstract": "Chest pain risk score.", "grade": "High (A)"},
+]
+
+
+def test_compact_nodes_round_trip_and_shrink():
+    compact = compact_nodes(NODES)
+    assert len(compact) < len(json.dumps(NODES, indent=2)) / 2
+    parsed = json.loads(compact)
+    assert parsed[0] == {"t": "Start", "l": "Patient presents to ED with chest pain"}
+    assert parsed[1]["b"] == [{"l": "Yes", "to": 2}, {"l": "No", "to": 3}]
+    expanded = expand_nodes(parsed)
+    assert expanded[1] == NODES[1]
+    assert expanded[3] == NODES[3]
+    assert expand_nodes(NODES) == NODES and expand_nodes(None) is None
+
+
+def test_evidence_is_ranked_by_request_then_nodes():
+    ranked = rank_evidence(EVIDENCE, "troponin", node_label_text(NODES))
+    assert [e["id"] for e in ranked[:2]] == ["900", "901"]
+    assert [e["id"] for e in rank_evidence(EVIDENCE, "", "HEART score")[:1]] == ["901"]
+    # Unmatched items keep their original order
+    assert [e["id"] for e in ranked[2:5]] == ["100", "101", "102"]
+    assert rank_evidence(EVIDENCE, "") == EVIDENCE
+    assert "[GRADE: High (A)]" in evidence_lines(EVIDENCE, "HEART")[0]
+
+
+def test_fill_slot_respects_budget_and_minimum():
+    kept, dropped = fill_greedy(["a" * 40, "b" * 400, "c" * 40], budget_tokens=25)
+    assert kept == ["a" * 40, "c" * 40] and dropped == 1
+
+    lines = evidence_lines(EVIDENCE, "troponin chest pain", node_label_text(NODES))
+    template = f"Pathway:\n{compact_nodes(NODES)}\n\nEvidence:\n{EVIDENCE_SLOT}\n"
+    prompt, dropped = fill_slot(template, EVIDENCE_SLOT, lines, budget_tokens=600)
+    assert estimate_tokens(prompt) <= 600 and dropped > 0
+    assert prompt.index("PMID 900") < prompt.index("Evidence:") + 200
+
+    prompt, _ = fill_slot(template, EVIDENCE_SLOT, lines, budget_tokens=10, min_items=2)
+    assert "PMID 900" in prompt and "PMID 901" in prompt and "PMID 100" not in prompt
+    assert fill_slot(template, EVIDENCE_SLOT, [], 1000)[0].endswith("No specific evidence provided.\n")
+
+
+def test_budget_uses_smallest_model_and_env_override():
+    assert token_budget(["gemini-2.5-pro", "gemini-2.0-flash-lite"]) == 8000
+    assert token_budget([]) == token_budget(["unknown-model"])
+    os.environ["CPQ_PROMPT_TOKENS"] = "20000"
+    try:
+        assert token_budget(["gemini-2.0-flash-lite"]) == 20000
+    finally:
+        del os.environ["CPQ_PROMPT_TOKENS"]
+
+
+def test_build_evidence_context_keeps_relevant_items_past_twenty():
+    context = build_evidence_context(EVIDENCE, max_items=None, query="troponin", budget_tokens=300)
+    assert context.splitlines()[0].startswith("- PMID 900")
+    assert estimate_tokens(context) <= 300
+    assert len(build_evidence_context(EVIDENCE).splitlines()) == 20
+    assert build_evidence_context([]) == "No specific evidence provided."
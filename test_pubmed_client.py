@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Tests for pubmed_client.py against a local stand-in E-utilities server.
+
+Run with pytest (make units).
+"""
+
+import io
+import json
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pubmed_client import PubMedClient, TokenBucket, iter_pubmed_articles, parse_pubmed_articles
+
+
+def _article(pmid):
+    return (
+        f"<PubmedArticle><MedlineCitation><PMID>{pmid}</PMID><Article>"
+        f"<Journal><Title>Journal {pmid}</Title></Journal>"
+        f"<ArticleTitle>Title {pmid}</ArticleTitle>"
+        f"<Abstract><AbstractText>Abstract {pmid}</AbstractText></Abstract>"
+        f"<AuthorList><Author><LastName>Smith</LastName><Initials>J</Initials></Author></AuthorList>"
+        f"</Article></MedlineCitation>"
+        f"<PubmedData/><Journal><JournalIssue><PubDate><Year>2020</Year></PubDate></JournalIssue></Journal>"
+        f"</PubmedArticle>"
+    )
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    log = []
+    ports = set()
+    known = {str(p) for p in range(100, 400)}
+
+    def log_message(self, *args):
+        pass
+
+    def _params(self):
+        parsed = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+        return parsed.path, params
+
+    def _reply(self, body: bytes, ctype: str):
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        path, params = self._params()
+        type(self).log.append((self.command, path, params))
+        type(self).ports.add(self.client_address[1])
+        if path.endswith("esearch.fcgi"):
+            ids = [str(100 + i) for i in range(int(params.get("retmax", 20)))]
+            self._reply(json.dumps({"esearchresult": {"idlist": ids}}).encode(), "application/json")
+        else:
+            ids = [i for i in params["id"].split(",") if i in self.known]
+            xml = "<PubmedArticleSet>" + "".join(_article(i) for i in ids) + "</PubmedArticleSet>"
+            self._reply(xml.encode(), "text/xml")
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def _server():
+    _StandIn.log = []
+    _StandIn.ports = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def test_search_batches_efetch_and_keeps_order():
+    server, url = _server()
+    try:
+        client = PubMedClient(base_url=url, rate=1000, batch_size=10)
+        citations = client.search("sepsis", retmax=25)
+        assert [c["id"] for c in citations] == [str(100 + i) for i in range(25)]
+        assert citations[0]["title"] == "Title 100"
+        assert citations[0]["authors"] == "Smith J" and citations[0]["year"] == "2020"
+        efetches = [p for _, path, p in _StandIn.log if path.endswith("efetch.fcgi")]
+        # 25 IDs in batches of 10 -> 3 efetch calls with comma-joined IDs
+        assert len(efetches) == 3
+        assert sorted(len(p["id"].split(",")) for p in efetches) == [5, 10, 10]
+        assert all(p["tool"] == "carepathiq" for _, _, p in _StandIn.log)
+    finally:
+        server.shutdown()
+
+
+def test_fetch_citations_single_session_and_unknown_ids():
+    server, url = _server()
+    try:
+        client = PubMedClient(base_url=url, rate=1000, max_workers=1)
+        found = client.fetch_citations(["101", "999", "101", " 102 "])
+        assert set(found) == {"101", "102"}
+        client.fetch_citations(["103"])
+        client.fetch_citations(["104"])
+        # One efetch per call, all over the same keep-alive connection
+        assert client.request_count == 3
+        assert len(_StandIn.ports) == 1
+    finally:
+        server.shutdown()
+
+
+def test_long_id_lists_use_post_and_api_key_is_sent():
+    server, url = _server()
+    try:
+        client = PubMedClient(base_url=url, api_key="secret", rate=1000, batch_size=500)
+        assert client.limiter.rate == 1000
+        assert PubMedClient(api_key="k").limiter.rate == 10
+        assert PubMedClient().limiter.rate == 3
+        found = client.fetch_citations(str(p) for p in range(100, 400))
+        assert len(found) == 300
+        method, _, params = _StandIn.log[-1]
+        assert method == "POST" and params["api_key"] == "secret"
+    finally:
+        server.shutdown()
+
+
+def test_search_many_runs_concurrently():
+    server, url = _server()
+    try:
+        client = PubMedClient(base_url=url, rate=1000, max_workers=3)
+        results = client.search_many(["a", "b", "c"], retmax=5)
+        assert set(results) == {"a", "b", "c"}
+        assert all(len(v) == 5 for v in results.values())
+    finally:
+        server.shutdown()
+
+
+def test_token_bucket_paces_requests():
+    now = [0.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=3, clock=lambda: now[0], sleep=sleep)
+    for _ in range(3):
+        assert bucket.acquire() == 0     # initial burst
+    waited = sum(bucket.acquire() for _ in range(3))
+    # Three more tokens at 3/s take one second
+    assert abs(waited - 1.0) < 1e-6
+    assert abs(now[0] - 1.0) < 1e-6
+
+
+def test_iterparse_matches_fields_and_skips_incomplete():
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<PubmedArticleSet>'
+        + _article(101)
+        + "<PubmedArticle><MedlineCitation><PMID>5</PMID><Article/></MedlineCitation></PubmedArticle>"
+        + "<PubmedBookArticle><BookDocument/></PubmedBookArticle>"
+        + _article(102).replace("<AbstractText>Abstract 102</AbstractText>",
+                                "<AbstractText>Caf\u00e9 part 1</AbstractText><AbstractText>part 2</AbstractText>")
+        + "</PubmedArticleSet>"
+    ).encode("utf-8")
+    citations = parse_pubmed_articles(xml)
+    assert [c["id"] for c in citations] == ["101", "102"]
+    assert citations[0] == {
+        "id": "101", "title": "Title 101", "authors": "Smith J", "year": "2020",
+        "journal": "Journal 101", "url": "https://pubmed.ncbi.nlm.nih.gov/101/", "abstract": "Abstract 101",
+    }
+    assert citations[1]["abstract"] == "Caf\u00e9 part 1 part 2"
+
+
+def test_iterparse_releases_articles_as_it_goes():
+    count = 3000
+    xml = ("<PubmedArticleSet>" + "".join(_article(i) for i in range(count)) + "</PubmedArticleSet>").encode()
+    seen = 0
+    holder = {}
+    original = ET.iterparse
+
+    def spying_iterparse(source, events=None):
+        context = original(source, events=events)
+        for event, elem in context:
+            holder.setdefault("root", elem)
+            yield event, elem
+
+    ET.iterparse = spying_iterparse
+    try:
+        for _ in iter_pubmed_articles(io.BytesIO(xml)):
+            seen += 1
+            # Processed articles are dropped from the tree
+            assert len(holder["root"]) <= 1
+    finally:
+        ET.iterparse = original
+    assert seen == count
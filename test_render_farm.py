@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for render_farm.py (cached, asynchronous Graphviz rendering).
+
+A fake renderer stands in for the dot executable.
+Run with pytest (make units).
+"""
+
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from render_farm import RenderError, RenderFarm, run_dot
+
+DOT = 'digraph G { a -> b [label="Yes"]; }'
+
+
+class _Renderer:
+    """Fake dot: records calls and returns format-tagged bytes."""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, source, formats, engine, timeout):
+        self.calls.append(tuple(formats))
+        self.release.wait(5)
+        time.sleep(self.delay)
+        if self.fail:
+            raise RenderError("dot: syntax error in line 1")
+        return {fmt: f"{fmt}:{engine}:{len(source)}".encode() for fmt in formats}
+
+
+def test_submit_returns_before_render_finishes():
+    renderer = _Renderer()
+    renderer.release.clear()
+    farm = RenderFarm(renderer=renderer)
+    try:
+        future = farm.submit(DOT, ("svg", "png", "pdf"))
+        assert not future.done()
+        # An identical request while rendering shares the same job
+        assert farm.submit(DOT, ("svg", "png", "pdf")) is future
+        renderer.release.set()
+        results = future.result(timeout=5)
+        assert set(results) == {"svg", "png", "pdf"} and results["png"].startswith(b"png:dot")
+        # One job rendered all three formats
+        assert renderer.calls == [("svg", "png", "pdf")]
+    finally:
+        farm.shutdown()
+
+
+def test_outputs_cached_per_hash_format_and_engine():
+    renderer = _Renderer()
+    farm = RenderFarm(renderer=renderer)
+    try:
+        farm.submit(DOT, ("svg", "png")).result(timeout=5)
+        again = farm.submit(DOT, ("png", "svg"))
+        assert again.done() and again.result()["svg"] is not None
+        # Only the missing format is rendered
+        farm.submit(DOT, ("svg", "pdf")).result(timeout=5)
+        assert renderer.calls == [("svg", "png"), ("pdf",)]
+        farm.render(DOT, "svg", engine="neato")
+        farm.render(DOT + " ", "svg")
+        assert len(renderer.calls) == 4
+        assert farm.cached(DOT, "pdf") is not None
+    finally:
+        farm.shutdown()
+
+
+def test_failures_yield_none_and_are_not_cached():
+    renderer = _Renderer(fail=True)
+    farm = RenderFarm(renderer=renderer, inline=True)
+    assert farm.render(DOT, "svg") is None
+    assert "syntax error" in farm.last_error
+    farm.render(DOT, "svg")
+    assert len(renderer.calls) == 2 and farm.stats["failures"] == 2
+
+
+def test_run_dot_reports_missing_executable_and_timeouts():
+    try:
+        run_dot(DOT, ("svg",), engine="cpq-no-such-layout-engine")
+        assert False, "expected RenderError"
+    except RenderError as e:
+        assert "not found" in str(e)
+    with tempfile.TemporaryDirectory() as tmp:
+        hung = os.path.join(tmp, "hung-dot")
+        with open(hung, "w") as fh:
+            fh.write("#!/bin/sh\nsleep 30\n")
+        os.chmod(hung, os.stat(hung).st_mode | stat.S_IEXEC)
+        start = time.monotonic()
+        try:
+            run_dot(DOT, ("svg",), engine=hung, timeout=0.5)
+            assert False, "expected RenderError"
+        except RenderError as e:
+            assert "timed out" in str(e)
+        assert time.monotonic() - start < 5
+    if shutil.which("dot"):
+        svg = run_dot(DOT, ("svg", "png"))
+        assert svg["svg"].lstrip().startswith(b"<?xml") and svg["png"][:4] == b"\x89PNG"
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for response_cache.py (content-addressed LLM response cache).
+
+Run with pytest (make units).
+"""
+
+import os
+import tempfile
+import time
+
+from response_cache import ResponseCache, request_fingerprint
+
+
+def test_fingerprint_is_stable_and_order_independent():
+    a = request_fingerprint(prompt="p", json_mode=True, thinking_budget=1024)
+    b = request_fingerprint(thinking_budget=1024, json_mode=True, prompt="p")
+    c = request_fingerprint(prompt="p", json_mode=False, thinking_budget=1024)
+    assert a == b
+    assert a != c
+
+
+def test_hit_returns_fresh_copy():
+    cache = ResponseCache()
+    cache.set("k", {"nodes": [{"label": "Start"}]})
+    hit, value = cache.get("k")
+    assert hit
+    value["nodes"].append({"label": "mutated"})
+    _, again = cache.get("k")
+    assert len(again["nodes"]) == 1
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 0
+
+
+def test_ttl_expiry():
+    cache = ResponseCache(default_ttl=0.05)
+    cache.set("k", "text")
+    time.sleep(0.1)
+    hit, _ = cache.get("k")
+    assert not hit
+    assert cache.stats()["expired"] == 1
+
+
+def test_lru_eviction_by_count_and_bytes():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")          # a is now most recently used
+    cache.set("c", "3")     # evicts b
+    assert cache.get("a")[0] and cache.get("c")[0]
+    assert not cache.get("b")[0]
+
+    small = ResponseCache(max_bytes=30)
+    small.set("x", "a" * 20)
+    small.set("y", "b" * 20)
+    assert not small.get("x")[0]
+    assert small.get("y")[0]
+
+
+def test_disk_tier_shared_between_instances():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "responses.sqlite")
+        writer = ResponseCache(disk_path=path)
+        writer.set("k", ["shared"])
+        reader = ResponseCache(disk_path=path)
+        hit, value = reader.get("k")
+        assert hit and value == ["shared"]
+        assert reader.stats()["disk_hits"] == 1
+
+
+def test_disk_hit_keeps_the_stored_expiry():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "responses.sqlite")
+        ResponseCache(disk_path=path).set("k", "short-lived", ttl=0.1)
+        reader = ResponseCache(disk_path=path, default_ttl=3600)
+        assert reader.get("k") == (True, "short-lived")
+        time.sleep(0.15)
+        assert not reader.get("k")[0]
+
+
+def test_unserializable_values_are_skipped():
+    cache = ResponseCache()
+    assert cache.set("k", object()) is False
+    assert cache.set("none", None) is False
+    assert not cache.get("k")[0]
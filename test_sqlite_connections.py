@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for sqlite_connections.py (per-thread SQLite connections).
+
+Run with pytest (make units).
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from sqlite_connections import SQLiteConnections
+
+
+def _in_thread(fn):
+    out = []
+    thread = threading.Thread(target=lambda: out.append(fn()))
+    thread.start()
+    thread.join()
+    return out[0]
+
+
+def test_file_database_gets_one_wal_connection_per_thread():
+    tmp = tempfile.mkdtemp()
+    try:
+        db = SQLiteConnections(os.path.join(tmp, "nested", "store.sqlite"))
+        assert os.path.isdir(os.path.join(tmp, "nested")) and not db.in_memory
+        conn = db.connection()
+        assert db.connection() is conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1)")
+        conn.commit()
+        other = _in_thread(db.connection)
+        assert other is not conn
+        assert _in_thread(lambda: db.connection().execute("SELECT x FROM t").fetchone()[0]) == 1
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def test_memory_database_is_shared_by_every_thread():
+    db = SQLiteConnections(":memory:")
+    assert db.in_memory
+    db.connection().execute("CREATE TABLE t (x INTEGER)")
+    assert _in_thread(db.connection) is db.connection()
+    assert _in_thread(lambda: db.connection().execute("SELECT COUNT(*) FROM t").fetchone()[0]) == 0